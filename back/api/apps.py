@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class ApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'api'
+
+    def ready(self):
+        from . import profiling, signals  # noqa: F401
+
+        if profiling.enabled():
+            profiling.instrument_serializers()
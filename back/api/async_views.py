@@ -0,0 +1,129 @@
+"""
+Native async list/retrieve for viewsets, for ASGI deployments.
+
+DRF views are synchronous, so under ASGI Django runs each request to one in
+a worker thread from start to finish. For a viewset with ``AsyncReadMixin``,
+``as_view`` returns a coroutine view instead: GET/HEAD requests for the
+actions in ``async_actions`` run ``alist``/``aretrieve`` on the event loop.
+Authentication (which may load the user row) runs in a thread, the queries
+go through ``acount()``, ``aiterator()`` and ``aget()``, and serialization
+and rendering run on the loop over rows whose relations ``get_queryset``
+already joined or prefetched; a serializer that still lazily loads one
+raises ``SynchronousOnlyOperation``. Every other request on the same URL,
+writes included, is handed to the viewset's ordinary sync view through
+``sync_to_async``.
+
+Under WSGI every async view costs an event loop per request, so unless
+``ASYNC_READ_VIEWS`` is on (``health/asgi.py`` turns it on) ``as_view``
+returns the plain sync view.
+"""
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.http import Http404
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework.response import Response
+
+from .pagination import afetch
+from .profiling import phase
+
+
+class AsyncReadMixin:
+    """Serve ``async_actions`` from async ``a<action>`` methods"""
+
+    async_actions = ("list", "retrieve")
+
+    @classmethod
+    def as_view(cls, actions=None, **initkwargs):
+        sync_view = super().as_view(actions, **initkwargs)
+        action = actions.get("get")
+        if action not in cls.async_actions or not getattr(
+            settings, "ASYNC_READ_VIEWS", False
+        ):
+            return sync_view
+        action_map = {"head": action, **actions}
+
+        async def view(request, *args, **kwargs):
+            if request.method not in ("GET", "HEAD"):
+                return await sync_to_async(sync_view)(request, *args, **kwargs)
+            self = cls(**initkwargs)
+            self.action_map = action_map
+            self.request = request
+            self.args = args
+            self.kwargs = kwargs
+            handler = getattr(self, f"a{action}")
+            return await self.adispatch(request, handler, *args, **kwargs)
+
+        view.cls = cls
+        view.initkwargs = initkwargs
+        view.actions = actions
+        return csrf_exempt(view)
+
+    async def adispatch(self, request, handler, *args, **kwargs):
+        """``APIView.dispatch`` for an async handler"""
+        self.args = args
+        self.kwargs = kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+
+        try:
+            await self.ainitial(request, *args, **kwargs)
+            response = await handler(request, *args, **kwargs)
+        except Exception as exc:
+            response = self.handle_exception(exc)
+
+        self.response = self.finalize_response(request, response, *args, **kwargs)
+        # Rendering needs no I/O; done here it saves Django a thread hop
+        with phase("render"):
+            return self.response.render()
+
+    async def ainitial(self, request, *args, **kwargs):
+        """``APIView.initial``, authenticating in a thread"""
+        self.format_kwarg = self.get_format_suffix(**kwargs)
+        neg = self.perform_content_negotiation(request)
+        request.accepted_renderer, request.accepted_media_type = neg
+        version, scheme = self.determine_version(request, *args, **kwargs)
+        request.version, request.versioning_scheme = version, scheme
+
+        await sync_to_async(self.perform_authentication)(request)
+        self.check_permissions(request)
+        self.check_throttles(request)
+
+    async def aget_object(self):
+        queryset = self.filter_queryset(self.get_queryset())
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        filter_kwargs = {self.lookup_field: self.kwargs[lookup_url_kwarg]}
+        try:
+            obj = await queryset.aget(**filter_kwargs)
+        except (queryset.model.DoesNotExist, TypeError, ValueError, ValidationError):
+            raise Http404
+        self.check_object_permissions(self.request, obj)
+        return obj
+
+    async def apaginate_queryset(self, queryset):
+        paginator = self.paginator
+        if paginator is None:
+            return None
+        if hasattr(paginator, "apaginate_queryset"):
+            return await paginator.apaginate_queryset(queryset, self.request, view=self)
+        return await sync_to_async(paginator.paginate_queryset)(
+            queryset, self.request, view=self
+        )
+
+    async def alist(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+
+        page = await self.apaginate_queryset(queryset)
+        if page is not None:
+            serializer = self.get_serializer(page, many=True)
+            return self.get_paginated_response(serializer.data)
+
+        serializer = self.get_serializer(await afetch(queryset), many=True)
+        return Response(serializer.data)
+
+    async def aretrieve(self, request, *args, **kwargs):
+        instance = await self.aget_object()
+        serializer = self.get_serializer(instance)
+        return Response(serializer.data)
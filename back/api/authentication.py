@@ -0,0 +1,128 @@
+"""
+JWT authentication that trusts the claims in the access token.
+
+Access tokens issued through the token endpoints carry the user's ``role``
+and ``is_staff`` (``CustomUser.CLAIM_FIELDS``). ``ClaimsJWTAuthentication``
+turns those into a ``CustomUser`` that has only its id and the claims
+loaded, so requests that need no more than ``request.user.id`` or ``role``
+never read the users table; touching any other field loads the row once
+through ``CustomUser.cached``.
+
+When a user's claims change (role, staff flag or deactivation),
+``mark_claims_changed`` stores the time in the user's ``claims_changed_at``
+column. Tokens issued before then, and tokens of deleted users, are no
+longer trusted and authenticate through the cached row instead, until they
+expire or are refreshed with the new claims. Every worker reads the column
+through its own cache for ``AUTH_CLAIMS_TTL`` seconds (one small query per
+user and worker per period), so a change made in one worker reaches the
+others within that time; the worker that made it drops its entry at once.
+"""
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.serializers import (
+    TokenObtainPairSerializer,
+    TokenRefreshSerializer,
+)
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+from .models import CustomUser
+
+
+def claims_key(user_id):
+    return f"auth:claims-changed:{user_id}"
+
+
+def add_claims(token, user):
+    for name in CustomUser.CLAIM_FIELDS:
+        token[name] = getattr(user, name)
+    return token
+
+
+def claims_ttl():
+    return getattr(settings, "AUTH_CLAIMS_TTL", getattr(settings, "AUTH_USER_CACHE_TTL", 60))
+
+
+def mark_claims_changed(user_id):
+    """Stop trusting ``user_id``'s tokens issued until now (in the caller's transaction)"""
+    CustomUser.objects.filter(pk=user_id).update(claims_changed_at=timezone.now())
+    forget_claims(user_id)
+
+
+def forget_claims(user_id):
+    transaction.on_commit(lambda: cache.delete(claims_key(user_id)))
+
+
+def claims_changed_at(user_id):
+    """
+    Unix time of the user's last claims change, 0 if there was none and None
+    if there is no such user.
+    """
+    key = claims_key(user_id)
+    changed = cache.get(key)
+    if changed is None:
+        found = list(
+            CustomUser.objects.filter(pk=user_id).values_list(
+                "claims_changed_at", flat=True
+            )[:1]
+        )
+        if not found:
+            changed = -1
+        else:
+            changed = found[0].timestamp() if found[0] is not None else 0
+        cache.set(key, changed, claims_ttl())
+    return None if changed < 0 else changed
+
+
+def claims_current(token, user_id):
+    changed = claims_changed_at(user_id)
+    return changed is not None and token.get("iat", 0) > changed
+
+
+class ClaimsTokenObtainPairSerializer(TokenObtainPairSerializer):
+    @classmethod
+    def get_token(cls, user):
+        # The access token copies these from the refresh token
+        return add_claims(super().get_token(user), user)
+
+
+class ClaimsTokenRefreshSerializer(TokenRefreshSerializer):
+    def validate(self, attrs):
+        data = super().validate(attrs)
+        # Claims copied from the refresh token may predate a role change
+        access = AccessToken(data["access"])
+        user = CustomUser.cached(access[api_settings.USER_ID_CLAIM])
+        if user is None or not user.is_active:
+            raise AuthenticationFailed(_("User not found"), code="user_not_found")
+        data["access"] = str(add_claims(access, user))
+        return data
+
+
+class ClaimsJWTAuthentication(JWTAuthentication):
+    """
+    ``JWTAuthentication`` that builds the user from the token's claims, and
+    falls back to the cached user row for tokens without (current) claims.
+    """
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+
+        has_claims = all(name in validated_token for name in CustomUser.CLAIM_FIELDS)
+        if has_claims and claims_current(validated_token, user_id):
+            return CustomUser.from_claims(user_id, validated_token)
+
+        user = CustomUser.cached(user_id)
+        if user is None:
+            raise AuthenticationFailed(_("User not found"), code="user_not_found")
+        if not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+        return user
@@ -0,0 +1,267 @@
+"""
+Compiled read-only serializers for large list responses.
+
+A ``ModelSerializer`` building a page of rows costs a model instance per row
+(plus one per nested object and prefetched child), then a walk over bound
+fields that resolves every source attribute by attribute. ``compile_serializer``
+reads a serializer class once and turns it into a ``CompiledSerializer``:
+
+- the ``.values()`` columns its readable fields come from, following forward
+  foreign keys for nested serializers and dotted sources such as
+  ``user.username``;
+- one query per nested ``many=True`` serializer over a reverse foreign key,
+  run for a whole page of parent rows and grouped by parent (the same rows,
+  in the same order, that ``prefetch_related`` would load);
+- a converter per field. Text, integer and boolean columns already hold
+  what the field would output and are copied; every other field still runs
+  its own ``to_representation`` on the column value.
+
+The output is equal to the serializer's, so the rendered JSON is byte for
+byte the same. Model properties have no column; a serializer can map one to
+the columns it is computed from with ``compiled_sources`` on its ``Meta``:
+``{"rating_histogram": (("rating_1_count", ...), Therapist.histogram)}``.
+Anything else that cannot be read from columns (method fields, ``source="*"``,
+hyperlinks, file fields, nullable hops in a dotted source, serializers with
+their own ``to_representation``) raises ``NotCompilable`` when the class is
+compiled, not when a request is served.
+
+``CompiledListMixin`` serves a viewset's ``list`` (and ``alist`` under
+``AsyncReadMixin``) this way.
+"""
+
+from collections import defaultdict
+from functools import cache
+
+from django.core.exceptions import FieldDoesNotExist
+from django.db import models
+from rest_framework import serializers
+from rest_framework.relations import PrimaryKeyRelatedField
+from rest_framework.response import Response
+
+from .pagination import afetch
+from .profiling import phase
+
+# DRF fields whose to_representation returns a column value of these model
+# field types unchanged
+PASSTHROUGH = (
+    (serializers.CharField, (models.CharField, models.TextField)),
+    (serializers.IntegerField, (models.IntegerField,)),
+    (serializers.BooleanField, (models.BooleanField,)),
+)
+
+
+class NotCompilable(Exception):
+    pass
+
+
+class ManyRelation:
+    """A nested ``many=True`` serializer, read with one query per page"""
+
+    def __init__(self, key, parent_column, fk, compiled):
+        self.key = key
+        self.parent_column = parent_column
+        self.fk = fk
+        self.compiled = compiled
+
+    def queryset(self, rows):
+        ids = {row[self.parent_column] for row in rows} - {None}
+        children = self.compiled.model._default_manager.filter(
+            **{f"{self.fk.name}__in": ids}
+        )
+        columns = dict.fromkeys([self.fk.attname, *self.compiled.columns])
+        return children.values(*columns)
+
+    def group(self, children, batch):
+        grouped = defaultdict(list)
+        build = self.compiled.build
+        for child in children:
+            grouped[child[self.fk.attname]].append(build(child, batch))
+        return grouped
+
+
+class CompiledSerializer:
+    def __init__(self, serializer_class):
+        serializer = serializer_class()
+        self.model = serializer.Meta.model
+        self.columns = []
+        self.relations = []
+        self.build = self._compile(serializer, self.model, "")
+
+    def values(self, queryset):
+        """The queryset as the ``.values()`` rows ``serialize`` takes"""
+        return queryset.prefetch_related(None).values(*dict.fromkeys(self.columns))
+
+    def serialize(self, rows):
+        rows = list(rows)
+        batch = self.fetch(rows)
+        with phase("serialize"):
+            return [self.build(row, batch) for row in rows]
+
+    async def aserialize(self, rows):
+        rows = list(rows)
+        batch = await self.afetch(rows)
+        with phase("serialize"):
+            return [self.build(row, batch) for row in rows]
+
+    def fetch(self, rows):
+        """The nested lists of a batch of rows, grouped by parent"""
+        batch = {}
+        for relation in self.relations:
+            children = list(relation.queryset(rows))
+            batch[relation.key] = relation.group(
+                children, relation.compiled.fetch(children)
+            )
+        return batch
+
+    async def afetch(self, rows):
+        batch = {}
+        for relation in self.relations:
+            children = await afetch(relation.queryset(rows))
+            batch[relation.key] = relation.group(
+                children, await relation.compiled.afetch(children)
+            )
+        return batch
+
+    def _column(self, name):
+        self.columns.append(name)
+        return name
+
+    def _compile(self, serializer, model, prefix):
+        if (
+            type(serializer).to_representation
+            is not serializers.ModelSerializer.to_representation
+        ):
+            raise NotCompilable(
+                f"{type(serializer).__name__} overrides to_representation"
+            )
+        getters = [
+            (field.field_name, self._compile_field(serializer, field, model, prefix))
+            for field in serializer._readable_fields
+        ]
+
+        def build(row, batch):
+            return {name: get(row, batch) for name, get in getters}
+
+        return build
+
+    def _compile_field(self, serializer, field, model, prefix):
+        name = f"{type(serializer).__name__}.{field.field_name}"
+        if field.source == "*":
+            raise NotCompilable(f"{name} reads the whole object")
+
+        if isinstance(field, serializers.ListSerializer):
+            return self._compile_many(name, field, model, prefix)
+
+        # Walk the source across forward foreign keys to a column
+        *hops, attr = field.source_attrs
+        for hop in hops:
+            relation = self._model_field(model, hop, name)
+            if not (relation.many_to_one or relation.one_to_one) or relation.null:
+                raise NotCompilable(f"{name} goes through {hop}, which may be empty")
+            model = relation.related_model
+            prefix = f"{prefix}{hop}__"
+
+        if isinstance(field, serializers.ModelSerializer):
+            relation = self._model_field(model, attr, name)
+            forward = relation.many_to_one or relation.one_to_one
+            if not forward or not relation.concrete:
+                raise NotCompilable(f"{name} is not a forward foreign key")
+            present = self._column(f"{prefix}{relation.attname}")
+            nested = self._compile(
+                field, relation.related_model, f"{prefix}{attr}__"
+            )
+            return lambda row, batch: (
+                None if row[present] is None else nested(row, batch)
+            )
+
+        computed = getattr(serializer.Meta, "compiled_sources", {}).get(attr)
+        if computed is not None and not hops:
+            columns, compute = computed
+            columns = [self._column(f"{prefix}{column}") for column in columns]
+            convert = field.to_representation
+            return lambda row, batch: convert(compute(*(row[c] for c in columns)))
+
+        model_field = self._model_field(model, attr, name)
+        if isinstance(field, serializers.RelatedField):
+            if not isinstance(field, PrimaryKeyRelatedField) or field.pk_field:
+                raise NotCompilable(f"{name} is a {type(field).__name__}")
+            if not model_field.concrete or not model_field.many_to_one:
+                raise NotCompilable(f"{name} is not a forward foreign key")
+            column = self._column(f"{prefix}{attr}")
+            return lambda row, batch: row[column]
+
+        if model_field.is_relation or not model_field.concrete:
+            raise NotCompilable(f"{name} has no column")
+        if isinstance(field, serializers.FileField):
+            raise NotCompilable(f"{name} needs a file object")
+        column = self._column(f"{prefix}{attr}")
+        if any(
+            type(field).to_representation is drf.to_representation
+            and isinstance(model_field, columns)
+            for drf, columns in PASSTHROUGH
+        ):
+            return lambda row, batch: row[column]
+        convert = field.to_representation
+
+        def get(row, batch):
+            value = row[column]
+            return None if value is None else convert(value)
+
+        return get
+
+    def _compile_many(self, name, field, model, prefix):
+        if not isinstance(field.child, serializers.ModelSerializer):
+            raise NotCompilable(f"{name} is not a list of model serializers")
+        if len(field.source_attrs) != 1:
+            raise NotCompilable(f"{name} has a dotted source")
+        relation = self._model_field(model, field.source_attrs[0], name)
+        if not relation.one_to_many:
+            raise NotCompilable(f"{name} is not a reverse foreign key")
+        parent_column = self._column(f"{prefix}{model._meta.pk.attname}")
+        key = f"{prefix}{field.source}"
+        self.relations.append(
+            ManyRelation(
+                key,
+                parent_column,
+                relation.remote_field,
+                compile_serializer(type(field.child)),
+            )
+        )
+        return lambda row, batch: batch[key].get(row[parent_column], [])
+
+    def _model_field(self, model, attr, name):
+        try:
+            return model._meta.get_field(attr)
+        except FieldDoesNotExist:
+            # Reverse accessors go by related_name, not the query name
+            for relation in model._meta.related_objects:
+                if relation.get_accessor_name() == attr:
+                    return relation
+        raise NotCompilable(f"{name} is not a field of {model.__name__}")
+
+
+@cache
+def compile_serializer(serializer_class):
+    return CompiledSerializer(serializer_class)
+
+
+class CompiledListMixin:
+    """Serve ``list`` through the compiled form of the serializer class"""
+
+    def list(self, request, *args, **kwargs):
+        compiled = compile_serializer(self.get_serializer_class())
+        queryset = compiled.values(self.filter_queryset(self.get_queryset()))
+
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(compiled.serialize(page))
+        return Response(compiled.serialize(queryset))
+
+    async def alist(self, request, *args, **kwargs):
+        compiled = compile_serializer(self.get_serializer_class())
+        queryset = compiled.values(self.filter_queryset(self.get_queryset()))
+
+        page = await self.apaginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(await compiled.aserialize(page))
+        return Response(await compiled.aserialize(await afetch(queryset)))
@@ -0,0 +1,127 @@
+"""
+Database connection layer: SQLite tuning, read replica routing and the
+request middleware that decides where a request's reads go.
+
+``DATABASES`` in settings keeps connections open for ``CONN_MAX_AGE`` seconds
+with health checks, so a request reuses its thread's connection instead of
+opening a new one. ``tune_connection`` (connected to ``connection_created``
+in ``api.signals``) applies ``SQLITE_PRAGMAS`` to every new SQLite
+connection: WAL journaling so readers no longer wait for writers, a busy
+timeout so writers queue instead of failing, and memory-mapped reads.
+
+``ReplicaRouter`` sends reads made inside ``replica_reads()`` to one of
+``DATABASE_REPLICAS`` and everything else to ``default``. The middleware
+opens that scope for GET/HEAD/OPTIONS requests. Once a request writes, or
+while a transaction is open on the primary, its reads go to the primary so
+it sees its own changes.
+"""
+
+import contextvars
+import random
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+PRIMARY, REPLICA = "primary", "replica"
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+
+_target = contextvars.ContextVar("db_target", default=PRIMARY)
+
+
+def tune_connection(connection):
+    if connection.vendor != "sqlite":
+        return
+    pragmas = getattr(settings, "SQLITE_PRAGMAS", {})
+    with connection.cursor() as cursor:
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name} = {value}")
+
+
+def replica_aliases():
+    return [
+        alias
+        for alias in getattr(settings, "DATABASE_REPLICAS", ())
+        if alias in settings.DATABASES
+    ]
+
+
+@contextmanager
+def replica_reads():
+    """Route reads in this block (and this context) to a replica"""
+    token = _target.set(REPLICA)
+    try:
+        yield
+    finally:
+        _target.reset(token)
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if _target.get() != REPLICA:
+            return DEFAULT_DB_ALIAS
+        replicas = replica_aliases()
+        if not replicas or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        # Later reads in the same request must see this write
+        if _target.get() == REPLICA:
+            _target.set(PRIMARY)
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
+
+
+class ReplicaReadMiddleware:
+    """
+    Serve the reads of safe requests from replicas. A viewset can keep
+    particular actions on the primary by listing them in ``primary_actions``.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+            # Django would run a sync process_view in a thread
+            self.process_view = self.aprocess_view
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        request._replica_reads = request.method in SAFE_METHODS
+        if not request._replica_reads:
+            return self.get_response(request)
+        with replica_reads():
+            return self.get_response(request)
+
+    async def __acall__(self, request):
+        request._replica_reads = request.method in SAFE_METHODS
+        if not request._replica_reads:
+            return await self.get_response(request)
+        with replica_reads():
+            return await self.get_response(request)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        viewset = getattr(view_func, "cls", None)
+        actions = getattr(view_func, "actions", None) or {}
+        action = actions.get(request.method.lower())
+        primary_actions = getattr(viewset, "primary_actions", ())
+        if request._replica_reads and action in primary_actions:
+            _target.set(PRIMARY)
+        return None
+
+    async def aprocess_view(self, request, view_func, view_args, view_kwargs):
+        return ReplicaReadMiddleware.process_view(
+            self, request, view_func, view_args, view_kwargs
+        )
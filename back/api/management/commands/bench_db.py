@@ -0,0 +1,118 @@
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import DatabaseError, connection, connections
+from django.utils import timezone
+
+from api.db import replica_reads
+from api.models import CustomUser, Message
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure concurrent read and write throughput of the configured database "
+        "(message inbox reads against message inserts)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--readers", type=int, default=8)
+        parser.add_argument("--writers", type=int, default=2)
+        parser.add_argument("--seconds", type=float, default=5.0)
+        parser.add_argument(
+            "--rows", type=int, default=1000, help="Messages in the inbox before the run"
+        )
+
+    def handle(self, *args, **options):
+        sender, receiver = self.create_users()
+        try:
+            Message.objects.bulk_create(
+                Message(
+                    sender=sender,
+                    receiver=receiver,
+                    message=f"seed {index}",
+                    timestamp=timezone.now(),
+                )
+                for index in range(options["rows"])
+            )
+            result = self.run(sender, receiver, options)
+        finally:
+            # Cascades to the messages
+            CustomUser.objects.filter(pk__in=[sender.pk, receiver.pk]).delete()
+
+        seconds = options["seconds"]
+        database = connection.settings_dict
+        self.stdout.write(
+            f"{connection.vendor} {database['NAME']} "
+            f"readers={options['readers']} writers={options['writers']}"
+        )
+        if connection.vendor == "sqlite":
+            with connection.cursor() as cursor:
+                cursor.execute("PRAGMA journal_mode")
+                self.stdout.write(f"journal_mode={cursor.fetchone()[0]}")
+        for kind in ("reads", "writes"):
+            self.stdout.write(
+                f"{kind}: {result[kind] / seconds:.0f}/s "
+                f"({result[kind + '_failed']} failed)"
+            )
+
+    def create_users(self):
+        stamp = time.monotonic_ns()
+        return [
+            CustomUser.objects.create(
+                username=f"bench-{name}-{stamp}",
+                email=f"bench-{name}-{stamp}@example.com",
+            )
+            for name in ("sender", "receiver")
+        ]
+
+    def run(self, sender, receiver, options):
+        result = dict.fromkeys(["reads", "reads_failed", "writes", "writes_failed"], 0)
+        lock = threading.Lock()
+        deadline = time.monotonic() + options["seconds"]
+
+        def read():
+            with replica_reads():
+                list(
+                    Message.objects.filter(receiver=receiver).order_by(
+                        "-timestamp", "-id"
+                    )[:20]
+                )
+                Message.objects.filter(receiver=receiver, read=False).count()
+
+        def write():
+            Message.objects.create(
+                sender=sender,
+                receiver=receiver,
+                message="bench",
+                timestamp=timezone.now(),
+            )
+
+        def worker(kind, operation):
+            done = failed = 0
+            try:
+                while time.monotonic() < deadline:
+                    try:
+                        operation()
+                        done += 1
+                    except DatabaseError:
+                        # "database is locked" once the busy timeout runs out
+                        failed += 1
+            finally:
+                connections.close_all()
+            with lock:
+                result[kind] += done
+                result[kind + "_failed"] += failed
+
+        threads = [
+            threading.Thread(target=worker, args=("reads", read))
+            for _ in range(options["readers"])
+        ] + [
+            threading.Thread(target=worker, args=("writes", write))
+            for _ in range(options["writers"])
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return result
@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api import plans
+
+
+class Command(BaseCommand):
+    help = (
+        "EXPLAIN every query of the API's hot paths on seeded data (rolled back "
+        "afterwards) and fail if any of them reads a whole table"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--rows", type=int, default=2000, help="Rows seeded per filtered table"
+        )
+        parser.add_argument(
+            "--show-plans", action="store_true", help="Print the plan of every query"
+        )
+
+    def handle(self, *args, **options):
+        failed = set()
+        for label, sql, plan, scanned in plans.check_plans(options["rows"]):
+            if scanned:
+                failed.add(label)
+                self.stdout.write(
+                    self.style.ERROR(f"FULL SCAN {label}: {', '.join(scanned)}")
+                )
+            elif options["show_plans"]:
+                self.stdout.write(f"ok {label}")
+            else:
+                continue
+            self.stdout.write(f"  {sql}")
+            for line in plan:
+                self.stdout.write(f"    {line}")
+
+        checked = len(plans.HOT_PATHS)
+        if failed:
+            raise CommandError(
+                f"{len(failed)} of {checked} hot paths scan a whole table"
+            )
+        self.stdout.write(self.style.SUCCESS(f"All {checked} hot paths use indexes"))
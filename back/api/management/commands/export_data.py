@@ -0,0 +1,61 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api import transfer
+
+
+class Command(BaseCommand):
+    help = "Stream api tables out as NDJSON (one file or stdout) or CSV (one file per table)"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "models",
+            nargs="*",
+            help="Models to export, e.g. message userprogress (default: all, parents first)",
+        )
+        parser.add_argument("--format", choices=["ndjson", "csv"], default="ndjson")
+        parser.add_argument(
+            "--output",
+            default="-",
+            help="NDJSON file (.gz to compress, - for stdout) or CSV directory",
+        )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=transfer.DEFAULT_CHUNK_SIZE,
+            help="Rows fetched from the database cursor at a time",
+        )
+        parser.add_argument(
+            "--progress-every",
+            type=int,
+            default=100000,
+            help="Report progress every this many rows of a table",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            models = [transfer.get_model(name) for name in options["models"]] or None
+        except transfer.TransferError as error:
+            raise CommandError(error)
+        if models:
+            ordered = transfer.ordered_models()
+            models.sort(key=ordered.index)
+        progress = transfer.Progress(self.report, options["progress_every"])
+        output = options["output"]
+
+        if options["format"] == "csv":
+            if output == "-":
+                raise CommandError("CSV exports need --output DIRECTORY")
+            total = transfer.export_csv(output, models, options["chunk_size"], progress)
+        elif output == "-":
+            total = transfer.export_ndjson(
+                self.stdout, models, options["chunk_size"], progress
+            )
+        else:
+            with transfer.open_text(output, "w") as out:
+                total = transfer.export_ndjson(out, models, options["chunk_size"], progress)
+        self.stderr.write(self.style.SUCCESS(f"Exported {total} rows"))
+
+    def report(self, label, rows, seconds):
+        # Data may be going to stdout, so progress goes to stderr
+        rate = rows / seconds if seconds else rows
+        self.stderr.write(f"{label}: {rows} rows ({rate:,.0f} rows/s)")
@@ -0,0 +1,69 @@
+import os
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api import transfer
+
+
+class Command(BaseCommand):
+    help = "Load api tables from an NDJSON stream or a directory of CSV files"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "source",
+            help="NDJSON file (.gz allowed, - for stdin) or directory of <model>.csv files",
+        )
+        parser.add_argument(
+            "models",
+            nargs="*",
+            help="Models to load from a CSV directory (default: every file present)",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=transfer.DEFAULT_BATCH_SIZE,
+            help="Rows per bulk insert",
+        )
+        parser.add_argument(
+            "--new-ids",
+            action="store_true",
+            help="Let the database assign primary keys and resolve references to them",
+        )
+        parser.add_argument(
+            "--progress-every",
+            type=int,
+            default=100000,
+            help="Report progress every this many rows of a table",
+        )
+
+    def handle(self, *args, **options):
+        source = options["source"]
+        progress = transfer.Progress(self.report, options["progress_every"])
+        settings = {
+            "batch_size": options["batch_size"],
+            "new_ids": options["new_ids"],
+            "progress": progress,
+        }
+        try:
+            if os.path.isdir(source):
+                models = [transfer.get_model(name) for name in options["models"]] or None
+                counts = transfer.import_csv(source, models, **settings)
+            elif options["models"]:
+                raise CommandError("Models can only be chosen for CSV directories")
+            elif source == "-":
+                counts = transfer.import_ndjson(sys.stdin, **settings)
+            else:
+                with transfer.open_text(source, "r") as lines:
+                    counts = transfer.import_ndjson(lines, **settings)
+        except (OSError, transfer.TransferError) as error:
+            raise CommandError(error)
+
+        total = sum(counts.values())
+        self.stdout.write(
+            self.style.SUCCESS(f"Imported {total} rows into {len(counts)} tables")
+        )
+
+    def report(self, label, rows, seconds):
+        rate = rows / seconds if seconds else rows
+        self.stdout.write(f"{label}: {rows} rows ({rate:,.0f} rows/s)")
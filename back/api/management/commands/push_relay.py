@@ -0,0 +1,24 @@
+import asyncio
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api.push import serve_relay
+
+
+class Command(BaseCommand):
+    help = "Run the line relay that shares push events between workers"
+
+    def add_arguments(self, parser):
+        host, port = getattr(settings, "PUSH_RELAY_ADDRESS", ("127.0.0.1", 8765))
+        parser.add_argument("--host", default=host)
+        parser.add_argument("--port", type=int, default=port)
+
+    def handle(self, *args, **options):
+        def started(address):
+            self.stdout.write(f"Push relay listening on {address[0]}:{address[1]}")
+
+        try:
+            asyncio.run(serve_relay(options["host"], options["port"], started))
+        except KeyboardInterrupt:
+            pass
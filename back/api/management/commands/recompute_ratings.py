@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from api.models import Therapist
+
+
+class Command(BaseCommand):
+    help = "Rebuild therapist rating aggregates from the reviews table"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Number of therapists written per bulk update",
+        )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            written = Therapist.recompute_ratings(batch_size=options["batch_size"])
+        self.stdout.write(
+            self.style.SUCCESS(f"Recomputed ratings for {written} therapists")
+        )
@@ -0,0 +1,87 @@
+import os
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api import seeding, transfer
+
+
+class Command(BaseCommand):
+    help = (
+        "Generate a deterministic synthetic data set for every api table, "
+        "about 11,000 rows per --scale unit"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--scale",
+            type=int,
+            default=1,
+            help="Units of 10 therapists with 20 clients each (1000 is about 11M rows)",
+        )
+        parser.add_argument(
+            "--seed", type=int, default=0, help="Same seed, same rows (and usernames)"
+        )
+        parser.add_argument(
+            "--anchor-date",
+            type=date.fromisoformat,
+            default=None,
+            help="The day histories end on, YYYY-MM-DD (default: today)",
+        )
+        parser.add_argument(
+            "--processes",
+            type=int,
+            default=os.cpu_count() or 1,
+            help="Processes generating rows (and writing them, except on SQLite)",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=transfer.DEFAULT_BATCH_SIZE,
+            help="Rows per bulk insert",
+        )
+        parser.add_argument(
+            "--distribution",
+            choices=seeding.Distribution.KINDS,
+            default=None,
+            help="How the per-client counts below are drawn (default: power law "
+            "for appointments and messages, uniform for progress days)",
+        )
+        for name, (_, low, mean, high) in seeding.COUNTS.items():
+            parser.add_argument(
+                f"--{name}",
+                type=int,
+                default=mean,
+                help=f"Mean {name} per active client ({low} to {high})",
+            )
+        parser.add_argument(
+            "--password", default="password", help="Password of every seeded user"
+        )
+
+    def handle(self, *args, **options):
+        try:
+            seeder = seeding.Seeder(
+                options["scale"],
+                seed=options["seed"],
+                anchor=options["anchor_date"],
+                distribution=options["distribution"],
+                means={name: options[name] for name in seeding.COUNTS},
+                password=options["password"],
+            )
+        except seeding.SeedError as error:
+            raise CommandError(error)
+
+        counts = seeding.load(
+            seeder, options["processes"], options["batch_size"], self.report
+        )
+        for model, rows in sorted(counts.items(), key=lambda item: -item[1]):
+            self.stdout.write(f"{model._meta.label_lower}: {rows}")
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Seeded {sum(counts.values())} rows into {len(counts)} tables"
+            )
+        )
+
+    def report(self, done, tasks, rows, seconds):
+        rate = rows / seconds if seconds else rows
+        self.stdout.write(f"{done}/{tasks} tasks: {rows} rows ({rate:,.0f} rows/s)")
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from api import stats
+
+
+class Command(BaseCommand):
+    help = "Write the daily AdminStats row from the live dashboard counters"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--rebuild",
+            action="store_true",
+            help="Recompute all counters from the tables first (after bulk imports)",
+        )
+        parser.add_argument("--date", help="Day to snapshot (YYYY-MM-DD), default today")
+
+    def handle(self, *args, **options):
+        day = None
+        if options["date"]:
+            day = parse_date(options["date"])
+            if day is None:
+                raise CommandError("--date must be YYYY-MM-DD")
+
+        if options["rebuild"]:
+            count = stats.rebuild()
+            self.stdout.write(f"Rebuilt {count} counters")
+
+        row = stats.snapshot(day)
+        self.stdout.write(self.style.SUCCESS(f"Saved statistics for {row.date}"))
@@ -0,0 +1,358 @@
+"""
+Ranked therapist matching.
+
+``match_index`` keeps a feature matrix with one row per available therapist:
+one-hot columns for the languages and specializations they list (their
+``specialty`` counts as a specialization), then price, rating, years of
+experience and the number of bookable slots in the next ``MATCH_SLOT_DAYS``
+days. ``top`` scores every row against a user's preferences and returns the
+best ``limit`` therapist ids with their scores, ties broken by id.
+
+A score is the weighted mean (``WEIGHTS``) of components between 0 and 1:
+
+- languages, specializations: the share of the requested ones listed;
+- price: 1 up to ``max_price``, falling linearly to 0 at twice that;
+- rating over 5, and experience and free slots capped at
+  ``EXPERIENCE_CAP`` and ``FREE_SLOT_CAP``.
+
+Languages, specializations and price only count when the user asks for them.
+
+With NumPy installed the matrix is a few arrays and scoring is one vectorized
+pass plus a partial sort; without it the same scores are computed row by row,
+which is fine for small directories. Like the slot index, the matrix is
+loaded lazily, refreshed row by row when the signals in ``api.signals``
+report a therapist, schedule, appointment or review change, and reloaded
+after ``MATCH_INDEX_TTL`` seconds, which also moves the free-slot window on.
+"""
+
+import heapq
+import threading
+import time as monotonic_time
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from .models import Therapist
+from .slots import slot_index
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+MATCH_SLOT_DAYS = 14
+MAX_RATING = 5
+EXPERIENCE_CAP = 20
+FREE_SLOT_CAP = 20
+WEIGHTS = {
+    "languages": 3,
+    "specializations": 3,
+    "price": 2,
+    "rating": 2,
+    "experience": 1,
+    "free_slots": 1,
+}
+DEFAULT_LIMIT = 10
+MAX_LIMIT = 100
+
+# Numeric columns of the matrix, in order
+PRICE, RATING, EXPERIENCE, FREE_SLOTS = range(4)
+
+
+def terms(value):
+    """Lower-cased terms of a languages/specializations value (list, dict or str)"""
+    if isinstance(value, str):
+        value = [value]
+    elif not isinstance(value, (list, tuple, set, dict)):
+        return set()
+    return {str(term).strip().lower() for term in value} - {""}
+
+
+def match_params(params):
+    """Parse the match query parameters; raises ValueError on bad input"""
+
+    def term_list(name):
+        return sorted(terms(params.get(name, "").split(",")))
+
+    max_price = params.get("max_price")
+    if max_price:
+        try:
+            max_price = float(max_price)
+        except ValueError:
+            max_price = 0
+        if not max_price > 0:
+            raise ValueError("max_price must be a positive number")
+    else:
+        max_price = None
+
+    try:
+        limit = int(params.get("limit", DEFAULT_LIMIT))
+    except ValueError:
+        limit = 0
+    if not 1 <= limit <= MAX_LIMIT:
+        raise ValueError(f"limit must be between 1 and {MAX_LIMIT}")
+    return {
+        "languages": term_list("languages"),
+        "specializations": term_list("specializations"),
+        "max_price": max_price,
+        "limit": limit,
+    }
+
+
+class Features:
+    """One therapist's row of the matrix"""
+
+    __slots__ = ("languages", "specializations", "numbers")
+
+    def __init__(self, languages, specializations, price, rating, experience, free_slots):
+        self.languages = terms(languages)
+        self.specializations = terms(specializations)
+        self.numbers = (float(price), float(rating), float(experience), float(free_slots))
+
+
+def weight_total(languages, specializations, max_price):
+    total = WEIGHTS["rating"] + WEIGHTS["experience"] + WEIGHTS["free_slots"]
+    if languages:
+        total += WEIGHTS["languages"]
+    if specializations:
+        total += WEIGHTS["specializations"]
+    if max_price:
+        total += WEIGHTS["price"]
+    return total
+
+
+def score_row(features, languages, specializations, max_price):
+    """The score ``FeatureMatrix`` computes for a row, one row at a time"""
+    price, rating, experience, free_slots = features.numbers
+    total = (
+        WEIGHTS["rating"] * min(rating / MAX_RATING, 1)
+        + WEIGHTS["experience"] * min(experience, EXPERIENCE_CAP) / EXPERIENCE_CAP
+        + WEIGHTS["free_slots"] * min(free_slots, FREE_SLOT_CAP) / FREE_SLOT_CAP
+    )
+    if languages:
+        shared = len(features.languages.intersection(languages))
+        total += WEIGHTS["languages"] * shared / len(languages)
+    if specializations:
+        shared = len(features.specializations.intersection(specializations))
+        total += WEIGHTS["specializations"] * shared / len(specializations)
+    if max_price:
+        total += WEIGHTS["price"] * min(max(2 - price / max_price, 0), 1)
+    return total / weight_total(languages, specializations, max_price)
+
+
+def grown(array, shape):
+    """``array`` zero-padded to ``shape`` (returned as is when it fits)"""
+    if array.shape == shape:
+        return array
+    larger = np.zeros(shape, dtype=array.dtype)
+    larger[tuple(slice(0, size) for size in array.shape)] = array
+    return larger
+
+
+class FeatureMatrix:
+    """
+    The rows of all available therapists. With NumPy, also as arrays:
+    boolean one-hots per language and specialization term, the numeric
+    columns, and which rows are live (positions of removed therapists stay,
+    marked not live, until the next full load).
+    """
+
+    def __init__(self, rows):
+        self.rows = {}
+        self.ids = []
+        self.positions = {}
+        self.vocabulary = {"languages": {}, "specializations": {}}
+        if np is not None:
+            self.id_array = np.zeros(0, dtype=np.int64)
+            self.live = np.zeros(0, dtype=bool)
+            self.numbers = np.zeros((0, 4))
+            self.onehots = {
+                "languages": np.zeros((0, 0), dtype=bool),
+                "specializations": np.zeros((0, 0), dtype=bool),
+            }
+        self.replace(rows)
+
+    def replace(self, rows):
+        """Apply ``{therapist_id: Features or None}``; None drops the row"""
+        for therapist_id, features in rows.items():
+            if features is None:
+                self.rows.pop(therapist_id, None)
+                continue
+            self.rows[therapist_id] = features
+            if therapist_id not in self.positions:
+                self.positions[therapist_id] = len(self.ids)
+                self.ids.append(therapist_id)
+            for kind, vocabulary in self.vocabulary.items():
+                for term in getattr(features, kind):
+                    vocabulary.setdefault(term, len(vocabulary))
+        if np is not None:
+            self._write_arrays(rows)
+
+    def _write_arrays(self, rows):
+        size = len(self.ids)
+        if len(self.id_array) != size:
+            self.id_array = np.array(self.ids, dtype=np.int64)
+        self.live = grown(self.live, (size,))
+        self.numbers = grown(self.numbers, (size, 4))
+        for kind, vocabulary in self.vocabulary.items():
+            self.onehots[kind] = grown(self.onehots[kind], (size, len(vocabulary)))
+
+        positions = [
+            self.positions[therapist_id]
+            for therapist_id in rows
+            if therapist_id in self.positions
+        ]
+        written = [rows[self.ids[position]] for position in positions]
+        self.live[positions] = [features is not None for features in written]
+        self.numbers[positions] = [
+            features.numbers if features is not None else (0.0,) * 4
+            for features in written
+        ]
+        for kind, vocabulary in self.vocabulary.items():
+            onehot = self.onehots[kind]
+            onehot[positions] = False
+            hot_rows, hot_columns = [], []
+            for position, features in zip(positions, written):
+                for term in getattr(features, kind, ()):
+                    hot_rows.append(position)
+                    hot_columns.append(vocabulary[term])
+            onehot[hot_rows, hot_columns] = True
+
+    def scores(self, languages=(), specializations=(), max_price=None):
+        """Every row's score (NumPy), -inf for rows that are not live"""
+        numbers = self.numbers
+        total = (
+            WEIGHTS["rating"] * np.minimum(numbers[:, RATING] / MAX_RATING, 1)
+            + WEIGHTS["experience"]
+            * np.minimum(numbers[:, EXPERIENCE], EXPERIENCE_CAP)
+            / EXPERIENCE_CAP
+            + WEIGHTS["free_slots"]
+            * np.minimum(numbers[:, FREE_SLOTS], FREE_SLOT_CAP)
+            / FREE_SLOT_CAP
+        )
+        for kind, wanted in (("languages", languages), ("specializations", specializations)):
+            if not wanted:
+                continue
+            vocabulary = self.vocabulary[kind]
+            columns = [vocabulary[term] for term in wanted if term in vocabulary]
+            shared = np.count_nonzero(self.onehots[kind][:, columns], axis=1)
+            total += WEIGHTS[kind] * shared / len(wanted)
+        if max_price:
+            total += WEIGHTS["price"] * np.clip(2 - numbers[:, PRICE] / max_price, 0, 1)
+        total /= weight_total(languages, specializations, max_price)
+        return np.where(self.live, total, -np.inf)
+
+    def top(self, limit, languages=(), specializations=(), max_price=None):
+        """The best ``limit`` rows as ``[(therapist_id, score)]``, best first"""
+        languages = sorted(terms(languages))
+        specializations = sorted(terms(specializations))
+        count = min(limit, len(self.rows))
+        if not count:
+            return []
+
+        if np is None:
+            scored = (
+                (
+                    score_row(features, languages, specializations, max_price),
+                    therapist_id,
+                )
+                for therapist_id, features in self.rows.items()
+            )
+            best = heapq.nsmallest(count, scored, key=lambda item: (-item[0], item[1]))
+            return [(therapist_id, round(score, 4)) for score, therapist_id in best]
+
+        scores = self.scores(languages, specializations, max_price)
+        # Everything scoring at least the count-th best, so ties at the cut
+        # are settled by id rather than by the partition
+        threshold = scores[np.argpartition(-scores, count - 1)[count - 1]]
+        candidates = np.flatnonzero(scores >= threshold)
+        order = np.lexsort((self.id_array[candidates], -scores[candidates]))
+        best = candidates[order[:count]]
+        return [
+            (int(therapist_id), round(float(score), 4))
+            for therapist_id, score in zip(self.id_array[best], scores[best])
+        ]
+
+
+class MatchIndex:
+    """
+    Process-wide cache of the ``FeatureMatrix``, loaded and refreshed the way
+    ``SlotIndex`` is.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._matrix = None
+        self._dirty = set()
+        self._loaded_at = 0.0
+
+    def invalidate(self, therapist_id=None):
+        with self._lock:
+            if therapist_id is None:
+                self._matrix = None
+            else:
+                self._dirty.add(therapist_id)
+
+    def _ttl(self):
+        return getattr(settings, "MATCH_INDEX_TTL", 60)
+
+    def _load(self, therapist_ids=None):
+        rows = {}
+        therapists = Therapist.objects.filter(availability=True).order_by("id")
+        if therapist_ids is not None:
+            therapists = therapists.filter(pk__in=therapist_ids)
+            # Deleted or no longer available therapists drop out
+            rows = dict.fromkeys(therapist_ids)
+
+        values = list(
+            therapists.values_list(
+                "id",
+                "languages",
+                "specializations",
+                "specialty",
+                "price",
+                "rating",
+                "experience",
+            )
+        )
+        start = timezone.localdate()
+        end = start + timedelta(days=MATCH_SLOT_DAYS - 1)
+        free_slots = slot_index.free_slot_counts([row[0] for row in values], start, end)
+
+        for (
+            therapist_id,
+            languages,
+            specializations,
+            specialty,
+            price,
+            rating,
+            experience,
+        ) in values:
+            rows[therapist_id] = Features(
+                languages,
+                [*terms(specializations), specialty],
+                price,
+                rating,
+                experience,
+                free_slots[therapist_id],
+            )
+        return rows
+
+    def _snapshot(self):
+        with self._lock:
+            expired = monotonic_time.monotonic() - self._loaded_at > self._ttl()
+            if self._matrix is None or expired:
+                self._matrix = FeatureMatrix(self._load())
+                self._dirty.clear()
+                self._loaded_at = monotonic_time.monotonic()
+            elif self._dirty:
+                self._matrix.replace(self._load(self._dirty))
+                self._dirty.clear()
+            return self._matrix
+
+    def top(self, limit=DEFAULT_LIMIT, languages=(), specializations=(), max_price=None):
+        return self._snapshot().top(limit, languages, specializations, max_price)
+
+
+match_index = MatchIndex()
@@ -0,0 +1,58 @@
+# Generated by Django 5.0.1 on 2026-10-18 06:47
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_conversations(apps, schema_editor):
+    Message = apps.get_model("api", "Message")
+    Conversation = apps.get_model("api", "Conversation")
+
+    conversations = {}
+    messages = Message.objects.order_by("timestamp", "id").values_list(
+        "id", "sender_id", "receiver_id", "timestamp", "read"
+    )
+    for message_id, sender_id, receiver_id, timestamp, read in messages.iterator():
+        pair = (min(sender_id, receiver_id), max(sender_id, receiver_id))
+        conversation = conversations.get(pair)
+        if conversation is None:
+            conversation = conversations[pair] = Conversation(
+                user_a_id=pair[0], user_b_id=pair[1]
+            )
+        conversation.last_message_id = message_id
+        conversation.last_timestamp = timestamp
+        if not read:
+            if receiver_id == pair[0]:
+                conversation.unread_a += 1
+            else:
+                conversation.unread_b += 1
+
+    Conversation.objects.bulk_create(conversations.values(), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_remove_resource_tags_alter_resource_type'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Conversation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_timestamp', models.DateTimeField(blank=True, null=True)),
+                ('unread_a', models.PositiveIntegerField(default=0)),
+                ('unread_b', models.PositiveIntegerField(default=0)),
+                ('last_message', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='api.message')),
+                ('user_a', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='conversations_as_a', to=settings.AUTH_USER_MODEL)),
+                ('user_b', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='conversations_as_b', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user_a', '-last_timestamp'], name='api_convers_user_a__2c6bc5_idx'), models.Index(fields=['user_b', '-last_timestamp'], name='api_convers_user_b__eab863_idx')],
+                'unique_together': {('user_a', 'user_b')},
+            },
+        ),
+        migrations.RunPython(backfill_conversations, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,73 @@
+# Generated by Django 5.0.1 on 2026-10-18 06:56
+
+from datetime import date, datetime, timedelta
+
+from django.db import migrations, models
+from django.utils import timezone
+
+DAYS = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+
+
+def resolve_start(date_value, time_value, reference):
+    try:
+        if date_value in DAYS:
+            day = reference + timedelta(days=(DAYS.index(date_value) - reference.weekday()) % 7)
+        else:
+            day = date.fromisoformat(date_value)
+        hours, minutes = time_value.split(":")
+        start = datetime.combine(day, datetime.min.time()).replace(
+            hour=int(hours), minute=int(minutes)
+        )
+    except (TypeError, ValueError):
+        return None
+    return timezone.make_aware(start)
+
+
+def backfill_start_end(apps, schema_editor):
+    Appointment = apps.get_model("api", "Appointment")
+
+    batch = []
+    for appointment in Appointment.objects.only(
+        "id", "date", "time", "duration", "created_at"
+    ).iterator(chunk_size=2000):
+        start_at = resolve_start(
+            appointment.date, appointment.time, timezone.localdate(appointment.created_at)
+        )
+        if start_at is None:
+            continue
+        appointment.start_at = start_at
+        appointment.end_at = start_at + timedelta(minutes=appointment.duration)
+        batch.append(appointment)
+        if len(batch) >= 2000:
+            Appointment.objects.bulk_update(batch, ["start_at", "end_at"])
+            batch = []
+    Appointment.objects.bulk_update(batch, ["start_at", "end_at"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_conversation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='appointment',
+            name='end_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='appointment',
+            name='start_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['therapist', 'start_at'], name='api_appoint_therapi_b4e1c6_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['user', 'start_at'], name='api_appoint_user_id_7cd05b_idx'),
+        ),
+        migrations.RunPython(backfill_start_end, migrations.RunPython.noop),
+    ]
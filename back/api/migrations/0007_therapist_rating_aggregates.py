@@ -0,0 +1,78 @@
+# Generated by Django 5.0.1 on 2026-10-18 07:10
+
+from django.db import migrations, models
+from django.db.models import Count, FloatField, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Cast, Coalesce, NullIf, Round
+
+
+def backfill_rating_aggregates(apps, schema_editor):
+    Therapist = apps.get_model("api", "Therapist")
+    Review = apps.get_model("api", "Review")
+
+    def review_total(aggregate):
+        return Coalesce(
+            Subquery(
+                Review.objects.filter(therapist=OuterRef("pk"))
+                .order_by()
+                .values("therapist")
+                .annotate(total=aggregate)
+                .values("total")
+            ),
+            0,
+        )
+
+    rating_sum = review_total(Sum("rating"))
+    reviews_count = review_total(Count("id"))
+    Therapist.objects.update(
+        rating_sum=rating_sum,
+        reviews_count=reviews_count,
+        rating=Coalesce(
+            Round(Cast(rating_sum, FloatField()) / NullIf(reviews_count, 0), 2),
+            Value(0.0),
+        ),
+        **{
+            f"rating_{value}_count": review_total(Count("id", filter=Q(rating=value)))
+            for value in range(1, 6)
+        },
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_event_registered_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='therapist',
+            name='rating_1_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='therapist',
+            name='rating_2_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='therapist',
+            name='rating_3_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='therapist',
+            name='rating_4_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='therapist',
+            name='rating_5_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='therapist',
+            name='rating_sum',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_rating_aggregates, migrations.RunPython.noop),
+    ]
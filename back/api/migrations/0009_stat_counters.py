@@ -0,0 +1,65 @@
+# Generated by Django 5.0.1 on 2026-10-18 07:20
+
+from django.db import migrations, models
+from django.db.models import Count
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+
+def backfill_counters(apps, schema_editor):
+    CustomUser = apps.get_model("api", "CustomUser")
+    Therapist = apps.get_model("api", "Therapist")
+    Resource = apps.get_model("api", "Resource")
+    Appointment = apps.get_model("api", "Appointment")
+    Event = apps.get_model("api", "Event")
+    StatCounter = apps.get_model("api", "StatCounter")
+    tz = timezone.get_current_timezone()
+
+    def grouped(queryset, field):
+        return queryset.values(field).annotate(total=Count("id")).order_by()
+
+    def days(queryset, field):
+        return grouped(
+            queryset.exclude(**{f"{field}__isnull": True}).annotate(
+                day=TruncDate(field, tzinfo=tz)
+            ),
+            "day",
+        )
+
+    counters = {
+        "therapists": Therapist.objects.count(),
+        "resources": Resource.objects.count(),
+    }
+    for row in grouped(CustomUser.objects, "role"):
+        counters[f"users:role:{row['role']}"] = row["total"]
+    for row in grouped(Appointment.objects, "status"):
+        counters[f"appointments:status:{row['status']}"] = row["total"]
+    for row in days(CustomUser.objects.filter(role="user"), "date_joined"):
+        counters[f"users:joined:{row['day'].isoformat()}"] = row["total"]
+    for row in days(Appointment.objects, "start_at"):
+        counters[f"appointments:day:{row['day'].isoformat()}"] = row["total"]
+    for row in grouped(Event.objects, "date"):
+        counters[f"events:day:{row['date'].isoformat()}"] = row["total"]
+
+    StatCounter.objects.bulk_create(
+        StatCounter(key=key, value=value) for key, value in counters.items()
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_notification_receipts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StatCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=100, unique=True)),
+                ('value', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(backfill_counters, migrations.RunPython.noop),
+    ]
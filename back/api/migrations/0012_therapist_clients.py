@@ -0,0 +1,51 @@
+# Generated by Django 5.0.1 on 2026-10-18 08:54
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Max, Min, Q
+
+
+def backfill_therapist_clients(apps, schema_editor):
+    Appointment = apps.get_model("api", "Appointment")
+    TherapistClient = apps.get_model("api", "TherapistClient")
+
+    sessions = ~Q(status="Cancelled")
+    rows = (
+        Appointment.objects.order_by()
+        .values("therapist_id", "user_id")
+        .annotate(
+            appointments_count=Count("id"),
+            first_session_at=Min("start_at", filter=sessions),
+            last_session_at=Max("start_at", filter=sessions),
+        )
+    )
+    TherapistClient.objects.bulk_create(
+        (TherapistClient(**row) for row in rows.iterator()), batch_size=1000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_access_path_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TherapistClient',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('appointments_count', models.PositiveIntegerField(default=0)),
+                ('first_session_at', models.DateTimeField(blank=True, null=True)),
+                ('last_session_at', models.DateTimeField(blank=True, null=True)),
+                ('therapist', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='client_links', to='api.therapist')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='therapist_links', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['therapist', '-last_session_at'], name='api_therapi_therapi_7c3a63_idx')],
+                'unique_together': {('therapist', 'user')},
+            },
+        ),
+        migrations.RunPython(backfill_therapist_clients, migrations.RunPython.noop),
+    ]
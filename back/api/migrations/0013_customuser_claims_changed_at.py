@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0012_therapist_clients"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="customuser",
+            name="claims_changed_at",
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+    ]
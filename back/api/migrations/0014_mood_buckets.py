@@ -0,0 +1,52 @@
+# Generated by Django 5.0.1 on 2026-10-18 09:39
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+from api.trends import BucketStart, bucket_totals
+
+
+def backfill_mood_buckets(apps, schema_editor):
+    UserProgress = apps.get_model("api", "UserProgress")
+    MoodBucket = apps.get_model("api", "MoodBucket")
+
+    for kind in ("week", "month"):
+        rows = (
+            UserProgress.objects.order_by()
+            .annotate(start=BucketStart("date", kind))
+            .values("user_id", "start")
+            .annotate(**bucket_totals())
+        )
+        MoodBucket.objects.bulk_create(
+            (MoodBucket(kind=kind, **row) for row in rows.iterator()), batch_size=1000
+        )
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0013_customuser_claims_changed_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MoodBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('week', 'Week'), ('month', 'Month')], max_length=5)),
+                ('start', models.DateField()),
+                ('entries', models.PositiveIntegerField(default=0)),
+                ('low', models.PositiveIntegerField(default=0)),
+                ('high', models.PositiveIntegerField(default=0)),
+                ('mood_sum', models.PositiveIntegerField(default=0)),
+                ('day_sum', models.BigIntegerField(default=0)),
+                ('day_mood_sum', models.BigIntegerField(default=0)),
+                ('day_square_sum', models.BigIntegerField(default=0)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='mood_buckets', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('user', 'kind', 'start')},
+            },
+        ),
+        migrations.RunPython(backfill_mood_buckets, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0014_mood_buckets"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="notificationreceipt",
+            name="read",
+            field=models.BooleanField(default=True),
+        ),
+    ]
@@ -1,6 +1,13 @@
-from django.db import models
+from datetime import date, datetime, timedelta
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, models, transaction
 from django.contrib.auth.models import AbstractUser
 from django.core.validators import MinValueValidator, MaxValueValidator
+from django.db.models.functions import Cast, Coalesce, NullIf, Round
+from django.utils import timezone
+
+from .trends import BucketStart, bucket_start, bucket_totals, next_bucket
 
 
 class CustomUser(AbstractUser):
@@ -18,15 +25,63 @@ class CustomUser(AbstractUser):
     profile_image = models.URLField(blank=True, null=True)
     date_joined = models.DateTimeField(auto_now_add=True)
     name = models.CharField(max_length=250, default="Anon")
+    # Last change to the claims in access tokens (role, staff flag, active);
+    # tokens issued before it are not trusted (see api.authentication)
+    claims_changed_at = models.DateTimeField(null=True, blank=True, editable=False)
     USERNAME_FIELD = "email"
     REQUIRED_FIELDS = [
         "username",
         "phone",
     ]
 
+    # Carried in access tokens, so most requests never load the user row
+    CLAIM_FIELDS = ("role", "is_staff")
+
     def __str__(self):
         return f"{self.username} ({self.get_role_display()})"
 
+    @staticmethod
+    def cache_key(user_id):
+        return f"auth:user:{user_id}"
+
+    @classmethod
+    def cached(cls, user_id):
+        """The full user, read through a short-lived cache; None if there is none"""
+        key = cls.cache_key(user_id)
+        values = cache.get(key)
+        if values is None:
+            names = [field.attname for field in cls._meta.concrete_fields]
+            values = cls.objects.filter(pk=user_id).values_list(*names).first()
+            if values is None:
+                return None
+            cache.set(key, values, getattr(settings, "AUTH_USER_CACHE_TTL", 60))
+        return cls.from_db(DEFAULT_DB_ALIAS, None, values)
+
+    @classmethod
+    def from_claims(cls, user_id, claims):
+        """
+        A user holding only its id and the token's claims. The first access
+        to any other field loads the rest of the row through ``cached``.
+        Only called for tokens issued after the user's last claims change,
+        and deactivation is one, so the user is known to be active.
+        """
+        known = {"id": user_id, "is_active": True}
+        known.update((name, claims[name]) for name in cls.CLAIM_FIELDS)
+        names = [f.attname for f in cls._meta.concrete_fields if f.attname in known]
+        user = cls.from_db(DEFAULT_DB_ALIAS, names, [known[name] for name in names])
+        user._claims_only = True
+        return user
+
+    def refresh_from_db(self, using=None, fields=None):
+        if fields is not None and self.__dict__.pop("_claims_only", False):
+            full = type(self).cached(self.pk)
+            if full is None:
+                raise self.DoesNotExist("User no longer exists")
+            for name in self.get_deferred_fields():
+                self.__dict__[name] = full.__dict__[name]
+            return
+        super().refresh_from_db(using, fields)
+
 
 class Therapist(models.Model):
     """Therapist profile model"""
@@ -49,10 +104,118 @@ class Therapist(models.Model):
         validators=[MinValueValidator(0), MaxValueValidator(5)],
     )
     reviews_count = models.PositiveIntegerField(default=0)
+    rating_sum = models.PositiveIntegerField(default=0)
+    rating_1_count = models.PositiveIntegerField(default=0)
+    rating_2_count = models.PositiveIntegerField(default=0)
+    rating_3_count = models.PositiveIntegerField(default=0)
+    rating_4_count = models.PositiveIntegerField(default=0)
+    rating_5_count = models.PositiveIntegerField(default=0)
+
+    RATING_VALUES = range(1, 6)
+    RATING_COUNT_FIELDS = tuple(f"rating_{value}_count" for value in RATING_VALUES)
 
     def __str__(self):
         return f"{self.user.username} - {self.specialty}"
 
+    @property
+    def rating_histogram(self):
+        return self.histogram(
+            *(getattr(self, name) for name in self.RATING_COUNT_FIELDS)
+        )
+
+    @classmethod
+    def histogram(cls, *counts):
+        """Review counts per rating value, keyed by the value as a string"""
+        return {str(value): count for value, count in zip(cls.RATING_VALUES, counts)}
+
+    @staticmethod
+    def average_expression(rating_sum, reviews_count):
+        """Average rating rounded to two places, 0 when there are no reviews"""
+        return Coalesce(
+            Round(
+                Cast(rating_sum, models.FloatField()) / NullIf(reviews_count, 0),
+                2,
+            ),
+            models.Value(0.0),
+        )
+
+    @classmethod
+    def adjust_ratings(cls, therapist_id, added=None, removed=None):
+        """
+        Apply one review's change to the stored aggregates in a single UPDATE:
+        ``added`` is the new rating (or None on delete) and ``removed`` the
+        previous one (or None on create).
+        """
+        if added == removed:
+            return
+        updates = {}
+        for value, step in ((added, 1), (removed, -1)):
+            if value is not None:
+                field = f"rating_{value}_count"
+                updates[field] = models.F(field) + step
+
+        rating_sum = models.F("rating_sum") + (added or 0) - (removed or 0)
+        reviews_count = models.F("reviews_count") + (
+            (added is not None) - (removed is not None)
+        )
+        cls.objects.filter(pk=therapist_id).update(
+            rating_sum=rating_sum,
+            reviews_count=reviews_count,
+            rating=cls.average_expression(rating_sum, reviews_count),
+            **updates,
+        )
+
+    @classmethod
+    def recompute_ratings(cls, therapist_ids=None, batch_size=1000):
+        """
+        Rebuild therapists' aggregates from the reviews table with one grouped
+        query; returns the number of therapists written.
+        """
+        therapists = cls.objects.only("id")
+        reviews = Review.objects.order_by()
+        if therapist_ids is not None:
+            therapists = therapists.filter(pk__in=therapist_ids)
+            reviews = reviews.filter(therapist_id__in=therapist_ids)
+
+        totals = {
+            row.pop("therapist"): row
+            for row in reviews
+            .values("therapist")
+            .annotate(
+                total=models.Sum("rating"),
+                count=models.Count("id"),
+                **{
+                    f"rating_{value}_count": models.Count(
+                        "id", filter=models.Q(rating=value)
+                    )
+                    for value in cls.RATING_VALUES
+                },
+            )
+        }
+        fields = ["rating", "rating_sum", "reviews_count"] + [
+            f"rating_{value}_count" for value in cls.RATING_VALUES
+        ]
+        empty = dict.fromkeys(fields[3:], 0)
+
+        batch = []
+        written = 0
+        for therapist in therapists.iterator(chunk_size=batch_size):
+            row = totals.get(therapist.pk, {"total": 0, "count": 0, **empty})
+            therapist.rating_sum = row["total"]
+            therapist.reviews_count = row["count"]
+            therapist.rating = (
+                round(row["total"] / row["count"], 2) if row["count"] else 0
+            )
+            for field in fields[3:]:
+                setattr(therapist, field, row[field])
+            batch.append(therapist)
+            if len(batch) >= batch_size:
+                written += cls.objects.bulk_update(batch, fields)
+                batch = []
+        if batch:
+            written += cls.objects.bulk_update(batch, fields)
+        return written
+
 
 class Schedule(models.Model):
     """Therapist schedule model"""
@@ -80,6 +243,40 @@ class Schedule(models.Model):
     def __str__(self):
         return f"{self.therapist.user.username} - {self.day} {self.time}"
 
+    @classmethod
+    def replace_for(cls, therapist, schedule):
+        """
+        Make ``therapist``'s bookable slots exactly ``schedule`` (day -> list
+        of "HH:MM" times) with one INSERT, one DELETE and one UPDATE at most.
+        Slots that stay keep their ids. Bulk writes send no signals, so callers
+        refresh whatever caches the slots feed.
+        """
+        wanted = {(day, time) for day, times in schedule.items() for time in times}
+        existing = {
+            (slot.day, slot.time): slot
+            for slot in cls.objects.filter(therapist=therapist).only(
+                "id", "day", "time", "is_available"
+            )
+        }
+        removed = [slot.pk for key, slot in existing.items() if key not in wanted]
+        added = [
+            cls(therapist=therapist, day=day, time=time, is_available=True)
+            for day, time in sorted(wanted - existing.keys())
+        ]
+        reopened = [
+            slot
+            for key, slot in existing.items()
+            if key in wanted and not slot.is_available
+        ]
+        for slot in reopened:
+            slot.is_available = True
+
+        with transaction.atomic():
+            if removed:
+                cls.objects.filter(pk__in=removed).delete()
+            cls.objects.bulk_create(added)
+            cls.objects.bulk_update(reopened, ["is_available"])
+
 
 class Appointment(models.Model):
     """Appointment model for booking sessions with therapists"""
@@ -106,15 +303,191 @@ class Appointment(models.Model):
     )
     date = models.CharField(max_length=20)  # Day of week or specific date
     time = models.CharField(max_length=5)  # Format: "HH:MM"
+    # Typed session window derived from date/time/duration on save
+    start_at = models.DateTimeField(null=True, blank=True, db_index=True)
+    end_at = models.DateTimeField(null=True, blank=True)
     status = models.CharField(max_length=10, choices=STATUS_CHOICES, default="Pending")
     type = models.CharField(max_length=10, choices=TYPE_CHOICES, default="Video Call")
     notes = models.TextField(blank=True)
     duration = models.PositiveIntegerField(default=60)  # Duration in minutes
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["therapist", "start_at"]),
+            models.Index(fields=["user", "start_at"]),
+            # ?status= within a participant's list, and across all for admins
+            models.Index(fields=["therapist", "status", "start_at"]),
+            models.Index(fields=["user", "status", "start_at"]),
+            models.Index(fields=["status", "start_at"]),
+            # A therapist's clients (progress visibility)
+            models.Index(fields=["therapist", "user"]),
+        ]
+
     def __str__(self):
         return f"{self.user.username} with {self.therapist.user.username} on {self.date} at {self.time}"
 
+    @staticmethod
+    def resolve_start(date_value, time_value, reference):
+        """
+        Resolve the free-form date and "HH:MM" time to an aware datetime.
+        ``date_value`` is an ISO date or a day-of-week name, which is taken as
+        the first such day on or after ``reference`` (the booking date).
+        Returns None when the values cannot be parsed.
+        """
+        days = [day for day, _ in Schedule.DAYS_OF_WEEK]
+        try:
+            if date_value in days:
+                offset = (days.index(date_value) - reference.weekday()) % 7
+                day = reference + timedelta(days=offset)
+            else:
+                day = date.fromisoformat(date_value)
+            hours, minutes = time_value.split(":")
+            start = datetime.combine(day, datetime.min.time()).replace(
+                hour=int(hours), minute=int(minutes)
+            )
+        except (TypeError, ValueError):
+            return None
+        return timezone.make_aware(start)
+
+    def save(self, *args, **kwargs):
+        reference = timezone.localdate(self.created_at) if self.created_at else timezone.localdate()
+        start_at = self.resolve_start(self.date, self.time, reference)
+        if start_at is not None:
+            self.start_at = start_at
+        if self.start_at is not None:
+            self.end_at = self.start_at + timedelta(minutes=self.duration)
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None:
+            kwargs["update_fields"] = {*update_fields, "start_at", "end_at"}
+        super().save(*args, **kwargs)
+
+    @classmethod
+    def fill_windows(cls, batch_size=1000):
+        """
+        Set start_at/end_at on appointments stored without them, as save()
+        would have, after bulk writes that skipped it. Returns the number of
+        rows filled.
+        """
+        missing = cls.objects.filter(
+            models.Q(start_at__isnull=True) | models.Q(end_at__isnull=True)
+        ).order_by("pk")
+        filled = 0
+        last_pk = 0
+        while True:
+            rows = list(
+                missing.filter(pk__gt=last_pk).values_list(
+                    "pk", "date", "time", "duration", "created_at", "start_at"
+                )[:batch_size]
+            )
+            if not rows:
+                return filled
+            last_pk = rows[-1][0]
+            appointments = []
+            for pk, date_value, time_value, duration, created_at, start_at in rows:
+                reference = (
+                    timezone.localdate(created_at) if created_at else timezone.localdate()
+                )
+                start_at = cls.resolve_start(date_value, time_value, reference) or start_at
+                if start_at is None:
+                    continue
+                appointments.append(
+                    cls(
+                        pk=pk,
+                        start_at=start_at,
+                        end_at=start_at + timedelta(minutes=duration),
+                    )
+                )
+            filled += cls.objects.bulk_update(appointments, ["start_at", "end_at"])
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance.remember_client()
+        return instance
+
+    def remember_client(self):
+        """Record the stored pair so a later save can refresh the one it left"""
+        self._stored_client = (
+            self.__dict__.get("therapist_id"),
+            self.__dict__.get("user_id"),
+        )
+
+
+class TherapistClient(models.Model):
+    """
+    A therapist's client: a user with at least one appointment with them.
+    Maintained from Appointment writes by the signals in ``api.signals``.
+    """
+
+    therapist = models.ForeignKey(
+        Therapist, on_delete=models.CASCADE, related_name="client_links"
+    )
+    user = models.ForeignKey(
+        CustomUser, on_delete=models.CASCADE, related_name="therapist_links"
+    )
+    appointments_count = models.PositiveIntegerField(default=0)
+    # Earliest and latest start of the appointments that were not cancelled
+    first_session_at = models.DateTimeField(null=True, blank=True)
+    last_session_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        unique_together = ("therapist", "user")
+        indexes = [
+            # "My clients", most recently seen first
+            models.Index(fields=["therapist", "-last_session_at"]),
+        ]
+
+    def __str__(self):
+        return f"Client {self.user_id} of therapist {self.therapist_id}"
+
+    @staticmethod
+    def summary():
+        """Aggregates of an appointment queryset that make up a row"""
+        sessions = ~models.Q(status="Cancelled")
+        return {
+            "appointments_count": models.Count("id"),
+            "first_session_at": models.Min("start_at", filter=sessions),
+            "last_session_at": models.Max("start_at", filter=sessions),
+        }
+
+    @classmethod
+    def refresh(cls, therapist_id, user_id):
+        """Recompute one pair from its appointments; drops it when none are left"""
+        row = (
+            Appointment.objects.filter(therapist_id=therapist_id, user_id=user_id)
+            .order_by()
+            .aggregate(**cls.summary())
+        )
+        if not row["appointments_count"]:
+            cls.objects.filter(therapist_id=therapist_id, user_id=user_id).delete()
+            return None
+        client, _ = cls.objects.update_or_create(
+            therapist_id=therapist_id, user_id=user_id, defaults=row
+        )
+        return client
+
+    @classmethod
+    def rebuild(cls, therapist_ids=None, batch_size=1000):
+        """
+        Rebuild the table (or some therapists' rows) from appointments with one
+        grouped query, after bulk writes that sent no signals. Returns the
+        number of rows written.
+        """
+        clients = cls.objects.all()
+        appointments = Appointment.objects.order_by()
+        if therapist_ids is not None:
+            clients = clients.filter(therapist_id__in=therapist_ids)
+            appointments = appointments.filter(therapist_id__in=therapist_ids)
+
+        rows = appointments.values("therapist_id", "user_id").annotate(**cls.summary())
+        with transaction.atomic():
+            clients.delete()
+            created = cls.objects.bulk_create(
+                (cls(**row) for row in rows.iterator()), batch_size=batch_size
+            )
+        return len(created)
+
 
 class Payment(models.Model):
     """Payment model for appointments"""
@@ -167,6 +540,16 @@ class Review(models.Model):
     def __str__(self):
         return f"{self.user.username}'s review for {self.therapist.user.username}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance.remember_rating()
+        return instance
+
+    def remember_rating(self):
+        """Record the stored rating so a later save can apply only the change"""
+        self._stored_rating = (self.__dict__.get("therapist_id"), self.__dict__.get("rating"))
+
 
 class Resource(models.Model):
     """Resource model for educational resources"""
@@ -196,6 +579,18 @@ class Resource(models.Model):
     reviews_count = models.PositiveIntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        # ?category= and ?type= filters; the featured few get their own
+        # partial index (a plain boolean one is too unselective to be used)
+        indexes = [
+            models.Index(fields=["category", "type"]),
+            models.Index(
+                fields=["category", "type"],
+                condition=models.Q(featured=True),
+                name="resource_featured_idx",
+            ),
+        ]
+
     def __str__(self):
         return self.title
 
@@ -221,11 +616,63 @@ class Event(models.Model):
     presenter = models.CharField(max_length=100)
     price = models.DecimalField(max_digits=10, decimal_places=2)
     image = models.URLField(blank=True, null=True)
+    # Maintained by the EventRegistration signals in api.signals, so capacity
+    # checks never COUNT registrations.
+    registered_count = models.PositiveIntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        # ?upcoming=, alone and with ?category=
+        indexes = [
+            models.Index(fields=["date"]),
+            models.Index(fields=["category", "date"]),
+        ]
+
     def __str__(self):
         return f"{self.title} - {self.date}"
 
+    @property
+    def spots_left(self):
+        return self.capacity - self.registered_count
+
+    @classmethod
+    def reserve_spot(cls, event_id):
+        """Atomically take one spot if any are left; returns False when full"""
+        return bool(
+            cls.objects.filter(
+                pk=event_id, registered_count__lt=models.F("capacity")
+            ).update(registered_count=models.F("registered_count") + 1)
+        )
+
+    @classmethod
+    def release_spot(cls, event_id):
+        cls.objects.filter(pk=event_id, registered_count__gt=0).update(
+            registered_count=models.F("registered_count") - 1
+        )
+
+    @classmethod
+    def recount(cls, event_ids=None):
+        """Recompute registered_count from the registrations, after bulk writes"""
+        events = cls.objects.all()
+        if event_ids is not None:
+            events = events.filter(pk__in=event_ids)
+        return events.update(
+            registered_count=Coalesce(
+                models.Subquery(
+                    EventRegistration.objects.filter(event=models.OuterRef("pk"))
+                    .order_by()
+                    .values("event")
+                    .annotate(count=models.Count("id"))
+                    .values("count")
+                ),
+                0,
+            )
+        )
+
+
+class EventFull(Exception):
+    """A registration for an event that has no spots left"""
+
 
 class EventRegistration(models.Model):
     """Event registration model for users registering for events"""
@@ -247,6 +694,22 @@ class EventRegistration(models.Model):
     def __str__(self):
         return f"{self.user.username} - {self.event.title}"
 
+    def save(self, *args, **kwargs):
+        # The post_save signal takes the spot and raises EventFull when there
+        # is none; the registration must be rolled back with it
+        with transaction.atomic(using=kwargs.get("using")):
+            super().save(*args, **kwargs)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance.remember_event()
+        return instance
+
+    def remember_event(self):
+        """Record the stored event so a save that moves it can release its spot"""
+        self._stored_event = self.__dict__.get("event_id")
+
 
 class ReadingList(models.Model):
     """Reading lists for curated resources"""
@@ -276,6 +739,37 @@ class ReadingListItem(models.Model):
     def __str__(self):
         return f"{self.title} - {self.reading_list.title}"
 
+    @classmethod
+    def replace_for(cls, reading_list, titles):
+        """
+        Make ``reading_list``'s books exactly ``titles``, in that order, with
+        one INSERT, one DELETE and one UPDATE at most. Books already on the
+        list keep their ids and only have their position rewritten.
+        """
+        by_title = {}
+        for item in cls.objects.filter(reading_list=reading_list).order_by(
+            "order", "id"
+        ):
+            by_title.setdefault(item.title, []).append(item)
+
+        added, moved = [], []
+        for index, title in enumerate(titles):
+            matches = by_title.get(title)
+            if not matches:
+                added.append(cls(reading_list=reading_list, title=title, order=index))
+                continue
+            item = matches.pop(0)
+            if item.order != index:
+                item.order = index
+                moved.append(item)
+        removed = [item.pk for items in by_title.values() for item in items]
+
+        with transaction.atomic():
+            if removed:
+                cls.objects.filter(pk__in=removed).delete()
+            cls.objects.bulk_create(added)
+            cls.objects.bulk_update(moved, ["order"])
+
 
 class Category(models.Model):
     """Categories for resources and reading lists"""
@@ -321,9 +815,135 @@ class Notification(models.Model):
     date = models.DateTimeField()
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["user", "-created_at", "-id"]),
+            # Unread direct notifications (mark_all_read, ?read=)
+            models.Index(fields=["user", "read"]),
+            models.Index(
+                fields=["role", "-created_at", "-id"],
+                condition=models.Q(user__isnull=True),
+                name="notification_broadcast_idx",
+            ),
+        ]
+
     def __str__(self):
         return f"{self.title} - {self.date}"
 
+    @property
+    def is_broadcast(self):
+        return self.user_id is None
+
+    @classmethod
+    def for_user(cls, user):
+        """
+        Notifications addressed to ``user`` directly or broadcast to their role
+        or everyone, annotated with ``is_read`` for that user. Direct
+        notifications use their own ``read`` flag; a broadcast takes the state
+        of its receipt if it has one, else it is read when it is at or below
+        the user's watermark.
+        """
+        watermark = NotificationWatermark.objects.filter(user=user).values(
+            "last_read_id"
+        )[:1]
+        receipt = NotificationReceipt.objects.filter(
+            user=user, notification=models.OuterRef("pk")
+        )
+        return cls.objects.filter(
+            models.Q(user=user)
+            | models.Q(user__isnull=True, role__in=["all", user.role])
+        ).annotate(
+            is_read=models.Case(
+                models.When(user__isnull=False, then=models.F("read")),
+                models.When(models.Exists(receipt.filter(read=False)), then=False),
+                models.When(
+                    id__lte=Coalesce(models.Subquery(watermark), 0), then=True
+                ),
+                models.When(models.Exists(receipt), then=True),
+                default=False,
+                output_field=models.BooleanField(),
+            )
+        )
+
+    def mark_read(self, user, read=True):
+        """Set the read state of this notification as seen by ``user``"""
+        if not self.is_broadcast:
+            Notification.objects.filter(pk=self.pk).update(read=read)
+            self.read = read
+        else:
+            # A receipt is only kept where the watermark gives the wrong answer
+            watermark = (
+                NotificationWatermark.objects.filter(user=user)
+                .values_list("last_read_id", flat=True)
+                .first()
+            )
+            receipts = NotificationReceipt.objects.filter(user=user, notification=self)
+            if read == (self.pk <= (watermark or 0)):
+                receipts.delete()
+            else:
+                NotificationReceipt.objects.bulk_create(
+                    [NotificationReceipt(user=user, notification=self, read=read)],
+                    update_conflicts=True,
+                    unique_fields=["user", "notification"],
+                    update_fields=["read"],
+                )
+        self.is_read = read
+
+    @classmethod
+    def mark_all_read(cls, user):
+        """
+        Mark everything visible to ``user`` as read: broadcasts by moving the
+        user's watermark to the newest notification id (one upsert), direct
+        notifications with one update on the user index.
+        """
+        latest = cls.objects.aggregate(latest=models.Max("id"))["latest"] or 0
+        NotificationWatermark.objects.bulk_create(
+            [NotificationWatermark(user=user, last_read_id=latest)],
+            update_conflicts=True,
+            unique_fields=["user"],
+            update_fields=["last_read_id"],
+        )
+        # Receipts under the watermark, read or unread, no longer apply.
+        NotificationReceipt.objects.filter(
+            user=user, notification_id__lte=latest
+        ).delete()
+        cls.objects.filter(user=user, read=False).update(read=True)
+
+
+class NotificationWatermark(models.Model):
+    """Per-user high-water mark: broadcasts up to this id have been read"""
+
+    user = models.OneToOneField(
+        CustomUser, on_delete=models.CASCADE, related_name="notification_watermark"
+    )
+    last_read_id = models.PositiveBigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.user.username} read up to {self.last_read_id}"
+
+
+class NotificationReceipt(models.Model):
+    """
+    One user's read state of a broadcast where their watermark has it wrong:
+    read individually above it, or marked unread again at or below it
+    """
+
+    user = models.ForeignKey(
+        CustomUser, on_delete=models.CASCADE, related_name="notification_receipts"
+    )
+    notification = models.ForeignKey(
+        Notification, on_delete=models.CASCADE, related_name="receipts"
+    )
+    read = models.BooleanField(default=True)
+    read_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ("user", "notification")
+
+    def __str__(self):
+        state = "read" if self.read else "did not read"
+        return f"{self.user.username} {state} {self.notification_id}"
+
 
 class Message(models.Model):
     """Messages between users and therapists"""
@@ -339,9 +959,38 @@ class Message(models.Model):
     read = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        # Keyset pagination walks (timestamp, id) within each participant
+        indexes = [
+            models.Index(fields=["sender", "-timestamp", "-id"]),
+            models.Index(fields=["receiver", "-timestamp", "-id"]),
+            # ?partner_id= threads and ?read= (unread inbox)
+            models.Index(fields=["sender", "receiver", "-timestamp", "-id"]),
+            models.Index(fields=["receiver", "read", "-timestamp", "-id"]),
+        ]
+
     def __str__(self):
         return f"Message from {self.sender.username} to {self.receiver.username}"
 
+    def save(self, *args, **kwargs):
+        # The conversation is updated by a post_save signal (api.signals), in
+        # the same transaction as the message, as deletes already are
+        with transaction.atomic(using=kwargs.get("using")):
+            super().save(*args, **kwargs)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance.remember_thread()
+        return instance
+
+    def remember_thread(self):
+        """Record the stored participants, time and read flag for the conversation signals"""
+        self._stored_thread = tuple(
+            self.__dict__.get(name)
+            for name in ("sender_id", "receiver_id", "timestamp", "read")
+        )
+
 
 class UserProgress(models.Model):
     """User progress tracking model"""
@@ -358,9 +1007,110 @@ class UserProgress(models.Model):
     therapist_feedback = models.TextField(blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["user", "-created_at", "-id"]),
+            # ?start_date= / ?end_date= ranges
+            models.Index(fields=["user", "date"]),
+        ]
+
     def __str__(self):
         return f"{self.user.username}'s progress on {self.date}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance.remember_day()
+        return instance
+
+    def remember_day(self):
+        """Record the stored user and date so a later save can refresh the buckets it left"""
+        self._stored_day = (self.__dict__.get("user_id"), self.__dict__.get("date"))
+
+
+class MoodBucket(models.Model):
+    """
+    Totals of one user's progress entries in one week or month, read by mood
+    trends (see ``api.trends``). Maintained from UserProgress writes by the
+    signals in ``api.signals``.
+    """
+
+    KIND_CHOICES = [
+        ("week", "Week"),
+        ("month", "Month"),
+    ]
+
+    user = models.ForeignKey(
+        CustomUser, on_delete=models.CASCADE, related_name="mood_buckets"
+    )
+    kind = models.CharField(max_length=5, choices=KIND_CHOICES)
+    start = models.DateField()  # First day of the week (Monday) or month
+    entries = models.PositiveIntegerField(default=0)
+    low = models.PositiveIntegerField(default=0)
+    high = models.PositiveIntegerField(default=0)
+    mood_sum = models.PositiveIntegerField(default=0)
+    # Sums of d, d * mood and d * d over the entries, d being the days since
+    # trends.BUCKET_EPOCH, for the least-squares slope over any range
+    day_sum = models.BigIntegerField(default=0)
+    day_mood_sum = models.BigIntegerField(default=0)
+    day_square_sum = models.BigIntegerField(default=0)
+
+    class Meta:
+        unique_together = ("user", "kind", "start")
+
+    def __str__(self):
+        return f"{self.kind.title()} of {self.start} for user {self.user_id}"
+
+    @classmethod
+    def refresh(cls, user_id, day):
+        """Recompute the week and month ``day`` falls in; drops them when empty"""
+        day = UserProgress._meta.get_field("date").to_python(day)
+        for kind, _ in cls.KIND_CHOICES:
+            start = bucket_start(kind, day)
+            row = (
+                UserProgress.objects.filter(
+                    user_id=user_id, date__gte=start, date__lt=next_bucket(kind, start)
+                )
+                .order_by()
+                .aggregate(**bucket_totals())
+            )
+            if not row["entries"]:
+                cls.objects.filter(user_id=user_id, kind=kind, start=start).delete()
+                continue
+            cls.objects.update_or_create(
+                user_id=user_id, kind=kind, start=start, defaults=row
+            )
+
+    @classmethod
+    def rebuild(cls, user_ids=None, batch_size=1000):
+        """
+        Rebuild the table (or some users' rows) from progress entries with one
+        grouped query per kind, after bulk writes that sent no signals.
+        Returns the number of rows written.
+        """
+        buckets = cls.objects.all()
+        progress = UserProgress.objects.order_by()
+        if user_ids is not None:
+            buckets = buckets.filter(user_id__in=user_ids)
+            progress = progress.filter(user_id__in=user_ids)
+
+        written = 0
+        with transaction.atomic():
+            buckets.delete()
+            for kind, _ in cls.KIND_CHOICES:
+                rows = (
+                    progress.annotate(start=BucketStart("date", kind))
+                    .values("user_id", "start")
+                    .annotate(**bucket_totals())
+                )
+                written += len(
+                    cls.objects.bulk_create(
+                        (cls(kind=kind, **row) for row in rows.iterator()),
+                        batch_size=batch_size,
+                    )
+                )
+        return written
+
 
 class AdminStats(models.Model):
     """Admin statistics model"""
@@ -375,3 +1125,161 @@ class AdminStats(models.Model):
 
     def __str__(self):
         return f"Admin Stats - {self.date}"
+
+
+class StatCounter(models.Model):
+    """Named live counter maintained by api.stats"""
+
+    key = models.CharField(max_length=100, unique=True)
+    value = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.key} = {self.value}"
+
+    @classmethod
+    def bump(cls, key, delta):
+        """Atomically add ``delta`` to a counter, creating it on first use"""
+        counter = cls.objects.filter(key=key)
+        if not counter.update(value=models.F("value") + delta):
+            cls.objects.bulk_create([cls(key=key)], ignore_conflicts=True)
+            counter.update(value=models.F("value") + delta)
+
+
+class Conversation(models.Model):
+    """Inbox entry for a pair of users, maintained alongside Message writes"""
+
+    # The pair is stored ordered (user_a.id < user_b.id) so each conversation
+    # has exactly one row regardless of who sent the first message.
+    user_a = models.ForeignKey(
+        CustomUser, on_delete=models.CASCADE, related_name="conversations_as_a"
+    )
+    user_b = models.ForeignKey(
+        CustomUser, on_delete=models.CASCADE, related_name="conversations_as_b"
+    )
+    last_message = models.ForeignKey(
+        Message,
+        on_delete=models.SET_NULL,
+        related_name="+",
+        null=True,
+        blank=True,
+    )
+    last_timestamp = models.DateTimeField(null=True, blank=True)
+    unread_a = models.PositiveIntegerField(default=0)  # Unread by user_a
+    unread_b = models.PositiveIntegerField(default=0)  # Unread by user_b
+
+    class Meta:
+        unique_together = ("user_a", "user_b")
+        indexes = [
+            models.Index(fields=["user_a", "-last_timestamp"]),
+            models.Index(fields=["user_b", "-last_timestamp"]),
+        ]
+
+    def __str__(self):
+        return f"Conversation between {self.user_a_id} and {self.user_b_id}"
+
+    @staticmethod
+    def ordered_pair(first_id, second_id):
+        return (first_id, second_id) if first_id < second_id else (second_id, first_id)
+
+    @classmethod
+    def for_user(cls, user):
+        return cls.objects.filter(models.Q(user_a=user) | models.Q(user_b=user))
+
+    @classmethod
+    def record_message(cls, message):
+        """Move the conversation forward for a newly created message"""
+        user_a_id, user_b_id = cls.ordered_pair(message.sender_id, message.receiver_id)
+        conversation, _ = cls.objects.select_for_update().get_or_create(
+            user_a_id=user_a_id, user_b_id=user_b_id
+        )
+
+        updates = {}
+        if (
+            conversation.last_timestamp is None
+            or message.timestamp >= conversation.last_timestamp
+        ):
+            updates["last_message_id"] = message.id
+            updates["last_timestamp"] = message.timestamp
+        if not message.read:
+            unread_field = "unread_a" if message.receiver_id == user_a_id else "unread_b"
+            updates[unread_field] = models.F(unread_field) + 1
+        if updates:
+            cls.objects.filter(pk=conversation.pk).update(**updates)
+
+    @classmethod
+    def record_read(cls, message):
+        """Decrement the receiver's unread count for a message that was just read"""
+        user_a_id, user_b_id = cls.ordered_pair(message.sender_id, message.receiver_id)
+        unread_field = "unread_a" if message.receiver_id == user_a_id else "unread_b"
+        cls.objects.filter(
+            user_a_id=user_a_id, user_b_id=user_b_id, **{f"{unread_field}__gt": 0}
+        ).update(**{unread_field: models.F(unread_field) - 1})
+
+    @classmethod
+    def rebuild_all(cls, batch_size=1000):
+        """
+        Rebuild the whole table from messages in one pass, after bulk writes
+        that sent no signals. Returns the number of rows written.
+        """
+        # Per pair: latest (timestamp, id), unread by user_a, unread by user_b
+        pairs = {}
+        messages = Message.objects.order_by().values_list(
+            "id", "sender_id", "receiver_id", "timestamp", "read"
+        )
+        for pk, sender_id, receiver_id, timestamp, read in messages.iterator(
+            chunk_size=batch_size
+        ):
+            pair = cls.ordered_pair(sender_id, receiver_id)
+            state = pairs.get(pair)
+            if state is None:
+                state = pairs[pair] = [(timestamp, pk), 0, 0]
+            elif (timestamp, pk) > state[0]:
+                state[0] = (timestamp, pk)
+            if not read:
+                state[1 if receiver_id == pair[0] else 2] += 1
+
+        with transaction.atomic():
+            cls.objects.all().delete()
+            created = cls.objects.bulk_create(
+                (
+                    cls(
+                        user_a_id=user_a_id,
+                        user_b_id=user_b_id,
+                        last_message_id=last[1],
+                        last_timestamp=last[0],
+                        unread_a=unread_a,
+                        unread_b=unread_b,
+                    )
+                    for (user_a_id, user_b_id), (last, unread_a, unread_b) in pairs.items()
+                ),
+                batch_size=batch_size,
+            )
+        return len(created)
+
+    @classmethod
+    def rebuild(cls, first_id, second_id):
+        """Recompute a conversation from its messages (after deletes or imports)"""
+        user_a_id, user_b_id = cls.ordered_pair(first_id, second_id)
+        messages = Message.objects.filter(
+            models.Q(sender_id=user_a_id, receiver_id=user_b_id)
+            | models.Q(sender_id=user_b_id, receiver_id=user_a_id)
+        )
+        latest = messages.order_by("-timestamp", "-id").first()
+        if latest is None:
+            cls.objects.filter(user_a_id=user_a_id, user_b_id=user_b_id).delete()
+            return None
+
+        counts = messages.filter(read=False).aggregate(
+            unread_a=models.Count("id", filter=models.Q(receiver_id=user_a_id)),
+            unread_b=models.Count("id", filter=models.Q(receiver_id=user_b_id)),
+        )
+        conversation, _ = cls.objects.update_or_create(
+            user_a_id=user_a_id,
+            user_b_id=user_b_id,
+            defaults={
+                "last_message": latest,
+                "last_timestamp": latest.timestamp,
+                **counts,
+            },
+        )
+        return conversation
@@ -0,0 +1,271 @@
+import base64
+import json
+from collections import OrderedDict
+
+from django.core.exceptions import ValidationError
+from django.core.paginator import InvalidPage
+from django.db.models import F, Q
+from rest_framework import pagination
+from rest_framework.exceptions import NotFound
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+# Rows fetched per round trip by aiterator(); enough for any page
+FETCH_CHUNK_SIZE = 1000
+
+
+async def afetch(queryset):
+    """Evaluate a queryset (prefetches included) from async code"""
+    return [row async for row in queryset.aiterator(chunk_size=FETCH_CHUNK_SIZE)]
+
+
+class PageNumberPagination(pagination.PageNumberPagination):
+    """
+    DRF's page number pagination, which async views can also run through
+    ``apaginate_queryset``: the count and the page rows are read with
+    ``acount()`` and ``aiterator()``, the rest is the sync implementation.
+    """
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        page_size = self.get_page_size(request)
+        if not page_size:
+            return None
+
+        paginator = self.django_paginator_class(queryset, page_size)
+        # Paginator.count is a cached property; filling it in keeps the page
+        # lookup below from counting synchronously
+        paginator.count = await queryset.acount()
+        page_number = self.get_page_number(request, paginator)
+        try:
+            self.page = paginator.page(page_number)
+        except InvalidPage as exc:
+            msg = self.invalid_page_message.format(
+                page_number=page_number, message=str(exc)
+            )
+            raise NotFound(msg)
+
+        if paginator.num_pages > 1 and self.template is not None:
+            self.display_page_controls = True
+        self.page.object_list = await afetch(self.page.object_list)
+        return list(self.page)
+
+
+class KeysetPagination(PageNumberPagination):
+    """
+    Keyset ("seek") pagination for feed-like lists.
+
+    The view declares a two-column ordering through ``keyset_ordering`` (or
+    ``get_keyset_ordering()``), a field and the primary key, e.g.
+    ``("-timestamp", "-id")``. Each page is fetched with a ``WHERE`` on the
+    last row seen and a ``LIMIT``, so deep pages cost the same as the first
+    and no ``COUNT(*)`` is run unless the client asks for the total with
+    ``?count=true``. NULLs in the field sort after every value in both
+    directions.
+
+    Feeds that are the union of several lists (a user's sent and received
+    messages) can return one filter per list from ``get_keyset_partitions()``.
+    Each partition is then read with its own ``LIMIT`` and the pages merged,
+    which lets the database walk one index per partition instead of sorting
+    every row the ``OR`` matches.
+
+    Requests with ``?page=`` or an explicit ``?ordering=`` fall back to page
+    number pagination, over the keyset ordering unless ``?ordering=`` set
+    one. Async views paginate with ``apaginate_queryset``.
+    """
+
+    cursor_query_param = "cursor"
+    count_query_param = "count"
+    page_size_query_param = "page_size"
+    max_page_size = 100
+    invalid_cursor_message = "Invalid cursor"
+
+    def get_ordering(self, view):
+        if hasattr(view, "get_keyset_ordering"):
+            return view.get_keyset_ordering()
+        return view.keyset_ordering
+
+    def uses_keyset(self, request, view):
+        params = request.query_params
+        return not (
+            self.page_query_param in params
+            or "ordering" in params
+            or view is None
+            or self.get_ordering(view) is None
+        )
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset = self.uses_keyset(request, view)
+        if not self.keyset:
+            queryset = self.ordered(queryset, view)
+            return super().paginate_queryset(queryset, request, view)
+        self.count = queryset.count() if self.wants_count(request) else None
+        slices = self.page_slices(queryset, request, view)
+        return self.page_rows([list(rows) for rows in slices])
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        self.keyset = self.uses_keyset(request, view)
+        if not self.keyset:
+            queryset = self.ordered(queryset, view)
+            return await super().apaginate_queryset(queryset, request, view)
+        self.count = await queryset.acount() if self.wants_count(request) else None
+        slices = self.page_slices(queryset, request, view)
+        return self.page_rows([await afetch(rows) for rows in slices])
+
+    def wants_count(self, request):
+        value = request.query_params.get(self.count_query_param, "")
+        return value.lower() in ("1", "true")
+
+    def ordered(self, queryset, view):
+        """
+        The queryset page numbers are taken from, in the keyset order unless
+        a filter already ordered it, so pages never overlap or skip rows
+        """
+        if queryset.ordered:
+            return queryset
+        ordering = None if view is None else self.get_ordering(view)
+        return queryset.order_by(*(ordering or ("pk",)))
+
+    def page_slices(self, queryset, request, view):
+        """The querysets (one per partition) holding the requested page"""
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        ordering = self.get_ordering(view)
+        self.field_name = ordering[0].lstrip("-")
+        self.descending = ordering[0].startswith("-")
+        self.model_field = queryset.model._meta.get_field(self.field_name)
+        self.nullable = self.model_field.null
+
+        self.cursor = self.decode_cursor(request)
+        self.backwards = self.cursor is not None and self.cursor[2]
+        queryset = queryset.order_by(*self.order_expressions(self.backwards))
+        if self.cursor is not None:
+            value, pk, backwards = self.cursor
+            queryset = queryset.filter(self.seek(value, pk, backwards))
+
+        limit = self.page_size + 1
+        self.partitions = self.get_partitions(view)
+        if self.partitions:
+            return [queryset.filter(part)[:limit] for part in self.partitions]
+        return [queryset[:limit]]
+
+    def page_rows(self, pages):
+        """The page from the fetched slices, setting up the links"""
+        backwards = self.backwards
+        if self.partitions:
+            rows = self.merge(pages, backwards)[: self.page_size + 1]
+        else:
+            rows = pages[0]
+        has_more = len(rows) > self.page_size
+        rows = rows[: self.page_size]
+        if backwards:
+            rows.reverse()
+
+        self.rows = rows
+        self.has_next = has_more if not backwards else True
+        self.has_previous = self.cursor is not None and (
+            has_more if backwards else True
+        )
+        return rows
+
+    def get_partitions(self, view):
+        if hasattr(view, "get_keyset_partitions"):
+            return view.get_keyset_partitions()
+        return None
+
+    def merge(self, pages, backwards):
+        """Rows of several partition pages in walk order, without duplicates"""
+        rows = {row.pk: row for page in pages for row in page}.values()
+        descending = self.descending != backwards
+        present = sorted(
+            (row for row in rows if getattr(row, self.field_name) is not None),
+            key=lambda row: (getattr(row, self.field_name), row.pk),
+            reverse=descending,
+        )
+        missing = sorted(
+            (row for row in rows if getattr(row, self.field_name) is None),
+            key=lambda row: row.pk,
+            reverse=descending,
+        )
+        return missing + present if backwards else present + missing
+
+    def order_expressions(self, backwards):
+        # Walking back reverses the direction and moves NULLs to the front
+        descending = self.descending != backwards
+        field = F(self.field_name)
+        if self.nullable:
+            nulls = {"nulls_first": True} if backwards else {"nulls_last": True}
+            field = field.desc(**nulls) if descending else field.asc(**nulls)
+        else:
+            field = field.desc() if descending else field.asc()
+        pk = F("pk").desc() if descending else F("pk").asc()
+        return [field, pk]
+
+    def seek(self, value, pk, backwards):
+        """Rows strictly after (or before) the cursor row in feed order"""
+        lookup = "lt" if self.descending != backwards else "gt"
+        name = self.field_name
+        if value is None:
+            condition = Q(**{f"{name}__isnull": True, f"pk__{lookup}": pk})
+            if backwards:
+                condition |= Q(**{f"{name}__isnull": False})
+            return condition
+
+        # The redundant bound on the field alone gives the index a range to
+        # start from; the OR by itself makes the database scan from the top.
+        condition = Q(**{f"{name}__{lookup}e": value}) & (
+            Q(**{f"{name}__{lookup}": value}) | Q(**{f"pk__{lookup}": pk})
+        )
+        if self.nullable and not backwards:
+            condition |= Q(**{f"{name}__isnull": True})
+        return condition
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            padded = encoded + "=" * (-len(encoded) % 4)
+            value, pk, backwards = json.loads(base64.urlsafe_b64decode(padded))
+            if value is not None:
+                value = self.model_field.to_python(value)
+            return value, int(pk), bool(backwards)
+        except (TypeError, ValueError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_cursor(self, row, backwards):
+        value = getattr(row, self.field_name)
+        if value is not None and hasattr(value, "isoformat"):
+            value = value.isoformat()
+        payload = json.dumps([value, row.pk, backwards], separators=(",", ":"))
+        encoded = base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+        url = self.request.build_absolute_uri()
+        url = remove_query_param(url, self.page_query_param)
+        return replace_query_param(url, self.cursor_query_param, encoded)
+
+    def get_next_link(self):
+        if not self.keyset:
+            return super().get_next_link()
+        if not self.has_next or not self.rows:
+            return None
+        return self.encode_cursor(self.rows[-1], backwards=False)
+
+    def get_previous_link(self):
+        if not self.keyset:
+            return super().get_previous_link()
+        if not self.has_previous or not self.rows:
+            return None
+        return self.encode_cursor(self.rows[0], backwards=True)
+
+    def get_paginated_response(self, data):
+        if not self.keyset:
+            return super().get_paginated_response(data)
+        fields = [
+            ("next", self.get_next_link()),
+            ("previous", self.get_previous_link()),
+            ("results", data),
+        ]
+        if self.count is not None:
+            fields.insert(0, ("count", self.count))
+        return Response(OrderedDict(fields))
+
@@ -0,0 +1,295 @@
+"""
+Query plan checks for the API's hot paths.
+
+``HOT_PATHS`` lists list endpoints with the filters clients actually send.
+``check_plans`` seeds a data set inside a transaction it rolls back, requests
+each path as a user of the given role, records every SELECT the view runs
+(viewset queryset, keyset pagination, counts and subqueries) and asks the
+database for its plan with ``EXPLAIN QUERY PLAN`` (SQLite) or ``EXPLAIN``
+(Postgres). A plan that reads a whole table is reported as a full scan.
+
+Postgres plans are taken with ``enable_seqscan`` off, so a sequential scan
+in the plan means no index can serve the query at all, whatever the size of
+the seeded tables.
+"""
+
+import asyncio
+import re
+from datetime import timedelta
+from decimal import Decimal
+
+from asgiref.sync import async_to_sync
+from django.db import connection, transaction
+from django.test.utils import override_settings
+from django.urls import resolve
+from django.utils import timezone
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from .models import (
+    Appointment,
+    CustomUser,
+    Event,
+    Message,
+    MoodBucket,
+    Notification,
+    Resource,
+    Therapist,
+    TherapistClient,
+    UserProgress,
+)
+
+# (label, role of the requesting user, path, query parameters). Parameter
+# values are formatted with the ids ``seed`` returns.
+HOT_PATHS = [
+    ("messages", "user", "/api/messages/", {}),
+    ("unread messages", "user", "/api/messages/", {"read": "false"}),
+    ("message thread", "user", "/api/messages/", {"partner_id": "{therapist_user}"}),
+    ("notifications", "user", "/api/notifications/", {}),
+    ("unread notifications", "user", "/api/notifications/", {"read": "false"}),
+    ("appointments by status", "user", "/api/appointments/", {"status": "Pending"}),
+    (
+        "upcoming appointments",
+        "user",
+        "/api/appointments/",
+        {"status": "Confirmed", "upcoming": "true"},
+    ),
+    (
+        "therapist appointments by status",
+        "therapist",
+        "/api/appointments/",
+        {"status": "Confirmed"},
+    ),
+    ("all appointments by status", "admin", "/api/appointments/", {"status": "Pending"}),
+    (
+        "progress in a date range",
+        "user",
+        "/api/user-progress/",
+        {"start_date": "{start_date}", "end_date": "{end_date}"},
+    ),
+    ("client progress", "therapist", "/api/user-progress/", {}),
+    ("my clients", "therapist", "/api/therapists/clients/", {}),
+    ("upcoming events", "user", "/api/events/", {"upcoming": "true"}),
+    (
+        "upcoming events by category",
+        "user",
+        "/api/events/",
+        {"category": "Workshop", "upcoming": "true"},
+    ),
+    ("featured resources", "user", "/api/resources/featured/", {}),
+    (
+        "resources by category and type",
+        "user",
+        "/api/resources/",
+        {"category": "Category 1", "type": "Video"},
+    ),
+]
+
+SQLITE_SCAN = re.compile(r"^SCAN (\w+)(?: USING (?:COVERING )?INDEX (\w+))?")
+POSTGRES_SCAN = re.compile(r"Seq Scan on (\w+)()")
+
+
+class Rollback(Exception):
+    pass
+
+
+def seed(rows):
+    """
+    About ``rows`` rows in each filtered table, spread over many users so the
+    requesting users own a small share of them. Returns the ids and values
+    the hot path parameters refer to.
+    """
+    today = timezone.localdate()
+    now = timezone.now()
+    user_count = max(10, rows // 20)
+    users = CustomUser.objects.bulk_create(
+        CustomUser(username=f"plan-user{i}", email=f"plan-user{i}@example.com")
+        for i in range(user_count)
+    )
+    therapist_users = CustomUser.objects.bulk_create(
+        CustomUser(
+            username=f"plan-therapist{i}",
+            email=f"plan-therapist{i}@example.com",
+            role="therapist",
+        )
+        for i in range(max(3, rows // 200))
+    )
+    therapists = Therapist.objects.bulk_create(
+        Therapist(user=user, specialty="Anxiety", experience=5, price=Decimal("50"))
+        for user in therapist_users
+    )
+    admin = CustomUser.objects.create(
+        username="plan-admin", email="plan-admin@example.com", role="admin"
+    )
+
+    appointments = []
+    for i in range(rows):
+        start_at = now + timedelta(days=i % 60 - 30, hours=i % 8)
+        appointments.append(
+            Appointment(
+                user=users[i % user_count],
+                therapist=therapists[i % len(therapists)],
+                date=start_at.date().isoformat(),
+                time=start_at.strftime("%H:%M"),
+                start_at=start_at,
+                end_at=start_at + timedelta(minutes=60),
+                status=Appointment.STATUS_CHOICES[i % 4][0],
+            )
+        )
+    Appointment.objects.bulk_create(appointments)
+    TherapistClient.rebuild()
+    Message.objects.bulk_create(
+        Message(
+            sender=users[i % user_count],
+            receiver=therapist_users[i % len(therapist_users)]
+            if i % 2
+            else users[(i + 1) % user_count],
+            message="Hello",
+            timestamp=now - timedelta(minutes=i),
+            read=i % 3 == 0,
+        )
+        for i in range(rows)
+    )
+    Notification.objects.bulk_create(
+        Notification(
+            user=None if i % 10 == 0 else users[i % user_count],
+            role="all",
+            title="Notice",
+            message="Message",
+            type="system",
+            read=i % 3 == 0,
+            date=now,
+        )
+        for i in range(rows)
+    )
+    UserProgress.objects.bulk_create(
+        UserProgress(
+            user=users[i % user_count],
+            date=today - timedelta(days=i % 365),
+            mood_rating=i % 10 + 1,
+        )
+        for i in range(rows)
+    )
+    MoodBucket.rebuild()
+    Event.objects.bulk_create(
+        Event(
+            title=f"Event {i}",
+            date=today + timedelta(days=i % 365 - 300),
+            time="10 AM - 12 PM",
+            location="Online",
+            category=Event.CATEGORY_CHOICES[i % 5][0],
+            capacity=100,
+            description="Description",
+            presenter="Presenter",
+            price=Decimal("0.00") if i % 2 else Decimal("25.00"),
+        )
+        for i in range(rows)
+    )
+    Resource.objects.bulk_create(
+        Resource(
+            title=f"Resource {i}",
+            author="Author",
+            description="Description",
+            category=f"Category {i % 50}",
+            url="https://example.com/resource",
+            featured=i % 50 == 0,
+            type="Video" if i % 2 else "Ebook",
+        )
+        for i in range(rows)
+    )
+    return {
+        "user": users[0],
+        "therapist": therapist_users[1],
+        "admin": admin,
+        "therapist_user": therapist_users[1].pk,
+        "start_date": (today - timedelta(days=30)).isoformat(),
+        "end_date": today.isoformat(),
+    }
+
+
+def explain(sql, params):
+    prefix = connection.ops.explain_query_prefix()
+    with connection.cursor() as cursor:
+        cursor.execute(f"{prefix} {sql}", params)
+        if connection.vendor == "sqlite":
+            return [row[-1] for row in cursor.fetchall()]
+        return [row[0] for row in cursor.fetchall()]
+
+
+def partial_indexes():
+    """Names of SQLite partial indexes; walking one whole is not a table scan"""
+    if connection.vendor != "sqlite":
+        return set()
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'index' AND sql LIKE '% WHERE %'"
+        )
+        return {name for name, in cursor.fetchall()}
+
+
+def full_scans(plan, partial=()):
+    """The tables (or SQLite table aliases) a plan reads in full"""
+    pattern = POSTGRES_SCAN if connection.vendor == "postgresql" else SQLITE_SCAN
+    scanned = []
+    for line in plan:
+        match = pattern.search(line.strip())
+        if match and match.group(1) != "CONSTANT" and match.group(2) not in partial:
+            scanned.append(match.group(1))
+    return scanned
+
+
+def request_path(role, path, params, context):
+    """Run one hot path through its view; returns the (sql, params) it ran"""
+    request = APIRequestFactory().get(
+        path,
+        {name: value.format(**context) for name, value in params.items()},
+    )
+    force_authenticate(request, user=context[role])
+    match = resolve(path)
+    queries = []
+
+    def record(execute, sql, sql_params, many, execution_context):
+        if sql.lstrip().upper().startswith("SELECT"):
+            queries.append((sql, sql_params))
+        return execute(sql, sql_params, many, execution_context)
+
+    view = match.func
+    if asyncio.iscoroutinefunction(view):
+        # Its queries still run on this thread's connection
+        view = async_to_sync(view)
+    with connection.execute_wrapper(record):
+        response = view(request, *match.args, **match.kwargs)
+    if response.status_code != 200:
+        raise ValueError(f"{path} answered {response.status_code}")
+    return queries
+
+
+def check_plans(rows=2000, paths=HOT_PATHS):
+    """
+    Seed, then plan every query of every hot path. Returns a list of
+    ``(label, sql, plan, scanned_tables)``, one per distinct statement.
+    """
+    results = []
+    try:
+        with transaction.atomic():
+            context = seed(rows)
+            partial = partial_indexes()
+            with connection.cursor() as cursor:
+                cursor.execute("ANALYZE")
+                if connection.vendor == "postgresql":
+                    cursor.execute("SET LOCAL enable_seqscan = off")
+            # Cached catalog responses would skip the queries being checked;
+            # pagination links are built for the request factory's host.
+            with override_settings(RESPONSE_CACHE_ENABLED=False, ALLOWED_HOSTS=["*"]):
+                for label, role, path, params in paths:
+                    seen = set()
+                    for sql, sql_params in request_path(role, path, params, context):
+                        # Per-row lookups repeat the same statement
+                        if sql in seen:
+                            continue
+                        seen.add(sql)
+                        plan = explain(sql, sql_params)
+                        results.append((label, sql, plan, full_scans(plan, partial)))
+            raise Rollback
+    except Rollback:
+        pass
+    return results
@@ -0,0 +1,326 @@
+"""
+Request profiling: per-request phase timings and per-route histograms.
+
+``ProfilingMiddleware`` profiles a ``PROFILING_SAMPLE_RATE`` share of
+requests. For each sampled request it records:
+
+- the number of SQL queries and their total time;
+- serializer time, meaning the outermost ``.data`` of a DRF serializer or a
+  compiled serializer's ``serialize``;
+- render time, from the view returning to the response being rendered
+  (async views render it themselves, inside ``phase("render")``);
+- total time spent inside the middleware.
+
+Queries run while serializing or rendering (lazy relations) count as database
+time only. The phases go out in a ``Server-Timing`` header (unless
+``PROFILING_SERVER_TIMING`` is off), so browser dev tools show them.
+
+Every sampled request also lands in ``perf_registry``. The registry keeps a
+latency histogram and a query-count histogram per route (method and URL
+name), plus phase totals. The buckets are fixed and log-spaced, so memory does
+not grow with traffic and percentiles are within one bucket (10%) of the
+truth. ``/api/_perf/`` serves the registry to admins. Each worker process
+keeps its own registry.
+
+Queries are timed by an execute wrapper installed on every connection as it
+opens (see ``api.signals``). The wrapper reads the request's profile from a
+context variable, which also reaches ``sync_to_async`` threads. For requests
+that are not sampled it costs one context variable lookup per query.
+"""
+
+import contextvars
+import math
+import random
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.utils import timezone
+from rest_framework import serializers
+
+_current = contextvars.ContextVar("request_profile", default=None)
+
+# Upper bounds of the latency buckets in ms: 0.1 ms to about 10 minutes, each
+# 10% wider than the last
+LATENCY_BOUNDS_MS = tuple(0.1 * 1.1**power for power in range(165))
+# Exact up to 50 queries, coarser beyond
+QUERY_BOUNDS = (*range(51), 60, 70, 80, 90, 100, 150, 200, 300, 500, 1000)
+PERCENTILES = (50, 95, 99)
+PHASES = ("db", "serialize", "render")
+
+
+class RequestProfile:
+    __slots__ = ("started", "queries", "db", "serialize", "render", "view_done", "depth")
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db = 0.0
+        self.serialize = 0.0
+        self.render = 0.0
+        self.view_done = None
+        self.depth = 0
+
+    def server_timing(self, total):
+        return ", ".join(
+            [
+                f'db;dur={self.db * 1000:.2f};desc="{self.queries} queries"',
+                f"serialize;dur={self.serialize * 1000:.2f}",
+                f"render;dur={self.render * 1000:.2f}",
+                f"total;dur={total * 1000:.2f}",
+            ]
+        )
+
+
+def time_query(execute, sql, params, many, context):
+    profile = _current.get()
+    if profile is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        profile.queries += 1
+        profile.db += time.perf_counter() - started
+
+
+def install_query_timer(connection):
+    # First in the list, so wrappers pushed with execute_wrapper() pop cleanly
+    if time_query not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, time_query)
+
+
+@contextmanager
+def phase(name):
+    """
+    Add the time spent in the block, minus its queries, to a phase of the
+    current request's profile. Nested blocks count once.
+    """
+    profile = _current.get()
+    if profile is None or profile.depth:
+        yield
+        return
+    profile.depth += 1
+    started = time.perf_counter()
+    db_before = profile.db
+    try:
+        yield
+    finally:
+        profile.depth -= 1
+        elapsed = time.perf_counter() - started - (profile.db - db_before)
+        setattr(profile, name, getattr(profile, name) + elapsed)
+
+
+def profiled_data(data):
+    def get(self):
+        with phase("serialize"):
+            return data.fget(self)
+
+    get.original = data
+    return property(get)
+
+
+def instrument_serializers(enable=True):
+    """
+    Time ``.data`` of DRF serializers as the serialize phase, or with
+    ``enable=False`` put DRF's own property back. Only called while profiling
+    is on (see ``enabled``), so other setups keep DRF untouched.
+    """
+    for serializer_class in (serializers.Serializer, serializers.ListSerializer):
+        data = serializer_class.__dict__["data"]
+        original = getattr(data.fget, "original", None)
+        if enable and original is None:
+            serializer_class.data = profiled_data(data)
+        elif not enable and original is not None:
+            serializer_class.data = original
+
+
+class Histogram:
+    """Counts per bucket of fixed upper bounds, plus an overflow bucket"""
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0
+
+    def add(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def percentile(self, percent):
+        """The upper bound of the bucket holding the percentile, at most ``max``"""
+        rank = max(1, math.ceil(self.count * percent / 100))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                if index == len(self.bounds):
+                    return self.max
+                return min(self.bounds[index], self.max)
+        return self.max
+
+    def summary(self, digits=2):
+        summary = {
+            f"p{percent}": round(self.percentile(percent), digits)
+            for percent in PERCENTILES
+        }
+        summary["mean"] = round(self.total / self.count, digits) if self.count else 0
+        summary["max"] = round(self.max, digits)
+        return summary
+
+
+class RouteStats:
+    def __init__(self):
+        self.latency = Histogram(LATENCY_BOUNDS_MS)
+        self.queries = Histogram(QUERY_BOUNDS)
+        self.phases = dict.fromkeys(PHASES, 0.0)
+
+    def add(self, profile, total):
+        self.latency.add(total * 1000)
+        self.queries.add(profile.queries)
+        for name in PHASES:
+            self.phases[name] += getattr(profile, name) * 1000
+
+
+class PerfRegistry:
+    """Per-route statistics of the sampled requests of this process"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._routes = {}
+        self._since = timezone.now()
+
+    def record(self, route, profile, total):
+        with self._lock:
+            stats = self._routes.get(route)
+            if stats is None:
+                stats = self._routes[route] = RouteStats()
+            stats.add(profile, total)
+
+    def snapshot(self):
+        with self._lock:
+            routes = {}
+            for route, stats in sorted(self._routes.items()):
+                count = stats.latency.count
+                routes[route] = {
+                    "requests": count,
+                    "latency_ms": stats.latency.summary(),
+                    "queries": stats.queries.summary(digits=1),
+                    "mean_phase_ms": {
+                        name: round(total / count, 2)
+                        for name, total in stats.phases.items()
+                    },
+                }
+            return {
+                "since": self._since,
+                "sample_rate": sample_rate(),
+                "routes": routes,
+            }
+
+    def reset(self):
+        with self._lock:
+            self._routes.clear()
+            self._since = timezone.now()
+
+
+perf_registry = PerfRegistry()
+
+
+def sample_rate():
+    if not getattr(settings, "PROFILING_ENABLED", True):
+        return 0.0
+    return getattr(settings, "PROFILING_SAMPLE_RATE", 1.0)
+
+
+def enabled():
+    """Whether any request can be profiled with the current settings"""
+    return (
+        "api.profiling.ProfilingMiddleware" in settings.MIDDLEWARE
+        and sample_rate() > 0
+    )
+
+
+def route_name(request):
+    match = getattr(request, "resolver_match", None)
+    name = (match.view_name or match.route) if match else "unresolved"
+    return f"{request.method} {name}"
+
+
+class ProfilingMiddleware:
+    """
+    Profile a sample of requests; put it first in ``MIDDLEWARE`` so the total
+    covers the rest of the stack. Streaming responses are not recorded.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+            # Django would run a sync process_template_response in a thread
+            self.process_template_response = self.aprocess_template_response
+
+    def _start(self):
+        rate = sample_rate()
+        if rate <= 0 or (rate < 1 and random.random() >= rate):
+            return None, None
+        profile = RequestProfile()
+        return profile, _current.set(profile)
+
+    def _finish(self, request, response, profile):
+        if response.streaming:
+            return response
+        total = time.perf_counter() - profile.started
+        perf_registry.record(route_name(request), profile, total)
+        if getattr(settings, "PROFILING_SERVER_TIMING", True):
+            response["Server-Timing"] = profile.server_timing(total)
+        return response
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        profile, token = self._start()
+        if profile is None:
+            return self.get_response(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self._finish(request, response, profile)
+
+    async def __acall__(self, request):
+        profile, token = self._start()
+        if profile is None:
+            return await self.get_response(request)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self._finish(request, response, profile)
+
+    def process_template_response(self, request, response):
+        # The view is done; the handler renders the response next, unless the
+        # view rendered it itself (async views do, timed as a phase there)
+        profile = _current.get()
+        if profile is not None and not response.is_rendered:
+            profile.view_done = time.perf_counter()
+            db_before = profile.db
+
+            def rendered(response):
+                elapsed = time.perf_counter() - profile.view_done
+                profile.render += elapsed - (profile.db - db_before)
+
+            response.add_post_render_callback(rendered)
+        return response
+
+    async def aprocess_template_response(self, request, response):
+        return ProfilingMiddleware.process_template_response(self, request, response)
@@ -0,0 +1,338 @@
+"""
+Publish/subscribe behind the server-sent event stream at ``/api/stream/``.
+
+Each open stream subscribes to its user's channels (the user, their role and
+everyone) on the worker's broker. Signal handlers publish new notifications
+and messages to the matching channel once the transaction commits, and the
+broker hands them to every subscribed stream on that stream's event loop.
+
+``PUSH_BACKEND`` selects the broker class. ``LocalBroker`` only reaches
+streams in the same process; ``RelayBroker`` forwards through a small line
+based relay (``manage.py push_relay``) so every worker sees every event, as a
+local stand-in for a shared broker such as Redis.
+"""
+
+import asyncio
+import itertools
+import json
+import queue
+import socket
+import threading
+import time
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+DEFAULT_QUEUE_SIZE = 100
+DEFAULT_KEEPALIVE = 15
+# Events a worker holds for the relay, and bytes the relay holds for a worker
+DEFAULT_RELAY_BUFFER = 1000
+DEFAULT_RELAY_CLIENT_BUFFER = 1024 * 1024
+# Reconnect delays in seconds, doubling from the first to the second
+RELAY_RETRY = (0.1, 5.0)
+RELAY_BATCH = 100
+
+
+def user_channel(user_id):
+    return f"user:{user_id}"
+
+
+def role_channel(role):
+    return f"role:{role}"
+
+
+def channels_for(user):
+    """Channels a user's stream listens on"""
+    return [user_channel(user.pk), role_channel(user.role), role_channel("all")]
+
+
+class Subscription:
+    """Bounded queue of events for one open stream, bound to its event loop"""
+
+    def __init__(self, channels, queue_size):
+        self.channels = channels
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(queue_size)
+        self.overflowed = False
+
+    def deliver(self, event):
+        # A stream that falls this far behind is closed instead of buffering
+        # without bound; the client reconnects and refetches.
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.overflowed = True
+
+    async def get(self, timeout):
+        return await asyncio.wait_for(self.queue.get(), timeout)
+
+
+class LocalBroker:
+    """Fan-out to the streams open in this process"""
+
+    def __init__(self, queue_size=DEFAULT_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self._lock = threading.Lock()
+        self._subscribers = {}
+        self._ids = itertools.count(1)
+
+    def subscribe(self, channels):
+        subscription = Subscription(channels, self.queue_size)
+        with self._lock:
+            for channel in channels:
+                self._subscribers.setdefault(channel, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            for channel in subscription.channels:
+                subscribers = self._subscribers.get(channel)
+                if subscribers is not None:
+                    subscribers.discard(subscription)
+                    if not subscribers:
+                        del self._subscribers[channel]
+
+    def subscriber_count(self):
+        with self._lock:
+            return len(set().union(*self._subscribers.values()))
+
+    def publish(self, channel, event_type, data):
+        self.dispatch(channel, {"type": event_type, "data": data})
+
+    def dispatch(self, channel, event):
+        """Hand ``event`` to this process's subscribers of ``channel``"""
+        event = {**event, "id": next(self._ids)}
+        with self._lock:
+            subscribers = list(self._subscribers.get(channel, ()))
+        for subscription in subscribers:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.deliver, event)
+            except RuntimeError:
+                # The stream's event loop has already shut down
+                self.unsubscribe(subscription)
+
+
+class RelayBroker(LocalBroker):
+    """
+    ``LocalBroker`` whose publishes go through the relay at
+    ``PUSH_RELAY_ADDRESS``. The relay echoes every line to all connected
+    workers, including the publisher, and a reader thread dispatches what
+    arrives.
+
+    ``publish`` never waits on the network, since it runs on request threads:
+    it queues the event for a writer thread, which connects, reconnects with
+    backoff and sends whatever has queued up in one write. While the relay is
+    unreachable, and once ``PUSH_RELAY_BUFFER`` events are already waiting
+    for it, events are delivered locally only (and counted in ``dropped``).
+    """
+
+    def __init__(self, queue_size=DEFAULT_QUEUE_SIZE, address=None, buffer_size=None):
+        super().__init__(queue_size)
+        host, port = address or getattr(
+            settings, "PUSH_RELAY_ADDRESS", ("127.0.0.1", 8765)
+        )
+        self.address = (host, int(port))
+        self.dropped = 0
+        self._socket = None
+        self._socket_lock = threading.Lock()
+        self._pending = queue.Queue(
+            buffer_size or getattr(settings, "PUSH_RELAY_BUFFER", DEFAULT_RELAY_BUFFER)
+        )
+        self._writer = None
+        self._down = False
+        self._closed = False
+
+    def _connect(self):
+        with self._socket_lock:
+            if self._socket is None:
+                connection = socket.create_connection(self.address, timeout=1)
+                connection.settimeout(None)
+                self._socket = connection
+                threading.Thread(
+                    target=self._read, args=(connection,), daemon=True
+                ).start()
+            return self._socket
+
+    def _disconnect(self, connection):
+        with self._socket_lock:
+            if self._socket is connection:
+                self._socket = None
+        try:
+            connection.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def _read(self, connection):
+        try:
+            for line in connection.makefile("rb"):
+                message = json.loads(line)
+                self.dispatch(message["channel"], message["event"])
+        except (OSError, ValueError):
+            pass
+        finally:
+            self._disconnect(connection)
+            connection.close()
+
+    def _write(self):
+        delay = RELAY_RETRY[0]
+        while not self._closed:
+            try:
+                connection = self._connect()
+            except OSError:
+                self._down = True
+                self._deliver_locally(delay)
+                delay = min(delay * 2, RELAY_RETRY[1])
+                continue
+            self._down = False
+            delay = RELAY_RETRY[0]
+
+            batch = [self._pending.get()]
+            while len(batch) < RELAY_BATCH and batch[-1] is not None:
+                try:
+                    batch.append(self._pending.get_nowait())
+                except queue.Empty:
+                    break
+            batch = [item for item in batch if item is not None]
+            if not batch:
+                continue
+            try:
+                # Fails if the reader saw the relay go away in the meantime
+                connection.sendall(b"".join(line for _, _, line in batch))
+            except OSError:
+                self._disconnect(connection)
+                for channel, event, _ in batch:
+                    self.dispatch(channel, event)
+
+    def _deliver_locally(self, seconds):
+        """Dispatch queued events here while waiting to reconnect"""
+        deadline = time.monotonic() + seconds
+        while not self._closed and (remaining := deadline - time.monotonic()) > 0:
+            try:
+                item = self._pending.get(timeout=remaining)
+            except queue.Empty:
+                return
+            if item is not None:
+                self.dispatch(item[0], item[1])
+
+    def close(self):
+        self._closed = True
+        try:
+            self._pending.put_nowait(None)  # Wakes the writer
+        except queue.Full:
+            pass
+        with self._socket_lock:
+            connection, self._socket = self._socket, None
+        if connection is not None:
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def _start(self):
+        """Start the writer, which also connects, on first use"""
+        if self._writer is None:
+            with self._socket_lock:
+                if self._writer is None:
+                    self._writer = threading.Thread(target=self._write, daemon=True)
+                    self._writer.start()
+
+    def subscribe(self, channels):
+        # Streams only receive what arrives over the relay connection
+        self._start()
+        return super().subscribe(channels)
+
+    def publish(self, channel, event_type, data):
+        event = {"type": event_type, "data": data}
+        self._start()
+        if not self._down and not self._closed:
+            line = json.dumps({"channel": channel, "event": event}).encode() + b"\n"
+            try:
+                self._pending.put_nowait((channel, event, line))
+                return
+            except queue.Full:
+                pass
+        self.dropped += 1
+        self.dispatch(channel, event)
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    global _broker
+    if _broker is None:
+        with _broker_lock:
+            if _broker is None:
+                backend = getattr(settings, "PUSH_BACKEND", "api.push.LocalBroker")
+                _broker = import_string(backend)(
+                    queue_size=getattr(settings, "PUSH_QUEUE_SIZE", DEFAULT_QUEUE_SIZE)
+                )
+    return _broker
+
+
+def publish(channel, event_type, data):
+    get_broker().publish(channel, event_type, data)
+
+
+def format_event(event):
+    data = json.dumps(event["data"], separators=(",", ":"))
+    return f"id: {event['id']}\nevent: {event['type']}\ndata: {data}\n\n"
+
+
+async def stream_events(user, broker=None):
+    """Yield server-sent event frames for ``user`` until the client leaves"""
+    broker = broker or get_broker()
+    keepalive = getattr(settings, "PUSH_KEEPALIVE", DEFAULT_KEEPALIVE)
+    subscription = broker.subscribe(channels_for(user))
+    try:
+        yield "retry: 5000\n\n"
+        while not subscription.overflowed:
+            try:
+                event = await subscription.get(keepalive)
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+                continue
+            yield format_event(event)
+        yield "event: overflow\ndata: {}\n\n"
+    finally:
+        broker.unsubscribe(subscription)
+
+
+async def relay(reader, writer, clients, client_buffer=DEFAULT_RELAY_CLIENT_BUFFER):
+    """
+    Echo each line from one worker to every connected worker. Writes are not
+    awaited, so one slow worker cannot hold up the rest; a worker that lets
+    more than ``client_buffer`` bytes pile up is disconnected instead, and
+    reconnects once it catches up.
+    """
+    clients.add(writer)
+    try:
+        while line := await reader.readline():
+            for client in list(clients):
+                try:
+                    client.write(line)
+                except (ConnectionError, RuntimeError):
+                    clients.discard(client)
+                    continue
+                if client.transport.get_write_buffer_size() > client_buffer:
+                    clients.discard(client)
+                    client.transport.abort()
+    except asyncio.CancelledError:
+        pass  # relay shutting down; a cancelled handler is logged as an error
+    finally:
+        clients.discard(writer)
+        writer.close()
+
+
+async def serve_relay(host, port, started=None, client_buffer=DEFAULT_RELAY_CLIENT_BUFFER):
+    clients = set()
+    server = await asyncio.start_server(
+        lambda reader, writer: relay(reader, writer, clients, client_buffer),
+        host,
+        port,
+    )
+    if started is not None:
+        started(server.sockets[0].getsockname())
+    async with server:
+        await server.serve_forever()
@@ -0,0 +1,91 @@
+"""
+orjson and MessagePack renderers and parsers, the API's defaults.
+
+``ORJSONRenderer`` writes the same JSON as DRF's ``JSONRenderer`` (compact,
+UTF-8, U+2028/U+2029 escaped) with orjson. Values orjson has no type for
+(``Decimal``, lazy translations, querysets) and the date and time types,
+whose format differs from DRF's, go through DRF's own
+``JSONEncoder.default``. Decimals become numbers and UTC datetimes end in
+``Z``, exactly as before. Anything orjson still rejects falls back to the
+stdlib renderer. Examples are integers wider than 64 bits and non-string
+dict keys. Indented output (the browsable API, ``; indent=`` in ``Accept``)
+also uses the stdlib renderer.
+
+``ORJSONParser`` reads request bodies with orjson. One difference from the
+stdlib: integers wider than 64 bits come back as floats.
+
+``MessagePackRenderer`` and ``MessagePackParser`` serve
+``application/msgpack`` to clients that ask for it in ``Accept`` or
+``Content-Type``. Values are converted the same way as for JSON, so a
+msgpack body decodes to the JSON body's data. They need the optional
+``msgpack`` package; settings only enable them when it is installed.
+"""
+
+import orjson
+from django.conf import settings
+from rest_framework import parsers, renderers
+from rest_framework.exceptions import ParseError
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+encode_default = JSONEncoder().default
+
+ORJSON_OPTIONS = orjson.OPT_PASSTHROUGH_DATETIME
+LINE_SEPARATORS = ((b"\xe2\x80\xa8", b"\\u2028"), (b"\xe2\x80\xa9", b"\\u2029"))
+
+
+class ORJSONRenderer(renderers.JSONRenderer):
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+        if self.get_indent(accepted_media_type, renderer_context or {}) is not None:
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            ret = orjson.dumps(data, default=encode_default, option=ORJSON_OPTIONS)
+        except orjson.JSONEncodeError:
+            return super().render(data, accepted_media_type, renderer_context)
+        for character, escaped in LINE_SEPARATORS:
+            if character in ret:
+                ret = ret.replace(character, escaped)
+        return ret
+
+
+class ORJSONParser(parsers.JSONParser):
+    renderer_class = ORJSONRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get("encoding", settings.DEFAULT_CHARSET)
+        if encoding.lower().replace("-", "") != "utf8":
+            return super().parse(stream, media_type, parser_context)
+        try:
+            return orjson.loads(stream.read())
+        except orjson.JSONDecodeError as exc:
+            raise ParseError(f"JSON parse error - {exc}")
+
+
+class MessagePackRenderer(renderers.BaseRenderer):
+    media_type = "application/msgpack"
+    format = "msgpack"
+    charset = None
+    render_style = "binary"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+        return msgpack.packb(data, default=encode_default, datetime=False)
+
+
+class MessagePackParser(parsers.BaseParser):
+    media_type = "application/msgpack"
+    renderer_class = MessagePackRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        try:
+            return msgpack.unpackb(stream.read())
+        except (ValueError, msgpack.UnpackException) as exc:
+            raise ParseError(f"MessagePack parse error - {exc}")
@@ -0,0 +1,164 @@
+"""
+Response cache for the read-heavy catalog endpoints.
+
+Cached views store their serialized ``response.data`` in the ``responses``
+cache alias (LRU with a TTL, see ``CACHES`` in settings) under a key built
+from the namespace, the namespace's current version, the requester's role,
+the host, the path and the sorted query parameters. Writes never delete
+entries: the signals in ``api.signals`` bump the namespace version after the
+transaction commits, so every older key simply stops being read and ages out.
+Async views are cached the same way through the cache's async methods.
+"""
+
+import asyncio
+import hashlib
+import threading
+import time
+from functools import wraps
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.response import Response
+
+CACHE_ALIAS = "responses"
+
+
+class ResponseCache:
+    def __init__(self, alias=CACHE_ALIAS):
+        self.alias = alias
+        self._lock = threading.Lock()
+        self._counters = {}
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    @property
+    def enabled(self):
+        return getattr(settings, "RESPONSE_CACHE_ENABLED", True)
+
+    def version(self, namespace):
+        key = f"version:{namespace}"
+        version = self.cache.get(key)
+        if version is None:
+            # Seeded from the clock so a version evicted by the LRU never
+            # comes back with a number older entries were stored under.
+            self.cache.add(key, time.time_ns(), timeout=None)
+            version = self.cache.get(key)
+        return version
+
+    async def aversion(self, namespace):
+        key = f"version:{namespace}"
+        version = await self.cache.aget(key)
+        if version is None:
+            await self.cache.aadd(key, time.time_ns(), timeout=None)
+            version = await self.cache.aget(key)
+        return version
+
+    def invalidate(self, *namespaces):
+        for namespace in namespaces:
+            try:
+                self.cache.incr(f"version:{namespace}")
+            except ValueError:
+                self.cache.add(f"version:{namespace}", time.time_ns(), timeout=None)
+
+    def key(self, namespace, request, version=None):
+        if version is None:
+            version = self.version(namespace)
+        user = request.user
+        role = user.role if user.is_authenticated else "anonymous"
+        query = urlencode(sorted(request.query_params.lists()), doseq=True)
+        target = f"{request.get_host()}{request.path}?{query}"
+        digest = hashlib.md5(target.encode()).hexdigest()
+        return f"response:{namespace}:{version}:{role}:{digest}"
+
+    async def akey(self, namespace, request):
+        return self.key(namespace, request, await self.aversion(namespace))
+
+    def record(self, namespace, hit):
+        with self._lock:
+            counters = self._counters.setdefault(namespace, [0, 0])
+            counters[0 if hit else 1] += 1
+
+    def stats(self):
+        """Hits and misses per namespace since this process started"""
+        with self._lock:
+            return {
+                namespace: {
+                    "hits": hits,
+                    "misses": misses,
+                    "hit_rate": round(hits / (hits + misses), 4),
+                }
+                for namespace, (hits, misses) in sorted(self._counters.items())
+            }
+
+    def reset_stats(self):
+        with self._lock:
+            self._counters.clear()
+
+
+response_cache = ResponseCache()
+
+
+def cached_response(namespace, anonymous_only=False):
+    """
+    Serve a GET view from the response cache, storing successful responses.
+    With ``anonymous_only`` authenticated requests always go to the view.
+    """
+
+    def bypass(request):
+        return (
+            request.method != "GET"
+            or not response_cache.enabled
+            or (anonymous_only and request.user.is_authenticated)
+        )
+
+    def hit(data):
+        response_cache.record(namespace, hit=True)
+        response = Response(data)
+        response["X-Cache"] = "HIT"
+        return response
+
+    def decorator(view):
+        if asyncio.iscoroutinefunction(view):
+
+            @wraps(view)
+            async def async_wrapper(viewset, request, *args, **kwargs):
+                if bypass(request):
+                    return await view(viewset, request, *args, **kwargs)
+
+                key = await response_cache.akey(namespace, request)
+                data = await response_cache.cache.aget(key)
+                if data is not None:
+                    return hit(data)
+
+                response_cache.record(namespace, hit=False)
+                response = await view(viewset, request, *args, **kwargs)
+                if response.status_code == 200:
+                    await response_cache.cache.aset(key, response.data)
+                response["X-Cache"] = "MISS"
+                return response
+
+            return async_wrapper
+
+        @wraps(view)
+        def wrapper(viewset, request, *args, **kwargs):
+            if bypass(request):
+                return view(viewset, request, *args, **kwargs)
+
+            key = response_cache.key(namespace, request)
+            data = response_cache.cache.get(key)
+            if data is not None:
+                return hit(data)
+
+            response_cache.record(namespace, hit=False)
+            response = view(viewset, request, *args, **kwargs)
+            if response.status_code == 200:
+                response_cache.cache.set(key, response.data)
+            response["X-Cache"] = "MISS"
+            return response
+
+        return wrapper
+
+    return decorator
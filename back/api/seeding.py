@@ -0,0 +1,985 @@
+"""
+Deterministic synthetic data at production volumes, behind the ``seed``
+command.
+
+``Seeder`` describes one data set: ``scale`` units of ten therapists with
+twenty clients each, plus events, resources, reading lists, broadcasts and
+a month of admin stats. It fills every table in this app, at about 11,000
+rows per unit:
+
+- therapists with a weekly schedule grid;
+- clients with appointment histories, payments for the sessions that were
+  held or booked, and reviews of their therapist;
+- a message thread with their therapist, with its ``Conversation`` row;
+- personal notifications, broadcast receipts and read watermarks;
+- event registrations;
+- daily progress entries for the clients who track their mood.
+
+The number of appointments, messages and progress days each client gets
+is drawn from a ``Distribution``. The default is a power law, so most
+conversations are short and a few are very long.
+
+The rows are a function of the seed, the scale, the distribution and the
+anchor date (today by default) only. Each task draws from its own random
+generator, named after the seed and the task. Primary keys are assigned up
+front, starting above the keys already in use. Clients come in chunks.
+Every chunk's appointments, messages and progress entries get a key range
+computed from a cheap first pass over the per-client counts, so chunks can
+be generated in any order and by any number of processes.
+
+Rows are written with batched parameterised INSERTs, as ``transfer`` does,
+with one transaction per task. With more than one process, workers generate
+the rows. On SQLite, which has a single writer, the parent process writes
+them. Other backends let each worker write its own tasks. Bulk inserts send
+no signals, so the derived tables and caches are rebuilt once at the end.
+"""
+
+import math
+import random
+import time
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from datetime import time as clock
+from decimal import Decimal
+from functools import partial
+from multiprocessing import get_context
+
+import django
+from django.contrib.auth.hashers import make_password
+from django.core.management.color import no_style
+from django.db import DEFAULT_DB_ALIAS, connections, models, transaction
+from django.utils import timezone
+
+from . import transfer
+from .models import (
+    AdminStats,
+    Appointment,
+    Category,
+    Conversation,
+    CustomUser,
+    Event,
+    EventRegistration,
+    Message,
+    Notification,
+    NotificationReceipt,
+    NotificationWatermark,
+    Payment,
+    ReadingList,
+    ReadingListItem,
+    Resource,
+    Review,
+    Schedule,
+    Therapist,
+    UserProgress,
+)
+
+THERAPISTS_PER_SCALE = 10
+CLIENTS_PER_THERAPIST = 20
+EVENTS_PER_SCALE = 2
+RESOURCES_PER_SCALE = 20
+BROADCASTS_PER_SCALE = 3
+READING_LISTS_PER_SCALE = 1
+BOOKS_PER_LIST = 5
+ADMIN_STATS_DAYS = 30
+
+CLIENT_CHUNK = 1000
+THERAPIST_CHUNK = 500
+
+# Shares of clients who book sessions, message their therapist, track their
+# mood and review their therapist after a session
+BOOKING_SHARE = 0.9
+MESSAGING_SHARE = 0.8
+TRACKING_SHARE = 0.35
+REVIEW_SHARE = 0.35
+REGISTRATION_SHARE = 0.25
+
+# Key strides for the tables with at most this many rows per client
+NOTIFICATIONS_PER_CLIENT = 3
+RECEIPTS_PER_CLIENT = 2
+RECENT_BROADCASTS = 30
+REGISTRATIONS_PER_CLIENT = 2
+# Smallest and largest event capacity
+EVENT_CAPACITY = (50, 200)
+
+# (distribution, minimum, mean, maximum) per active client; the command can
+# change the means and use one distribution for all three
+COUNTS = {
+    "appointments": ("powerlaw", 1, 6, 200),
+    "messages": ("powerlaw", 2, 15, 5000),
+    "progress": ("uniform", 7, 90, 365),
+}
+
+JOIN_DAYS = 730
+HISTORY_DAYS = 365
+BOOKING_AHEAD_DAYS = 30
+MESSAGE_DAYS = 180
+
+DAYS = [day for day, _ in Schedule.DAYS_OF_WEEK]
+SLOT_TIMES = [f"{hour:02d}:00" for hour in range(9, 17)]
+SLOTS_PER_THERAPIST = len(DAYS) * len(SLOT_TIMES)
+
+FIRST_NAMES = [
+    "Amara", "Ben", "Chloe", "Daniel", "Elena", "Farid", "Grace", "Hiro",
+    "Ines", "Jonas", "Kemi", "Liam", "Maya", "Noah", "Olga", "Priya",
+    "Quinn", "Rosa", "Sami", "Tara", "Umar", "Vera", "Wen", "Yara",
+]
+LAST_NAMES = [
+    "Adeyemi", "Brown", "Costa", "Dubois", "Evans", "Fischer", "Garcia",
+    "Hansen", "Ivanova", "Jensen", "Kowalski", "Lopez", "Murphy", "Nakamura",
+    "Okafor", "Patel", "Rossi", "Silva", "Tanaka", "Weber",
+]
+SPECIALTIES = [
+    "Anxiety", "Depression", "Trauma", "Relationships", "Addiction",
+    "Grief", "Stress", "Sleep",
+]
+SPECIALIZATIONS = [
+    "CBT", "DBT", "EMDR", "ACT", "Psychodynamic", "Mindfulness",
+    "Family Therapy", "Couples Therapy",
+]
+LANGUAGES = ["English", "Spanish", "French", "German", "Arabic", "Hindi", "Mandarin"]
+DEGREES = ["MSc Clinical Psychology", "PhD Psychology", "MA Counselling", "PsyD"]
+CATEGORIES = [
+    ("Anxiety", "brain", "#6366f1"),
+    ("Depression", "cloud", "#0ea5e9"),
+    ("Stress", "flame", "#f97316"),
+    ("Relationships", "heart", "#ec4899"),
+    ("Sleep", "moon", "#8b5cf6"),
+    ("Mindfulness", "leaf", "#22c55e"),
+    ("Trauma", "shield", "#ef4444"),
+    ("Self-esteem", "star", "#eab308"),
+]
+EXERCISES = ["breathing", "journaling", "meditation", "walk", "stretching", "gratitude"]
+# Picked whole, which is several times cheaper than sampling per entry
+EXERCISE_SETS = [
+    [],
+    [],
+    *([exercise] for exercise in EXERCISES),
+    *([first, second] for first, second in zip(EXERCISES, EXERCISES[1:])),
+]
+MESSAGES = [
+    "Hi, how are you feeling this week?",
+    "Thanks for the session yesterday.",
+    "Could we move our appointment?",
+    "I tried the breathing exercise and it helped.",
+    "Please fill in your mood tracker before we meet.",
+    "I had a difficult day today.",
+    "See you on Thursday.",
+    "Here is the article I mentioned.",
+]
+REVIEWS = [
+    "Very attentive and helpful.",
+    "Gave me practical tools that work.",
+    "Good listener, sessions were useful.",
+    "Not the right fit for me.",
+    "Changed how I deal with stress.",
+]
+NOTES = ["", "", "", "Slept badly", "Good day at work", "Felt anxious", "Calm weekend"]
+NOTIFICATIONS = [
+    ("appointment", "Appointment reminder", "Your session starts in one hour."),
+    ("appointment", "Appointment confirmed", "Your therapist confirmed the booking."),
+    ("message", "New message", "You have a new message from your therapist."),
+    ("system", "Weekly check-in", "Remember to record how you feel today."),
+]
+BROADCASTS = [
+    ("system", "Scheduled maintenance", "The app will be unavailable for a few minutes."),
+    ("event", "New workshop", "Registrations for the next workshop are open."),
+    ("system", "New features", "Mood trends are now available in your progress page."),
+]
+BROADCAST_ROLES = ["all", "user", "therapist"]
+RATING_WEIGHTS = [5, 7, 15, 33, 40]
+
+
+class SeedError(ValueError):
+    """A data set that cannot be generated into this database"""
+
+
+class Distribution:
+    """
+    How many rows of a kind one client gets: between ``low`` and ``high``,
+    ``mean`` on average, drawn from a power law (Pareto, with the shape whose
+    mean is ``mean`` once capped at ``high``), uniformly, or always the mean.
+    """
+
+    KINDS = ("powerlaw", "uniform", "fixed")
+
+    def __init__(self, kind, low, mean, high):
+        if kind not in self.KINDS:
+            raise SeedError(f"Distribution must be one of: {', '.join(self.KINDS)}")
+        if not low <= mean <= high:
+            raise SeedError(f"Mean must be between {low} and {high}")
+        self.kind = kind
+        self.low = low
+        self.mean = mean
+        self.high = high
+        if kind == "powerlaw" and low < mean < high:
+            self.alpha = self.shape()
+
+    def capped_mean(self, alpha):
+        low, high = self.low, self.high
+        if alpha == 1:
+            return low * (1 + math.log(high / low))
+        return (low * alpha - low**alpha * high ** (1 - alpha)) / (alpha - 1)
+
+    def shape(self):
+        # The capped mean falls as the shape grows; bisect on a log scale
+        lower, upper = 0.01, 100.0
+        for _ in range(60):
+            alpha = math.sqrt(lower * upper)
+            if self.capped_mean(alpha) > self.mean:
+                lower = alpha
+            else:
+                upper = alpha
+        return alpha
+
+    def draw(self, rng):
+        if self.kind == "fixed" or self.mean in (self.low, self.high):
+            return self.mean
+        if self.kind == "uniform":
+            return rng.randint(
+                max(self.low, 2 * self.mean - self.high),
+                min(self.high, 2 * self.mean - self.low),
+            )
+        return min(self.high, round(self.low * rng.paretovariate(self.alpha)))
+
+
+def next_keys(models_):
+    """The first free primary key of each model"""
+    return {
+        model: (model.objects.aggregate(top=models.Max("pk"))["top"] or 0) + 1
+        for model in models_
+    }
+
+
+class Table:
+    """Column order, defaults and value converters of one model's INSERTs"""
+
+    def __init__(self, model, connection):
+        fields = transfer.data_fields(model)
+        self.model = model
+        self.names = [field.attname for field in fields]
+        self.columns = [model._meta.pk.column] + [field.column for field in fields]
+        self.defaults = [
+            None if field.null or not field.has_default() else field.get_default()
+            for field in fields
+        ]
+        self.fields = list(zip(self.names, self.defaults))
+        # (position in the row, converter) of the columns that need one
+        self.converted = [
+            (position, convert)
+            for position, convert in enumerate(
+                (converter(field, connection) for field in fields), 1
+            )
+            if convert is not None
+        ]
+
+    def row(self, pk, values):
+        row = [pk, *[values.get(name, default) for name, default in self.fields]]
+        for position, convert in self.converted:
+            if row[position] is not None:
+                row[position] = convert(row[position])
+        return row
+
+
+def converter(field, connection):
+    """
+    Turns a generated value into what the driver takes, None when it takes
+    the value as is. Datetimes are generated naive, in UTC.
+    """
+    ops = connection.ops
+    if isinstance(field, models.DateTimeField):
+        adapt, sample = ops.adapt_datetimefield_value, datetime(2000, 1, 2, 3, 4, 5)
+    elif isinstance(field, models.DateField):
+        adapt, sample = ops.adapt_datefield_value, datetime(2000, 1, 2).date()
+    elif isinstance(field, models.JSONField):
+        return partial(ops.adapt_json_value, encoder=field.encoder)
+    else:
+        return None
+    # Backends that store these as text want what str() gives; skip their
+    # per-value checks
+    return str if adapt(sample) == str(sample) else adapt
+
+
+_tables = {}
+
+
+def table(model):
+    found = _tables.get(model)
+    if found is None:
+        found = _tables[model] = Table(model, connections[DEFAULT_DB_ALIAS])
+    return found
+
+
+class Seeder:
+    """
+    One data set, as a list of tasks (``tasks``) that each generate the rows
+    of a few tables (``generate``). Instances are sent to worker processes,
+    so they only hold plain values.
+    """
+
+    def __init__(
+        self,
+        scale,
+        seed=0,
+        anchor=None,
+        distribution=None,
+        means=None,
+        password="password",
+    ):
+        if scale < 1:
+            raise SeedError("Scale must be at least 1")
+        self.scale = scale
+        self.seed = seed
+        self.anchor = anchor or timezone.localdate()
+        self.now = datetime.combine(self.anchor, clock(12))
+        means = means or {}
+        self.distributions = {
+            name: Distribution(distribution or kind, low, means.get(name) or mean, high)
+            for name, (kind, low, mean, high) in COUNTS.items()
+        }
+
+        self.therapists = scale * THERAPISTS_PER_SCALE
+        self.clients = self.therapists * CLIENTS_PER_THERAPIST
+        self.events = scale * EVENTS_PER_SCALE
+        self.resources = scale * RESOURCES_PER_SCALE
+        self.broadcasts = scale * BROADCASTS_PER_SCALE
+        self.reading_lists = scale * READING_LISTS_PER_SCALE
+        self.client_chunks = math.ceil(self.clients / CLIENT_CHUNK)
+        self.therapist_chunks = math.ceil(self.therapists / THERAPIST_CHUNK)
+
+        if CustomUser.objects.filter(username=self.username("admin")).exists():
+            raise SeedError(f"Seed {seed} is already loaded; pick another --seed")
+        self.keys = next_keys(transfer.ordered_models())
+        existing = set(AdminStats.objects.values_list("date", flat=True))
+        self.stats_dates = [
+            self.anchor - timedelta(days=days)
+            for days in range(ADMIN_STATS_DAYS, 0, -1)
+            if self.anchor - timedelta(days=days) not in existing
+        ]
+        # One hash for everyone, salted by the seed so it is reproducible
+        self.password = make_password(password, salt=f"seed{seed}")
+
+        rng = self.random("prices")
+        self.prices = [
+            Decimal(rng.randrange(40, 205, 5)).quantize(Decimal("0.01"))
+            for _ in range(self.therapists)
+        ]
+        rng = self.random("capacities")
+        self.capacities = [rng.randint(*EVENT_CAPACITY) for _ in range(self.events)]
+        # Where each client chunk's appointments, messages and progress
+        # entries start, relative to the table's first free key
+        self.offsets = {"appointments": [], "messages": [], "progress": []}
+        totals = Counter()
+        for chunk in range(self.client_chunks):
+            for name in self.offsets:
+                self.offsets[name].append(totals[name])
+            for _, appointments, messages, progress in self.plan(chunk):
+                totals.update(
+                    appointments=appointments, messages=messages, progress=progress
+                )
+
+    def random(self, *parts):
+        return random.Random(":".join(map(str, (self.seed, *parts))))
+
+    def username(self, name):
+        return f"seed{self.seed}-{name}"
+
+    def broadcast_time(self, index):
+        # Oldest first, so later broadcasts have higher ids as real ones do
+        spacing = timedelta(days=HISTORY_DAYS) / self.broadcasts
+        return self.now - spacing * (self.broadcasts - index)
+
+    def user_id(self, kind, index):
+        base = self.keys[CustomUser]
+        if kind == "client":
+            return base + index
+        if kind == "therapist":
+            return base + self.clients + index
+        return base + self.clients + self.therapists
+
+    def tasks(self):
+        """Tasks in two phases: parents of the client rows, then the clients"""
+        parents = [("catalog", 0)]
+        parents += [("therapists", chunk) for chunk in range(self.therapist_chunks)]
+        return [parents, [("clients", chunk) for chunk in range(self.client_chunks)]]
+
+    def generate(self, task):
+        """``[(model, rows)]`` of a task, parents first, rows ready to insert"""
+        kind, chunk = task
+        rows = {}
+        getattr(self, f"generate_{kind}")(chunk, rows)
+        return [
+            (model, rows[model]) for model in transfer.ordered_models() if rows.get(model)
+        ]
+
+    def add(self, rows, model, pk, values):
+        rows.setdefault(model, []).append(table(model).row(pk, values))
+
+    def user(self, rows, pk, rng, username, role, joined, **values):
+        first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+        self.add(
+            rows,
+            CustomUser,
+            pk,
+            {
+                "password": self.password,
+                "username": self.username(username),
+                "email": f"{self.username(username)}@example.com",
+                "first_name": first,
+                "last_name": last,
+                "name": f"{first} {last}",
+                "phone": f"+1555{rng.randrange(10**7):07d}",
+                "role": role,
+                "date_joined": joined,
+                **values,
+            },
+        )
+
+    def generate_catalog(self, chunk, rows):
+        rng = self.random("catalog")
+        keys = self.keys
+        self.user(
+            rows,
+            self.user_id("admin", 0),
+            rng,
+            "admin",
+            "admin",
+            self.now - timedelta(days=JOIN_DAYS + 30),
+            is_staff=True,
+            is_superuser=True,
+        )
+
+        resources_in = Counter()
+        for index in range(self.resources):
+            title, _, _ = rng.choice(CATEGORIES)
+            resources_in[title] += 1
+            kind = rng.choice(["Video", "Ebook"])
+            duration = None
+            if kind == "Video":
+                duration = f"{rng.randint(3, 59):02d}:{rng.randint(0, 59):02d}"
+            self.add(
+                rows,
+                Resource,
+                keys[Resource] + index,
+                {
+                    "title": f"{title} {kind.lower()} {index + 1}",
+                    "author": f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}",
+                    "description": f"A practical {kind.lower()} on {title.lower()}.",
+                    "category": title,
+                    "url": f"https://example.com/seed{self.seed}/resources/{index}",
+                    "featured": rng.random() < 0.05,
+                    "duration": duration,
+                    "type": kind,
+                    "rating": Decimal(rng.randint(300, 500)) / 100,
+                    "reviews_count": rng.randint(0, 500),
+                    "created_at": self.now - timedelta(days=rng.randint(1, JOIN_DAYS)),
+                },
+            )
+        for index, (title, icon, color) in enumerate(CATEGORIES):
+            self.add(
+                rows,
+                Category,
+                keys[Category] + index,
+                {"title": title, "icon": icon, "color": color, "count": resources_in[title]},
+            )
+
+        for index in range(self.events):
+            day = self.anchor + timedelta(days=rng.randint(-180, 180))
+            category, _ = rng.choice(Event.CATEGORY_CHOICES)
+            self.add(
+                rows,
+                Event,
+                keys[Event] + index,
+                {
+                    "title": f"{rng.choice(SPECIALTIES)} {category.lower()} {index + 1}",
+                    "date": day,
+                    "time": rng.choice(["10 AM - 12 PM", "2 PM - 4 PM", "6 PM - 7 PM"]),
+                    "location": rng.choice(["Online", "Community Center", "Main Clinic"]),
+                    "category": category,
+                    "capacity": self.capacities[index],
+                    "description": "An open session led by one of our therapists.",
+                    "presenter": f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}",
+                    "price": Decimal(rng.choice([0, 10, 25, 50])),
+                    "created_at": datetime.combine(day, clock(9)) - timedelta(days=60),
+                },
+            )
+
+        for index in range(self.reading_lists):
+            category, _, _ = rng.choice(CATEGORIES)
+            self.add(
+                rows,
+                ReadingList,
+                keys[ReadingList] + index,
+                {
+                    "title": f"Reading on {category.lower()} {index + 1}",
+                    "description": f"Books we recommend on {category.lower()}.",
+                    "category": category,
+                    "created_at": self.now - timedelta(days=rng.randint(1, JOIN_DAYS)),
+                },
+            )
+            for order in range(BOOKS_PER_LIST):
+                self.add(
+                    rows,
+                    ReadingListItem,
+                    keys[ReadingListItem] + index * BOOKS_PER_LIST + order,
+                    {
+                        "reading_list_id": keys[ReadingList] + index,
+                        "title": f"{category} book {order + 1}",
+                        "order": order,
+                    },
+                )
+
+        for index in range(self.broadcasts):
+            kind, title, message = BROADCASTS[index % len(BROADCASTS)]
+            sent = self.broadcast_time(index)
+            self.add(
+                rows,
+                Notification,
+                keys[Notification] + index,
+                {
+                    "role": BROADCAST_ROLES[index % len(BROADCAST_ROLES)],
+                    "title": title,
+                    "message": message,
+                    "type": kind,
+                    "date": sent,
+                    "created_at": sent,
+                },
+            )
+
+        for index, day in enumerate(self.stats_dates):
+            self.add(
+                rows,
+                AdminStats,
+                keys[AdminStats] + index,
+                {
+                    "date": day,
+                    "total_therapists": self.therapists,
+                    "active_users": round(self.clients * rng.uniform(0.2, 0.4)),
+                    "appointments_today": round(self.clients * rng.uniform(0.01, 0.03)),
+                    "total_resources": self.resources,
+                    "user_growth": Decimal(rng.randint(-200, 800)) / 100,
+                    "success_rate": Decimal(rng.randint(7000, 9500)) / 100,
+                },
+            )
+
+    def generate_therapists(self, chunk, rows):
+        rng = self.random("therapists", chunk)
+        keys = self.keys
+        first = chunk * THERAPIST_CHUNK
+        for index in range(first, min(self.therapists, first + THERAPIST_CHUNK)):
+            user_id = self.user_id("therapist", index)
+            joined = self.now - timedelta(days=rng.randint(JOIN_DAYS, 2 * JOIN_DAYS))
+            self.user(rows, user_id, rng, f"therapist{index}", "therapist", joined)
+            therapist_id = keys[Therapist] + index
+            specialty = rng.choice(SPECIALTIES)
+            self.add(
+                rows,
+                Therapist,
+                therapist_id,
+                {
+                    "user_id": user_id,
+                    "specialty": specialty,
+                    "experience": rng.randint(1, 35),
+                    "availability": rng.random() < 0.95,
+                    "price": self.prices[index],
+                    "languages": ["English", *rng.sample(LANGUAGES[1:], rng.randint(0, 2))],
+                    "specializations": rng.sample(SPECIALIZATIONS, rng.randint(1, 3)),
+                    "education": [rng.choice(DEGREES)],
+                    "about": f"I help clients with {specialty.lower()}.",
+                },
+            )
+            weekend = rng.random() < 0.2
+            for day_index, day in enumerate(DAYS):
+                if day_index >= 5 and not (weekend and day == "Saturday"):
+                    continue
+                for slot_index, slot in enumerate(SLOT_TIMES):
+                    self.add(
+                        rows,
+                        Schedule,
+                        keys[Schedule]
+                        + index * SLOTS_PER_THERAPIST
+                        + day_index * len(SLOT_TIMES)
+                        + slot_index,
+                        {
+                            "therapist_id": therapist_id,
+                            "day": day,
+                            "time": slot,
+                            "is_available": rng.random() < 0.9,
+                        },
+                    )
+
+    def plan(self, chunk):
+        """``(days since joining, appointments, messages, progress days)`` per client"""
+        rng = self.random("plan", chunk)
+        appointments, messages, progress = (
+            self.distributions[name] for name in ("appointments", "messages", "progress")
+        )
+        planned = []
+        first = chunk * CLIENT_CHUNK
+        for _ in range(first, min(self.clients, first + CLIENT_CHUNK)):
+            joined = rng.randint(1, JOIN_DAYS)
+            booked = appointments.draw(rng) if rng.random() < BOOKING_SHARE else 0
+            sent = messages.draw(rng) if rng.random() < MESSAGING_SHARE else 0
+            tracked = 0
+            if rng.random() < TRACKING_SHARE:
+                # Entries skip a day now and then, so they span up to twice as many
+                tracked = min(progress.draw(rng), (joined - 1) // 2)
+            planned.append((joined, booked, sent, tracked))
+        return planned
+
+    def generate_clients(self, chunk, rows):
+        rng = self.random("clients", chunk)
+        keys = self.keys
+        next_key = {
+            Appointment: keys[Appointment] + self.offsets["appointments"][chunk],
+            Message: keys[Message] + self.offsets["messages"][chunk],
+            UserProgress: keys[UserProgress] + self.offsets["progress"][chunk],
+        }
+        seats = self.seats(chunk)
+        for offset, (joined_days, booked, sent, tracked) in enumerate(self.plan(chunk)):
+            index = chunk * CLIENT_CHUNK + offset
+            user_id = self.user_id("client", index)
+            joined = self.now - timedelta(days=joined_days, seconds=rng.randrange(86400))
+            self.user(rows, user_id, rng, f"user{index}", "user", joined)
+            client = Client(self, rows, rng, index, user_id, joined, next_key)
+            client.appointments(booked)
+            client.messages(sent)
+            client.progress(tracked)
+            client.notifications()
+            client.registrations(seats)
+
+    def seats(self, chunk):
+        """
+        Spots of each event left to a client chunk's registrations. The
+        chunks' shares add up to the capacity, so chunks generated in any
+        process can never overbook an event between them.
+        """
+        chunks = self.client_chunks
+        return [
+            capacity * (chunk + 1) // chunks - capacity * chunk // chunks
+            for capacity in self.capacities
+        ]
+
+
+class Client:
+    """The rows of one client, written into a task's ``rows``"""
+
+    def __init__(self, seeder, rows, rng, index, user_id, joined, next_key):
+        self.seeder = seeder
+        self.rows = rows
+        self.rng = rng
+        self.index = index
+        self.user_id = user_id
+        self.joined = joined
+        self.next_key = next_key
+        self.therapist = index % seeder.therapists
+        self.now = seeder.now
+
+    def key(self, model):
+        key = self.next_key[model]
+        self.next_key[model] += 1
+        return key
+
+    def add(self, model, pk, values):
+        self.seeder.add(self.rows, model, pk, values)
+
+    def appointments(self, count):
+        seeder, rng, keys = self.seeder, self.rng, self.seeder.keys
+        since = max(self.joined, self.now - timedelta(days=HISTORY_DAYS)).date()
+        days = (self.seeder.anchor - since).days + BOOKING_AHEAD_DAYS
+        last_session = None
+        for _ in range(count):
+            therapist = self.therapist
+            if rng.random() < 0.1:
+                therapist = rng.randrange(seeder.therapists)
+            day = since + timedelta(days=rng.randrange(days))
+            slot = rng.choice(SLOT_TIMES)
+            start_at = datetime.combine(day, clock(int(slot[:2])))
+            if start_at < self.now:
+                status = "Completed" if rng.random() < 0.8 else "Cancelled"
+            else:
+                status = rng.choices(["Confirmed", "Pending", "Cancelled"], [6, 3, 1])[0]
+            created_at = max(self.joined, start_at - timedelta(days=rng.randint(1, 14)))
+            pk = self.key(Appointment)
+            self.add(
+                Appointment,
+                pk,
+                {
+                    "user_id": self.user_id,
+                    "therapist_id": keys[Therapist] + therapist,
+                    "date": day.isoformat(),
+                    "time": slot,
+                    "start_at": start_at,
+                    "end_at": start_at + timedelta(minutes=60),
+                    "status": status,
+                    "type": rng.choice(Appointment.TYPE_CHOICES)[0],
+                    "notes": "",
+                    "duration": 60,
+                    "created_at": created_at,
+                },
+            )
+            if status == "Completed" and therapist == self.therapist:
+                last_session = max(last_session or start_at, start_at)
+
+            payment = {"Completed": "Paid", "Confirmed": "Pending"}.get(status)
+            if status == "Cancelled" and rng.random() < 0.3:
+                payment = "Refunded"
+            if payment:
+                self.add(
+                    Payment,
+                    keys[Payment] + pk - keys[Appointment],
+                    {
+                        "appointment_id": pk,
+                        "amount": seeder.prices[therapist],
+                        "status": payment,
+                        "method": rng.choice(Payment.PAYMENT_METHOD)[0],
+                        "transaction_id": f"seed{seeder.seed}-{pk}",
+                        "timestamp": created_at,
+                    },
+                )
+
+        if last_session is not None and rng.random() < REVIEW_SHARE:
+            reviewed = last_session + timedelta(days=1)
+            self.add(
+                Review,
+                keys[Review] + self.index,
+                {
+                    "user_id": self.user_id,
+                    "therapist_id": keys[Therapist] + self.therapist,
+                    "rating": rng.choices(range(1, 6), RATING_WEIGHTS)[0],
+                    "comment": rng.choice(REVIEWS),
+                    "date": reviewed.date(),
+                    "created_at": reviewed,
+                },
+            )
+
+    def messages(self, count):
+        if not count:
+            return
+        rng = self.rng
+        therapist_id = self.seeder.user_id("therapist", self.therapist)
+        since = max(self.joined, self.now - timedelta(days=MESSAGE_DAYS))
+        span = (self.now - since).total_seconds()
+        offsets = sorted(rng.random() * span for _ in range(count))
+        unread = {self.user_id: 0, therapist_id: 0}
+        for offset in offsets:
+            sent = since + timedelta(seconds=offset)
+            sender, receiver = self.user_id, therapist_id
+            if rng.random() < 0.45:
+                sender, receiver = receiver, sender
+            # The last two days' messages may still be waiting to be read
+            read = self.now - sent > timedelta(days=2) or rng.random() < 0.5
+            if not read:
+                unread[receiver] += 1
+            pk = self.key(Message)
+            self.add(
+                Message,
+                pk,
+                {
+                    "sender_id": sender,
+                    "receiver_id": receiver,
+                    "message": rng.choice(MESSAGES),
+                    "timestamp": sent,
+                    "read": read,
+                    "created_at": sent,
+                },
+            )
+        # Clients are created before therapists, so they are always user_a
+        self.add(
+            Conversation,
+            self.seeder.keys[Conversation] + self.index,
+            {
+                "user_a_id": self.user_id,
+                "user_b_id": therapist_id,
+                "last_message_id": pk,
+                "last_timestamp": sent,
+                "unread_a": unread[self.user_id],
+                "unread_b": unread[therapist_id],
+            },
+        )
+
+    def progress(self, count):
+        rng = self.rng
+        day = self.seeder.anchor - timedelta(days=rng.randint(0, 2))
+        mood = rng.randint(3, 8)
+        entries = []
+        for _ in range(count):
+            mood = min(10, max(1, mood + rng.choice((-1, 0, 0, 1))))
+            entries.append((day, mood))
+            day -= timedelta(days=2 if rng.random() < 0.15 else 1)
+        for day, mood in reversed(entries):
+            self.add(
+                UserProgress,
+                self.key(UserProgress),
+                {
+                    "user_id": self.user_id,
+                    "date": day,
+                    "mood_rating": mood,
+                    "notes": rng.choice(NOTES),
+                    "completed_exercises": rng.choice(EXERCISE_SETS),
+                    "therapist_feedback": "",
+                    "created_at": datetime.combine(day, clock(20))
+                    + timedelta(minutes=rng.randrange(180)),
+                },
+            )
+
+    def notifications(self):
+        seeder, rng, keys = self.seeder, self.rng, self.seeder.keys
+        base = keys[Notification] + seeder.broadcasts + self.index * NOTIFICATIONS_PER_CLIENT
+        for number in range(rng.randint(0, NOTIFICATIONS_PER_CLIENT)):
+            kind, title, message = rng.choice(NOTIFICATIONS)
+            sent = self.now - timedelta(minutes=rng.randrange(60 * 24 * 60))
+            self.add(
+                Notification,
+                base + number,
+                {
+                    "user_id": self.user_id,
+                    "role": "user",
+                    "title": title,
+                    "message": message,
+                    "type": kind,
+                    "read": rng.random() < 0.7,
+                    "date": sent,
+                    "created_at": sent,
+                },
+            )
+
+        # Half of the clients caught up with "mark all read" at some point;
+        # some read a few of the recent broadcasts for users one by one
+        recent = range(max(0, seeder.broadcasts - RECENT_BROADCASTS), seeder.broadcasts)
+        caught_up = -1
+        if rng.random() < 0.5:
+            caught_up = rng.choice(recent)
+            self.add(
+                NotificationWatermark,
+                keys[NotificationWatermark] + self.index,
+                {"user_id": self.user_id, "last_read_id": keys[Notification] + caught_up},
+            )
+        unread = [
+            index
+            for index in recent
+            if index > caught_up
+            and BROADCAST_ROLES[index % len(BROADCAST_ROLES)] in ("all", "user")
+        ]
+        read = rng.sample(unread, min(len(unread), rng.randint(0, RECEIPTS_PER_CLIENT)))
+        for number, index in enumerate(sorted(read)):
+            self.add(
+                NotificationReceipt,
+                keys[NotificationReceipt] + self.index * RECEIPTS_PER_CLIENT + number,
+                {
+                    "user_id": self.user_id,
+                    "notification_id": keys[Notification] + index,
+                    "read_at": seeder.broadcast_time(index)
+                    + timedelta(hours=rng.randint(1, 72)),
+                },
+            )
+
+    def registrations(self, seats):
+        seeder, rng, keys = self.seeder, self.rng, self.seeder.keys
+        if rng.random() >= REGISTRATION_SHARE:
+            return
+        events = rng.sample(range(seeder.events), rng.randint(1, REGISTRATIONS_PER_CLIENT))
+        # Full events are passed over
+        events = [event for event in events if seats[event]]
+        for number, event in enumerate(events):
+            seats[event] -= 1
+            self.add(
+                EventRegistration,
+                keys[EventRegistration] + self.index * REGISTRATIONS_PER_CLIENT + number,
+                {
+                    "user_id": self.user_id,
+                    "event_id": keys[Event] + event,
+                    "registration_date": self.now - timedelta(days=rng.randint(1, 90)),
+                    "payment_status": rng.choices(["Paid", "Pending"], [4, 1])[0],
+                },
+            )
+
+
+def write(tables, batch_size):
+    """Insert a task's rows in one transaction; returns rows per model"""
+    connection = connections[DEFAULT_DB_ALIAS]
+    counts = Counter()
+    with transaction.atomic(), connection.cursor() as cursor:
+        for model, rows in tables:
+            insert, placeholders = transfer.insert_sql(
+                connection, model, table(model).columns
+            )
+            for start in range(0, len(rows), batch_size):
+                cursor.executemany(
+                    f"{insert} VALUES {placeholders}", rows[start : start + batch_size]
+                )
+            counts[model] += len(rows)
+    return counts
+
+
+def generate_and_write(seeder, batch_size, task):
+    return write(seeder.generate(task), batch_size)
+
+
+def run_ahead(pool, function, items, ahead):
+    """``pool.map`` with at most ``ahead`` results waiting, to bound memory"""
+    pending = deque()
+    for item in items:
+        pending.append(pool.submit(function, item))
+        if len(pending) >= ahead:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def load(seeder, processes=1, batch_size=transfer.DEFAULT_BATCH_SIZE, report=None):
+    """
+    Generate and insert the data set with ``processes`` processes, then
+    rebuild what signals would have maintained. Returns rows per model.
+    """
+    connection = connections[DEFAULT_DB_ALIAS]
+    processes = max(1, processes)
+    # SQLite takes one writer at a time; elsewhere the workers write too
+    workers_write = connection.vendor != "sqlite" and not connection.in_atomic_block
+    counts = Counter()
+    started = time.perf_counter()
+    done = 0
+
+    def finished(task_counts):
+        nonlocal done
+        counts.update(task_counts)
+        done += 1
+        if report:
+            report(done, total_tasks, sum(counts.values()), time.perf_counter() - started)
+
+    phases = seeder.tasks()
+    total_tasks = sum(len(tasks) for tasks in phases)
+    if processes == 1:
+        for tasks in phases:
+            for task in tasks:
+                finished(write(seeder.generate(task), batch_size))
+    else:
+        if workers_write:
+            # Workers open their own connections; never share one across a fork
+            connections.close_all()
+            function = partial(generate_and_write, seeder, batch_size)
+        else:
+            function = seeder.generate
+        with ProcessPoolExecutor(
+            # Fresh interpreters share no connections; Django is set up before
+            # the first task (and this module) is unpickled
+            processes, mp_context=get_context("spawn"), initializer=django.setup
+        ) as pool:
+            # Each phase completes before the next, so rows committed by one
+            # worker never point at rows another has yet to commit
+            for tasks in phases:
+                for result in run_ahead(pool, function, tasks, 2 * processes):
+                    finished(result if workers_write else write(result, batch_size))
+
+    refresh(seeder, [model for model in transfer.ordered_models() if counts[model]])
+    return counts
+
+
+def refresh(seeder, written):
+    connection = connections[DEFAULT_DB_ALIAS]
+    with transaction.atomic():
+        # Rows came with their keys; move sequences past them (PostgreSQL)
+        with connection.cursor() as cursor:
+            for sql in connection.ops.sequence_reset_sql(no_style(), written):
+                cursor.execute(sql)
+        transfer.refresh_derived()
@@ -1,11 +1,16 @@
 from rest_framework import serializers
 from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.utils import timezone
 from .models import (
     Therapist, Schedule, Appointment, Payment, Review, Resource, 
     Event, EventRegistration, ReadingList, ReadingListItem, 
-    Category, Notification, Message, UserProgress, AdminStats
+    Category, Notification, Message, UserProgress, AdminStats, Conversation,
+    TherapistClient
 )
 from djoser.serializers import UserCreateSerializer
+from .slots import slot_index
+from .matching import match_index
 User = get_user_model()
 
 
@@ -54,55 +59,51 @@ class TherapistSerializer(serializers.ModelSerializer):
     )
     time_slots = ScheduleSerializer(many=True, read_only=True)
     schedule = serializers.DictField(write_only=True, required=False)
+    rating_histogram = serializers.DictField(child=serializers.IntegerField(), read_only=True)
     
     class Meta:
         model = Therapist
         fields = [
             'id', 'user', 'user_id', 'specialty', 'experience', 'availability',
             'price', 'languages', 'specializations', 'education', 'about',
-            'rating', 'reviews_count', 'time_slots', 'schedule'
+            'rating', 'reviews_count', 'rating_histogram', 'time_slots', 'schedule'
         ]
+        # Maintained from reviews by Therapist.adjust_ratings
+        read_only_fields = ['rating', 'reviews_count']
+        # Columns api.compiled reads for the rating_histogram property
+        compiled_sources = {
+            'rating_histogram': (Therapist.RATING_COUNT_FIELDS, Therapist.histogram)
+        }
     
     def create(self, validated_data):
         schedule_data = validated_data.pop('schedule', {})
-        therapist = Therapist.objects.create(**validated_data)
-        
-        # Create schedule time slots
-        for day, times in schedule_data.items():
-            for time in times:
-                Schedule.objects.create(
-                    therapist=therapist,
-                    day=day,
-                    time=time,
-                    is_available=True
-                )
+        with transaction.atomic():
+            therapist = Therapist.objects.create(**validated_data)
+            self._write_schedule(therapist, schedule_data)
         
         return therapist
     
     def update(self, instance, validated_data):
         schedule_data = validated_data.pop('schedule', None)
         
-        # Update therapist fields
-        for attr, value in validated_data.items():
-            setattr(instance, attr, value)
-        instance.save()
-        
-        # Update schedule if provided
-        if schedule_data:
-            # Remove existing schedule
-            instance.time_slots.all().delete()
+        with transaction.atomic():
+            # Update therapist fields
+            for attr, value in validated_data.items():
+                setattr(instance, attr, value)
+            instance.save()
             
-            # Create new schedule
-            for day, times in schedule_data.items():
-                for time in times:
-                    Schedule.objects.create(
-                        therapist=instance,
-                        day=day,
-                        time=time,
-                        is_available=True
-                    )
+            # Update schedule if provided
+            if schedule_data:
+                self._write_schedule(instance, schedule_data)
         
         return instance
+    
+    def _write_schedule(self, therapist, schedule_data):
+        # The therapist's own save above already expires cached listings;
+        # the bulk slot writes bypass the signal that refreshes the slot index.
+        Schedule.replace_for(therapist, schedule_data)
+        slot_index.invalidate(therapist.id)
+        match_index.invalidate(therapist.id)
 
 
 class PaymentSerializer(serializers.ModelSerializer):
@@ -116,14 +117,31 @@ class AppointmentSerializer(serializers.ModelSerializer):
     payment_data = PaymentSerializer(write_only=True, required=False)
     user_name = serializers.CharField(source='user.username', read_only=True)
     therapist_name = serializers.CharField(source='therapist.user.username', read_only=True)
+    start_at = serializers.DateTimeField(required=False)
     
     class Meta:
         model = Appointment
         fields = [
             'id', 'user', 'therapist', 'user_name', 'therapist_name',
-            'date', 'time', 'status', 'type', 'notes', 'duration',
-            'created_at', 'payment', 'payment_data'
+            'date', 'time', 'start_at', 'end_at', 'status', 'type', 'notes',
+            'duration', 'created_at', 'payment', 'payment_data'
         ]
+        read_only_fields = ['end_at']
+        extra_kwargs = {
+            'date': {'required': False},
+            'time': {'required': False},
+        }
+    
+    def validate(self, attrs):
+        start_at = attrs.pop('start_at', None)
+        if start_at is not None:
+            # date/time stay the stored source of truth, start_at is derived from them
+            local = timezone.localtime(start_at)
+            attrs['date'] = local.date().isoformat()
+            attrs['time'] = local.strftime('%H:%M')
+        elif self.instance is None and not (attrs.get('date') and attrs.get('time')):
+            raise serializers.ValidationError('Provide either start_at or both date and time.')
+        return attrs
     
     def create(self, validated_data):
         payment_data = validated_data.pop('payment_data', None)
@@ -135,26 +153,20 @@ class AppointmentSerializer(serializers.ModelSerializer):
         return appointment
 
 
+class TherapistClientSerializer(serializers.ModelSerializer):
+    user = UserSerializer(read_only=True)
+
+    class Meta:
+        model = TherapistClient
+        fields = ['user', 'appointments_count', 'first_session_at', 'last_session_at']
+
+
 class ReviewSerializer(serializers.ModelSerializer):
     user_name = serializers.CharField(source='user.username', read_only=True)
     
     class Meta:
         model = Review
         fields = ['id', 'user', 'therapist', 'user_name', 'rating', 'comment', 'date', 'created_at']
-    
-    def create(self, validated_data):
-        review = Review.objects.create(**validated_data)
-        
-        # Update therapist rating
-        therapist = review.therapist
-        reviews = Review.objects.filter(therapist=therapist)
-        average_rating = reviews.aggregate(models.Avg('rating'))['rating__avg'] or 0
-        
-        therapist.rating = average_rating
-        therapist.reviews_count = reviews.count()
-        therapist.save()
-        
-        return review
 
 
 class ResourceSerializer(serializers.ModelSerializer):
@@ -175,20 +187,27 @@ class EventRegistrationSerializer(serializers.ModelSerializer):
         fields = ['id', 'user', 'user_name', 'event', 'registration_date', 'payment_status']
 
 
-class EventSerializer(serializers.ModelSerializer):
-    registered_users = EventRegistrationSerializer(source='registrations', many=True, read_only=True)
-    spots_left = serializers.SerializerMethodField()
+class EventSummarySerializer(serializers.ModelSerializer):
+    spots_left = serializers.IntegerField(read_only=True)
     
     class Meta:
         model = Event
         fields = [
             'id', 'title', 'date', 'time', 'location', 'category',
             'capacity', 'description', 'presenter', 'price', 'image',
-            'created_at', 'registered_users', 'spots_left'
+            'created_at', 'spots_left'
         ]
+
+
+class EventSerializer(EventSummarySerializer):
+    registered_users = EventRegistrationSerializer(source='registrations', many=True, read_only=True)
     
-    def get_spots_left(self, obj):
-        return obj.capacity - obj.registrations.count()
+    class Meta(EventSummarySerializer.Meta):
+        fields = [
+            'id', 'title', 'date', 'time', 'location', 'category',
+            'capacity', 'description', 'presenter', 'price', 'image',
+            'created_at', 'registered_users', 'spots_left'
+        ]
 
 
 class ReadingListItemSerializer(serializers.ModelSerializer):
@@ -211,37 +230,24 @@ class ReadingListSerializer(serializers.ModelSerializer):
     
     def create(self, validated_data):
         book_list = validated_data.pop('book_list', [])
-        reading_list = ReadingList.objects.create(**validated_data)
-        
-        for index, book_title in enumerate(book_list):
-            ReadingListItem.objects.create(
-                reading_list=reading_list,
-                title=book_title,
-                order=index
-            )
+        with transaction.atomic():
+            reading_list = ReadingList.objects.create(**validated_data)
+            ReadingListItem.replace_for(reading_list, book_list)
         
         return reading_list
     
     def update(self, instance, validated_data):
         book_list = validated_data.pop('book_list', None)
         
-        # Update reading list fields
-        for attr, value in validated_data.items():
-            setattr(instance, attr, value)
-        instance.save()
-        
-        # Update books if provided
-        if book_list is not None:
-            # Remove existing books
-            instance.books.all().delete()
+        with transaction.atomic():
+            # Update reading list fields; saving it also expires cached lists
+            for attr, value in validated_data.items():
+                setattr(instance, attr, value)
+            instance.save()
             
-            # Create new books
-            for index, book_title in enumerate(book_list):
-                ReadingListItem.objects.create(
-                    reading_list=instance,
-                    title=book_title,
-                    order=index
-                )
+            # Update books if provided
+            if book_list is not None:
+                ReadingListItem.replace_for(instance, book_list)
         
         return instance
 
@@ -256,6 +262,13 @@ class NotificationSerializer(serializers.ModelSerializer):
     class Meta:
         model = Notification
         fields = ['id', 'user', 'role', 'title', 'message', 'type', 'read', 'date', 'created_at']
+    
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        # Broadcasts are shared, so report the requesting user's read state
+        if hasattr(instance, 'is_read'):
+            data['read'] = instance.is_read
+        return data
 
 
 class MessageSerializer(serializers.ModelSerializer):
@@ -267,6 +280,26 @@ class MessageSerializer(serializers.ModelSerializer):
         fields = ['id', 'sender', 'receiver', 'sender_name', 'receiver_name', 'message', 'timestamp', 'read', 'created_at']
 
 
+class ConversationSerializer(serializers.ModelSerializer):
+    partner = serializers.SerializerMethodField()
+    latest_message = MessageSerializer(source='last_message', read_only=True)
+    unread_count = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Conversation
+        fields = ['id', 'partner', 'latest_message', 'unread_count']
+
+    def _is_user_a(self, obj):
+        return obj.user_a_id == self.context['request'].user.id
+
+    def get_partner(self, obj):
+        partner = obj.user_b if self._is_user_a(obj) else obj.user_a
+        return UserSerializer(partner).data
+
+    def get_unread_count(self, obj):
+        return obj.unread_a if self._is_user_a(obj) else obj.unread_b
+
+
 class UserProgressSerializer(serializers.ModelSerializer):
     class Meta:
         model = UserProgress
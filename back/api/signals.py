@@ -0,0 +1,295 @@
+from django.core.cache import cache
+from django.core.signals import setting_changed
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_init, post_save, pre_save
+from django.dispatch import receiver
+
+from . import db, profiling, push, stats
+from .authentication import forget_claims, mark_claims_changed
+from .matching import match_index
+from .response_cache import response_cache
+from .models import (
+    Appointment,
+    Category,
+    Conversation,
+    CustomUser,
+    Event,
+    EventFull,
+    EventRegistration,
+    Message,
+    MoodBucket,
+    Notification,
+    ReadingList,
+    ReadingListItem,
+    Resource,
+    Review,
+    Schedule,
+    Therapist,
+    TherapistClient,
+    UserProgress,
+)
+from .serializers import MessageSerializer, NotificationSerializer
+from .slots import slot_index
+
+
+@receiver([post_save, post_delete], sender=Schedule)
+@receiver([post_save, post_delete], sender=Appointment)
+def refresh_therapist_slots(sender, instance, **kwargs):
+    therapist_id = instance.therapist_id
+    # Now, for reads later in this transaction, and again once it commits:
+    # a snapshot loaded in between from the rows as they were before the
+    # commit would otherwise be served until SLOT_INDEX_TTL runs out.
+    slot_index.invalidate(therapist_id)
+    transaction.on_commit(lambda: slot_index.invalidate(therapist_id))
+
+
+# Rows of the match index: profile fields, free slots and rating
+@receiver([post_save, post_delete], sender=Schedule)
+@receiver([post_save, post_delete], sender=Appointment)
+@receiver([post_save, post_delete], sender=Review)
+@receiver([post_save, post_delete], sender=Therapist)
+def refresh_therapist_match(sender, instance, **kwargs):
+    therapist_id = instance.pk if sender is Therapist else instance.therapist_id
+    # As for the slot index: now, and again once the write is visible to others
+    match_index.invalidate(therapist_id)
+    transaction.on_commit(lambda: match_index.invalidate(therapist_id))
+
+
+@receiver(post_save, sender=Appointment)
+def refresh_therapist_client(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    TherapistClient.refresh(instance.therapist_id, instance.user_id)
+    stored = getattr(instance, "_stored_client", None)
+    # Moved to another therapist or user: the pair it left may be gone
+    if stored and None not in stored and stored != (
+        instance.therapist_id,
+        instance.user_id,
+    ):
+        TherapistClient.refresh(*stored)
+    instance.remember_client()
+
+
+@receiver(post_delete, sender=Appointment)
+def drop_therapist_client(sender, instance, **kwargs):
+    TherapistClient.refresh(instance.therapist_id, instance.user_id)
+
+
+@receiver(post_save, sender=UserProgress)
+def refresh_mood_buckets(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    MoodBucket.refresh(instance.user_id, instance.date)
+    stored = getattr(instance, "_stored_day", None)
+    # Moved to another day or user: the buckets it left lost an entry
+    if stored and None not in stored and stored != (instance.user_id, instance.date):
+        MoodBucket.refresh(*stored)
+    instance.remember_day()
+
+
+@receiver(post_delete, sender=UserProgress)
+def drop_mood_entry(sender, instance, **kwargs):
+    MoodBucket.refresh(instance.user_id, instance.date)
+
+
+@receiver(post_save, sender=EventRegistration)
+def take_event_spot(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    stored = None if created else getattr(instance, "_stored_event", None)
+    if created or (stored is not None and stored != instance.event_id):
+        # A conditional increment, so concurrent sign-ups can never push
+        # registered_count past capacity; EventRegistration.save rolls back
+        if not Event.reserve_spot(instance.event_id):
+            raise EventFull(f"Event {instance.event_id} is already full")
+        if stored is not None:
+            Event.release_spot(stored)
+    instance.remember_event()
+
+
+@receiver(post_delete, sender=EventRegistration)
+def release_event_spot(sender, instance, **kwargs):
+    Event.release_spot(instance.event_id)
+
+
+@receiver(post_save, sender=Review)
+def apply_review_rating(sender, instance, created, **kwargs):
+    if created:
+        Therapist.adjust_ratings(instance.therapist_id, added=instance.rating)
+    else:
+        therapist_id, rating = getattr(instance, "_stored_rating", (None, None))
+        if therapist_id is None or rating is None:
+            # Saved without being loaded first, so the previous rating is unknown
+            Therapist.recompute_ratings([instance.therapist_id])
+        elif therapist_id != instance.therapist_id:
+            Therapist.adjust_ratings(therapist_id, removed=rating)
+            Therapist.adjust_ratings(instance.therapist_id, added=instance.rating)
+        else:
+            Therapist.adjust_ratings(
+                therapist_id, added=instance.rating, removed=rating
+            )
+    instance.remember_rating()
+
+
+@receiver(post_delete, sender=Review)
+def remove_review_rating(sender, instance, **kwargs):
+    Therapist.adjust_ratings(instance.therapist_id, removed=instance.rating)
+
+
+@receiver(post_save, sender=Notification)
+def push_notification(sender, instance, created, **kwargs):
+    if not created:
+        return
+    if instance.user_id is not None:
+        channel = push.user_channel(instance.user_id)
+    else:
+        channel = push.role_channel(instance.role)
+    data = NotificationSerializer(instance).data
+    transaction.on_commit(lambda: push.publish(channel, "notification", data))
+
+
+@receiver(post_save, sender=Message)
+def refresh_conversation(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    if created:
+        Conversation.record_message(instance)
+        instance.remember_thread()
+        return
+
+    stored = getattr(instance, "_stored_thread", None)
+    if stored is None or None in stored:
+        # Saved without being loaded first, so what changed is unknown
+        Conversation.rebuild(instance.sender_id, instance.receiver_id)
+    elif {stored[0], stored[1]} != {instance.sender_id, instance.receiver_id}:
+        # Moved to another pair: both conversations changed
+        Conversation.rebuild(stored[0], stored[1])
+        Conversation.rebuild(instance.sender_id, instance.receiver_id)
+    elif stored[2] == instance.timestamp and not stored[3] and instance.read:
+        Conversation.record_read(instance)
+    elif stored[2:] != (instance.timestamp, instance.read):
+        Conversation.rebuild(instance.sender_id, instance.receiver_id)
+    instance.remember_thread()
+
+
+@receiver(post_delete, sender=Message)
+def drop_conversation_message(sender, instance, **kwargs):
+    Conversation.rebuild(instance.sender_id, instance.receiver_id)
+
+
+@receiver(post_save, sender=Message)
+def push_message(sender, instance, created, **kwargs):
+    if not created:
+        return
+    data = MessageSerializer(instance).data
+    channels = {
+        push.user_channel(instance.receiver_id),
+        push.user_channel(instance.sender_id),
+    }
+
+    def publish():
+        for channel in channels:
+            push.publish(channel, "message", data)
+
+    transaction.on_commit(publish)
+
+
+def remember_stat_fields(sender, instance, **kwargs):
+    stats.remember(instance)
+
+
+def load_stat_fields(sender, instance, raw=False, **kwargs):
+    if not raw:
+        stats.load_state(instance)
+
+
+def count_saved(sender, instance, created, raw=False, **kwargs):
+    if not raw:
+        stats.record_save(instance, created)
+
+
+def count_deleted(sender, instance, **kwargs):
+    stats.record_delete(instance)
+
+
+for model in stats.TRACKED:
+    post_init.connect(remember_stat_fields, sender=model)
+    pre_save.connect(load_stat_fields, sender=model)
+    post_save.connect(count_saved, sender=model)
+    post_delete.connect(count_deleted, sender=model)
+
+
+# Model -> cached response namespaces its rows appear in. Reviews change the
+# therapist rating through a queryset update, which sends no signal itself.
+CACHED_NAMESPACES = {
+    Resource: ("resources",),
+    Category: ("categories",),
+    ReadingList: ("reading-lists",),
+    ReadingListItem: ("reading-lists",),
+    Therapist: ("therapists",),
+    Schedule: ("therapists",),
+    Review: ("therapists",),
+}
+
+
+def invalidate_cached_responses(sender, instance, **kwargs):
+    namespaces = CACHED_NAMESPACES[sender]
+    transaction.on_commit(lambda: response_cache.invalidate(*namespaces))
+
+
+for model in CACHED_NAMESPACES:
+    post_save.connect(invalidate_cached_responses, sender=model)
+    post_delete.connect(invalidate_cached_responses, sender=model)
+
+
+@receiver([post_save, post_delete], sender=CustomUser)
+def invalidate_therapist_profiles(sender, instance, **kwargs):
+    # Therapist listings embed the therapist's user record
+    if instance.role == "therapist":
+        transaction.on_commit(lambda: response_cache.invalidate("therapists"))
+
+
+# Fields whose change makes the claims in already issued tokens stale
+CLAIM_STATE = (*CustomUser.CLAIM_FIELDS, "is_active")
+
+
+@receiver(post_init, sender=CustomUser)
+def remember_claims(sender, instance, **kwargs):
+    values = instance.__dict__
+    if all(name in values for name in CLAIM_STATE):
+        instance._claims_state = tuple(values[name] for name in CLAIM_STATE)
+    else:
+        instance._claims_state = None
+
+
+@receiver(post_save, sender=CustomUser)
+def refresh_user_auth(sender, instance, created, **kwargs):
+    previous = instance._claims_state
+    remember_claims(sender, instance)
+    # Unknown previous claims (loaded with them deferred) count as changed
+    changed = not created and (previous is None or previous != instance._claims_state)
+
+    if changed:
+        mark_claims_changed(instance.pk)
+    transaction.on_commit(lambda: cache.delete(CustomUser.cache_key(instance.pk)))
+
+
+@receiver(post_delete, sender=CustomUser)
+def forget_user_auth(sender, instance, **kwargs):
+    # Without a row the claims are never current again
+    user_id = instance.pk
+    forget_claims(user_id)
+    transaction.on_commit(lambda: cache.delete(CustomUser.cache_key(user_id)))
+
+
+@receiver(connection_created)
+def tune_database_connection(sender, connection, **kwargs):
+    db.tune_connection(connection)
+    profiling.install_query_timer(connection)
+
+
+@receiver(setting_changed)
+def toggle_serializer_timing(sender, setting, **kwargs):
+    if setting in ("PROFILING_ENABLED", "PROFILING_SAMPLE_RATE", "MIDDLEWARE"):
+        profiling.instrument_serializers(profiling.enabled())
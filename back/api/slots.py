@@ -0,0 +1,336 @@
+"""
+Bookable-slot engine for therapist availability.
+
+Each therapist's weekly ``Schedule`` and their upcoming non-cancelled
+appointments are held in memory as bitmasks over a week split into 5-minute
+bins: one mask for the recurring schedule (a bit per slot start) and one
+occupancy mask per calendar week (a bit per busy bin). Free slots for a week
+are then a handful of integer operations, so a directory-wide "who is free
+at ..." search does not touch the database or loop over appointment rows.
+"""
+
+import logging
+import threading
+import time as monotonic_time
+from datetime import datetime, time, timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from .models import Appointment, Schedule
+
+BIN_MINUTES = 5
+BINS_PER_DAY = 24 * 60 // BIN_MINUTES
+WEEK_BINS = 7 * BINS_PER_DAY
+WEEK_MASK = (1 << WEEK_BINS) - 1
+DAY_INDEX = {day: index for index, (day, _) in enumerate(Schedule.DAYS_OF_WEEK)}
+
+DEFAULT_SESSION_MINUTES = 60
+MAX_RANGE_DAYS = 92
+
+logger = logging.getLogger(__name__)
+
+
+def parse_clock(value):
+    """Parse an "HH:MM" string into minutes after midnight"""
+    hours, minutes = value.split(":")
+    hours, minutes = int(hours), int(minutes)
+    if not (0 <= hours < 24 and 0 <= minutes < 60):
+        raise ValueError(f"{value!r} is not a time of day")
+    return hours * 60 + minutes
+
+
+def week_start(day):
+    return day - timedelta(days=day.weekday())
+
+
+def dilate(mask, width):
+    """Set bit ``i`` when any of bits ``i .. i + width - 1`` is set in ``mask``"""
+    span = 1
+    while span < width:
+        step = min(span, width - span)
+        mask |= mask >> step
+        span += step
+    return mask
+
+
+class TherapistSlots:
+    """Weekly schedule and per-week occupancy masks for one therapist"""
+
+    __slots__ = ("schedule", "busy")
+
+    def __init__(self):
+        self.schedule = 0
+        self.busy = {}
+
+    def add_slot(self, day, clock):
+        if day not in DAY_INDEX:
+            raise ValueError(f"{day!r} is not a day of the week")
+        self.schedule |= 1 << (DAY_INDEX[day] * BINS_PER_DAY + parse_clock(clock) // BIN_MINUTES)
+
+    def add_appointment(self, start, duration):
+        """Mark ``[start, start + duration)`` as busy, splitting at week boundaries"""
+        first_bin = (start.weekday() * 24 * 60 + start.hour * 60 + start.minute) // BIN_MINUTES
+        bins = -(-max(duration, 1) // BIN_MINUTES)
+        week = week_start(start.date())
+        while bins > 0:
+            length = min(bins, WEEK_BINS - first_bin)
+            self.busy[week] = self.busy.get(week, 0) | (((1 << length) - 1) << first_bin)
+            bins -= length
+            first_bin = 0
+            week += timedelta(days=7)
+
+    def free_mask(self, week, session_bins):
+        """Slot starts in ``week`` with ``session_bins`` of unoccupied time after them"""
+        if not self.schedule:
+            return 0
+        # Look into the next week so late-Sunday sessions see Monday bookings.
+        busy = self.busy.get(week, 0) | (
+            self.busy.get(week + timedelta(days=7), 0) << WEEK_BINS
+        )
+        return self.schedule & ~dilate(busy, session_bins) & WEEK_MASK
+
+
+def bits_to_int(positions, size):
+    """Build an integer with the given bit positions set"""
+    buffer = bytearray((size + 7) // 8)
+    for position in positions:
+        buffer[position >> 3] |= 1 << (position & 7)
+    return int.from_bytes(buffer, "little")
+
+
+def set_bits(value):
+    """Positions of the set bits in ``value``, lowest first"""
+    digits = bin(value)[:1:-1]
+    if value.bit_count() * 16 > len(digits):
+        return [position for position, digit in enumerate(digits) if digit == "1"]
+    positions = []
+    position = digits.find("1")
+    while position != -1:
+        positions.append(position)
+        position = digits.find("1", position + 1)
+    return positions
+
+
+class SlotDirectory:
+    """
+    All therapists' ``TherapistSlots`` plus two directory-wide indexes used by
+    point-in-time searches: for every week bin, a bitset over therapist
+    positions of who has a schedule slot starting there, and for every week,
+    the therapists with at least one booking in it.
+    """
+
+    def __init__(self, therapists):
+        self.therapists = therapists
+        self.ids = list(therapists)
+        self.positions = {therapist_id: index for index, therapist_id in enumerate(self.ids)}
+        self.weeks = {}
+
+        holders = [[] for _ in range(WEEK_BINS)]
+        for therapist_id, slots in therapists.items():
+            position = self.positions[therapist_id]
+            for bin_index in set_bits(slots.schedule):
+                holders[bin_index].append(position)
+            for week in slots.busy:
+                self.weeks.setdefault(week, set()).add(therapist_id)
+        self.by_bin = [bits_to_int(positions, len(self.ids)) for positions in holders]
+
+    def replace(self, therapist_id, slots):
+        """Swap in freshly loaded slots for one therapist"""
+        previous = self.therapists.get(therapist_id)
+        if therapist_id not in self.positions:
+            self.positions[therapist_id] = len(self.ids)
+            self.ids.append(therapist_id)
+        bit = 1 << self.positions[therapist_id]
+
+        if previous is not None:
+            for bin_index in set_bits(previous.schedule):
+                self.by_bin[bin_index] &= ~bit
+            for week in previous.busy:
+                self.weeks.get(week, set()).discard(therapist_id)
+        for bin_index in set_bits(slots.schedule):
+            self.by_bin[bin_index] |= bit
+        for week in slots.busy:
+            self.weeks.setdefault(week, set()).add(therapist_id)
+        self.therapists[therapist_id] = slots
+
+
+class SlotIndex:
+    """
+    Process-wide cache of the ``SlotDirectory``. It is loaded lazily with one
+    query per table, refreshed per therapist when the signals in
+    ``api.signals`` report a change, and reloaded fully after
+    ``SLOT_INDEX_TTL`` seconds to pick up writes made by other processes.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._directory = None
+        self._dirty = set()
+        self._loaded_at = 0.0
+
+    def invalidate(self, therapist_id=None):
+        with self._lock:
+            if therapist_id is None:
+                self._directory = None
+            else:
+                self._dirty.add(therapist_id)
+
+    def _ttl(self):
+        return getattr(settings, "SLOT_INDEX_TTL", 60)
+
+    def _load(self, therapist_ids=None):
+        therapists = {}
+
+        schedules = Schedule.objects.filter(is_available=True)
+        appointments = Appointment.objects.exclude(status="Cancelled")
+        if therapist_ids is not None:
+            schedules = schedules.filter(therapist_id__in=therapist_ids)
+            appointments = appointments.filter(therapist_id__in=therapist_ids)
+            therapists = {therapist_id: TherapistSlots() for therapist_id in therapist_ids}
+
+        for schedule_id, therapist_id, day, clock in schedules.values_list(
+            "id", "therapist_id", "day", "time"
+        ).iterator():
+            slots = therapists.get(therapist_id)
+            if slots is None:
+                slots = therapists[therapist_id] = TherapistSlots()
+            # Schedule.time is free text; one bad row must not take every
+            # therapist's availability down with it.
+            try:
+                slots.add_slot(day, clock)
+            except ValueError as error:
+                logger.warning("Skipping schedule %s: %s", schedule_id, error)
+
+        # Past weeks never produce bookable slots, so only recent and future
+        # appointments are loaded, through the start_at index.
+        tz = timezone.get_current_timezone()
+        horizon = timezone.make_aware(
+            datetime.combine(week_start(timezone.localdate()), time()), tz
+        )
+        for therapist_id, start_at, end_at in appointments.filter(
+            end_at__gte=horizon
+        ).values_list("therapist_id", "start_at", "end_at").iterator():
+            slots = therapists.get(therapist_id)
+            if slots is None:
+                slots = therapists[therapist_id] = TherapistSlots()
+            slots.add_appointment(
+                timezone.localtime(start_at, tz).replace(tzinfo=None),
+                int((end_at - start_at).total_seconds() // 60),
+            )
+
+        return therapists
+
+    def _snapshot(self):
+        with self._lock:
+            expired = monotonic_time.monotonic() - self._loaded_at > self._ttl()
+            if self._directory is None or expired:
+                self._directory = SlotDirectory(self._load())
+                self._dirty.clear()
+                self._loaded_at = monotonic_time.monotonic()
+            elif self._dirty:
+                for therapist_id, slots in self._load(self._dirty).items():
+                    self._directory.replace(therapist_id, slots)
+                self._dirty.clear()
+            return self._directory
+
+    def _week_bounds(self, start, end):
+        week = week_start(start)
+        while week <= end:
+            yield week
+            week += timedelta(days=7)
+
+    def _bin_range(self, week, start, end, not_before):
+        """Bins of ``week`` that fall inside the requested date range and future"""
+        first_day = max((start - week).days, 0)
+        last_day = min((end - week).days, 6)
+        if first_day > last_day:
+            return 0
+        low = first_day * BINS_PER_DAY
+        high = (last_day + 1) * BINS_PER_DAY
+        if not_before is not None:
+            offset = (not_before - datetime.combine(week, time())).total_seconds()
+            low = max(low, -(-int(offset) // (BIN_MINUTES * 60)))
+        if low >= high:
+            return 0
+        return ((1 << (high - low)) - 1) << low
+
+    def bookable_slots(self, therapist_ids, start, end, duration=DEFAULT_SESSION_MINUTES):
+        """
+        Concrete bookable start times for each therapist between the dates
+        ``start`` and ``end`` (inclusive), as ``{therapist_id: [datetime]}``.
+        """
+        therapists = self._snapshot().therapists
+        tz = timezone.get_current_timezone()
+        now = timezone.localtime(timezone.now(), tz).replace(tzinfo=None)
+        session_bins = -(-duration // BIN_MINUTES)
+
+        result = {therapist_id: [] for therapist_id in therapist_ids}
+        for week in self._week_bounds(start, end):
+            window = self._bin_range(week, start, end, now)
+            if not window:
+                continue
+            week_origin = datetime.combine(week, time())
+            for therapist_id in therapist_ids:
+                slots = therapists.get(therapist_id)
+                if slots is None:
+                    continue
+                for offset in set_bits(slots.free_mask(week, session_bins) & window):
+                    result[therapist_id].append(
+                        timezone.make_aware(
+                            week_origin + timedelta(minutes=offset * BIN_MINUTES), tz
+                        )
+                    )
+        return result
+
+    def free_slot_counts(self, therapist_ids, start, end, duration=DEFAULT_SESSION_MINUTES):
+        """
+        Number of bookable start times for each therapist between ``start``
+        and ``end``, as ``{therapist_id: count}``, without building them.
+        """
+        therapists = self._snapshot().therapists
+        tz = timezone.get_current_timezone()
+        now = timezone.localtime(timezone.now(), tz).replace(tzinfo=None)
+        session_bins = -(-duration // BIN_MINUTES)
+
+        counts = dict.fromkeys(therapist_ids, 0)
+        for week in self._week_bounds(start, end):
+            window = self._bin_range(week, start, end, now)
+            if not window:
+                continue
+            for therapist_id in therapist_ids:
+                slots = therapists.get(therapist_id)
+                if slots is not None:
+                    counts[therapist_id] += (
+                        slots.free_mask(week, session_bins) & window
+                    ).bit_count()
+        return counts
+
+    def free_therapists(self, at, duration=DEFAULT_SESSION_MINUTES):
+        """Ids of therapists with a bookable slot starting exactly at ``at``"""
+        directory = self._snapshot()
+        local = timezone.localtime(at, timezone.get_current_timezone())
+        week = week_start(local.date())
+        next_week = week + timedelta(days=7)
+        bin_index = (local.weekday() * 24 * 60 + local.hour * 60 + local.minute) // BIN_MINUTES
+        if (local.minute % BIN_MINUTES) or local.second or local.microsecond:
+            return []
+        session = (1 << -(-duration // BIN_MINUTES)) - 1
+
+        # Only therapists with a booking this week or next can be busy at ``at``.
+        busy_positions = []
+        for therapist_id in directory.weeks.get(week, set()) | directory.weeks.get(
+            next_week, set()
+        ):
+            busy = directory.therapists[therapist_id].busy
+            occupied = busy.get(week, 0) | (busy.get(next_week, 0) << WEEK_BINS)
+            if (occupied >> bin_index) & session:
+                busy_positions.append(directory.positions[therapist_id])
+
+        free = directory.by_bin[bin_index] & ~bits_to_int(
+            busy_positions, len(directory.ids)
+        )
+        return [directory.ids[position] for position in set_bits(free)]
+
+
+slot_index = SlotIndex()
@@ -0,0 +1,234 @@
+"""
+Live counters behind the admin dashboard.
+
+Every tracked model instance contributes one to a few ``StatCounter`` keys,
+derived from a handful of its fields (a user's role and join day, an
+appointment's status and day, an event's day). The signals in ``api.signals``
+remember those fields when an instance is loaded and, on save or delete,
+move the instance's contribution from its old keys to its new ones. The
+dashboard then reads a fixed set of keys in one query, and the
+``snapshot_stats`` command writes the daily ``AdminStats`` row from them (or
+rebuilds every counter with grouped queries after bulk writes, which bypass
+signals).
+"""
+
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Count, Q
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import (
+    AdminStats,
+    Appointment,
+    CustomUser,
+    Event,
+    Resource,
+    StatCounter,
+    Therapist,
+)
+
+GROWTH_WINDOW_DAYS = 30
+EVENT_DAY_PREFIX = "events:day:"
+
+
+def day_key(prefix, value):
+    return f"{prefix}{value.isoformat()}"
+
+
+def user_keys(role, date_joined):
+    keys = [f"users:role:{role}"]
+    if role == "user" and date_joined is not None:
+        keys.append(day_key("users:joined:", timezone.localdate(date_joined)))
+    return keys
+
+
+def appointment_keys(status, start_at):
+    keys = [f"appointments:status:{status}"]
+    if start_at is not None:
+        keys.append(day_key("appointments:day:", timezone.localdate(start_at)))
+    return keys
+
+
+def event_keys(date):
+    return [day_key(EVENT_DAY_PREFIX, date)]
+
+
+# Model -> (fields the keys depend on, function of those fields -> keys)
+TRACKED = {
+    CustomUser: (("role", "date_joined"), user_keys),
+    Therapist: ((), lambda: ["therapists"]),
+    Resource: ((), lambda: ["resources"]),
+    Appointment: (("status", "start_at"), appointment_keys),
+    Event: (("date",), event_keys),
+}
+
+
+def remember(instance):
+    """Store the tracked field values an instance currently counts under"""
+    fields, _ = TRACKED[type(instance)]
+    values = instance.__dict__
+    if all(field in values for field in fields):
+        instance._stat_state = tuple(values[field] for field in fields)
+    else:
+        instance._stat_state = None
+
+
+def load_state(instance):
+    """
+    Read the stored values when the remembered ones cannot be trusted: the
+    instance was loaded with tracked fields deferred, or built by hand with
+    the primary key of an existing row.
+    """
+    unknown = instance._state.adding or getattr(instance, "_stat_state", None) is None
+    if instance.pk is not None and unknown:
+        fields, _ = TRACKED[type(instance)]
+        instance._stat_state = (
+            type(instance)
+            .objects.filter(pk=instance.pk)
+            .values_list(*fields)
+            .first()
+        )
+
+
+def keys_for(model, state):
+    _, keys = TRACKED[model]
+    return keys(*state) if state is not None else []
+
+
+def apply(changes):
+    for key, delta in changes.items():
+        if delta:
+            StatCounter.bump(key, delta)
+
+
+def record_save(instance, created):
+    old = [] if created else keys_for(type(instance), instance._stat_state)
+    remember(instance)
+    new = keys_for(type(instance), instance._stat_state)
+    changes = {}
+    for key in old:
+        changes[key] = changes.get(key, 0) - 1
+    for key in new:
+        changes[key] = changes.get(key, 0) + 1
+    apply(changes)
+
+
+def record_delete(instance):
+    apply({key: -1 for key in keys_for(type(instance), instance._stat_state)})
+
+
+def counted_days(queryset, field, prefix):
+    tz = timezone.get_current_timezone()
+    rows = (
+        queryset.exclude(**{f"{field}__isnull": True})
+        .annotate(day=TruncDate(field, tzinfo=tz))
+        .values("day")
+        .annotate(total=Count("id"))
+        .order_by()
+    )
+    return {day_key(prefix, row["day"]): row["total"] for row in rows}
+
+
+def rebuild():
+    """Recompute every counter from the tables with grouped queries"""
+    counters = {
+        "therapists": Therapist.objects.count(),
+        "resources": Resource.objects.count(),
+    }
+    for row in CustomUser.objects.values("role").annotate(total=Count("id")).order_by():
+        counters[f"users:role:{row['role']}"] = row["total"]
+    for row in Appointment.objects.values("status").annotate(total=Count("id")).order_by():
+        counters[f"appointments:status:{row['status']}"] = row["total"]
+    counters.update(
+        counted_days(CustomUser.objects.filter(role="user"), "date_joined", "users:joined:")
+    )
+    counters.update(counted_days(Appointment.objects, "start_at", "appointments:day:"))
+    for row in Event.objects.values("date").annotate(total=Count("id")).order_by():
+        counters[day_key(EVENT_DAY_PREFIX, row["date"])] = row["total"]
+
+    with transaction.atomic():
+        StatCounter.objects.all().delete()
+        StatCounter.objects.bulk_create(
+            StatCounter(key=key, value=value) for key, value in counters.items()
+        )
+    return len(counters)
+
+
+def percentage(part, whole):
+    if not whole:
+        return Decimal("0.00")
+    return min(Decimal(part * 100) / whole, Decimal("999.99")).quantize(Decimal("0.01"))
+
+
+def live_stats(today=None):
+    """
+    Current dashboard figures from the counters, read with one query: an
+    unsaved ``AdminStats`` for ``today``, appointment counts by status and the
+    number of events from today on.
+    """
+    today = today or timezone.localdate()
+    statuses = [status for status, _ in Appointment.STATUS_CHOICES]
+    joined_keys = [
+        day_key("users:joined:", today - timedelta(days=offset))
+        for offset in range(GROWTH_WINDOW_DAYS)
+    ]
+    keys = [
+        "therapists",
+        "resources",
+        "users:role:user",
+        day_key("appointments:day:", today),
+        *[f"appointments:status:{status}" for status in statuses],
+        *joined_keys,
+    ]
+    # Event day keys sort by date, so the upcoming ones are a key range
+    counters = dict(
+        StatCounter.objects.filter(
+            Q(key__in=keys)
+            | Q(
+                key__gte=day_key(EVENT_DAY_PREFIX, today),
+                key__startswith=EVENT_DAY_PREFIX,
+            )
+        ).values_list("key", "value")
+    )
+
+    by_status = {
+        status: counters.get(f"appointments:status:{status}", 0) for status in statuses
+    }
+    active_users = counters.get("users:role:user", 0)
+    recent_users = sum(counters.get(key, 0) for key in joined_keys)
+    stats = AdminStats(
+        date=today,
+        total_therapists=counters.get("therapists", 0),
+        active_users=active_users,
+        appointments_today=counters.get(day_key("appointments:day:", today), 0),
+        total_resources=counters.get("resources", 0),
+        # Share of current users who joined within the window, relative to
+        # how many there were before it
+        user_growth=percentage(recent_users, active_users - recent_users),
+        # Completed out of all appointments that reached an outcome
+        success_rate=percentage(
+            by_status["Completed"], by_status["Completed"] + by_status["Cancelled"]
+        ),
+    )
+    upcoming_events = sum(
+        value for key, value in counters.items() if key.startswith(EVENT_DAY_PREFIX)
+    )
+    appointments_by_status = [
+        {"status": status, "count": count} for status, count in by_status.items() if count
+    ]
+    return stats, appointments_by_status, upcoming_events
+
+
+def snapshot(today=None):
+    """Write the ``AdminStats`` row for ``today`` from the live counters"""
+    stats, _, _ = live_stats(today)
+    values = {
+        field.name: getattr(stats, field.name)
+        for field in AdminStats._meta.concrete_fields
+        if field.name not in ("id", "date")
+    }
+    row, _ = AdminStats.objects.update_or_create(date=stats.date, defaults=values)
+    return row
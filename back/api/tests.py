@@ -1,3 +1,3619 @@
-from django.test import TestCase
+import asyncio
+import base64
+import io
+import json
+import os
+import random
+import socket
+import tempfile
+import threading
+import time
+import unittest
+import tracemalloc
+import statistics
+import subprocess
+import sys
+import types
+import uuid
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from pathlib import Path
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, sync_to_async
+from django.core.cache import cache
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.paginator import UnorderedObjectListWarning
+from django.core.management import CommandError, call_command
+from django.db import connection, connections, transaction
+from django.db.backends.sqlite3.base import DatabaseWrapper
+from django.db.models import Count, F, Q
+from django.test import RequestFactory, TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import get_resolver, include, path
+from django.utils import timezone
+from django.utils.translation import gettext_lazy
+from rest_framework import serializers
+from rest_framework.exceptions import ErrorDetail, ParseError
+from rest_framework.renderers import JSONRenderer
+from rest_framework.routers import DefaultRouter
+from rest_framework.test import APIClient
+from rest_framework.utils.serializer_helpers import ReturnDict, ReturnList
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.tokens import AccessToken
+
+from . import db, matching, plans, push, seeding, slots, stats, transfer
+from . import authentication as auth
+from . import urls as api_urls
+from .authentication import ClaimsTokenObtainPairSerializer, claims_key
+from .compiled import NotCompilable, compile_serializer
+from .matching import FeatureMatrix, Features, match_index
+from .profiling import LATENCY_BOUNDS_MS, QUERY_BOUNDS, Histogram, perf_registry
+from .renderers import MessagePackRenderer, ORJSONParser, ORJSONRenderer, msgpack
+from .response_cache import response_cache
+from .views import NotificationViewSet
+from .serializers import (
+    AppointmentSerializer,
+    EventRegistrationSerializer,
+    EventSerializer,
+    MessageSerializer,
+    NotificationSerializer,
+    ReadingListSerializer,
+    ResourceSerializer,
+    ReviewSerializer,
+    TherapistSerializer,
+)
+from .slots import slot_index
+from .models import (
+    CustomUser,
+    Therapist,
+    Schedule,
+    Appointment,
+    Payment,
+    Review,
+    Resource,
+    Event,
+    EventFull,
+    EventRegistration,
+    ReadingList,
+    ReadingListItem,
+    Category,
+    Notification,
+    NotificationReceipt,
+    Message,
+    Conversation,
+    UserProgress,
+    MoodBucket,
+    AdminStats,
+    StatCounter,
+    TherapistClient,
+)
+
+# Benchmark configuration, overridable from the environment:
+#   API_BENCH_SIZES=100,10000,100000  dataset sizes (appointments and messages)
+#   API_BENCH_UPDATE=1                rewrite the baseline file from this run
+#   API_BENCH_TIME_FACTOR=3           also fail when an endpoint is this many
+#                                     times slower than its recorded wall time
+BASELINE_PATH = Path(__file__).with_name("perf_baseline.json")
+BENCH_SIZES = [
+    int(size) for size in os.environ.get("API_BENCH_SIZES", "100").split(",") if size
+]
+BENCH_UPDATE = os.environ.get("API_BENCH_UPDATE") == "1"
+BENCH_TIME_FACTOR = float(os.environ.get("API_BENCH_TIME_FACTOR", "0"))
+# API_PUSH_BENCH_CONNECTIONS=5000      open this many streams in one worker and
+#                                     time a broadcast reaching all of them
+PUSH_BENCH_CONNECTIONS = int(os.environ.get("API_PUSH_BENCH_CONNECTIONS", "0"))
+# API_BENCH_KEYSET_ROWS=100000        feed length for the page 1 vs page 10,000
+#                                     keyset pagination benchmark
+KEYSET_BENCH_ROWS = int(os.environ.get("API_BENCH_KEYSET_ROWS", "0"))
+# API_BENCH_AUTH_REQUESTS=5000        authenticated requests timed with the
+#                                     claims and the database-backed JWT auth
+AUTH_BENCH_REQUESTS = int(os.environ.get("API_BENCH_AUTH_REQUESTS", "0"))
+# API_BENCH_TRANSFER_ROWS=1000000     messages and progress records each for the
+#                                     export_data / import_data round trip
+TRANSFER_BENCH_ROWS = int(os.environ.get("API_BENCH_TRANSFER_ROWS", "0"))
+# API_BENCH_ASYNC_REQUESTS=2000       message list requests, 32 in flight, through
+#                                     sync WSGI, sync ASGI and async ASGI views
+ASYNC_BENCH_REQUESTS = int(os.environ.get("API_BENCH_ASYNC_REQUESTS", "0"))
+# API_BENCH_SERIALIZER_ROWS=1000,10000 therapists per response serialized by
+#                                     TherapistSerializer and its compiled form
+# API_BENCH_RENDER_ROWS=5000           seed size for the JSON / orjson / MessagePack
+#                                     render time and payload size comparison
+RENDER_BENCH_ROWS = int(os.environ.get("API_BENCH_RENDER_ROWS", "0"))
+# API_BENCH_TREND_CLIENTS=50          clients with three years of daily progress
+#                                     entries behind one trends request
+TREND_BENCH_CLIENTS = int(os.environ.get("API_BENCH_TREND_CLIENTS", "0"))
+# API_BENCH_MATCH_THERAPISTS=50000   rows in the therapist feature matrix scored
+#                                     per match query (needs NumPy)
+MATCH_BENCH_THERAPISTS = int(os.environ.get("API_BENCH_MATCH_THERAPISTS", "0"))
+# API_BENCH_SEED_SCALE=100            scale of a data set generated by the seed
+#                                     command (about 11,000 rows per unit)
+SEED_BENCH_SCALE = int(os.environ.get("API_BENCH_SEED_SCALE", "0"))
+SERIALIZER_BENCH_ROWS = [
+    int(rows)
+    for rows in os.environ.get("API_BENCH_SERIALIZER_ROWS", "").split(",")
+    if rows
+]
+
+DAYS = [day for day, _ in Schedule.DAYS_OF_WEEK]
+SLOT_TIMES = [f"{hour:02d}:00" for hour in range(9, 17)]
+
+
+def seed_dataset(size):
+    """
+    Create a consistent data set with ``size`` appointments and ``size``
+    messages, plus proportionate users, therapists and catalog rows.
+    Returns the ids the benchmarked URLs are built from.
+    """
+    today = timezone.localdate()
+    now = timezone.now()
+    user_count = max(10, size // 20)
+    therapist_count = max(3, size // 200)
+
+    admin = CustomUser.objects.create(
+        username="bench-admin",
+        email="bench-admin@example.com",
+        role="admin",
+        is_staff=True,
+    )
+    users = CustomUser.objects.bulk_create(
+        CustomUser(username=f"user{i}", email=f"user{i}@example.com", role="user")
+        for i in range(user_count)
+    )
+    therapist_users = CustomUser.objects.bulk_create(
+        CustomUser(
+            username=f"therapist{i}",
+            email=f"therapist{i}@example.com",
+            role="therapist",
+        )
+        for i in range(therapist_count)
+    )
+    therapists = Therapist.objects.bulk_create(
+        Therapist(
+            user=therapist_user,
+            specialty="Anxiety",
+            experience=i % 30,
+            price=Decimal("50.00") + i % 100,
+            languages=["en"],
+            specializations=["CBT"],
+            education=["MSc"],
+            rating=Decimal("4.50"),
+        )
+        for i, therapist_user in enumerate(therapist_users)
+    )
+    Schedule.objects.bulk_create(
+        Schedule(therapist=therapist, day=day, time=slot)
+        for therapist in therapists
+        for day in DAYS[:5]
+        for slot in SLOT_TIMES
+    )
+
+    appointments = []
+    for i in range(size):
+        day = today + timedelta(days=i % 60 - 30)
+        clock = SLOT_TIMES[i % len(SLOT_TIMES)]
+        start_at = Appointment.resolve_start(day.isoformat(), clock, today)
+        appointments.append(
+            Appointment(
+                user=users[i % user_count],
+                therapist=therapists[i % therapist_count],
+                date=day.isoformat(),
+                time=clock,
+                start_at=start_at,
+                end_at=start_at + timedelta(minutes=60),
+                status=Appointment.STATUS_CHOICES[i % 4][0],
+            )
+        )
+    appointments = Appointment.objects.bulk_create(appointments)
+    TherapistClient.rebuild()
+    Payment.objects.bulk_create(
+        Payment(appointment=appointment, amount=Decimal("80.00"), method="card")
+        for appointment in appointments[::2]
+    )
+    Review.objects.bulk_create(
+        Review(
+            user=user,
+            therapist=therapists[i % therapist_count],
+            rating=i % 5 + 1,
+            comment="Helpful session",
+            date=today,
+        )
+        for i, user in enumerate(users)
+    )
+    Therapist.recompute_ratings()
+
+    Category.objects.bulk_create(
+        Category(title=f"Category {i}", icon="FaBrain", color="#4A90E2")
+        for i in range(10)
+    )
+    Resource.objects.bulk_create(
+        Resource(
+            title=f"Resource {i}",
+            author="Author",
+            description="Description",
+            category=f"Category {i % 10}",
+            url="https://example.com/resource",
+            featured=i % 5 == 0,
+            type="Video" if i % 2 else "Ebook",
+        )
+        for i in range(max(20, size // 10))
+    )
+    reading_lists = ReadingList.objects.bulk_create(
+        ReadingList(title=f"List {i}", description="Description", category="Anxiety")
+        for i in range(20)
+    )
+    ReadingListItem.objects.bulk_create(
+        ReadingListItem(reading_list=reading_list, title=f"Book {j}", order=j)
+        for reading_list in reading_lists
+        for j in range(5)
+    )
+
+    attendees = users[:20]
+    events = Event.objects.bulk_create(
+        Event(
+            title=f"Event {i}",
+            date=today + timedelta(days=i - 10),
+            time="10 AM - 12 PM",
+            location="Online",
+            category="Webinar",
+            capacity=size,
+            description="Description",
+            presenter="Presenter",
+            price=Decimal("0.00") if i % 2 else Decimal("25.00"),
+            registered_count=len(attendees),
+        )
+        for i in range(30)
+    )
+    EventRegistration.objects.bulk_create(
+        EventRegistration(user=user, event=event)
+        for event in events
+        for user in attendees
+    )
+
+    Notification.objects.bulk_create(
+        Notification(
+            user=users[i % user_count] if i % 3 else None,
+            role=["all", "user", "therapist"][i % 3],
+            title="Notice",
+            message="Message",
+            type="system",
+            date=now,
+        )
+        for i in range(max(30, size // 10))
+    )
+
+    # Every message goes between a client and their therapist so the busiest
+    # inbox grows with the data set.
+    messages = Message.objects.bulk_create(
+        Message(
+            sender=users[i % user_count] if i % 2 else therapist_users[i % therapist_count],
+            receiver=therapist_users[i % therapist_count] if i % 2 else users[i % user_count],
+            message="Hello",
+            timestamp=now - timedelta(minutes=size - i),
+            read=i % 3 == 0,
+        )
+        for i in range(size)
+    )
+    conversations = {}
+    for message in messages:
+        pair = Conversation.ordered_pair(message.sender_id, message.receiver_id)
+        conversation = conversations.setdefault(
+            pair, Conversation(user_a_id=pair[0], user_b_id=pair[1])
+        )
+        conversation.last_message = message
+        conversation.last_timestamp = message.timestamp
+        if not message.read:
+            if message.receiver_id == pair[0]:
+                conversation.unread_a += 1
+            else:
+                conversation.unread_b += 1
+    Conversation.objects.bulk_create(conversations.values())
+
+    UserProgress.objects.bulk_create(
+        UserProgress(
+            user=users[i % user_count],
+            date=today - timedelta(days=i // user_count),
+            mood_rating=i % 10 + 1,
+        )
+        for i in range(size)
+    )
+    MoodBucket.rebuild()
+    # Bulk inserts bypass the counter signals
+    stats.rebuild()
+
+    return {
+        "admin": admin,
+        "user": users[0],
+        "therapist_user": therapist_users[0],
+        "therapist": therapists[0].id,
+        "appointment": appointments[0].id,
+        "review": Review.objects.filter(therapist=therapists[0]).first().id,
+        "resource": Resource.objects.first().id,
+        "event": events[-1].id,
+        "reading_list": reading_lists[0].id,
+        "category": Category.objects.first().id,
+        "notification": Notification.objects.filter(role="all").first().id,
+        "message": messages[0].id,
+        "progress": UserProgress.objects.filter(user=users[0]).first().id,
+        "user_id": users[0].id,
+        "today": today.isoformat(),
+        "next_week": (today + timedelta(days=7)).isoformat(),
+        "next_month": (today + timedelta(days=30)).isoformat(),
+        "next_monday": (today + timedelta(days=7 - today.weekday())).isoformat(),
+    }
+
+
+# (name, method, path, caller). Paths are formatted with the ids returned by
+# seed_dataset; caller is the seeded account the request is made as.
+ENDPOINTS = [
+    ("users-list", "get", "/api/users/", "admin"),
+    ("users-detail", "get", "/api/users/{user_id}/", "admin"),
+    ("users-me", "get", "/api/users/me/", "user"),
+    ("therapists-list", "get", "/api/therapists/", None),
+    ("therapists-list-cached", "get", "/api/therapists/", None),
+    ("therapists-detail", "get", "/api/therapists/{therapist}/", None),
+    ("therapists-reviews", "get", "/api/therapists/{therapist}/reviews/", None),
+    ("therapists-appointments", "get", "/api/therapists/{therapist}/appointments/", "admin"),
+    ("therapists-availability", "get", "/api/therapists/{therapist}/availability/", None),
+    (
+        "therapists-availability-range",
+        "get",
+        "/api/therapists/{therapist}/availability/?start={today}&end={next_week}",
+        None,
+    ),
+    ("therapists-slots", "get", "/api/therapists/slots/?start={today}&end={next_week}", None),
+    ("therapists-free", "get", "/api/therapists/free/?at={next_monday}T10:00", None),
+    ("appointments-list", "get", "/api/appointments/", "admin"),
+    ("appointments-list-therapist", "get", "/api/appointments/", "therapist_user"),
+    ("appointments-detail", "get", "/api/appointments/{appointment}/", "admin"),
+    (
+        "appointments-range",
+        "get",
+        "/api/appointments/?from={today}&to={next_month}&ordering=-start_at",
+        "therapist_user",
+    ),
+    ("appointments-upcoming", "get", "/api/appointments/?upcoming=true", "user"),
+    ("reviews-list", "get", "/api/reviews/", "user"),
+    ("reviews-detail", "get", "/api/reviews/{review}/", "user"),
+    ("resources-list", "get", "/api/resources/", None),
+    ("resources-list-cached", "get", "/api/resources/", None),
+    ("resources-detail", "get", "/api/resources/{resource}/", None),
+    ("resources-featured", "get", "/api/resources/featured/", None),
+    ("events-list", "get", "/api/events/", None),
+    ("events-detail", "get", "/api/events/{event}/", None),
+    (
+        "events-detail-registrations",
+        "get",
+        "/api/events/{event}/?include=registrations",
+        None,
+    ),
+    ("events-registrations", "get", "/api/events/{event}/registrations/", None),
+    ("events-register", "post", "/api/events/{event}/register/", "admin"),
+    ("reading-lists-list", "get", "/api/reading-lists/", None),
+    ("reading-lists-list-cached", "get", "/api/reading-lists/", None),
+    ("reading-lists-detail", "get", "/api/reading-lists/{reading_list}/", None),
+    ("categories-list", "get", "/api/categories/", None),
+    ("categories-list-cached", "get", "/api/categories/", None),
+    ("categories-detail", "get", "/api/categories/{category}/", None),
+    ("notifications-list", "get", "/api/notifications/", "user"),
+    ("notifications-detail", "get", "/api/notifications/{notification}/", "user"),
+    ("notifications-unread-count", "get", "/api/notifications/unread_count/", "user"),
+    ("notifications-mark-all", "post", "/api/notifications/mark_all_as_read/", "user"),
+    ("messages-list", "get", "/api/messages/", "therapist_user"),
+    ("messages-detail", "get", "/api/messages/{message}/", "therapist_user"),
+    ("messages-conversations", "get", "/api/messages/conversations/", "therapist_user"),
+    ("user-progress-list", "get", "/api/user-progress/", "therapist_user"),
+    ("user-progress-detail", "get", "/api/user-progress/{progress}/", "user"),
+    ("admin-stats-list", "get", "/api/admin-stats/", "admin"),
+    ("admin-stats-dashboard", "get", "/api/admin-stats/dashboard/", "admin"),
+]
+
+
+class EndpointBenchmarkTests(TestCase):
+    """
+    Query count, wall time and response size for every routed endpoint,
+    checked against perf_baseline.json so serializer N+1s fail the run.
+    """
+
+    def run(self, result=None):
+        # The table is printed when updating the baseline or at -v 2 and up,
+        # which is when the runner's TextTestResult sets showAll
+        self.verbose = BENCH_UPDATE or getattr(result, "showAll", False)
+        return super().run(result)
+
+    def measure(self, client, method, path):
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            response = getattr(client, method)(path)
+            elapsed = time.perf_counter() - started
+        self.assertLess(response.status_code, 400, f"{path}: {response.content[:200]}")
+        return {
+            "queries": len(queries),
+            "ms": round(elapsed * 1000, 2),
+            "bytes": len(response.content),
+        }
+
+    def run_endpoints(self, size):
+        ids = seed_dataset(size)
+        slot_index.invalidate()
+        response_cache.cache.clear()
+        results = {}
+        for name, method, path, caller in ENDPOINTS:
+            client = APIClient()
+            if caller:
+                client.force_authenticate(ids[caller])
+            results[name] = self.measure(client, method, path.format(**ids))
+        return results
+
+    def test_endpoints_against_baseline(self):
+        baseline = (
+            json.loads(BASELINE_PATH.read_text()) if BASELINE_PATH.exists() else {}
+        )
+
+        for size in BENCH_SIZES:
+            with transaction.atomic():
+                results = self.run_endpoints(size)
+                transaction.set_rollback(True)
+
+            if self.verbose:
+                print(f"\nEndpoint benchmark, size={size}")
+                for name, result in results.items():
+                    print(
+                        f"  {name:<30} {result['queries']:>4} queries "
+                        f"{result['ms']:>9.2f} ms {result['bytes']:>9} bytes"
+                    )
+
+            if BENCH_UPDATE:
+                baseline[str(size)] = results
+                continue
+
+            expected = baseline.get(str(size))
+            if expected is None:
+                self.skipTest(f"No baseline recorded for size {size}")
+            for name, result in results.items():
+                with self.subTest(size=size, endpoint=name):
+                    self.assertIn(name, expected, "Endpoint missing from baseline")
+                    self.assertLessEqual(result["queries"], expected[name]["queries"])
+                    if BENCH_TIME_FACTOR:
+                        self.assertLessEqual(
+                            result["ms"], expected[name]["ms"] * BENCH_TIME_FACTOR
+                        )
+
+        if BENCH_UPDATE:
+            BASELINE_PATH.write_text(json.dumps(baseline, indent=2, sort_keys=True) + "\n")
+
+
+class ConversationIndexTests(TestCase):
+    def setUp(self):
+        self.alice, self.bob, self.carol = [
+            CustomUser.objects.create(username=name, email=f"{name}@example.com")
+            for name in ("alice", "bob", "carol")
+        ]
+        self.now = timezone.now()
+
+    def send(self, sender, receiver, minutes=0, **fields):
+        return Message.objects.create(
+            sender=sender,
+            receiver=receiver,
+            message="Hello",
+            timestamp=self.now + timedelta(minutes=minutes),
+            **fields,
+        )
+
+    def conversations(self):
+        return {
+            (c.user_a_id, c.user_b_id): (c.last_message_id, c.unread_a, c.unread_b)
+            for c in Conversation.objects.all()
+        }
+
+    def assertMaintained(self, expected):
+        stored = self.conversations()
+        for pair in [*stored, *expected]:
+            Conversation.rebuild(*pair)
+        self.assertEqual(self.conversations(), stored)
+        self.assertEqual(stored, expected)
+
+    def test_record_message_and_read(self):
+        pair = (self.alice.id, self.bob.id)
+
+        def write(sender, receiver, minutes):
+            # bulk_create leaves the index alone, so only the calls below move it
+            Message.objects.bulk_create(
+                [
+                    Message(
+                        sender=sender,
+                        receiver=receiver,
+                        message="Hello",
+                        timestamp=self.now + timedelta(minutes=minutes),
+                    )
+                ]
+            )
+            return Message.objects.latest("id")
+
+        Conversation.record_message(write(self.alice, self.bob, 0))
+        second = write(self.bob, self.alice, 1)
+        Conversation.record_message(second)
+        self.assertMaintained({pair: (second.id, 1, 1)})
+
+        # An older message counts as unread but stays behind the latest one
+        older = write(self.alice, self.bob, -5)
+        Conversation.record_message(older)
+        self.assertMaintained({pair: (second.id, 1, 2)})
+
+        Message.objects.filter(pk=older.pk).update(read=True)
+        Conversation.record_read(older)
+        self.assertMaintained({pair: (second.id, 1, 1)})
+
+    def test_orm_writes_keep_conversations_current(self):
+        pair = (self.alice.id, self.bob.id)
+        first = self.send(self.alice, self.bob)
+        second = self.send(self.bob, self.alice, minutes=1)
+        self.assertMaintained({pair: (second.id, 1, 1)})
+
+        first.read = True
+        first.save()
+        loaded = Message.objects.get(pk=second.pk)
+        loaded.read = True
+        loaded.save()
+        self.assertMaintained({pair: (second.id, 0, 0)})
+
+        # An older timestamp hands the conversation back to the first message
+        loaded.timestamp = self.now - timedelta(minutes=1)
+        loaded.read = False
+        loaded.save()
+        self.assertMaintained({pair: (first.id, 1, 0)})
+
+        # Moving a message to another pair changes both conversations
+        first.receiver = self.carol
+        first.save()
+        self.assertMaintained(
+            {pair: (second.id, 1, 0), (self.alice.id, self.carol.id): (first.id, 0, 0)}
+        )
+
+        # Saved without being loaded, so the signal cannot tell what changed
+        Message(
+            pk=first.pk,
+            sender=self.alice,
+            receiver=self.carol,
+            message="Edited",
+            timestamp=first.timestamp,
+            read=False,
+            created_at=first.created_at,
+        ).save()
+        self.assertMaintained(
+            {pair: (second.id, 1, 0), (self.alice.id, self.carol.id): (first.id, 0, 1)}
+        )
+
+        Message.objects.get(pk=second.pk).delete()
+        self.assertMaintained({(self.alice.id, self.carol.id): (first.id, 0, 1)})
+
+    def test_api_writes_keep_conversations_current(self):
+        client = APIClient()
+        client.force_authenticate(self.alice)
+        response = client.post(
+            "/api/messages/",
+            {
+                "sender": self.alice.id,
+                "receiver": self.bob.id,
+                "message": "Hi",
+                "timestamp": self.now.isoformat(),
+            },
+        )
+        self.assertEqual(response.status_code, 201, response.data)
+        message_id = response.data["id"]
+        self.assertMaintained({(self.alice.id, self.bob.id): (message_id, 0, 1)})
+
+        client.force_authenticate(self.bob)
+        client.patch(f"/api/messages/{message_id}/mark_as_read/")
+        self.assertMaintained({(self.alice.id, self.bob.id): (message_id, 0, 0)})
+
+        client.delete(f"/api/messages/{message_id}/")
+        self.assertMaintained({})
+
+
+class AppointmentWindowTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create(username="client", email="client@example.com")
+        therapist_user = CustomUser.objects.create(
+            username="therapist", email="therapist@example.com", role="therapist"
+        )
+        self.therapist = Therapist.objects.create(
+            user=therapist_user, specialty="Anxiety", experience=5, price=Decimal("80.00")
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def book(self, date, time, **fields):
+        return Appointment.objects.create(
+            user=self.user, therapist=self.therapist, date=date, time=time, **fields
+        )
+
+    def listed(self, **params):
+        response = self.client.get("/api/appointments/", params)
+        self.assertEqual(response.status_code, 200)
+        return [item["id"] for item in response.data["results"]]
+
+    def at(self, day, hour, minute=0):
+        return timezone.make_aware(datetime.combine(day, datetime.min.time())).replace(
+            hour=hour, minute=minute
+        )
+
+    def test_save_derives_the_window_from_date_and_time(self):
+        today = timezone.localdate()
+        monday = today + timedelta(days=-today.weekday() % 7)
+        appointment = self.book("Monday", "09:30", duration=45)
+        self.assertEqual(appointment.start_at, self.at(monday, 9, 30))
+        self.assertEqual(appointment.end_at, self.at(monday, 10, 15))
+
+        day = today + timedelta(days=10)
+        appointment = self.book(day.isoformat(), "14:00")
+        self.assertEqual(appointment.start_at, self.at(day, 14))
+        self.assertEqual(appointment.end_at, self.at(day, 15))
+        # Saving only the time still moves the window
+        appointment.time = "16:15"
+        appointment.save(update_fields=["time"])
+        appointment.refresh_from_db()
+        self.assertEqual(appointment.start_at, self.at(day, 16, 15))
+        self.assertEqual(appointment.end_at, self.at(day, 17, 15))
+
+        for date_value, time_value in (("someday", "10:00"), (day.isoformat(), "late")):
+            appointment = self.book(date_value, time_value)
+            self.assertIsNone(appointment.start_at)
+            self.assertIsNone(appointment.end_at)
+
+    def test_range_filters(self):
+        day = timezone.localdate() + timedelta(days=5)
+        morning = self.book(day.isoformat(), "10:00")
+        late = self.book((day + timedelta(days=1)).isoformat(), "23:30")
+        midnight = self.book((day + timedelta(days=2)).isoformat(), "00:00")
+
+        # A bare date as ``to`` takes in the whole of that day
+        to = (day + timedelta(days=1)).isoformat()
+        self.assertEqual(
+            self.listed(**{"from": day.isoformat(), "to": to}), [morning.id, late.id]
+        )
+        after_ten = self.at(day, 10, 1).isoformat()
+        self.assertEqual(self.listed(**{"from": after_ten}), [late.id, midnight.id])
+        self.assertEqual(self.listed(to=self.at(day, 10).isoformat()), [])
+        last_day = (day + timedelta(days=2)).isoformat()
+        self.assertEqual(self.listed(date=last_day), [midnight.id])
+
+        for params in ({"from": "soon"}, {"to": "2024-13-01"}, {"date": "2024-02-30"}):
+            response = self.client.get("/api/appointments/", params)
+            self.assertEqual(response.status_code, 400, params)
+            self.assertIn("error", response.data)
+
+    def test_upcoming_leaves_out_past_and_cancelled_sessions(self):
+        today = timezone.localdate()
+        self.book((today - timedelta(days=1)).isoformat(), "10:00")
+        upcoming = self.book((today + timedelta(days=1)).isoformat(), "10:00")
+        self.book((today + timedelta(days=2)).isoformat(), "10:00", status="Cancelled")
+        later = self.book(
+            (today + timedelta(days=3)).isoformat(), "10:00", status="Confirmed"
+        )
+
+        self.assertEqual(self.listed(upcoming="true"), [upcoming.id, later.id])
+        self.assertEqual(len(self.listed()), 4)
+
+
+class EventRegistrationConcurrencyTests(TransactionTestCase):
+    """Parallel sign-ups for one event must never exceed its capacity"""
+
+    capacity = 5
+    attempts = 40
+
+    def setUp(self):
+        self.event = Event.objects.create(
+            title="Popular webinar",
+            date=timezone.localdate(),
+            time="10 AM - 12 PM",
+            location="Online",
+            category="Webinar",
+            capacity=self.capacity,
+            description="Description",
+            presenter="Presenter",
+            price=Decimal("0.00"),
+        )
+        self.users = CustomUser.objects.bulk_create(
+            CustomUser(username=f"attendee{i}", email=f"attendee{i}@example.com")
+            for i in range(self.attempts)
+        )
+
+    def register(self, user, barrier):
+        # The test client's exception hook is process-wide, so errors are
+        # returned as responses rather than raised into the wrong thread.
+        client = APIClient(raise_request_exception=False)
+        client.force_authenticate(user)
+        barrier.wait()
+        try:
+            # The in-memory SQLite test database reports lock contention as an
+            # error (a 500 here) instead of waiting, so contended requests retry.
+            for _ in range(50):
+                response = client.post(f"/api/events/{self.event.id}/register/")
+                if response.status_code != 500:
+                    return response.status_code
+                time.sleep(0.01)
+            return None
+        finally:
+            connection.close()
+
+    def test_parallel_registrations_do_not_overbook(self):
+        barrier = threading.Barrier(self.attempts)
+        with ThreadPoolExecutor(max_workers=self.attempts) as executor:
+            statuses = list(
+                executor.map(lambda user: self.register(user, barrier), self.users)
+            )
+
+        self.assertNotIn(None, statuses)
+        self.event.refresh_from_db()
+        registrations = EventRegistration.objects.filter(event=self.event).count()
+        self.assertEqual(statuses.count(201), registrations)
+        self.assertEqual(registrations, self.capacity)
+        self.assertEqual(self.event.registered_count, registrations)
+
+    def test_unregister_releases_a_spot(self):
+        client = APIClient()
+        client.force_authenticate(self.users[0])
+        client.post(f"/api/events/{self.event.id}/register/")
+        response = client.delete(f"/api/events/{self.event.id}/unregister/")
+
+        self.assertEqual(response.status_code, 200)
+        self.event.refresh_from_db()
+        self.assertEqual(self.event.registered_count, 0)
+        self.assertEqual(self.event.spots_left, self.capacity)
+
+    def test_registrations_written_anywhere_keep_the_count(self):
+        def counts():
+            return list(
+                Event.objects.order_by("pk").values_list("registered_count", flat=True)
+            )
+
+        other = Event.objects.create(
+            title="Quiet webinar",
+            date=timezone.localdate(),
+            time="1 PM - 2 PM",
+            location="Online",
+            category="Webinar",
+            capacity=1,
+            description="Description",
+            presenter="Presenter",
+            price=Decimal("0.00"),
+        )
+        registrations = [
+            EventRegistration.objects.create(user=user, event=self.event)
+            for user in self.users[: self.capacity]
+        ]
+        self.assertEqual(counts(), [self.capacity, 0])
+        with self.assertRaises(EventFull):
+            EventRegistration.objects.create(user=self.users[-1], event=self.event)
+        self.assertEqual(EventRegistration.objects.count(), self.capacity)
+
+        # Moving a registration moves its spot, if the new event has one
+        moved = EventRegistration.objects.get(pk=registrations[0].pk)
+        moved.event = other
+        moved.save()
+        self.assertEqual(counts(), [self.capacity - 1, 1])
+        second = EventRegistration.objects.get(pk=registrations[1].pk)
+        second.event = other
+        with self.assertRaises(EventFull):
+            second.save()
+        self.assertEqual(counts(), [self.capacity - 1, 1])
+
+        moved.delete()
+        self.users[1].delete()
+        EventRegistration.objects.filter(user=self.users[2]).delete()
+        self.assertEqual(counts(), [self.capacity - 3, 0])
+        self.assertEqual(
+            EventRegistration.objects.filter(event=self.event).count(), self.capacity - 3
+        )
+
+
+class EventRegistrationListTests(TestCase):
+    def setUp(self):
+        self.event = Event.objects.create(
+            title="Webinar",
+            date=timezone.localdate(),
+            time="10 AM - 12 PM",
+            location="Online",
+            category="Webinar",
+            capacity=20,
+            description="Description",
+            presenter="Presenter",
+            price=Decimal("0.00"),
+        )
+        self.attendees = CustomUser.objects.bulk_create(
+            CustomUser(username=f"attendee{i}", email=f"attendee{i}@example.com")
+            for i in range(12)
+        )
+        registrations = EventRegistration.objects.bulk_create(
+            EventRegistration(user=user, event=self.event) for user in self.attendees
+        )
+        self.registration_ids = [registration.id for registration in registrations]
+        Event.objects.filter(pk=self.event.pk).update(registered_count=12)
+        self.client = APIClient()
+
+    def test_list_and_plain_detail_leave_registrations_out(self):
+        response = self.client.get("/api/events/")
+        self.assertEqual(response.status_code, 200)
+        (item,) = response.data["results"]
+        self.assertNotIn("registered_users", item)
+        self.assertEqual(item["spots_left"], 8)
+
+        response = self.client.get(f"/api/events/{self.event.id}/")
+        self.assertNotIn("registered_users", response.data)
+
+        response = self.client.get(f"/api/events/{self.event.id}/?include=registrations")
+        self.assertEqual(
+            [registration["id"] for registration in response.data["registered_users"]],
+            self.registration_ids,
+        )
+        self.assertEqual(response.data["registered_users"][0]["user_name"], "attendee0")
+
+    def test_registrations_are_paginated(self):
+        url = f"/api/events/{self.event.id}/registrations/"
+        first = self.client.get(url)
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(first.data["count"], 12)
+        second = self.client.get(first.data["next"])
+        self.assertIsNone(second.data["next"])
+        self.assertEqual(
+            [item["id"] for item in first.data["results"] + second.data["results"]],
+            self.registration_ids,
+        )
+
+    def test_registrations_follow_the_event_permissions(self):
+        # Events, registrations included, have always been readable by anyone
+        url = f"/api/events/{self.event.id}/registrations/"
+        self.assertEqual(self.client.get(url).status_code, 200)
+        self.client.force_authenticate(self.attendees[0])
+        self.assertEqual(self.client.get(url).status_code, 200)
+        self.assertEqual(self.client.post(url).status_code, 405)
+        self.assertEqual(self.client.get("/api/events/0/registrations/").status_code, 404)
+
+
+class TherapistRatingAggregateTests(TestCase):
+    def setUp(self):
+        therapist_user = CustomUser.objects.create(
+            username="therapist", email="therapist@example.com", role="therapist"
+        )
+        self.therapist = Therapist.objects.create(
+            user=therapist_user, specialty="Anxiety", experience=5, price=50
+        )
+        self.users = [
+            CustomUser.objects.create(username=f"user{i}", email=f"user{i}@example.com")
+            for i in range(3)
+        ]
+
+    def assertAggregates(self, ratings):
+        self.therapist.refresh_from_db()
+        self.assertEqual(self.therapist.reviews_count, len(ratings))
+        self.assertEqual(self.therapist.rating_sum, sum(ratings))
+        self.assertEqual(
+            self.therapist.rating,
+            round(Decimal(sum(ratings)) / len(ratings), 2) if ratings else 0,
+        )
+        self.assertEqual(
+            self.therapist.rating_histogram,
+            {str(value): ratings.count(value) for value in range(1, 6)},
+        )
+
+    def test_create_update_and_delete_through_the_api(self):
+        client = APIClient()
+        client.force_authenticate(self.users[0])
+        response = client.post(
+            "/api/reviews/",
+            {
+                "user": self.users[0].id,
+                "therapist": self.therapist.id,
+                "rating": 5,
+                "comment": "Great",
+                "date": timezone.localdate().isoformat(),
+            },
+        )
+        self.assertEqual(response.status_code, 201)
+        Review.objects.create(
+            user=self.users[1],
+            therapist=self.therapist,
+            rating=2,
+            comment="Okay",
+            date=timezone.localdate(),
+        )
+        self.assertAggregates([5, 2])
+
+        review_id = response.data["id"]
+        client.patch(f"/api/reviews/{review_id}/", {"rating": 4})
+        self.assertAggregates([4, 2])
+
+        client.delete(f"/api/reviews/{review_id}/")
+        self.assertAggregates([2])
+
+    def test_recompute_ratings_repairs_drift(self):
+        Review.objects.bulk_create(
+            Review(
+                user=user,
+                therapist=self.therapist,
+                rating=rating,
+                comment="Imported",
+                date=timezone.localdate(),
+            )
+            for user, rating in zip(self.users, [1, 3, 3])
+        )
+        self.assertAggregates([])
+
+        call_command("recompute_ratings", stdout=io.StringIO())
+        self.assertAggregates([1, 3, 3])
+
+
+class NotificationReadStateTests(TestCase):
+    def setUp(self):
+        self.alice = CustomUser.objects.create(username="alice", email="alice@example.com")
+        self.bob = CustomUser.objects.create(username="bob", email="bob@example.com")
+        self.broadcast = self.notify(title="Maintenance")
+        self.direct = self.notify(user=self.alice, title="Reminder")
+
+    def notify(self, **fields):
+        return Notification.objects.create(
+            message="Message", type="system", date=timezone.now(), **fields
+        )
+
+    def client_for(self, user):
+        client = APIClient()
+        client.force_authenticate(user)
+        return client
+
+    def unread(self, user):
+        return self.client_for(user).get("/api/notifications/unread_count/").data[
+            "unread_count"
+        ]
+
+    def test_broadcast_read_state_is_per_user(self):
+        self.assertEqual(self.unread(self.alice), 2)
+        self.assertEqual(self.unread(self.bob), 1)
+
+        response = self.client_for(self.alice).patch(
+            f"/api/notifications/{self.broadcast.id}/", {"read": True}
+        )
+        self.assertTrue(response.data["read"])
+        self.broadcast.refresh_from_db()
+        self.assertFalse(self.broadcast.read)
+        self.assertEqual(self.unread(self.alice), 1)
+        self.assertEqual(self.unread(self.bob), 1)
+
+        response = self.client_for(self.bob).get("/api/notifications/?read=false")
+        self.assertEqual(
+            [item["id"] for item in response.data["results"]], [self.broadcast.id]
+        )
+
+    def test_mark_all_as_read_does_not_grow_with_broadcasts(self):
+        client = self.client_for(self.alice)
+        with CaptureQueriesContext(connection) as few:
+            response = client.post("/api/notifications/mark_all_as_read/")
+            self.assertEqual(response.status_code, 200)
+        for i in range(20):
+            self.notify(title=f"Notice {i}", role="user")
+        with CaptureQueriesContext(connection) as many:
+            response = client.post("/api/notifications/mark_all_as_read/")
+            self.assertEqual(response.status_code, 200)
+
+        self.assertEqual(len(few.captured_queries), len(many.captured_queries))
+        self.assertEqual(self.unread(self.alice), 0)
+        self.assertEqual(self.unread(self.bob), 21)
+
+        self.notify(title="Later")
+        self.assertEqual(self.unread(self.alice), 1)
+
+    def test_broadcast_marked_unread_under_the_watermark(self):
+        client = self.client_for(self.alice)
+        client.post("/api/notifications/mark_all_as_read/")
+        self.assertEqual(self.unread(self.alice), 0)
+
+        response = client.patch(f"/api/notifications/{self.broadcast.id}/", {"read": False})
+        self.assertFalse(response.data["read"])
+        self.assertEqual(self.unread(self.alice), 1)
+        response = client.get(f"/api/notifications/{self.broadcast.id}/")
+        self.assertFalse(response.data["read"])
+        self.assertEqual(self.unread(self.bob), 1)
+
+        # Reading it again drops the override; so does the next mark all
+        client.patch(f"/api/notifications/{self.broadcast.id}/", {"read": True})
+        self.assertEqual(self.unread(self.alice), 0)
+        self.assertFalse(NotificationReceipt.objects.exists())
+        client.patch(f"/api/notifications/{self.broadcast.id}/", {"read": False})
+        client.post("/api/notifications/mark_all_as_read/")
+        self.assertEqual(self.unread(self.alice), 0)
+        self.assertFalse(NotificationReceipt.objects.exists())
+
+
+class StreamConnection:
+    """An ``/api/stream/`` request driven directly against the ASGI handler"""
+
+    def __init__(self, app, token):
+        self.frames = asyncio.Queue()
+        self.status = None
+        self.disconnected = asyncio.Event()
+        self.request_sent = False
+        scope = {
+            "type": "http",
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "method": "GET",
+            "scheme": "http",
+            "path": "/api/stream/",
+            "raw_path": b"/api/stream/",
+            "root_path": "",
+            "query_string": f"token={token}".encode(),
+            "headers": [(b"host", b"testserver")],
+            "server": ("testserver", 80),
+            "client": ("127.0.0.1", 50000),
+        }
+        self.task = asyncio.ensure_future(app(scope, self.receive, self.send))
+
+    async def receive(self):
+        if not self.request_sent:
+            self.request_sent = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        await self.disconnected.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(self, message):
+        if message["type"] == "http.response.start":
+            self.status = message["status"]
+        elif message.get("body"):
+            await self.frames.put(message["body"].decode())
+
+    async def next_frame(self, timeout=5):
+        return await asyncio.wait_for(self.frames.get(), timeout)
+
+    async def next_event(self, timeout=5):
+        while True:
+            frame = await self.next_frame(timeout)
+            if frame.startswith("id:"):
+                fields = dict(line.split(": ", 1) for line in frame.strip().split("\n"))
+                return fields["event"], json.loads(fields["data"])
+
+    async def close(self):
+        self.disconnected.set()
+        await asyncio.wait_for(self.task, 5)
+
+
+class PushStreamTests(TransactionTestCase):
+    def setUp(self):
+        push._broker = push.LocalBroker()
+        self.alice = CustomUser.objects.create(
+            username="alice", email="alice@example.com", role="user"
+        )
+        self.bob = CustomUser.objects.create(
+            username="bob", email="bob@example.com", role="therapist"
+        )
+
+    def tearDown(self):
+        push._broker = None
+
+    def test_new_notifications_and_messages_reach_only_their_users(self):
+        async def scenario():
+            app = ASGIHandler()
+            alice = StreamConnection(app, AccessToken.for_user(self.alice))
+            bob = StreamConnection(app, AccessToken.for_user(self.bob))
+            try:
+                self.assertEqual(await alice.next_frame(), "retry: 5000\n\n")
+                await bob.next_frame()
+                self.assertEqual(alice.status, 200)
+
+                create = sync_to_async(Notification.objects.create)
+                now = timezone.now()
+                await create(
+                    user=self.alice, title="Direct", message="m", type="system", date=now
+                )
+                await create(
+                    role="therapist", title="Staff", message="m", type="system", date=now
+                )
+                await sync_to_async(Message.objects.create)(
+                    sender=self.bob, receiver=self.alice, message="Hi", timestamp=now
+                )
+
+                kind, data = await alice.next_event()
+                self.assertEqual((kind, data["title"]), ("notification", "Direct"))
+                kind, data = await alice.next_event()
+                self.assertEqual((kind, data["message"]), ("message", "Hi"))
+
+                kind, data = await bob.next_event()
+                self.assertEqual((kind, data["title"]), ("notification", "Staff"))
+                kind, data = await bob.next_event()
+                self.assertEqual((kind, data["message"]), ("message", "Hi"))
+            finally:
+                await alice.close()
+                await bob.close()
+            self.assertEqual(push.get_broker().subscriber_count(), 0)
+
+        async_to_sync(scenario)()
+
+    def test_stream_requires_a_valid_token(self):
+        async def scenario():
+            connection = StreamConnection(ASGIHandler(), "not-a-token")
+            await connection.next_frame()
+            await connection.close()
+            return connection.status
+
+        self.assertEqual(async_to_sync(scenario)(), 401)
+
+    def start_relay(self, port=0, **options):
+        """Run a relay on a thread until the test ends; returns its address"""
+        started = threading.Event()
+        stop = threading.Event()
+        addresses = []
+
+        def on_start(address):
+            addresses.append(address)
+            started.set()
+
+        async def run_relay():
+            relay = asyncio.ensure_future(
+                push.serve_relay("127.0.0.1", port, on_start, **options)
+            )
+            await asyncio.get_running_loop().run_in_executor(None, stop.wait)
+            relay.cancel()
+
+        thread = threading.Thread(target=asyncio.run, args=(run_relay(),))
+        thread.start()
+        self.addCleanup(thread.join, 5)
+        self.addCleanup(stop.set)
+        self.assertTrue(started.wait(5))
+        return addresses[0]
+
+    def relay_brokers(self, address, count=2):
+        brokers = [push.RelayBroker(address=address) for _ in range(count)]
+        for broker in brokers:
+            self.addCleanup(broker.close)
+        return brokers
+
+    def test_relay_shares_events_between_workers(self):
+        publisher, listener = self.relay_brokers(self.start_relay())
+
+        async def scenario():
+            # Connect first so the relay already knows the listening worker
+            listener._connect()
+            subscription = listener.subscribe(push.channels_for(self.alice))
+            await asyncio.sleep(0.1)
+            publisher.publish(push.role_channel("all"), "notification", {"id": 1})
+            event = await subscription.get(5)
+            listener.unsubscribe(subscription)
+            return event
+
+        event = async_to_sync(scenario)()
+        self.assertEqual((event["type"], event["data"]), ("notification", {"id": 1}))
+
+    def test_publish_does_not_wait_for_a_relay_that_is_down(self):
+        with socket.socket() as probe:
+            probe.bind(("127.0.0.1", 0))
+            address = probe.getsockname()
+        publisher, listener = self.relay_brokers(address)
+
+        async def scenario():
+            local = publisher.subscribe(push.channels_for(self.alice))
+            await asyncio.sleep(0.2)
+            started = time.perf_counter()
+            publisher.publish(push.role_channel("all"), "notification", {"id": 1})
+            elapsed = time.perf_counter() - started
+            # Delivered to this worker's streams only
+            self.assertEqual((await local.get(5))["data"], {"id": 1})
+
+            # The writer thread reconnects once the relay is back
+            self.start_relay(port=address[1])
+            remote = listener.subscribe(push.channels_for(self.alice))
+            for _ in range(100):
+                if publisher._socket is not None and listener._socket is not None:
+                    break
+                await asyncio.sleep(0.05)
+            await asyncio.sleep(0.1)
+            publisher.publish(push.role_channel("all"), "notification", {"id": 2})
+            return elapsed, await remote.get(5), await local.get(5)
+
+        elapsed, remote, local = async_to_sync(scenario)()
+        self.assertLess(elapsed, 0.05)
+        self.assertEqual(publisher.dropped, 1)
+        self.assertEqual((remote["data"], local["data"]), ({"id": 2}, {"id": 2}))
+
+    def test_relay_drops_workers_that_stop_reading(self):
+        address = self.start_relay(client_buffer=64 * 1024)
+        (publisher,) = self.relay_brokers(address, 1)
+        stalled = socket.create_connection(address)
+        self.addCleanup(stalled.close)
+
+        # About 20 MB, more than the loopback socket buffers hold
+        events = 5000
+        for i in range(events):
+            while publisher._pending.qsize() > 500:
+                time.sleep(0.01)
+            publisher.publish("role:all", "notification", {"id": i, "pad": "x" * 4096})
+        self.assertEqual(publisher.dropped, 0)
+
+        stalled.settimeout(5)
+        received = 0
+        try:
+            while chunk := stalled.recv(1 << 20):
+                received += len(chunk)
+        except ConnectionResetError:
+            pass
+        self.assertLess(received, events * 4096)
+
+    @unittest.skipUnless(PUSH_BENCH_CONNECTIONS, "set API_PUSH_BENCH_CONNECTIONS")
+    def test_concurrent_connections_per_worker(self):
+        async def scenario():
+            app = ASGIHandler()
+            token = str(AccessToken.for_user(self.alice))
+            tracemalloc.start()
+            baseline = tracemalloc.get_traced_memory()[0]
+
+            started = time.perf_counter()
+            connections = []
+            for _ in range(PUSH_BENCH_CONNECTIONS):
+                connections.append(StreamConnection(app, token))
+            await asyncio.gather(*(c.next_frame(60) for c in connections))
+            opened = time.perf_counter() - started
+            memory = tracemalloc.get_traced_memory()[0] - baseline
+            tracemalloc.stop()
+
+            started = time.perf_counter()
+            push.publish(push.role_channel("all"), "notification", {"id": 1})
+            await asyncio.gather(*(c.next_event(60) for c in connections))
+            delivered = time.perf_counter() - started
+
+            await asyncio.gather(*(c.close() for c in connections))
+            return opened, memory, delivered
+
+        opened, memory, delivered = async_to_sync(scenario)()
+        print(
+            f"\n  {PUSH_BENCH_CONNECTIONS} streams: opened in {opened:.2f} s, "
+            f"{memory / PUSH_BENCH_CONNECTIONS / 1024:.1f} KiB each, "
+            f"broadcast delivered to all in {delivered * 1000:.1f} ms"
+        )
+        self.assertEqual(push.get_broker().subscriber_count(), 0)
+
+
+class AdminDashboardStatsTests(TestCase):
+    def setUp(self):
+        self.admin = CustomUser.objects.create(
+            username="admin", email="admin@example.com", role="admin", is_staff=True
+        )
+        self.users = [
+            CustomUser.objects.create(username=f"user{i}", email=f"user{i}@example.com")
+            for i in range(4)
+        ]
+        therapist_user = CustomUser.objects.create(
+            username="therapist", email="therapist@example.com", role="therapist"
+        )
+        self.therapist = Therapist.objects.create(
+            user=therapist_user, specialty="Anxiety", experience=5, price=50
+        )
+        today = timezone.localdate()
+        self.appointments = [
+            Appointment.objects.create(
+                user=self.users[i],
+                therapist=self.therapist,
+                date=(today + timedelta(days=i % 2)).isoformat(),
+                time="10:00",
+                status=status,
+            )
+            for i, status in enumerate(["Completed", "Completed", "Cancelled", "Pending"])
+        ]
+        Event.objects.create(
+            title="Past", date=today - timedelta(days=1), time="10 AM", location="Hall",
+            category="Workshop", capacity=10, description="d", presenter="p", price=0,
+        )
+        Event.objects.create(
+            title="Soon", date=today + timedelta(days=3), time="10 AM", location="Hall",
+            category="Workshop", capacity=10, description="d", presenter="p", price=0,
+        )
+
+    def dashboard(self):
+        client = APIClient()
+        client.force_authenticate(self.admin)
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get("/api/admin-stats/dashboard/")
+        self.assertEqual(len(queries.captured_queries), 1)
+        return response.data
+
+    def test_counters_follow_saves_and_deletes(self):
+        data = self.dashboard()
+        self.assertEqual(data["stats"]["active_users"], 4)
+        self.assertEqual(data["stats"]["total_therapists"], 1)
+        self.assertEqual(data["stats"]["appointments_today"], 2)
+        self.assertEqual(data["stats"]["success_rate"], "66.67")
+        self.assertEqual(data["upcoming_events"], 1)
+
+        pending = Appointment.objects.get(pk=self.appointments[3].pk)
+        pending.status = "Cancelled"
+        pending.save()
+        self.appointments[0].delete()
+        self.users[3].role = "therapist"
+        self.users[3].save()
+
+        data = self.dashboard()
+        self.assertEqual(data["stats"]["active_users"], 3)
+        self.assertEqual(data["stats"]["appointments_today"], 1)
+        self.assertEqual(data["stats"]["success_rate"], "33.33")
+        self.assertEqual(
+            {row["status"]: row["count"] for row in data["appointments_by_status"]},
+            {"Completed": 1, "Cancelled": 2},
+        )
+
+    def test_rebuild_matches_incremental_counters_and_snapshot_saves_a_row(self):
+        live = dict(StatCounter.objects.exclude(value=0).values_list("key", "value"))
+        stats.rebuild()
+        self.assertEqual(
+            dict(StatCounter.objects.exclude(value=0).values_list("key", "value")), live
+        )
+
+        # Users who all joined today, against none before the window
+        CustomUser.objects.filter(pk=self.users[0].pk).update(
+            date_joined=timezone.now() - timedelta(days=60)
+        )
+        call_command("snapshot_stats", "--rebuild", stdout=io.StringIO())
+        row = AdminStats.objects.get(date=timezone.localdate())
+        self.assertEqual(row.active_users, 4)
+        self.assertEqual(row.user_growth, Decimal("300.00"))
+
+
+class ResponseCacheTests(TestCase):
+    def setUp(self):
+        response_cache.cache.clear()
+        response_cache.reset_stats()
+        self.category = Category.objects.create(title="Anxiety", icon="FaBrain", color="#fff")
+        self.client = APIClient()
+
+    def get(self, path, **params):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(path, params)
+        return response, len(queries.captured_queries)
+
+    def test_hits_skip_the_database_until_a_write_invalidates(self):
+        first, _ = self.get("/api/categories/", page=1, search="a")
+        second, queries = self.get("/api/categories/", search="a", page=1)
+        self.assertEqual((first["X-Cache"], second["X-Cache"]), ("MISS", "HIT"))
+        self.assertEqual(queries, 0)
+        self.assertEqual(first.content, second.content)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Category.objects.create(title="Sleep", icon="FaBed", color="#000")
+        third, _ = self.get("/api/categories/", page=1, search="a")
+        self.assertEqual(third["X-Cache"], "MISS")
+        self.assertEqual(third.data["count"], 2)
+        self.assertEqual(
+            response_cache.stats()["categories"],
+            {"hits": 1, "misses": 2, "hit_rate": 0.3333},
+        )
+
+    def test_entries_are_per_role_and_therapists_only_for_anonymous(self):
+        self.get("/api/categories/")
+        user = CustomUser.objects.create(username="user", email="user@example.com")
+        self.client.force_authenticate(user)
+        response, _ = self.get("/api/categories/")
+        self.assertEqual(response["X-Cache"], "MISS")
+
+        response, _ = self.get("/api/therapists/")
+        self.assertFalse(response.has_header("X-Cache"))
+
+
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create(username="user", email="user@example.com")
+        self.partner = CustomUser.objects.create(
+            username="partner", email="partner@example.com"
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def walk(self, url, link="next"):
+        pages = []
+        while url:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            for query in queries.captured_queries:
+                self.assertNotIn("COUNT(", query["sql"])
+                self.assertNotIn("OFFSET", query["sql"])
+            pages.append([item["id"] for item in response.data["results"]])
+            url = response.data[link]
+            last = response.data
+        return pages, last
+
+    def test_walks_ties_forwards_and_back(self):
+        now = timezone.now()
+        Message.objects.bulk_create(
+            Message(
+                sender=self.partner if i % 2 else self.user,
+                receiver=self.user if i % 2 else self.partner,
+                message=f"Message {i}",
+                # Groups of four share a timestamp, so the id breaks ties
+                timestamp=now - timedelta(minutes=i // 4),
+            )
+            for i in range(23)
+        )
+        # Notes to self sit in both partitions; others' messages in neither
+        Message.objects.create(
+            sender=self.user, receiver=self.user, message="Note", timestamp=now
+        )
+        Message.objects.create(
+            sender=self.partner, receiver=self.partner, message="Other", timestamp=now
+        )
+        expected = list(
+            Message.objects.filter(Q(sender=self.user) | Q(receiver=self.user))
+            .order_by("-timestamp", "-id")
+            .values_list("id", flat=True)
+        )
+
+        pages, last = self.walk("/api/messages/?page_size=5")
+        self.assertEqual(sum(pages, []), expected)
+        self.assertEqual([len(page) for page in pages], [5, 5, 5, 5, 4])
+
+        back, _ = self.walk(last["previous"], link="previous")
+        self.assertEqual(back, pages[-2::-1])
+
+    def test_merges_direct_and_broadcast_notifications(self):
+        now = timezone.now()
+        for i in range(9):
+            Notification.objects.create(
+                user=self.user if i % 3 else None,
+                title=f"Notice {i}",
+                message="Message",
+                type="system",
+                date=now,
+            )
+        Notification.objects.create(
+            role="therapist", title="Hidden", message="Message", type="system", date=now
+        )
+        expected = list(
+            Notification.for_user(self.user)
+            .order_by("-created_at", "-id")
+            .values_list("id", flat=True)
+        )
+        self.assertEqual(len(expected), 9)
+
+        pages, last = self.walk("/api/notifications/?page_size=4")
+        self.assertEqual(sum(pages, []), expected)
+        back, _ = self.walk(last["previous"], link="previous")
+        self.assertEqual(back, pages[-2::-1])
+
+    def test_null_keys_sort_last_in_both_directions(self):
+        therapist_user = CustomUser.objects.create(
+            username="therapist", email="therapist@example.com", role="therapist"
+        )
+        therapist = Therapist.objects.create(
+            user=therapist_user, specialty="Anxiety", experience=5, price=50
+        )
+        today = timezone.localdate()
+        for i in range(7):
+            Appointment.objects.create(
+                user=self.user,
+                therapist=therapist,
+                # Unparseable dates leave start_at empty
+                date=(today + timedelta(days=i)).isoformat() if i % 3 else "someday",
+                time="10:00",
+            )
+        expected = [
+            appointment.id
+            for appointment in sorted(
+                Appointment.objects.all(),
+                key=lambda a: (a.start_at is None, a.start_at or timezone.now(), a.id),
+            )
+        ]
+
+        pages, last = self.walk("/api/appointments/?page_size=2")
+        self.assertEqual(sum(pages, []), expected)
+        back, _ = self.walk(last["previous"], link="previous")
+        self.assertEqual(back, pages[-2::-1])
+
+    def test_page_numbers_and_bad_cursors(self):
+        for i in range(12):
+            UserProgress.objects.create(user=self.user, date=timezone.localdate(), mood_rating=5)
+
+        with warnings.catch_warnings():
+            warnings.simplefilter("error", UnorderedObjectListWarning)
+            response = self.client.get("/api/user-progress/?page=2")
+            messages = self.client.get("/api/messages/?page=1")
+        self.assertEqual(response.data["count"], 12)
+        self.assertEqual(len(response.data["results"]), 2)
+        # Page numbers follow the keyset order
+        newest = UserProgress.objects.order_by("-created_at", "-id")
+        self.assertEqual(
+            [item["id"] for item in response.data["results"]],
+            [progress.id for progress in newest[10:12]],
+        )
+        self.assertEqual(messages.status_code, 200)
+
+        response = self.client.get("/api/user-progress/?cursor=bm90LWEtY3Vyc29y")
+        self.assertEqual(response.status_code, 404)
+
+    def test_count_only_when_asked_for(self):
+        for i in range(12):
+            UserProgress.objects.create(user=self.user, date=timezone.localdate(), mood_rating=5)
+
+        response = self.client.get("/api/user-progress/")
+        self.assertNotIn("count", response.data)
+        pages, _ = self.walk("/api/user-progress/?page_size=5")
+        self.assertEqual(len(pages), 3)
+
+        response = self.client.get("/api/user-progress/?count=true&page_size=5")
+        self.assertEqual(response.data["count"], 12)
+        self.assertEqual(len(response.data["results"]), 5)
+        # The cursor links keep asking for it
+        response = self.client.get(response.data["next"])
+        self.assertEqual(response.data["count"], 12)
+        self.assertEqual(len(response.data["results"]), 5)
+
+    @unittest.skipUnless(KEYSET_BENCH_ROWS, "set API_BENCH_KEYSET_ROWS")
+    def test_deep_pages_cost_the_same_as_the_first(self):
+        now = timezone.now()
+        Notification.objects.bulk_create(
+            (
+                Notification(
+                    user=self.user,
+                    title="Notice",
+                    message="Message",
+                    type="system",
+                    date=now,
+                )
+                for _ in range(KEYSET_BENCH_ROWS)
+            ),
+            batch_size=5000,
+        )
+        deep_page = KEYSET_BENCH_ROWS // 10
+        anchor = (
+            Notification.objects.filter(user=self.user)
+            .order_by("-created_at", "-id")[(deep_page - 1) * 10 - 1]
+        )
+        cursor = base64.urlsafe_b64encode(
+            json.dumps([anchor.created_at.isoformat(), anchor.id, False]).encode()
+        ).decode()
+
+        def timed(url, repeat=5):
+            best = float("inf")
+            for _ in range(repeat):
+                started = time.perf_counter()
+                response = self.client.get(url)
+                best = min(best, time.perf_counter() - started)
+            self.assertEqual(len(response.data["results"]), 10)
+            return best * 1000
+
+        first = timed("/api/notifications/")
+        deep = timed(f"/api/notifications/?cursor={cursor}")
+        offset = timed(f"/api/notifications/?page={deep_page}")
+        print(
+            f"\n  {KEYSET_BENCH_ROWS} rows: keyset page 1 {first:.2f} ms, "
+            f"page {deep_page} {deep:.2f} ms; page-number page {deep_page} {offset:.2f} ms"
+        )
+        self.assertLess(deep, first * 3 + 5)
+
+
+class NestedBulkWriteTests(TestCase):
+    DAYS = [day for day, _ in Schedule.DAYS_OF_WEEK]
+
+    def setUp(self):
+        user = CustomUser.objects.create(
+            username="therapist", email="therapist@example.com", role="therapist"
+        )
+        self.therapist = Therapist.objects.create(
+            user=user, specialty="Anxiety", experience=5, price=50
+        )
+
+    def grid(self, days, hours, start=8):
+        return {
+            day: [f"{start + hour:02d}:00" for hour in range(hours)]
+            for day in self.DAYS[:days]
+        }
+
+    def save_schedule(self, schedule):
+        serializer = TherapistSerializer(
+            self.therapist, data={"schedule": schedule}, partial=True
+        )
+        serializer.is_valid(raise_exception=True)
+        with CaptureQueriesContext(connection) as queries:
+            serializer.save()
+        return len(queries.captured_queries)
+
+    def slots(self):
+        return dict(
+            ((slot.day, slot.time), slot.id)
+            for slot in Schedule.objects.filter(therapist=self.therapist)
+        )
+
+    def test_schedule_diff_keeps_ids_and_query_count(self):
+        counts = []
+        for days, hours in ((1, 2), (7, 16)):
+            self.save_schedule(self.grid(days, hours))
+            before = self.slots()
+            Schedule.objects.filter(therapist=self.therapist).update(is_available=False)
+
+            # Shifting the grid by an hour adds, removes and reopens slots
+            counts.append(self.save_schedule(self.grid(days, hours, start=9)))
+            after = self.slots()
+            self.assertEqual(after.keys(), {
+                (day, time)
+                for day, times in self.grid(days, hours, start=9).items()
+                for time in times
+            })
+            self.assertEqual(after[("Monday", "09:00")], before[("Monday", "09:00")])
+            self.assertFalse(
+                Schedule.objects.filter(
+                    therapist=self.therapist, is_available=False
+                ).exists()
+            )
+            Schedule.objects.filter(therapist=self.therapist).delete()
+        self.assertEqual(counts[0], counts[1])
+
+    def test_reading_list_diff_keeps_ids_in_the_new_order(self):
+        serializer = ReadingListSerializer(
+            data={
+                "title": "Calm",
+                "description": "Description",
+                "category": "Anxiety",
+                "book_list": ["A", "B", "C", "B"],
+            }
+        )
+        serializer.is_valid(raise_exception=True)
+        reading_list = serializer.save()
+        ids = dict(reading_list.books.values_list("order", "id"))
+
+        def save(titles):
+            serializer = ReadingListSerializer(
+                reading_list, data={"book_list": titles}, partial=True
+            )
+            serializer.is_valid(raise_exception=True)
+            with CaptureQueriesContext(connection) as queries:
+                serializer.save()
+            return len(queries.captured_queries)
+
+        # Both add, drop and reorder books
+        small = save(["C", "B", "D"])
+        books = list(reading_list.books.values_list("title", "order", "id"))
+        self.assertEqual(
+            [(title, order) for title, order, _ in books], [("C", 0), ("B", 1), ("D", 2)]
+        )
+        self.assertEqual([books[0][2], books[1][2]], [ids[2], ids[1]])
+
+        large = save(["D", "C"] + [f"Book {i}" for i in range(200)])
+        self.assertEqual(small, large)
+        self.assertEqual(reading_list.books.count(), 202)
+
+
+class DataTransferTests(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(__import__("shutil").rmtree, self.directory)
+
+    def snapshot(self):
+        tables = {}
+        for model in transfer.transferred_models():
+            rows = model.objects.order_by("pk").values_list()
+            tables[model._meta.label] = list(rows)
+        # Not transferred but rebuilt from the imported rows, with new keys
+        for model in transfer.DERIVED:
+            names = [field.attname for field in transfer.data_fields(model)]
+            tables[model._meta.label] = sorted(model.objects.values_list(*names))
+        tables["counters"] = list(
+            StatCounter.objects.exclude(value=0).order_by("key").values_list("key", "value")
+        )
+        return tables
+
+    def clear(self):
+        for model in reversed(transfer.ordered_models()):
+            model.objects.all().delete()
+
+    def run_command(self, *args):
+        out, err = io.StringIO(), io.StringIO()
+        call_command(*args, stdout=out, stderr=err)
+        return out.getvalue(), err.getvalue()
+
+    def test_ndjson_round_trip_keeps_every_row(self):
+        seed_dataset(60)
+        before = self.snapshot()
+        self.assertTrue(before["api.Message"] and before["api.Conversation"])
+
+        data, progress = self.run_command("export_data", "--progress-every", "50")
+        self.assertIn("api.message: 50 rows", progress)
+        first = json.loads(data.splitlines()[0])
+        self.assertEqual(first["model"], "api.customuser")
+        path = os.path.join(self.directory, "dump.ndjson.gz")
+        with transfer.open_text(path, "w") as out:
+            out.write(data)
+
+        self.clear()
+        output, _ = self.run_command("import_data", path, "--batch-size", "7")
+        self.assertIn(f"Imported {len(data.splitlines())} rows", output)
+        self.assertEqual(self.snapshot(), before)
+
+    def test_csv_round_trip_keeps_nulls_and_json(self):
+        seed_dataset(20)
+        # No window can be resolved from "someday", so it stays NULL
+        Appointment.objects.filter(pk=Appointment.objects.first().pk).update(
+            date="someday", start_at=None, end_at=None, notes=""
+        )
+        TherapistClient.rebuild()
+        stats.rebuild()
+        before = self.snapshot()
+        self.run_command("export_data", "--format", "csv", "--output", self.directory)
+        self.assertTrue(os.path.exists(os.path.join(self.directory, "therapist.csv")))
+
+        self.clear()
+        self.run_command("import_data", self.directory)
+        self.assertEqual(self.snapshot(), before)
+
+    def test_new_ids_resolve_foreign_keys(self):
+        seed_dataset(20)
+
+        def contents():
+            return {
+                "messages": sorted(
+                    Message.objects.values_list(
+                        "sender__username", "receiver__username", "message", "timestamp"
+                    )
+                ),
+                "conversations": sorted(
+                    Conversation.objects.values_list(
+                        "user_a__username", "user_b__username", "last_message__message"
+                    )
+                ),
+                "slots": sorted(
+                    Schedule.objects.values_list("therapist__user__username", "day", "time")
+                ),
+            }
+
+        before = contents()
+        old_ids = set(Message.objects.values_list("id", flat=True))
+        data, _ = self.run_command("export_data")
+        self.clear()
+
+        transfer.import_ndjson(data.splitlines(), new_ids=True)
+        self.assertEqual(contents(), before)
+        self.assertFalse(old_ids & set(Message.objects.values_list("id", flat=True)))
+
+    def test_import_rebuilds_what_saves_and_signals_maintain(self):
+        user = CustomUser.objects.create(username="client", email="client@example.com")
+        therapist_user = CustomUser.objects.create(
+            username="therapist", email="therapist@example.com", role="therapist"
+        )
+        therapist = Therapist.objects.create(
+            user=therapist_user, specialty="Anxiety", experience=5, price=Decimal("80.00")
+        )
+        today = timezone.localdate()
+        for day, clock in (("Monday", "09:30"), ((today + timedelta(days=3)).isoformat(), "14:00")):
+            Appointment.objects.create(user=user, therapist=therapist, date=day, time=clock)
+        now = timezone.now()
+        for i in range(5):
+            Message.objects.create(
+                sender=user if i % 2 else therapist_user,
+                receiver=therapist_user if i % 2 else user,
+                message=f"Message {i}",
+                timestamp=now + timedelta(minutes=i),
+                read=i == 0,
+            )
+        for days_ago in range(10):
+            UserProgress.objects.create(
+                user=user, date=today - timedelta(days=days_ago), mood_rating=days_ago % 7 + 1
+            )
+        event = Event.objects.create(
+            title="Webinar",
+            date=today,
+            time="10 AM - 12 PM",
+            location="Online",
+            category="Webinar",
+            capacity=10,
+            description="Description",
+            presenter="Presenter",
+            price=Decimal("0.00"),
+        )
+        for attendee in (user, therapist_user):
+            EventRegistration.objects.create(user=attendee, event=event)
+
+        def derived():
+            return {
+                "windows": list(
+                    Appointment.objects.order_by("pk").values_list("start_at", "end_at")
+                ),
+                "registered": list(Event.objects.values_list("registered_count", flat=True)),
+                "conversations": list(
+                    Conversation.objects.values_list(
+                        "user_a_id", "user_b_id", "last_message_id", "last_timestamp",
+                        "unread_a", "unread_b",
+                    )
+                ),
+                "clients": list(
+                    TherapistClient.objects.values_list(
+                        "therapist_id", "user_id", "appointments_count",
+                        "first_session_at", "last_session_at",
+                    )
+                ),
+                "buckets": list(
+                    MoodBucket.objects.order_by("kind", "start").values_list(
+                        "user_id", "kind", "start", "entries", "mood_sum", "day_mood_sum"
+                    )
+                ),
+            }
+
+        before = derived()
+        self.assertEqual(before["registered"], [2])
+        self.assertEqual(before["clients"][0][2], 2)
+        self.assertTrue(before["buckets"])
+        self.assertTrue(all(start for start, _ in before["windows"]))
+        # An export that leaves out the columns save() and the signals fill in
+        data, _ = self.run_command("export_data")
+        derived_labels = [model._meta.label_lower for model in transfer.DERIVED]
+        lines = []
+        for line in data.splitlines():
+            row = json.loads(line)
+            self.assertNotIn(row["model"], derived_labels)
+            for name in ("start_at", "end_at", "registered_count"):
+                row["fields"].pop(name, None)
+            lines.append(json.dumps(row))
+        self.clear()
+
+        transfer.import_ndjson(lines)
+        self.assertEqual(derived(), before)
+
+    def test_bad_rows_report_their_line(self):
+        path = os.path.join(self.directory, "bad.ndjson")
+        with open(path, "w") as out:
+            out.write('{"model": "api.category", "pk": 1, "fields": {"title": "A", "icon": "i", "color": "c"}}\n')
+            out.write('{"model": "api.nothing", "pk": 1, "fields": {}}\n')
+        with self.assertRaisesMessage(Exception, "Line 2: Unknown model 'api.nothing'"):
+            self.run_command("import_data", path)
+        self.assertFalse(Category.objects.exists())
+
+    @unittest.skipUnless(TRANSFER_BENCH_ROWS, "set API_BENCH_TRANSFER_ROWS")
+    def test_streams_millions_of_rows(self):
+        users = CustomUser.objects.bulk_create(
+            CustomUser(username=f"user{i}", email=f"user{i}@example.com") for i in range(100)
+        )
+        now = timezone.now()
+        Message.objects.bulk_create(
+            (
+                Message(
+                    sender=users[i % 100],
+                    receiver=users[(i + 1) % 100],
+                    message=f"Message {i}",
+                    timestamp=now,
+                )
+                for i in range(TRANSFER_BENCH_ROWS)
+            ),
+            batch_size=5000,
+        )
+        UserProgress.objects.bulk_create(
+            (
+                UserProgress(
+                    user=users[i % 100],
+                    date=now.date(),
+                    mood_rating=i % 5 + 1,
+                    completed_exercises=["Breathing"],
+                )
+                for i in range(TRANSFER_BENCH_ROWS)
+            ),
+            batch_size=5000,
+        )
+        models = [CustomUser, Message, UserProgress]
+        path = os.path.join(self.directory, "dump.ndjson")
+
+        started = time.perf_counter()
+        with open(path, "w") as out:
+            total = transfer.export_ndjson(out, models, chunk_size=2000)
+        exported = time.perf_counter() - started
+
+        # Memory is traced on a separate pass; tracing slows the export down
+        tracemalloc.start()
+        with open(os.devnull, "w") as out:
+            transfer.export_ndjson(out, [Message], chunk_size=2000)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        Message.objects.all()._raw_delete(connection.alias)
+        UserProgress.objects.all()._raw_delete(connection.alias)
+        CustomUser.objects.all()._raw_delete(connection.alias)
+        started = time.perf_counter()
+        with open(path) as lines:
+            counts = transfer.import_ndjson(lines, batch_size=2000)
+        imported = time.perf_counter() - started
+
+        self.assertEqual(sum(counts.values()), total)
+        print(
+            f"\n  {total} rows: export {exported:.1f} s ({total / exported:,.0f} rows/s, "
+            f"peak {peak / 2**20:.1f} MiB), import {imported:.1f} s "
+            f"({total / imported:,.0f} rows/s)"
+        )
+        self.assertLess(peak, 20 * 2**20)
+
+
+class ClaimsAuthenticationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create_user(
+            username="user", email="user@example.com", password="secret-pass"
+        )
+        self.client = APIClient()
+
+    def login(self):
+        response = self.client.post(
+            "/api/token/", {"email": "user@example.com", "password": "secret-pass"}
+        )
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def get(self, path, token):
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {token}")
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(path)
+        user_queries = [
+            query["sql"] for query in queries.captured_queries
+            if 'FROM "api_customuser"' in query["sql"]
+        ]
+        return response, user_queries
+
+    def save(self, **changes):
+        for name, value in changes.items():
+            setattr(self.user, name, value)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.save()
+
+    def test_claims_authenticate_without_loading_the_user(self):
+        access = self.login()["access"]
+        self.assertEqual(AccessToken(access)["role"], "user")
+
+        # The claims' freshness is read once per AUTH_CLAIMS_TTL, then cached
+        response, user_queries = self.get("/api/notifications/", access)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(user_queries), 1)
+        self.assertIn("claims_changed_at", user_queries[0])
+        response, user_queries = self.get("/api/notifications/", access)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(user_queries, [])
+
+        # A view that needs the whole user loads it once, then from the cache
+        response, user_queries = self.get("/auth/users/me/", access)
+        self.assertEqual(response.data["email"], "user@example.com")
+        self.assertEqual(len(user_queries), 1)
+        response, user_queries = self.get("/auth/users/me/", access)
+        self.assertEqual(response.data["email"], "user@example.com")
+        self.assertEqual(user_queries, [])
+
+    def test_role_changes_override_older_tokens(self):
+        tokens = self.login()
+        response, _ = self.get("/api/admin-stats/cache/", tokens["access"])
+        self.assertEqual(response.status_code, 403)
+
+        self.save(is_staff=True, role="admin")
+        response, user_queries = self.get("/api/admin-stats/cache/", tokens["access"])
+        self.assertEqual(response.status_code, 200)
+        # The change time, then the row the stale token falls back to
+        self.assertEqual(len(user_queries), 2)
+
+        # Refreshing issues an access token with the current claims
+        response = self.client.post("/api/token/refresh/", {"refresh": tokens["refresh"]})
+        access = AccessToken(response.data["access"])
+        self.assertEqual((access["role"], access["is_staff"]), ("admin", True))
+
+        # Other edits only drop the cached row
+        changed = cache.get(claims_key(self.user.pk))
+        self.save(phone="555")
+        self.assertEqual(cache.get(claims_key(self.user.pk)), changed)
+        self.assertIsNone(cache.get(CustomUser.cache_key(self.user.pk)))
+
+    def test_deleted_and_inactive_users_are_refused(self):
+        access = self.login()["access"]
+        self.save(is_active=False)
+        response, _ = self.get("/api/notifications/", access)
+        self.assertEqual(response.status_code, 401)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.delete()
+        response, _ = self.get("/api/notifications/", access)
+        self.assertEqual(response.status_code, 401)
+
+    def test_claim_changes_reach_workers_that_did_not_make_them(self):
+        self.save(is_staff=True, role="admin")
+        access = self.login()["access"]
+        response, _ = self.get("/api/admin-stats/cache/", access)
+        self.assertEqual(response.status_code, 200)
+
+        # Another worker demotes, then deactivates the user. This worker's
+        # cached claims state is cleared, as it would expire after
+        # AUTH_CLAIMS_TTL; the stale token must not keep its admin claims.
+        users = CustomUser.objects.filter(pk=self.user.pk)
+        users.update(role="user", is_staff=False, claims_changed_at=timezone.now())
+        cache.clear()
+        response, _ = self.get("/api/admin-stats/cache/", access)
+        self.assertEqual(response.status_code, 403)
+
+        users.update(is_active=False)
+        auth.mark_claims_changed(self.user.pk)
+        cache.clear()
+        response, _ = self.get("/api/notifications/", access)
+        self.assertEqual(response.status_code, 401)
+
+    @unittest.skipUnless(AUTH_BENCH_REQUESTS, "set API_BENCH_AUTH_REQUESTS")
+    def test_claims_authentication_throughput(self):
+        access = self.login()["access"]
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {access}")
+
+        def rate():
+            self.client.get("/api/notifications/unread_count/")
+            started = time.perf_counter()
+            for _ in range(AUTH_BENCH_REQUESTS):
+                self.client.get("/api/notifications/unread_count/")
+            return AUTH_BENCH_REQUESTS / (time.perf_counter() - started)
+
+        with mock.patch.object(
+            NotificationViewSet, "authentication_classes", [JWTAuthentication]
+        ):
+            before = rate()
+        after = rate()
+        print(f"\n  {AUTH_BENCH_REQUESTS} requests: {before:.0f} req/s -> {after:.0f} req/s")
+        self.assertGreater(after, before)
+
+
+class DatabaseLayerTests(TestCase):
+    def test_new_sqlite_connections_are_tuned(self):
+        with tempfile.TemporaryDirectory() as directory:
+            wrapper = DatabaseWrapper(
+                {**connection.settings_dict, "NAME": os.path.join(directory, "db.sqlite3")}
+            )
+            try:
+                with wrapper.cursor() as cursor:
+                    cursor.execute("PRAGMA journal_mode")
+                    self.assertEqual(cursor.fetchone()[0], "wal")
+                    cursor.execute("PRAGMA busy_timeout")
+                    self.assertEqual(cursor.fetchone()[0], 5000)
+            finally:
+                wrapper.close()
+
+    def test_reads_go_to_a_replica_until_the_first_write(self):
+        router = db.ReplicaRouter()
+        primary = connections["default"]
+        with mock.patch.object(db, "replica_aliases", return_value=["replica1"]), \
+                mock.patch.object(primary, "in_atomic_block", False):
+            self.assertEqual(router.db_for_read(Message), "default")
+            with db.replica_reads():
+                self.assertEqual(router.db_for_read(Message), "replica1")
+                with mock.patch.object(primary, "in_atomic_block", True):
+                    self.assertEqual(router.db_for_read(Message), "default")
+                self.assertEqual(router.db_for_write(Message), "default")
+                self.assertEqual(router.db_for_read(Message), "default")
+            with db.replica_reads():
+                self.assertEqual(router.db_for_read(Message), "replica1")
+        self.assertFalse(router.allow_migrate("replica1", "api"))
+
+    def test_safe_requests_read_from_replicas(self):
+        user = CustomUser.objects.create(username="user", email="user@example.com")
+        client = APIClient()
+        client.force_authenticate(user)
+
+        # Only consulted for reads routed to the replicas
+        with mock.patch.object(db, "replica_aliases", return_value=[]) as replicas:
+            self.assertEqual(client.get("/api/notifications/").status_code, 200)
+            self.assertTrue(replicas.called)
+
+            replicas.reset_mock()
+            response = client.post("/api/notifications/mark_all_as_read/")
+            self.assertEqual(response.status_code, 200)
+            self.assertFalse(replicas.called)
+
+            replicas.reset_mock()
+            with mock.patch.object(
+                NotificationViewSet, "primary_actions", ("list",), create=True
+            ):
+                client.get("/api/notifications/")
+            self.assertFalse(replicas.called)
+
+
+class QueryPlanTests(TestCase):
+    def checkplans(self):
+        out = io.StringIO()
+        call_command("checkplans", stdout=out)
+        return out.getvalue()
+
+    def test_hot_paths_use_indexes(self):
+        output = self.checkplans()
+        self.assertIn(f"All {len(plans.HOT_PATHS)} hot paths use indexes", output)
+        # Seeded rows are rolled back
+        self.assertFalse(Message.objects.exists())
+
+    def test_missing_index_fails_the_check(self):
+        indexed = [index for index in Event._meta.indexes if "date" in index.fields]
+        # Dropped inside the test transaction, so restored afterwards
+        with connection.cursor() as cursor:
+            for index in indexed:
+                cursor.execute(f'DROP INDEX "{index.name}"')
+        with self.assertRaisesMessage(CommandError, "2 of"):
+            self.checkplans()
+
+    def test_full_scans(self):
+        self.assertEqual(
+            plans.full_scans(
+                [
+                    "SEARCH api_message USING INDEX idx (sender_id=?)",
+                    "SCAN U0 USING INDEX api_appointment_user_id",
+                    "SCAN api_resource USING INDEX resource_featured_idx",
+                    "SCAN CONSTANT ROW",
+                    "USE TEMP B-TREE FOR ORDER BY",
+                ],
+                partial={"resource_featured_idx"},
+            ),
+            ["U0"],
+        )
+
+
+def api_urlconf(async_reads):
+    """A URL conf with just the api routes, built with or without async reads"""
+    with override_settings(ASYNC_READ_VIEWS=async_reads):
+        router = DefaultRouter()
+        for prefix, viewset, basename in api_urls.router.registry:
+            router.register(prefix, viewset, basename)
+        urlconf = types.ModuleType(f"api_urls_{'async' if async_reads else 'sync'}")
+        urlconf.urlpatterns = [path("api/", include(router.urls))]
+    return urlconf
+
+
+async def asgi_request(app, method, path, token=None, body=None):
+    """One request straight through an ASGI handler: (status, headers, body)"""
+    path, _, query = path.partition("?")
+    headers = [(b"host", b"testserver")]
+    if token:
+        headers.append((b"authorization", f"Bearer {token}".encode()))
+    payload = json.dumps(body).encode() if body is not None else b""
+    if payload:
+        headers.append((b"content-type", b"application/json"))
+        headers.append((b"content-length", str(len(payload)).encode()))
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": method,
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "root_path": "",
+        "query_string": query.encode(),
+        "headers": headers,
+        "server": ("testserver", 80),
+        "client": ("127.0.0.1", 50000),
+    }
+    pending = [{"type": "http.request", "body": payload, "more_body": False}]
+    response = {"body": b""}
+
+    async def receive():
+        if pending:
+            return pending.pop()
+        # Never disconnects; Django stops listening once it has responded
+        await asyncio.Event().wait()
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            response["status"] = message["status"]
+            response["headers"] = {
+                name.decode(): value.decode() for name, value in message["headers"]
+            }
+        else:
+            response["body"] += message.get("body", b"")
+
+    await app(scope, receive, send)
+    return response["status"], response["headers"], response["body"]
+
+
+# Read endpoints served by AsyncReadMixin, formatted with seed_dataset ids
+ASYNC_READ_PATHS = [
+    "/api/therapists/",
+    "/api/therapists/{therapist}/",
+    "/api/resources/?page=2",
+    "/api/resources/{resource}/",
+    "/api/events/?upcoming=true",
+    "/api/events/{event}/",
+    "/api/events/{event}/?include=registrations",
+    "/api/reading-lists/",
+    "/api/reading-lists/{reading_list}/",
+    "/api/notifications/",
+    "/api/notifications/?read=false",
+    "/api/notifications/{notification}/",
+    "/api/messages/?page_size=5",
+    "/api/messages/?page=2",
+    "/api/messages/{message}/",
+    "/api/messages/999999/",
+]
+
+
+class AsyncReadViewTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.sync_urls = api_urlconf(False)
+        cls.async_urls = api_urlconf(True)
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.ids = seed_dataset(100)
+
+    def setUp(self):
+        response_cache.cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.ids["user"])
+
+    def get(self, urlconf, path):
+        with override_settings(ROOT_URLCONF=urlconf):
+            return self.client.get(path)
+
+    def test_read_actions_are_async_views(self):
+        resolve = get_resolver(self.async_urls).resolve
+        for path in ["/api/messages/", "/api/therapists/1/"]:
+            self.assertTrue(asyncio.iscoroutinefunction(resolve(path).func))
+        self.assertFalse(
+            asyncio.iscoroutinefunction(resolve("/api/messages/conversations/").func)
+        )
+        resolve = get_resolver(self.sync_urls).resolve
+        self.assertFalse(asyncio.iscoroutinefunction(resolve("/api/messages/").func))
+
+    def test_on_by_default_only_under_asgi(self):
+        env = {key: value for key, value in os.environ.items() if key != "API_ASYNC_READS"}
+        for module, expected in (("health.asgi", "True"), ("health.wsgi", "False")):
+            with self.subTest(module=module):
+                output = subprocess.run(
+                    [
+                        sys.executable,
+                        "-c",
+                        f"import {module}; from django.conf import settings; "
+                        "print(settings.ASYNC_READ_VIEWS)",
+                    ],
+                    cwd=BASELINE_PATH.parent.parent,
+                    env=env,
+                    capture_output=True,
+                    text=True,
+                    check=True,
+                ).stdout
+                self.assertEqual(output.strip(), expected)
+
+    def test_async_responses_match_sync(self):
+        paths = [path.format(**self.ids) for path in ASYNC_READ_PATHS]
+        # Follow a keyset cursor as well
+        paths.append(self.get(self.sync_urls, "/api/messages/?page_size=5").data["next"])
+        with override_settings(RESPONSE_CACHE_ENABLED=False):
+            for path in paths:
+                with self.subTest(path=path):
+                    expected = self.get(self.sync_urls, path)
+                    response = self.get(self.async_urls, path)
+                    self.assertEqual(response.status_code, expected.status_code)
+                    self.assertEqual(response.content, expected.content)
+
+    def test_async_reads_use_the_response_cache(self):
+        path = f"/api/resources/{self.ids['resource']}/"
+        self.assertEqual(self.get(self.async_urls, path)["X-Cache"], "MISS")
+        self.assertEqual(self.get(self.async_urls, path)["X-Cache"], "HIT")
+
+    def test_writes_share_the_url(self):
+        with override_settings(ROOT_URLCONF=self.async_urls):
+            response = self.client.post(
+                "/api/messages/",
+                {
+                    "sender": self.ids["user"].id,
+                    "receiver": self.ids["therapist_user"].id,
+                    "message": "Hi",
+                    "timestamp": timezone.now().isoformat(),
+                },
+                format="json",
+            )
+            self.assertEqual(response.status_code, 201)
+            response = self.client.head(f"/api/messages/{response.data['id']}/")
+            self.assertEqual(response.status_code, 200)
+
+        self.client.force_authenticate(None)
+        response = self.get(self.async_urls, "/api/messages/")
+        self.assertEqual(response.status_code, 401)
+
+
+class AsyncReadASGITests(TransactionTestCase):
+    def setUp(self):
+        response_cache.cache.clear()
+        self.ids = seed_dataset(100)
+        self.token = str(
+            ClaimsTokenObtainPairSerializer.get_token(self.ids["user"]).access_token
+        )
+
+    def test_reads_and_writes_under_asgi(self):
+        async def scenario():
+            app = ASGIHandler()
+            status, _, body = await asgi_request(
+                app, "GET", "/api/messages/", self.token
+            )
+            self.assertEqual(status, 200)
+            self.assertTrue(json.loads(body)["results"])
+
+            status, headers, _ = await asgi_request(app, "GET", "/api/resources/")
+            self.assertEqual((status, headers["X-Cache"]), (200, "MISS"))
+            status, headers, _ = await asgi_request(app, "GET", "/api/resources/")
+            self.assertEqual((status, headers["X-Cache"]), (200, "HIT"))
+
+            status, _, body = await asgi_request(
+                app,
+                "POST",
+                "/api/messages/",
+                self.token,
+                {
+                    "sender": self.ids["user"].id,
+                    "receiver": self.ids["therapist_user"].id,
+                    "message": "Hi",
+                    "timestamp": timezone.now().isoformat(),
+                },
+            )
+            self.assertEqual(status, 201)
+            created = json.loads(body)["id"]
+            status, _, body = await asgi_request(
+                app, "GET", f"/api/messages/{created}/", self.token
+            )
+            self.assertEqual((status, json.loads(body)["message"]), (200, "Hi"))
+
+        async_to_sync(scenario)()
+
+    @unittest.skipUnless(ASYNC_BENCH_REQUESTS, "set API_BENCH_ASYNC_REQUESTS")
+    def test_sync_and_async_read_throughput(self):
+        concurrency = 32
+        token = str(
+            ClaimsTokenObtainPairSerializer.get_token(
+                self.ids["therapist_user"]
+            ).access_token
+        )
+        peak = [0]
+        sampling = threading.Event()
+
+        def sample_threads():
+            while not sampling.wait(0.001):
+                peak[0] = max(peak[0], threading.active_count())
+
+        def measure(run):
+            peak[0] = threading.active_count()
+            sampling.clear()
+            sampler = threading.Thread(target=sample_threads)
+            sampler.start()
+            started = time.perf_counter()
+            run()
+            elapsed = time.perf_counter() - started
+            sampling.set()
+            sampler.join()
+            return ASYNC_BENCH_REQUESTS / elapsed, peak[0]
+
+        def wsgi():
+            handler = WSGIHandler()
+            environ = RequestFactory().get(
+                "/api/messages/", HTTP_AUTHORIZATION=f"Bearer {token}"
+            ).environ
+
+            def one(_):
+                statuses = []
+                handler(dict(environ), lambda status, headers: statuses.append(status))
+                self.assertEqual(statuses, ["200 OK"])
+
+            with ThreadPoolExecutor(concurrency) as pool:
+                list(pool.map(one, range(ASYNC_BENCH_REQUESTS)))
+
+        def asgi():
+            async def scenario():
+                app = ASGIHandler()
+                slots = asyncio.Semaphore(concurrency)
+
+                async def one():
+                    async with slots:
+                        status, _, _ = await asgi_request(
+                            app, "GET", "/api/messages/", token
+                        )
+                        self.assertEqual(status, 200)
+
+                await asyncio.gather(*(one() for _ in range(ASYNC_BENCH_REQUESTS)))
+
+            async_to_sync(scenario)()
+
+        results = {}
+        with override_settings(ROOT_URLCONF=api_urlconf(False)):
+            results["sync WSGI"] = measure(wsgi)
+            results["sync ASGI"] = measure(asgi)
+        with override_settings(ROOT_URLCONF=api_urlconf(True)):
+            results["async ASGI"] = measure(asgi)
+
+        print(f"\n  {ASYNC_BENCH_REQUESTS} x GET /api/messages/, {concurrency} in flight")
+        for name, (rate, threads) in results.items():
+            print(f"  {name:<11} {rate:7.0f} req/s  peak threads {threads}")
+
+
+class CompiledSerializerTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.ids = seed_dataset(100)
+        # Empty optional columns, a review histogram and no time slots
+        user = CustomUser.objects.create(
+            username="sparse", email="sparse@example.com", role="therapist"
+        )
+        Therapist.objects.create(
+            user=user,
+            specialty="Grief",
+            experience=1,
+            price=Decimal("80.50"),
+            rating_2_count=3,
+            languages=["English"],
+        )
+
+    def assertRendersSame(self, serializer_class, queryset):
+        compiled = compile_serializer(serializer_class)
+        expected = JSONRenderer().render(serializer_class(queryset, many=True).data)
+        rendered = JSONRenderer().render(compiled.serialize(compiled.values(queryset)))
+        self.assertEqual(rendered, expected)
+
+    def test_output_is_byte_identical(self):
+        cases = [
+            (TherapistSerializer, Therapist.objects.order_by("id")),
+            (ResourceSerializer, Resource.objects.order_by("id")),
+            (MessageSerializer, Message.objects.order_by("id")),
+            (ReviewSerializer, Review.objects.order_by("id")),
+            (EventRegistrationSerializer, EventRegistration.objects.order_by("id")),
+        ]
+        for serializer_class, queryset in cases:
+            with self.subTest(serializer=serializer_class.__name__):
+                self.assertTrue(queryset.exists())
+                self.assertRendersSame(serializer_class, queryset)
+
+    def test_nested_lists_take_one_query(self):
+        compiled = compile_serializer(TherapistSerializer)
+        rows = compiled.values(Therapist.objects.all())
+        with self.assertNumQueries(2):
+            data = compiled.serialize(rows)
+        self.assertTrue(any(therapist["time_slots"] for therapist in data))
+
+    def test_unreadable_fields_are_rejected(self):
+        for serializer_class in (ReadingListSerializer, NotificationSerializer):
+            with self.subTest(serializer=serializer_class.__name__):
+                with self.assertRaises(NotCompilable):
+                    compile_serializer(serializer_class)
+
+    def test_list_endpoint(self):
+        client = APIClient()
+        response = client.get("/api/therapists/?page=1")
+        expected = TherapistSerializer(
+            Therapist.objects.select_related("user")[:10], many=True
+        ).data
+        self.assertEqual(
+            JSONRenderer().render(response.data["results"]),
+            JSONRenderer().render(expected),
+        )
+
+    @unittest.skipUnless(SERIALIZER_BENCH_ROWS, "set API_BENCH_SERIALIZER_ROWS")
+    def test_compiled_serializer_throughput(self):
+        rows = max(SERIALIZER_BENCH_ROWS)
+        users = CustomUser.objects.bulk_create(
+            (
+                CustomUser(
+                    username=f"bench-therapist{i}",
+                    email=f"bench-therapist{i}@example.com",
+                    role="therapist",
+                )
+                for i in range(rows)
+            ),
+            batch_size=5000,
+        )
+        therapists = Therapist.objects.bulk_create(
+            (
+                Therapist(
+                    user=user,
+                    specialty="Anxiety",
+                    experience=5,
+                    price=Decimal("60.00"),
+                    languages=["English", "Spanish"],
+                )
+                for user in users
+            ),
+            batch_size=5000,
+        )
+        Schedule.objects.bulk_create(
+            (
+                Schedule(therapist=therapist, day=day, time=time)
+                for therapist in therapists
+                for day in DAYS[:5]
+                for time in SLOT_TIMES[:2]
+            ),
+            batch_size=5000,
+        )
+        compiled = compile_serializer(TherapistSerializer)
+
+        def best(serialize, repeat=3):
+            elapsed = float("inf")
+            for _ in range(repeat):
+                started = time.perf_counter()
+                body = JSONRenderer().render(serialize())
+                elapsed = min(elapsed, time.perf_counter() - started)
+            return elapsed, body
+
+        for size in sorted(SERIALIZER_BENCH_ROWS):
+            queryset = (
+                Therapist.objects.select_related("user")
+                .order_by("id")
+                .filter(id__gte=therapists[0].id)[:size]
+            )
+            drf, expected = best(
+                lambda: TherapistSerializer(
+                    queryset.prefetch_related("time_slots"), many=True
+                ).data
+            )
+            fast, body = best(lambda: compiled.serialize(compiled.values(queryset)))
+            self.assertEqual(body, expected)
+            print(
+                f"\n  {size} therapists per response: "
+                f"ModelSerializer {size / drf:7.0f} rows/s, "
+                f"compiled {size / fast:7.0f} rows/s ({drf / fast:.1f}x)"
+            )
+
+
+class RendererTests(TestCase):
+    def payload(self):
+        return ReturnDict(
+            {
+                "price": Decimal("80.50"),
+                "rating": Decimal("4.25"),
+                "at": datetime(2026, 3, 1, 9, 30, 15, 123456, tzinfo=dt_timezone.utc),
+                "local": timezone.localtime(
+                    datetime(2026, 3, 1, 9, 30, tzinfo=dt_timezone.utc)
+                ),
+                "day": date(2026, 3, 1),
+                "time": datetime(2026, 3, 1, 9, 30).time(),
+                "uuid": uuid.UUID("12345678-1234-5678-1234-567812345678"),
+                "text": "caf\u00e9 \u2028 \u2029 \U0001f600",
+                "error": ErrorDetail("Invalid", code="invalid"),
+                "lazy": gettext_lazy("Hello"),
+                "items": ReturnList([{"id": 1}, (2, 3.5, None, True)], serializer=None),
+            },
+            serializer=None,
+        )
+
+    def test_orjson_output_matches_drf(self):
+        payloads = [
+            self.payload(),
+            # Rejected by orjson, rendered by the stdlib instead
+            {"big": 2**70, 1: "int key"},
+            [],
+            "plain",
+        ]
+        for data in payloads:
+            with self.subTest(data=data):
+                self.assertEqual(
+                    ORJSONRenderer().render(data), JSONRenderer().render(data)
+                )
+        self.assertEqual(ORJSONRenderer().render(None), b"")
+
+    def test_indented_output_matches_drf(self):
+        media_type = "application/json; indent=2"
+        self.assertEqual(
+            ORJSONRenderer().render(self.payload(), media_type),
+            JSONRenderer().render(self.payload(), media_type),
+        )
+
+    def test_parser(self):
+        parsed = ORJSONParser().parse(io.BytesIO('{"a": [1, 2.5, "\u00e9"]}'.encode()))
+        self.assertEqual(parsed, {"a": [1, 2.5, "\u00e9"]})
+        with self.assertRaisesMessage(ParseError, "JSON parse error"):
+            ORJSONParser().parse(io.BytesIO(b'{"a": '))
+
+    def test_api_uses_orjson(self):
+        client = APIClient()
+        response = client.get("/api/resources/")
+        self.assertIsInstance(response.accepted_renderer, ORJSONRenderer)
+
+        response = client.post(
+            "/auth/jwt/create/", b'{"email": ', content_type="application/json"
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("JSON parse error", response.data["detail"])
+
+    @unittest.skipUnless(msgpack, "msgpack is not installed")
+    def test_messagepack_negotiation(self):
+        seed_dataset(100)
+        client = APIClient()
+        response = client.get("/api/therapists/", HTTP_ACCEPT="application/msgpack")
+        self.assertEqual(response["Content-Type"], "application/msgpack")
+        expected = json.loads(client.get("/api/therapists/").content)
+        self.assertEqual(msgpack.unpackb(response.content), expected)
+
+        body = msgpack.packb({"email": "nobody@example.com", "password": "wrong"})
+        response = client.post(
+            "/auth/jwt/create/", body, content_type="application/msgpack"
+        )
+        self.assertEqual(response.status_code, 401)
+
+    @unittest.skipUnless(RENDER_BENCH_ROWS, "set API_BENCH_RENDER_ROWS")
+    def test_render_time_and_size(self):
+        seed_dataset(RENDER_BENCH_ROWS)
+        payloads = {
+            "appointments": AppointmentSerializer(
+                Appointment.objects.select_related(
+                    "payment", "user", "therapist__user"
+                ),
+                many=True,
+            ).data,
+            "events+registrations": EventSerializer(
+                Event.objects.prefetch_related("registrations__user"), many=True
+            ).data,
+            "therapists": compile_serializer(TherapistSerializer).serialize(
+                compile_serializer(TherapistSerializer).values(Therapist.objects.all())
+            ),
+            "messages": MessageSerializer(
+                Message.objects.select_related("sender", "receiver"), many=True
+            ).data,
+        }
+        candidates = {"json": JSONRenderer(), "orjson": ORJSONRenderer()}
+        if msgpack:
+            candidates["msgpack"] = MessagePackRenderer()
+
+        print(f"\n  seed size {RENDER_BENCH_ROWS}")
+        for name, data in payloads.items():
+            line = f"  {name:<22} {len(data):6} rows"
+            for label, renderer in candidates.items():
+                elapsed = float("inf")
+                for _ in range(5):
+                    started = time.perf_counter()
+                    body = renderer.render(data)
+                    elapsed = min(elapsed, time.perf_counter() - started)
+                line += f"  {label} {elapsed * 1000:7.2f} ms {len(body):9} B"
+            print(line)
+
+
+class MoodTrendTests(TestCase):
+    START = date(2026, 1, 5)
+
+    @classmethod
+    def setUpTestData(cls):
+        therapist_user = CustomUser.objects.create(
+            username="therapist", email="therapist@example.com", role="therapist"
+        )
+        therapist = Therapist.objects.create(
+            user=therapist_user, specialty="Anxiety", experience=5, price=50
+        )
+        cls.therapist_user = therapist_user
+        cls.clients = [
+            CustomUser.objects.create(username=f"client{i}", email=f"client{i}@example.com")
+            for i in range(2)
+        ]
+        cls.outsider = CustomUser.objects.create(
+            username="outsider", email="outsider@example.com"
+        )
+        for client in cls.clients:
+            Appointment.objects.create(
+                user=client, therapist=therapist, date="2026-01-05", time="10:00"
+            )
+        # Irregular days and moods over about two months
+        cls.entries = {}
+        for n, user in enumerate([*cls.clients, cls.outsider]):
+            days = [day for day in range(60) if (day * (n + 3)) % 7 != 1]
+            cls.entries[user.id] = [
+                (cls.START + timedelta(days=day), (day * 7 + n * 3) % 10 + 1)
+                for day in days
+            ]
+            UserProgress.objects.bulk_create(
+                UserProgress(user=user, date=day, mood_rating=mood)
+                for day, mood in cls.entries[user.id]
+            )
+        MoodBucket.rebuild()
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def trends(self, user, **params):
+        self.client.force_authenticate(user)
+        params.setdefault("start_date", self.START.isoformat())
+        params.setdefault("end_date", (self.START + timedelta(days=59)).isoformat())
+        return self.client.get("/api/user-progress/trends/", params)
+
+    def expected(self, entries, bucket_start, bucket_days, window):
+        moods = [mood for _, mood in entries]
+        x = [(day - self.START).days for day, _ in entries]
+        buckets = {}
+        for day, mood in entries:
+            buckets.setdefault(bucket_start(day), []).append((day, mood))
+        return {
+            "entries": len(moods),
+            "average": round(statistics.mean(moods), 2),
+            "min": min(moods),
+            "max": max(moods),
+            "slope": round(statistics.linear_regression(x, moods).slope, 4),
+            "buckets": [
+                {
+                    "start": start.isoformat(),
+                    "entries": len(rows),
+                    "average": round(statistics.mean(mood for _, mood in rows), 2),
+                    "min": min(mood for _, mood in rows),
+                    "max": max(mood for _, mood in rows),
+                    "rolling_average": round(
+                        statistics.mean(
+                            mood
+                            for day, mood in entries
+                            if 0 <= bucket_days(start, bucket_start(day)) < window
+                        ),
+                        2,
+                    ),
+                }
+                for start, rows in sorted(buckets.items())
+            ],
+        }
+
+    def test_matches_per_row_computation(self):
+        cases = [
+            (
+                "week",
+                4,
+                lambda day: day - timedelta(days=day.weekday()),
+                lambda later, earlier: (later - earlier).days // 7,
+            ),
+            (
+                "month",
+                2,
+                lambda day: day.replace(day=1),
+                lambda later, earlier: (later.year - earlier.year) * 12
+                + later.month
+                - earlier.month,
+            ),
+        ]
+        for bucket, window, bucket_start, bucket_days in cases:
+            with self.subTest(bucket=bucket):
+                response = self.trends(self.clients[0], bucket=bucket, window=window)
+                self.assertEqual(response.status_code, 200)
+                data = json.loads(response.content)
+                self.assertEqual((data["bucket"], data["window"]), (bucket, window))
+                [user] = data["users"]
+                expected = self.expected(
+                    self.entries[self.clients[0].id], bucket_start, bucket_days, window
+                )
+                self.assertEqual(user, {"user": self.clients[0].id, **expected})
+
+    def test_buckets_follow_progress_writes(self):
+        def stored():
+            return list(
+                MoodBucket.objects.order_by("user", "kind", "start").values_list(
+                    "user", "kind", "start", "entries", "low", "high",
+                    "mood_sum", "day_sum", "day_mood_sum", "day_square_sum",
+                )
+            )
+
+        entry = UserProgress.objects.create(
+            user=self.outsider, date=self.START + timedelta(days=1), mood_rating=10
+        )
+        entry.mood_rating = 1
+        entry.save()
+        # Into another week, month and year, then to another user
+        moved = UserProgress.objects.filter(user=self.clients[0]).earliest("date")
+        moved.date = date(2025, 12, 31)
+        moved.save()
+        moved.user = self.clients[1]
+        moved.save()
+        UserProgress.objects.filter(user=self.clients[1]).latest("date").delete()
+        # A bucket whose only entry goes away is dropped
+        UserProgress.objects.create(user=self.outsider, date="2020-06-01", mood_rating=5)
+        UserProgress.objects.get(user=self.outsider, date="2020-06-01").delete()
+
+        maintained = stored()
+        self.assertEqual(MoodBucket.rebuild(), len(maintained))
+        self.assertEqual(stored(), maintained)
+
+    def test_therapist_gets_all_clients_in_one_query(self):
+        self.client.force_authenticate(self.therapist_user)
+        with self.assertNumQueries(1):
+            response = self.trends(self.therapist_user)
+        users = [user["user"] for user in response.data["users"]]
+        self.assertEqual(users, [client.id for client in self.clients])
+
+        response = self.trends(self.therapist_user, user_id=self.clients[1].id)
+        self.assertEqual([user["user"] for user in response.data["users"]], [self.clients[1].id])
+
+    def test_date_range(self):
+        end = self.START + timedelta(days=6)
+        response = self.trends(self.outsider, end_date=end.isoformat())
+        [user] = response.data["users"]
+        in_range = [entry for entry in self.entries[self.outsider.id] if entry[0] <= end]
+        self.assertEqual(user["entries"], len(in_range))
+        self.assertEqual(len(user["buckets"]), 1)
+
+        response = self.trends(self.outsider, start_date="2020-01-01", end_date="2020-02-01")
+        self.assertEqual(response.data["users"], [])
+
+    def test_bad_parameters(self):
+        for params in (
+            {"bucket": "year"},
+            {"window": "0"},
+            {"window": "53"},
+            {"window": "soon"},
+            {"start_date": "2026-13-01"},
+            {"start_date": "2026-02-01", "end_date": "2026-01-01"},
+        ):
+            with self.subTest(params=params):
+                response = self.trends(self.outsider, **params)
+                self.assertEqual(response.status_code, 400)
+                self.assertIn("error", response.data)
+
+    @unittest.skipUnless(TREND_BENCH_CLIENTS, "set API_BENCH_TREND_CLIENTS")
+    def test_three_years_of_clients(self):
+        therapist = Therapist.objects.get(user=self.therapist_user)
+        clients = CustomUser.objects.bulk_create(
+            CustomUser(username=f"bench{i}", email=f"bench{i}@example.com")
+            for i in range(TREND_BENCH_CLIENTS)
+        )
+        Appointment.objects.bulk_create(
+            Appointment(user=client, therapist=therapist, date="2026-01-05", time="11:00")
+            for client in clients
+        )
+        TherapistClient.rebuild([therapist.id])
+        end = timezone.localdate()
+        UserProgress.objects.bulk_create(
+            (
+                UserProgress(
+                    user=client,
+                    date=end - timedelta(days=day),
+                    mood_rating=(day + n) % 10 + 1,
+                )
+                for n, client in enumerate(clients)
+                for day in range(3 * 365)
+            ),
+            batch_size=5000,
+        )
+        MoodBucket.rebuild()
+        params = {
+            "start_date": (end - timedelta(days=3 * 365)).isoformat(),
+            "end_date": end.isoformat(),
+        }
+        for bucket in ("week", "month"):
+            best = float("inf")
+            for _ in range(5):
+                started = time.perf_counter()
+                response = self.trends(self.therapist_user, bucket=bucket, **params)
+                best = min(best, time.perf_counter() - started)
+            self.assertEqual(len(response.data["users"]), TREND_BENCH_CLIENTS + 2)
+            print(
+                f"\n  {TREND_BENCH_CLIENTS} clients x 3 years daily, {bucket} buckets: "
+                f"{best * 1000:.1f} ms"
+            )
+
+
+class TherapistClientTests(TestCase):
+    def setUp(self):
+        self.therapist_users = [
+            CustomUser.objects.create(
+                username=f"therapist{i}", email=f"therapist{i}@example.com", role="therapist"
+            )
+            for i in range(2)
+        ]
+        self.therapists = [
+            Therapist.objects.create(user=user, specialty="Anxiety", experience=5, price=50)
+            for user in self.therapist_users
+        ]
+        self.users = [
+            CustomUser.objects.create(username=f"user{i}", email=f"user{i}@example.com")
+            for i in range(3)
+        ]
+        self.client = APIClient()
+
+    def book(self, user, day, therapist=None, status="Confirmed"):
+        return Appointment.objects.create(
+            user=user,
+            therapist=therapist or self.therapists[0],
+            date=day,
+            time="10:00",
+            status=status,
+        )
+
+    def links(self):
+        return {
+            (link.therapist_id, link.user_id): (
+                link.appointments_count,
+                link.first_session_at and timezone.localdate(link.first_session_at),
+                link.last_session_at and timezone.localdate(link.last_session_at),
+            )
+            for link in TherapistClient.objects.all()
+        }
+
+    def test_maintained_from_appointment_writes(self):
+        therapist = self.therapists[0].id
+        user = self.users[0]
+        first = self.book(user, "2026-03-02")
+        later = self.book(user, "2026-03-16")
+        self.assertEqual(
+            self.links(),
+            {(therapist, user.id): (2, date(2026, 3, 2), date(2026, 3, 16))},
+        )
+
+        # Cancelled appointments keep the client but are not sessions
+        later.status = "Cancelled"
+        later.save()
+        self.assertEqual(
+            self.links(),
+            {(therapist, user.id): (2, date(2026, 3, 2), date(2026, 3, 2))},
+        )
+
+        moved = Appointment.objects.get(pk=first.pk)
+        moved.user = self.users[1]
+        moved.save()
+        self.assertEqual(
+            self.links(),
+            {
+                (therapist, user.id): (1, None, None),
+                (therapist, self.users[1].id): (1, date(2026, 3, 2), date(2026, 3, 2)),
+            },
+        )
+
+        later.delete()
+        self.assertEqual(
+            self.links(),
+            {(therapist, self.users[1].id): (1, date(2026, 3, 2), date(2026, 3, 2))},
+        )
+
+    def test_rebuild_matches_signals(self):
+        self.book(self.users[0], "2026-03-02")
+        self.book(self.users[0], "2026-03-09", status="Cancelled")
+        self.book(self.users[1], "2026-03-04", therapist=self.therapists[1])
+        maintained = self.links()
+
+        TherapistClient.objects.all().delete()
+        self.assertEqual(TherapistClient.rebuild(), 2)
+        self.assertEqual(self.links(), maintained)
+
+    def test_progress_and_appointment_access_follow_the_table(self):
+        self.book(self.users[0], "2026-03-02")
+        self.book(self.users[1], "2026-03-02", therapist=self.therapists[1])
+        for user in self.users:
+            UserProgress.objects.create(user=user, date=date(2026, 3, 3), mood_rating=5)
+        self.client.force_authenticate(self.therapist_users[0])
+
+        with self.assertNumQueries(1):
+            response = self.client.get("/api/user-progress/")
+        self.assertEqual(
+            [row["user"] for row in response.data["results"]], [self.users[0].id]
+        )
+
+        response = self.client.get("/api/appointments/", {"user_id": self.users[0].id})
+        self.assertEqual(len(response.data["results"]), 1)
+        # Not a client: nothing to show rather than the unfiltered list
+        response = self.client.get("/api/appointments/", {"user_id": self.users[1].id})
+        self.assertEqual(response.data["results"], [])
+
+    def test_my_clients(self):
+        self.book(self.users[0], "2026-03-02")
+        self.book(self.users[1], "2026-03-09")
+        self.book(self.users[2], "2026-03-16", status="Cancelled")
+        self.book(self.users[2], "2026-03-01", therapist=self.therapists[1])
+
+        self.client.force_authenticate(self.therapist_users[0])
+        response = self.client.get("/api/therapists/clients/")
+        self.assertEqual(response.status_code, 200)
+        rows = response.data["results"]
+        self.assertEqual(
+            [row["user"]["id"] for row in rows],
+            [self.users[1].id, self.users[0].id, self.users[2].id],
+        )
+        self.assertEqual(rows[0]["appointments_count"], 1)
+        self.assertIsNone(rows[2]["last_session_at"])
+
+        self.client.force_authenticate(self.users[0])
+        response = self.client.get("/api/therapists/clients/")
+        self.assertEqual(response.status_code, 403)
+
+
+class SlotEngineTests(TestCase):
+    def setUp(self):
+        slot_index.invalidate()
+        self.client_user = CustomUser.objects.create(
+            username="client", email="client@example.com"
+        )
+        self.therapists = {}
+        for name, times in (
+            ("morning", ["10:00", "10:30", "11:00", "12:00"]),
+            ("ten", ["10:00"]),
+            ("none", []),
+        ):
+            user = CustomUser.objects.create(
+                username=name, email=f"{name}@example.com", role="therapist"
+            )
+            therapist = self.therapists[name] = Therapist.objects.create(
+                user=user, specialty="Anxiety", price=80, experience=5
+            )
+            for clock in times:
+                Schedule.objects.create(therapist=therapist, day="Monday", time=clock)
+        # Always a whole week ahead, so no slot is in the past
+        self.monday = slots.week_start(timezone.localdate()) + timedelta(days=7)
+
+    def book(self, therapist, day, clock, duration=60, status="Pending"):
+        return Appointment.objects.create(
+            user=self.client_user,
+            therapist=therapist,
+            date=day.isoformat(),
+            time=clock,
+            duration=duration,
+            status=status,
+        )
+
+    def starts(self, name, day=None, duration=60):
+        day = day or self.monday
+        therapist_id = self.therapists[name].id
+        found = slot_index.bookable_slots([therapist_id], day, day, duration)[therapist_id]
+        counts = slot_index.free_slot_counts([therapist_id], day, day, duration)
+        self.assertEqual(counts[therapist_id], len(found))
+        return [timezone.localtime(start).strftime("%H:%M") for start in found]
+
+    def free_at(self, day, clock, duration=60):
+        at = timezone.make_aware(
+            datetime.combine(day, datetime.strptime(clock, "%H:%M").time())
+        )
+        names = {therapist.id: name for name, therapist in self.therapists.items()}
+        return sorted(names[therapist_id] for therapist_id in slot_index.free_therapists(at, duration))
+
+    def test_bookings_block_every_overlapping_start(self):
+        self.assertEqual(self.starts("morning"), ["10:00", "10:30", "11:00", "12:00"])
+
+        # 10:30-11:30 blocks the hour-long sessions at 10:00, 10:30 and 11:00
+        appointment = self.book(self.therapists["morning"], self.monday, "10:30")
+        self.assertEqual(self.starts("morning"), ["12:00"])
+        # but a half-hour session still fits before it
+        self.assertEqual(self.starts("morning", duration=30), ["10:00", "12:00"])
+        # and the other days of the week stay empty
+        self.assertEqual(self.starts("morning", day=self.monday + timedelta(days=1)), [])
+
+        appointment.status = "Cancelled"
+        appointment.save()
+        self.assertEqual(self.starts("morning"), ["10:00", "10:30", "11:00", "12:00"])
+
+    def test_cancelled_appointments_keep_their_slots(self):
+        self.book(self.therapists["morning"], self.monday, "12:00", status="Cancelled")
+        self.book(self.therapists["morning"], self.monday, "11:00", status="Completed")
+        self.assertEqual(self.starts("morning"), ["10:00", "12:00"])
+        self.assertEqual(self.starts("morning", duration=90), ["12:00"])
+
+    def test_bookings_invalidate_again_on_commit(self):
+        self.assertEqual(self.starts("ten"), ["10:00"])
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.book(self.therapists["ten"], self.monday, "10:00")
+            self.assertEqual(self.starts("ten"), [])
+            # A request in another process reloads before the booking commits
+            stale = slots.TherapistSlots()
+            stale.add_slot("Monday", "10:00")
+            slot_index._directory.replace(self.therapists["ten"].id, stale)
+        self.assertEqual(self.starts("ten"), ["10:00"])
+        for callback in callbacks:
+            callback()
+        self.assertEqual(self.starts("ten"), [])
+
+    def test_sessions_wrap_from_sunday_into_monday(self):
+        therapist = self.therapists["none"]
+        sunday = self.monday + timedelta(days=6)
+        Schedule.objects.create(therapist=therapist, day="Sunday", time="23:30")
+        self.assertEqual(self.starts("none", day=sunday), ["23:30"])
+
+        # A booking at midnight the next week cuts the late Sunday hour short
+        self.book(therapist, sunday + timedelta(days=1), "00:00", duration=30)
+        self.assertEqual(self.starts("none", day=sunday), [])
+        self.assertEqual(self.starts("none", day=sunday, duration=30), ["23:30"])
+        self.assertEqual(self.free_at(sunday, "23:30"), [])
+        self.assertEqual(self.free_at(sunday, "23:30", duration=30), ["none"])
+
+        # A booking running past midnight on Sunday occupies the next Monday
+        week = slots.week_start(sunday)
+        late = slots.TherapistSlots()
+        late.add_slot("Monday", "00:00")
+        late.add_slot("Monday", "00:30")
+        late.add_appointment(datetime.combine(sunday, datetime.min.time().replace(hour=23, minute=30)), 60)
+        self.assertEqual(late.free_mask(week + timedelta(days=7), 6), 1 << 6)
+
+    def test_free_therapists_are_exactly_those_with_an_open_slot(self):
+        self.assertEqual(self.free_at(self.monday, "10:00"), ["morning", "ten"])
+        self.assertEqual(self.free_at(self.monday, "12:00"), ["morning"])
+        self.assertEqual(self.free_at(self.monday, "10:05"), [])
+        self.assertEqual(self.free_at(self.monday + timedelta(days=1), "10:00"), [])
+
+        self.book(self.therapists["ten"], self.monday, "10:00")
+        self.assertEqual(self.free_at(self.monday, "10:00"), ["morning"])
+        # A booking that starts later still has to fit after the session
+        self.book(self.therapists["morning"], self.monday, "10:45", duration=15)
+        self.assertEqual(self.free_at(self.monday, "10:00"), [])
+        self.assertEqual(self.free_at(self.monday, "10:00", duration=45), ["morning"])
+
+        # A therapist added after the index was built is picked up too
+        Schedule.objects.create(therapist=self.therapists["none"], day="Monday", time="10:00")
+        self.assertEqual(self.free_at(self.monday, "10:00"), ["none"])
+
+    def test_malformed_schedule_rows_are_skipped(self):
+        therapist = self.therapists["none"]
+        Schedule.objects.create(therapist=therapist, day="Monday", time="noon")
+        Schedule.objects.create(therapist=therapist, day="Monday", time="25:00")
+        Schedule.objects.create(therapist=therapist, day="Someday", time="10:00")
+        Schedule.objects.create(therapist=therapist, day="Monday", time="09:00")
+
+        slot_index.invalidate()
+        with self.assertLogs("api.slots", "WARNING") as logs:
+            self.assertEqual(self.starts("morning"), ["10:00", "10:30", "11:00", "12:00"])
+        self.assertEqual(len(logs.output), 3)
+        self.assertEqual(self.starts("none"), ["09:00"])
+
+    def test_free_endpoint_validates_its_params(self):
+        api = APIClient()
+        at = f"{self.monday.isoformat()}T10:00"
+        response = api.get("/api/therapists/free/", {"at": at, "duration": "-5"})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()["error"], "duration must be positive")
+        response = api.get("/api/therapists/free/", {"at": at, "duration": "soon"})
+        self.assertEqual(response.status_code, 400)
+
+        past = f"{(self.monday - timedelta(days=14)).isoformat()}T10:00"
+        response = api.get("/api/therapists/free/", {"at": past})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()["error"], "at must not be in the past")
+
+        response = api.get("/api/therapists/free/", {"at": at})
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        results = data["results"] if isinstance(data, dict) else data
+        self.assertEqual(
+            [therapist["id"] for therapist in results],
+            sorted([self.therapists["morning"].id, self.therapists["ten"].id]),
+        )
+
+
+class TherapistMatchTests(TestCase):
+    def setUp(self):
+        slot_index.invalidate()
+        match_index.invalidate()
+        self.therapists = {}
+        for name, languages, specializations, price, rating, experience in (
+            ("bilingual", ["English", "French"], ["CBT"], 60, "4.50", 10),
+            ("english", ["English"], ["CBT", "Grief"], 120, "4.90", 25),
+            ("spanish", ["Spanish"], ["Family"], 40, "3.00", 2),
+            ("budget", ["English"], [], 30, "4.00", 5),
+        ):
+            user = CustomUser.objects.create(
+                username=name, email=f"{name}@example.com", role="therapist"
+            )
+            self.therapists[name] = Therapist.objects.create(
+                user=user,
+                specialty="Anxiety",
+                languages=languages,
+                specializations=specializations,
+                price=price,
+                rating=Decimal(rating),
+                experience=experience,
+            )
+        self.client = APIClient()
+        self.client.force_authenticate(user)
+
+    def ranking(self, **preferences):
+        names = {therapist.id: name for name, therapist in self.therapists.items()}
+        return [
+            (names[therapist_id], score)
+            for therapist_id, score in match_index.top(**preferences)
+        ]
+
+    def test_scores_and_order(self):
+        ranking = self.ranking(
+            languages=["english", "spanish"], specializations=["cbt"], max_price=80
+        )
+        # bilingual: (3 * 1/2 + 3 + 2 + 2 * 0.9 + 10 / 20) / 12
+        self.assertEqual(ranking[0], ("bilingual", round(8.8 / 12, 4)))
+        self.assertEqual([name for name, _ in ranking], ["bilingual", "english", "budget", "spanish"])
+
+        # Without preferences only rating, experience and free slots count
+        self.assertEqual(self.ranking(limit=1), [("english", round((2 * 0.98 + 1) / 4, 4))])
+        # The specialty is one of the specializations; terms ignore case
+        self.assertEqual(
+            [name for name, _ in self.ranking(specializations=["ANXIETY"], limit=2)],
+            ["english", "bilingual"],
+        )
+
+    def test_match_endpoint(self):
+        response = self.client.get(
+            "/api/therapists/match/",
+            {"languages": "English,French", "max_price": "50", "limit": "2"},
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [row["therapist"]["id"] for row in response.data],
+            [self.therapists["bilingual"].id, self.therapists["budget"].id],
+        )
+        self.assertEqual(
+            response.data[0]["therapist"],
+            TherapistSerializer(self.therapists["bilingual"]).data,
+        )
+
+        for params in ({"max_price": "free"}, {"max_price": "-5"}, {"limit": "0"}, {"limit": "x"}):
+            with self.subTest(params=params):
+                response = self.client.get("/api/therapists/match/", params)
+                self.assertEqual(response.status_code, 400)
+                self.assertIn("error", response.data)
+
+    def test_changes_invalidate_again_on_commit(self):
+        spanish = self.therapists["spanish"]
+        self.assertEqual(self.ranking(languages=["spanish"], limit=1)[0][0], "spanish")
+        before_commit = match_index._load([spanish.id])
+        with self.captureOnCommitCallbacks() as callbacks:
+            spanish.availability = False
+            spanish.save()
+            self.assertNotEqual(self.ranking(languages=["spanish"], limit=1)[0][0], "spanish")
+            # A request in another process reloads before the change commits
+            match_index._matrix.replace(before_commit)
+        self.assertEqual(self.ranking(languages=["spanish"], limit=1)[0][0], "spanish")
+        for callback in callbacks:
+            callback()
+        self.assertNotEqual(self.ranking(languages=["spanish"], limit=1)[0][0], "spanish")
+
+    def test_rows_refresh_when_therapists_and_reviews_change(self):
+        self.assertEqual(self.ranking(languages=["spanish"], limit=1)[0][0], "spanish")
+
+        spanish = self.therapists["spanish"]
+        spanish.availability = False
+        spanish.save()
+        budget = self.therapists["budget"]
+        budget.languages = ["Spanish"]
+        budget.save()
+        self.assertEqual(
+            [name for name, _ in self.ranking(languages=["spanish"])],
+            ["budget", "english", "bilingual"],
+        )
+
+        user = CustomUser.objects.create(
+            username="portuguese", email="portuguese@example.com", role="therapist"
+        )
+        newcomer = Therapist.objects.create(
+            user=user, specialty="Anxiety", languages=["Portuguese"], price=50, experience=1
+        )
+        self.therapists["portuguese"] = newcomer
+        Review.objects.create(
+            user=self.therapists["english"].user,
+            therapist=newcomer,
+            rating=5,
+            comment="Great",
+            date=timezone.localdate(),
+        )
+        ranking = self.ranking(languages=["portuguese"], limit=1)
+        self.assertEqual(ranking, [("portuguese", round((3 + 2 + 1 / 20) / 7, 4))])
+
+        # Free slots in the next two weeks count once a schedule is written
+        Schedule.objects.create(therapist=newcomer, day="Monday", time="10:00")
+        Schedule.objects.create(therapist=newcomer, day="Tuesday", time="10:00")
+        free = slot_index.free_slot_counts(
+            [newcomer.id],
+            timezone.localdate(),
+            timezone.localdate() + timedelta(days=matching.MATCH_SLOT_DAYS - 1),
+        )[newcomer.id]
+        self.assertGreater(free, 0)
+        ranking = self.ranking(languages=["portuguese"], limit=1)
+        self.assertEqual(ranking, [("portuguese", round((3 + 2 + 1 / 20 + min(free, 20) / 20) / 7, 4))])
+
+    @unittest.skipUnless(matching.np, "NumPy is not installed")
+    def test_vectorized_scores_match_row_scores(self):
+        import random
+
+        generator = random.Random(7)
+        words = [f"term{i}" for i in range(30)]
+        rows = {
+            therapist_id: Features(
+                generator.sample(words, 3),
+                generator.sample(words, 4),
+                generator.randrange(20, 200),
+                generator.choice([3.5, 4.0, 4.5, 5.0]),
+                generator.randrange(0, 30),
+                generator.randrange(0, 40),
+            )
+            for therapist_id in range(1, 2001)
+        }
+        vectorized = FeatureMatrix(rows)
+        with mock.patch.object(matching, "np", None):
+            row_by_row = FeatureMatrix(rows)
+        # Incremental updates land in the same rows the full build writes
+        vectorized.replace({5: None, 2001: Features(["term1"], ["new"], 50, 5, 20, 20)})
+        row_by_row.rows.pop(5)
+        row_by_row.rows[2001] = Features(["term1"], ["new"], 50, 5, 20, 20)
+
+        for preferences in (
+            {},
+            {"languages": ["term1", "term2"], "max_price": 90},
+            {"specializations": ["term3", "new", "unknown"]},
+        ):
+            with self.subTest(preferences=preferences):
+                with mock.patch.object(matching, "np", None):
+                    expected = row_by_row.top(25, **preferences)
+                self.assertEqual(vectorized.top(25, **preferences), expected)
+
+    @unittest.skipUnless(
+        MATCH_BENCH_THERAPISTS and matching.np, "set API_BENCH_MATCH_THERAPISTS, needs NumPy"
+    )
+    def test_scoring_time(self):
+        import random
+
+        generator = random.Random(7)
+        languages = [f"language{i}" for i in range(40)]
+        specializations = [f"specialization{i}" for i in range(120)]
+        started = time.perf_counter()
+        matrix = FeatureMatrix(
+            {
+                therapist_id: Features(
+                    generator.sample(languages, 2),
+                    generator.sample(specializations, 5),
+                    generator.randrange(20, 300),
+                    generator.uniform(1, 5),
+                    generator.randrange(0, 40),
+                    generator.randrange(0, 60),
+                )
+                for therapist_id in range(1, MATCH_BENCH_THERAPISTS + 1)
+            }
+        )
+        built = time.perf_counter() - started
+        preferences = {
+            "languages": languages[:2],
+            "specializations": specializations[:3],
+            "max_price": 120,
+        }
+        best = float("inf")
+        for _ in range(20):
+            started = time.perf_counter()
+            matrix.top(10, **preferences)
+            best = min(best, time.perf_counter() - started)
+        started = time.perf_counter()
+        matrix.replace({1: Features(["language1"], [], 80, 4, 10, 5)})
+        refreshed = time.perf_counter() - started
+        print(
+            f"\n  {MATCH_BENCH_THERAPISTS} therapists: build {built * 1000:.0f} ms, "
+            f"top 10 {best * 1000:.2f} ms, one-row refresh {refreshed * 1000:.2f} ms"
+        )
+
+
+def server_timing(response):
+    """The Server-Timing header as {name: (milliseconds, description)}"""
+    metrics = {}
+    for metric in response["Server-Timing"].split(", "):
+        name, *params = metric.split(";")
+        values = dict(param.split("=", 1) for param in params)
+        metrics[name] = (float(values["dur"]), values.get("desc", "").strip('"'))
+    return metrics
+
+
+class ProfilingTests(TestCase):
+    def setUp(self):
+        perf_registry.reset()
+        self.admin = CustomUser.objects.create(
+            username="admin", email="admin@example.com", role="admin", is_staff=True
+        )
+        self.user = CustomUser.objects.create(username="user", email="user@example.com")
+        Message.objects.bulk_create(
+            Message(
+                sender=self.admin,
+                receiver=self.user,
+                message=f"Hello {i}",
+                timestamp=timezone.now(),
+            )
+            for i in range(3)
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_server_timing_header(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get("/api/messages/")
+        self.assertEqual(response.status_code, 200)
+        timing = server_timing(response)
+
+        self.assertEqual(set(timing), {"db", "serialize", "render", "total"})
+        self.assertEqual(timing["db"][1], f"{len(queries)} queries")
+        self.assertGreater(timing["serialize"][0], 0)
+        self.assertGreater(timing["render"][0], 0)
+        phases = timing["db"][0] + timing["serialize"][0] + timing["render"][0]
+        self.assertLessEqual(phases, timing["total"][0] + 0.05)
+
+    def test_route_histograms_for_admins(self):
+        for _ in range(5):
+            response = self.client.get("/api/messages/")
+        query_count = int(server_timing(response)["db"][1].split()[0])
+        self.client.get("/api/notifications/")
+
+        response = self.client.get("/api/_perf/")
+        self.assertEqual(response.status_code, 403)
+
+        self.client.force_authenticate(self.admin)
+        response = self.client.get("/api/_perf/")
+        self.assertEqual(response.status_code, 200)
+        routes = response.data["routes"]
+        self.assertEqual(routes["GET notification-list"]["requests"], 1)
+        messages = routes["GET message-list"]
+        self.assertEqual(messages["requests"], 5)
+        self.assertEqual(messages["queries"]["p50"], query_count)
+        latency = messages["latency_ms"]
+        self.assertLessEqual(latency["p50"], latency["p95"])
+        self.assertLessEqual(latency["p95"], latency["p99"])
+        self.assertLessEqual(latency["p99"], latency["max"])
+        self.assertEqual(set(messages["mean_phase_ms"]), {"db", "serialize", "render"})
+
+        self.assertEqual(self.client.delete("/api/_perf/").status_code, 204)
+        routes = self.client.get("/api/_perf/").data["routes"]
+        self.assertNotIn("GET message-list", routes)
+
+    def test_sampling(self):
+        with override_settings(PROFILING_SAMPLE_RATE=0):
+            response = self.client.get("/api/messages/")
+        self.assertNotIn("Server-Timing", response)
+        with override_settings(PROFILING_SAMPLE_RATE=0.25):
+            with mock.patch("api.profiling.random.random", return_value=0.5):
+                self.assertNotIn("Server-Timing", self.client.get("/api/messages/"))
+            with mock.patch("api.profiling.random.random", return_value=0.1):
+                self.assertIn("Server-Timing", self.client.get("/api/messages/"))
+        with override_settings(PROFILING_SERVER_TIMING=False):
+            self.assertNotIn("Server-Timing", self.client.get("/api/messages/"))
+        self.assertEqual(perf_registry.snapshot()["routes"]["GET message-list"]["requests"], 2)
+
+    def test_serializers_untouched_while_profiling_is_off(self):
+        def timed():
+            return hasattr(serializers.Serializer.__dict__["data"].fget, "original")
+
+        self.assertTrue(timed())
+        with override_settings(PROFILING_ENABLED=False):
+            self.assertFalse(timed())
+            self.assertFalse(hasattr(serializers.ListSerializer.data.fget, "original"))
+            self.assertEqual(self.client.get("/api/messages/").status_code, 200)
+        with override_settings(PROFILING_SAMPLE_RATE=0):
+            self.assertFalse(timed())
+        self.assertTrue(timed())
+
+    def test_histogram_percentiles(self):
+        latency = Histogram(LATENCY_BOUNDS_MS)
+        for value in range(1, 1001):
+            latency.add(value)
+        summary = latency.summary()
+        for percent, exact in ((50, 500), (95, 950), (99, 990)):
+            self.assertAlmostEqual(summary[f"p{percent}"], exact, delta=exact * 0.1)
+        self.assertEqual((summary["max"], summary["mean"]), (1000, 500.5))
+
+        queries = Histogram(QUERY_BOUNDS)
+        for value in [2] * 90 + [7] * 9 + [2000]:
+            queries.add(value)
+        self.assertEqual(queries.summary(), {"p50": 2, "p95": 7, "p99": 7, "mean": 22.43, "max": 2000})
+
+
+class ProfilingASGITests(TransactionTestCase):
+    def test_queries_in_worker_threads_are_counted(self):
+        response_cache.cache.clear()
+        Resource.objects.create(
+            title="Resource",
+            author="Author",
+            description="Description",
+            category="Category",
+            url="https://example.com/resource",
+        )
+
+        async def scenario():
+            return await asgi_request(ASGIHandler(), "GET", "/api/resources/")
+
+        status, headers, _ = async_to_sync(scenario)()
+        self.assertEqual(status, 200)
+        timing = server_timing(headers)
+        self.assertNotEqual(timing["db"][1], "0 queries")
+        self.assertGreater(timing["db"][0], 0)
+
+
+class SeedCommandTests(TestCase):
+    ANCHOR = "2026-03-02"
+
+    def seed(self, *args):
+        out = io.StringIO()
+        call_command(
+            "seed", "--anchor-date", self.ANCHOR, "--processes", "1", *args, stdout=out
+        )
+        return out.getvalue()
+
+    def snapshot(self):
+        tables = {}
+        for model in transfer.ordered_models():
+            names = [field.attname for field in transfer.data_fields(model)]
+            # Rebuilt with new keys each time
+            order = {
+                TherapistClient: ("therapist", "user"),
+                MoodBucket: ("user", "kind", "start"),
+            }.get(model, ("pk",))
+            tables[model._meta.label] = list(
+                model.objects.order_by(*order).values_list(*names)
+            )
+        return tables
+
+    def clear(self):
+        # Plain DELETEs: the per-row delete signals would dominate the test
+        with connection.cursor() as cursor:
+            for model in reversed(transfer.ordered_models()):
+                cursor.execute(f"DELETE FROM {connection.ops.quote_name(model._meta.db_table)}")
+
+    def test_same_seed_same_rows_with_any_process_count(self):
+        output = self.seed("--seed", "7")
+        self.assertIn("Seeded", output)
+        first = self.snapshot()
+        for model in transfer.ordered_models():
+            self.assertTrue(first[model._meta.label], model._meta.label)
+
+        self.clear()
+        self.seed("--seed", "7", "--processes", "2")
+        self.assertEqual(self.snapshot(), first)
+
+        self.clear()
+        self.seed("--seed", "8")
+        self.assertNotEqual(self.snapshot()["api.Message"], first["api.Message"])
+
+    def test_rows_are_consistent(self):
+        self.seed("--scale", "2")
+        self.assertEqual(CustomUser.objects.filter(role="user").count(), 400)
+        self.assertEqual(Therapist.objects.count(), 20)
+
+        for appointment in Appointment.objects.all()[:50]:
+            start_at = Appointment.resolve_start(
+                appointment.date, appointment.time, date.today()
+            )
+            self.assertEqual(appointment.start_at, start_at)
+        self.assertFalse(
+            Payment.objects.exclude(amount=F("appointment__therapist__price")).exists()
+        )
+        pairs = Appointment.objects.values("therapist", "user").distinct().count()
+        self.assertEqual(TherapistClient.objects.count(), pairs)
+        self.assertEqual(
+            sum(Therapist.objects.values_list("reviews_count", flat=True)),
+            Review.objects.count(),
+        )
+        for event in Event.objects.annotate(registrations_total=Count("registrations")):
+            self.assertEqual(event.registered_count, event.registrations_total)
+            self.assertLessEqual(event.registered_count, event.capacity)
+
+        stored = {
+            (c.user_a_id, c.user_b_id): (c.last_message_id, c.unread_a, c.unread_b)
+            for c in Conversation.objects.all()
+        }
+        self.assertTrue(stored)
+        for user_a_id, user_b_id in stored:
+            Conversation.rebuild(user_a_id, user_b_id)
+        rebuilt = {
+            (c.user_a_id, c.user_b_id): (c.last_message_id, c.unread_a, c.unread_b)
+            for c in Conversation.objects.all()
+        }
+        self.assertEqual(rebuilt, stored)
+
+        self.assertFalse(
+            UserProgress.objects.values("user", "date")
+            .annotate(entries=Count("id"))
+            .filter(entries__gt=1)
+            .exists()
+        )
+        client = CustomUser.objects.get(username="seed0-user0")
+        self.assertTrue(client.check_password("password"))
+        self.assertTrue(Notification.for_user(client).exists())
+
+    def test_registrations_stay_within_capacity(self):
+        # About 37 sign-ups per event are drawn; every event fills up
+        with mock.patch.object(seeding, "EVENT_CAPACITY", (3, 6)):
+            self.seed("--scale", "3", "--processes", "2")
+        events = Event.objects.annotate(registrations_total=Count("registrations"))
+        self.assertEqual(len(events), 6)
+        for event in events:
+            self.assertLessEqual(event.capacity, 6)
+            self.assertEqual(event.registrations_total, event.capacity)
+            self.assertEqual(event.registered_count, event.capacity)
+
+    def test_refuses_to_load_a_seed_twice(self):
+        self.seed()
+        with self.assertRaisesMessage(CommandError, "Seed 0 is already loaded"):
+            self.seed()
+
+    def test_distributions_keep_their_mean(self):
+        for kind in seeding.Distribution.KINDS:
+            distribution = seeding.Distribution(kind, 2, 15, 5000)
+            rng = random.Random(0)
+            draws = [distribution.draw(rng) for _ in range(50000)]
+            self.assertAlmostEqual(statistics.mean(draws), 15, delta=1.5)
+            self.assertGreaterEqual(min(draws), 2)
+            self.assertLessEqual(max(draws), 5000)
+        with self.assertRaises(seeding.SeedError):
+            seeding.Distribution("powerlaw", 2, 1, 10)
+
+    @unittest.skipUnless(SEED_BENCH_SCALE, "set API_BENCH_SEED_SCALE")
+    def test_seed_rate(self):
+        started = time.perf_counter()
+        self.seed("--scale", str(SEED_BENCH_SCALE))
+        elapsed = time.perf_counter() - started
+        rows = sum(model.objects.count() for model in transfer.ordered_models())
+        print(
+            f"\n  scale {SEED_BENCH_SCALE}: {rows} rows in {elapsed:.1f} s "
+            f"({rows / elapsed:,.0f} rows/s)"
+        )
@@ -0,0 +1,443 @@
+"""
+Streaming export and import of every ``api`` table, behind the
+``export_data`` and ``import_data`` commands.
+
+NDJSON streams hold one row per line in the layout of Django's ``jsonl``
+serializer (``{"model": "api.message", "pk": 1, "fields": {...}}``), with
+foreign keys written as the referenced primary key. CSV exports write one
+``<model>.csv`` per table, a ``pk`` column followed by the fields. Tables are
+written parents first, so a stream can be loaded front to back.
+
+Exports read each table with ``values_list(...).iterator(chunk_size=...)``,
+which uses a server-side cursor where the backend has one, so memory stays
+flat whatever the table size. Imports write rows in batched multi-row
+INSERTs inside one transaction. Rows keep their primary keys unless
+``new_ids`` is set; the database then assigns them and foreign keys are
+resolved through the keys assigned to the referenced rows earlier in the
+stream. Bulk inserts send no signals and skip ``Model.save()``, so the
+tables, columns and caches those maintain are rebuilt once the rows are in;
+the tables that are wholly derived from others are not transferred at all.
+"""
+
+import csv
+import gzip
+import json
+import os
+import sys
+import time
+from datetime import date
+from datetime import time as clock
+
+from django.apps import apps
+from django.core.exceptions import ValidationError
+from django.core.management.color import no_style
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import DEFAULT_DB_ALIAS, connections, models, transaction
+from django.utils import timezone
+
+from . import stats
+from .matching import match_index
+from .models import (
+    Appointment,
+    Conversation,
+    Event,
+    MoodBucket,
+    NotificationWatermark,
+    Notification,
+    StatCounter,
+    Therapist,
+    TherapistClient,
+)
+from .response_cache import response_cache
+from .signals import CACHED_NAMESPACES
+from .slots import slot_index
+
+DEFAULT_CHUNK_SIZE = 2000
+DEFAULT_BATCH_SIZE = 1000
+
+# Integer columns that hold another table's primary key without being a
+# foreign key, remapped like one when the import assigns new keys.
+ID_COLUMNS = {NotificationWatermark: {"last_read_id": Notification}}
+
+# Tables recomputed from the others after every import, so never transferred
+REBUILT = (StatCounter,)
+# Tables the signals derive from other tables' rows. They are written like
+# any other by the seeder, but transfers leave them out and rebuild them.
+DERIVED = (Conversation, TherapistClient, MoodBucket)
+
+csv.field_size_limit(min(sys.maxsize, 2**31 - 1))
+
+
+class TransferError(ValueError):
+    """A row that cannot be imported, with its position in the input"""
+
+
+def ordered_models():
+    """The transferred models, each after every model it references"""
+    pending = [
+        model
+        for model in apps.get_app_config("api").get_models()
+        if model not in REBUILT
+    ]
+    ordered = []
+    while pending:
+        for model in pending:
+            if all(parent in ordered or parent is model for parent in parents(model)):
+                ordered.append(model)
+                pending.remove(model)
+                break
+        else:
+            raise TransferError("Circular references between models")
+    return ordered
+
+
+def transferred_models():
+    """The models exports write and imports read, in ``ordered_models`` order"""
+    return [model for model in ordered_models() if model not in DERIVED]
+
+
+def parents(model):
+    """Models in this app that ``model``'s rows point at"""
+    app_models = set(apps.get_app_config("api").get_models())
+    related = {
+        field.related_model
+        for field in model._meta.concrete_fields
+        if field.is_relation and field.related_model in app_models
+    }
+    related.update(ID_COLUMNS.get(model, {}).values())
+    return related
+
+
+def get_model(name):
+    """Resolve ``api.message``, ``message`` or ``Message``"""
+    label = name if "." in name else f"api.{name}"
+    try:
+        model = apps.get_model(label)
+    except (LookupError, ValueError):
+        model = None
+    if model is None or model._meta.app_label != "api":
+        raise TransferError(f"Unknown model {name!r}")
+    return model
+
+
+def data_fields(model):
+    return [field for field in model._meta.concrete_fields if not field.primary_key]
+
+
+def insert_sql(connection, model, columns):
+    """``INSERT INTO <table> (<columns>)`` and the placeholders of one row"""
+    quote = connection.ops.quote_name
+    insert = "INSERT INTO {} ({})".format(
+        quote(model._meta.db_table), ", ".join(quote(column) for column in columns)
+    )
+    return insert, "({})".format(", ".join(["%s"] * len(columns)))
+
+
+def open_text(path, mode):
+    """Open ``path`` as text, through gzip when it ends in ``.gz``"""
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8", newline="")
+    return open(path, mode, encoding="utf-8", newline="")
+
+
+class ExportEncoder(DjangoJSONEncoder):
+    # DjangoJSONEncoder cuts times to milliseconds; backups keep them exact
+    def default(self, o):
+        if isinstance(o, (date, clock)):
+            return o.isoformat()
+        return super().default(o)
+
+
+class Progress:
+    """Calls ``report(label, rows, seconds)`` every ``every`` rows of a table"""
+
+    def __init__(self, report=None, every=100000):
+        self.report = report
+        self.every = every
+        self.label = None
+
+    def start(self, model):
+        self.label = model._meta.label_lower
+        self.rows = 0
+        self.started = time.perf_counter()
+
+    def advance(self, rows):
+        before = self.rows
+        self.rows += rows
+        if self.report and self.rows // self.every > before // self.every:
+            self.report(self.label, self.rows, time.perf_counter() - self.started)
+
+    def finish(self):
+        if self.report and self.label is not None:
+            self.report(self.label, self.rows, time.perf_counter() - self.started)
+        self.label = None
+
+
+def table_rows(model, chunk_size):
+    """``(pk, values)`` tuples for every row of ``model``, in key order"""
+    names = [field.attname for field in data_fields(model)]
+    queryset = model._default_manager.order_by("pk").values_list("pk", *names)
+    for row in queryset.iterator(chunk_size=chunk_size):
+        yield row[0], row[1:]
+
+
+def export_ndjson(out, models=None, chunk_size=DEFAULT_CHUNK_SIZE, progress=None):
+    """Write the tables to the text stream ``out``; returns rows written"""
+    progress = progress or Progress()
+    encoder = ExportEncoder(separators=(",", ":"), ensure_ascii=False)
+    total = 0
+    for model in models or transferred_models():
+        label = model._meta.label_lower
+        names = [field.name for field in data_fields(model)]
+        progress.start(model)
+        for pk, values in table_rows(model, chunk_size):
+            row = {"model": label, "pk": pk, "fields": dict(zip(names, values))}
+            out.write(encoder.encode(row) + "\n")
+            progress.advance(1)
+        total += progress.rows
+        progress.finish()
+    return total
+
+
+def csv_value(field, value):
+    if value is None:
+        return ""
+    if isinstance(field, models.JSONField):
+        return json.dumps(value, cls=ExportEncoder, ensure_ascii=False)
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    if isinstance(value, (date, clock)):
+        return value.isoformat()
+    return str(value)
+
+
+def export_csv(directory, models=None, chunk_size=DEFAULT_CHUNK_SIZE, progress=None):
+    """Write one ``<model>.csv`` per table into ``directory``; returns rows written"""
+    progress = progress or Progress()
+    os.makedirs(directory, exist_ok=True)
+    total = 0
+    for model in models or transferred_models():
+        fields = data_fields(model)
+        progress.start(model)
+        path = os.path.join(directory, f"{model._meta.model_name}.csv")
+        with open_text(path, "w") as out:
+            writer = csv.writer(out)
+            writer.writerow(["pk", *(field.name for field in fields)])
+            for pk, values in table_rows(model, chunk_size):
+                writer.writerow(
+                    [pk, *(csv_value(field, value) for field, value in zip(fields, values))]
+                )
+                progress.advance(1)
+        total += progress.rows
+        progress.finish()
+    return total
+
+
+def missing_value(field):
+    """Value for a column the input leaves out"""
+    if getattr(field, "auto_now", False) or getattr(field, "auto_now_add", False):
+        return timezone.now()
+    return field.get_default()
+
+
+class Importer:
+    """
+    Collects parsed rows per table and writes them in batches of plain
+    parameterised INSERTs; going through ``bulk_create`` costs more per value
+    than parsing the row does. Values are still converted by each field's
+    ``to_python`` and ``get_db_prep_save``. With ``new_ids`` the keys
+    assigned to rows that later tables reference are remembered, so their
+    foreign keys can be pointed at the new rows; references to rows outside
+    the stream are kept as they are.
+    """
+
+    def __init__(self, batch_size=DEFAULT_BATCH_SIZE, new_ids=False, progress=None):
+        self.connection = connections[DEFAULT_DB_ALIAS]
+        if new_ids and not self.connection.features.can_return_rows_from_bulk_insert:
+            raise TransferError("This database cannot return keys from bulk inserts")
+        self.batch_size = batch_size
+        self.new_ids = new_ids
+        self.progress = progress or Progress()
+        self.model = None
+        self.batch = []
+        self.id_maps = {}
+        self.counts = {}
+        self.columns = {}
+        if new_ids:
+            for model in ordered_models():
+                for parent in parents(model) - {model}:
+                    self.id_maps.setdefault(parent, {})
+
+    def plan(self, model):
+        """Per field: the field, model whose keys it holds, and parser"""
+        if model not in self.columns:
+            id_columns = ID_COLUMNS.get(model, {})
+            columns = []
+            for field in data_fields(model):
+                if field.is_relation:
+                    target, parse = field.related_model, field.target_field.to_python
+                else:
+                    target, parse = id_columns.get(field.attname), field.to_python
+                columns.append((field, target, parse))
+            self.columns[model] = columns
+        return self.columns[model]
+
+    def add(self, model, pk, fields):
+        if model in REBUILT or model in DERIVED:
+            return
+        if model is not self.model:
+            self.flush()
+            self.progress.finish()
+            self.model = model
+            self.progress.start(model)
+        connection = self.connection
+        pk_field = model._meta.pk
+        if pk is not None:
+            pk = pk_field.to_python(pk)
+        row = [] if self.new_ids else [pk_field.get_db_prep_save(pk, connection)]
+        for field, target, parse in self.plan(model):
+            if field.name in fields:
+                value = fields[field.name]
+                if value is not None:
+                    value = parse(value)
+                    if target is not None and target in self.id_maps:
+                        value = self.id_maps[target].get(value, value)
+            else:
+                value = missing_value(field)
+            row.append(field.get_db_prep_save(value, connection))
+        self.batch.append((pk, row))
+        if len(self.batch) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.batch:
+            return
+        model, connection = self.model, self.connection
+        columns = [field.column for field, _, _ in self.plan(model)]
+        if not self.new_ids:
+            columns.insert(0, model._meta.pk.column)
+        insert, placeholders = insert_sql(connection, model, columns)
+        rows = [row for _, row in self.batch]
+
+        with connection.cursor() as cursor:
+            if not self.new_ids:
+                cursor.executemany(f"{insert} VALUES {placeholders}", rows)
+            else:
+                keys = self.insert_returning(cursor, insert, placeholders, rows)
+                id_map = self.id_maps.get(model)
+                if id_map is not None:
+                    for (pk, _), key in zip(self.batch, keys):
+                        id_map[pk] = key
+        self.counts[model] = self.counts.get(model, 0) + len(self.batch)
+        self.progress.advance(len(self.batch))
+        self.batch = []
+
+    def insert_returning(self, cursor, insert, placeholders, rows):
+        """Multi-row INSERTs that hand back the new keys in row order"""
+        connection = self.connection
+        returning, params = connection.ops.return_insert_columns([self.model._meta.pk])
+        max_params = connection.features.max_query_params or len(rows) * len(rows[0])
+        step = max(1, max_params // max(1, len(rows[0])))
+        keys = []
+        for start in range(0, len(rows), step):
+            chunk = rows[start : start + step]
+            cursor.execute(
+                f"{insert} VALUES {', '.join([placeholders] * len(chunk))} {returning}",
+                [value for row in chunk for value in row] + list(params),
+            )
+            keys.extend(key for key, in cursor.fetchall())
+        return keys
+
+    def finish(self):
+        self.flush()
+        self.progress.finish()
+        written = [model for model in ordered_models() if model in self.counts]
+        if not self.new_ids and written:
+            # Rows came with their keys; move sequences past them (PostgreSQL)
+            with self.connection.cursor() as cursor:
+                for sql in self.connection.ops.sequence_reset_sql(no_style(), written):
+                    cursor.execute(sql)
+        refresh_derived()
+        return self.counts
+
+
+def refresh_derived():
+    """
+    Rebuild what ``save()`` and the signals would have kept up to date for
+    each row
+    """
+    Appointment.fill_windows()
+    Event.recount()
+    Conversation.rebuild_all()
+    TherapistClient.rebuild()
+    MoodBucket.rebuild()
+    Therapist.recompute_ratings()
+    stats.rebuild()
+    slot_index.invalidate()
+    match_index.invalidate()
+    namespaces = {name for names in CACHED_NAMESPACES.values() for name in names}
+    transaction.on_commit(lambda: response_cache.invalidate(*sorted(namespaces)))
+
+
+def import_ndjson(lines, batch_size=DEFAULT_BATCH_SIZE, new_ids=False, progress=None):
+    """Load rows from an iterable of NDJSON lines; returns rows per model"""
+    with transaction.atomic():
+        importer = Importer(batch_size, new_ids, progress)
+        for number, line in enumerate(lines, 1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+                importer.add(get_model(row["model"]), row.get("pk"), row["fields"])
+            except (KeyError, TypeError, ValueError, ValidationError) as error:
+                raise TransferError(f"Line {number}: {error}") from error
+        return importer.finish()
+
+
+def csv_fields(model, header, cells):
+    fields = {field.name: field for field in data_fields(model)}
+    values = {}
+    for name, cell in zip(header, cells):
+        field = fields.get(name)
+        if field is None:
+            continue
+        if cell == "":
+            # CSV has no NULL: an empty cell is an empty string for text
+            # columns that cannot be NULL, and NULL everywhere else
+            text = isinstance(field, (models.CharField, models.TextField))
+            values[name] = "" if text and not field.null else None
+        elif isinstance(field, models.JSONField):
+            values[name] = json.loads(cell)
+        else:
+            values[name] = cell
+    return values
+
+
+def import_csv(
+    directory, models=None, batch_size=DEFAULT_BATCH_SIZE, new_ids=False, progress=None
+):
+    """Load the ``<model>.csv`` files found in ``directory``; returns rows per model"""
+    with transaction.atomic():
+        importer = Importer(batch_size, new_ids, progress)
+        for model in models or transferred_models():
+            path = os.path.join(directory, f"{model._meta.model_name}.csv")
+            for candidate in (path, path + ".gz"):
+                if os.path.exists(candidate):
+                    break
+            else:
+                continue
+            with open_text(candidate, "r") as source:
+                reader = csv.reader(source)
+                header = next(reader, None)
+                if header is None:
+                    continue
+                pk_index = header.index("pk") if "pk" in header else None
+                for number, cells in enumerate(reader, 2):
+                    try:
+                        pk = cells[pk_index] or None if pk_index is not None else None
+                        importer.add(model, pk, csv_fields(model, header, cells))
+                    except (IndexError, TypeError, ValueError, ValidationError) as error:
+                        raise TransferError(
+                            f"{os.path.basename(candidate)} line {number}: {error}"
+                        ) from error
+        return importer.finish()
@@ -0,0 +1,292 @@
+"""
+Mood trends over ``UserProgress`` rows.
+
+``mood_trends`` reads per user and week (or month) totals: the entry count,
+min, max and sum of moods, plus the sums a least-squares slope is computed
+from. Whole buckets inside the date range come from ``MoodBucket``, which
+the signals in ``api.signals`` keep up to date, so a year of daily entries
+costs one row per week instead of seven. The partial buckets at either end
+of the range are grouped from the entries themselves, in the same query
+(a ``UNION ALL``). Only those bucket rows reach Python, which derives
+everything else from them without looking at an entry:
+
+- a user's count, mean, min, max and slope, by adding up the user's buckets;
+- each bucket's rolling mean, the mean of all entries in that bucket and the
+  ``window - 1`` calendar buckets before it.
+
+Day numbers in the sums count from ``BUCKET_EPOCH``, so the stored totals do
+not depend on the range asked for; they are shifted to ``start`` exactly,
+with integers. The bucket start and the day number are plain SQL date
+arithmetic on both SQLite and Postgres. Django's ``Trunc`` functions would
+call a Python function per row on SQLite.
+"""
+
+from collections import deque
+from datetime import date, timedelta
+from itertools import groupby
+from operator import itemgetter
+
+from django.db.models import CharField, Count, F, FloatField, Func, Max, Min, Q, Sum
+from django.db.models.functions import Cast
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+# Bucket start in SQLite date() modifiers and as a Postgres date_trunc() field
+BUCKETS = {
+    "week": ("'weekday 0', '-6 days'", "week"),
+    "month": ("'start of month'", "month"),
+}
+# Julian day number of date.fromordinal(0)
+JULIAN_DAY_OFFSET = 1721424.5
+# Day 0 of the day numbers summed in MoodBucket
+BUCKET_EPOCH = date(2000, 1, 1)
+DEFAULT_RANGE_DAYS = 365
+DEFAULT_WINDOW = 4
+MAX_WINDOW = 52
+
+
+class DaysSince(Func):
+    """Days from a fixed date to a date expression, as a float"""
+
+    output_field = FloatField()
+
+    def __init__(self, expression, since, **extra):
+        super().__init__(expression, since=since, **extra)
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        # The fixed date's Julian day number, so SQLite parses one date per use
+        since = self.extra["since"].toordinal() + JULIAN_DAY_OFFSET
+        return self.as_sql(
+            compiler,
+            connection,
+            template=f"(julianday(%(expressions)s) - {since})",
+            **extra_context,
+        )
+
+    def as_postgresql(self, compiler, connection, **extra_context):
+        since = self.extra["since"].isoformat()
+        return self.as_sql(
+            compiler,
+            connection,
+            template=f"CAST(%(expressions)s - DATE '{since}' AS double precision)",
+            **extra_context,
+        )
+
+
+class BucketStart(Func):
+    """
+    First day of a date's week (Monday) or month, as ISO text: the response
+    has it as text anyway, and a date column would be converted row by row.
+    """
+
+    output_field = CharField()
+
+    def __init__(self, expression, bucket, **extra):
+        super().__init__(expression, bucket=bucket, **extra)
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        modifiers, _ = BUCKETS[self.extra["bucket"]]
+        return self.as_sql(
+            compiler,
+            connection,
+            template=f"date(%(expressions)s, {modifiers})",
+            **extra_context,
+        )
+
+    def as_postgresql(self, compiler, connection, **extra_context):
+        _, field = BUCKETS[self.extra["bucket"]]
+        return self.as_sql(
+            compiler,
+            connection,
+            template=f"to_char(date_trunc('{field}', %(expressions)s), 'YYYY-MM-DD')",
+            **extra_context,
+        )
+
+
+def bucket_start(bucket, day):
+    """First day of the week (Monday) or month ``day`` falls in"""
+    if bucket == "week":
+        return day - timedelta(days=day.weekday())
+    return day.replace(day=1)
+
+
+def next_bucket(bucket, start):
+    """First day of the bucket after the one starting on ``start``"""
+    if bucket == "week":
+        return start + timedelta(days=7)
+    return (start.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+
+def bucket_totals():
+    """Aggregates of a progress queryset that make up a ``MoodBucket`` row"""
+    x = DaysSince("date", BUCKET_EPOCH)
+    return {
+        "entries": Count("id"),
+        "low": Min("mood_rating"),
+        "high": Max("mood_rating"),
+        "mood_sum": Sum("mood_rating"),
+        "day_sum": Sum(x),
+        "day_mood_sum": Sum(x * F("mood_rating")),
+        "day_square_sum": Sum(x * x),
+    }
+
+
+def bucket_number(bucket, start):
+    """Consecutive numbers for consecutive buckets, from the ISO start date"""
+    if bucket == "week":
+        return date.fromisoformat(start).toordinal() // 7
+    return int(start[:4]) * 12 + int(start[5:7])
+
+
+def trend_params(params):
+    """Parse the trends query parameters; raises ValueError on bad input"""
+
+    def date_param(name, default):
+        value = params.get(name)
+        if not value:
+            return default
+        try:
+            parsed = parse_date(value)
+        except ValueError:
+            parsed = None
+        if parsed is None:
+            raise ValueError(f"{name} must be a date (YYYY-MM-DD)")
+        return parsed
+
+    end = date_param("end_date", timezone.localdate())
+    start = date_param("start_date", end - timedelta(days=DEFAULT_RANGE_DAYS))
+    if end < start:
+        raise ValueError("end_date must not be before start_date")
+
+    bucket = params.get("bucket", "week")
+    if bucket not in BUCKETS:
+        raise ValueError(f"bucket must be one of: {', '.join(BUCKETS)}")
+
+    try:
+        window = int(params.get("window", DEFAULT_WINDOW))
+    except ValueError:
+        window = 0
+    if not 1 <= window <= MAX_WINDOW:
+        raise ValueError(f"window must be between 1 and {MAX_WINDOW} buckets")
+    return {"start": start, "end": end, "bucket": bucket, "window": window}
+
+
+def slope(entries, sx, sy, sxy, sxx):
+    """Least-squares mood change per day, None for fewer than two days"""
+    denominator = entries * sxx - sx * sx
+    if entries < 2 or denominator <= 0:
+        return None
+    return round((entries * sxy - sx * sy) / denominator, 4)
+
+
+def mood_trends(queryset, buckets, start, end, bucket="week", window=DEFAULT_WINDOW):
+    """
+    Trends of the users in ``queryset`` (progress entries) between ``start``
+    and ``end``; ``buckets`` is their ``MoodBucket`` queryset.
+    """
+    # Buckets starting in [first, last) lie inside the range as a whole
+    first = bucket_start(bucket, start)
+    if first < start:
+        first = next_bucket(bucket, first)
+    last = bucket_start(bucket, end + timedelta(days=1))
+
+    totals = bucket_totals()
+    # Only annotations after user_id: Django selects model fields ahead of
+    # annotations, and both sides of the union need the same column order.
+    whole = (
+        buckets.filter(kind=bucket, start__gte=first, start__lt=last)
+        .annotate(
+            bucket=Cast("start", CharField()),
+            **{f"total_{name}": F(name) for name in totals},
+        )
+        .values_list("user_id", "bucket", *(f"total_{name}" for name in totals))
+    )
+    partial = (
+        # Two ranges rather than one with a hole, so both are index ranges
+        queryset.filter(
+            Q(date__gte=start, date__lt=first) | Q(date__gte=last, date__lte=end)
+        )
+        .annotate(bucket=BucketStart("date", bucket))
+        .values("user_id", "bucket")
+        .annotate(**totals)
+        .values_list("user_id", "bucket", *totals)
+    )
+    rows = whole.union(partial, all=True).order_by("user_id", "bucket")
+    # x in the slope sums is days since ``start``
+    shift = (start - BUCKET_EPOCH).days
+
+    results = []
+    numbers = {}  # bucket start -> bucket number, the same for every user
+    # (mood sum, entries) -> rounded mean: moods are small integers, so the
+    # same few pairs keep coming back and round() is slow
+    means = {}
+    for user_id, user_rows in groupby(rows, itemgetter(0)):
+        entries = sy = sd = sdy = sdd = 0
+        lowest, highest = float("inf"), float("-inf")
+        buckets = []
+        # (bucket number, entries, mood sum) of the buckets in the window
+        recent = deque()
+        in_window = in_window_sum = 0
+        for _, start_of, count, low, high, mood_sum, *day_sums in user_rows:
+            entries += count
+            sy += mood_sum
+            sd += day_sums[0]
+            sdy += day_sums[1]
+            sdd += day_sums[2]
+            if low < lowest:
+                lowest = low
+            if high > highest:
+                highest = high
+
+            number = numbers.get(start_of)
+            if number is None:
+                number = numbers[start_of] = bucket_number(bucket, start_of)
+            recent.append((number, count, mood_sum))
+            in_window += count
+            in_window_sum += mood_sum
+            while recent[0][0] <= number - window:
+                _, old_count, old_sum = recent.popleft()
+                in_window -= old_count
+                in_window_sum -= old_sum
+            average = means.get((mood_sum, count))
+            if average is None:
+                average = means[mood_sum, count] = round(mood_sum / count, 2)
+            rolling = means.get((in_window_sum, in_window))
+            if rolling is None:
+                rolling = means[in_window_sum, in_window] = round(
+                    in_window_sum / in_window, 2
+                )
+            buckets.append(
+                {
+                    "start": start_of,
+                    "entries": count,
+                    "average": average,
+                    "min": low,
+                    "max": high,
+                    "rolling_average": rolling,
+                }
+            )
+
+        # Entries' day sums come back as floats on SQLite; they are whole numbers
+        sd, sdy, sdd = round(sd), round(sdy), round(sdd)
+        sx = sd - entries * shift
+        sxy = sdy - shift * sy
+        sxx = sdd - 2 * shift * sd + entries * shift * shift
+        results.append(
+            {
+                "user": user_id,
+                "entries": entries,
+                "average": round(sy / entries, 2),
+                "min": lowest,
+                "max": highest,
+                "slope": slope(entries, sx, sy, sxy, sxx),
+                "buckets": buckets,
+            }
+        )
+    return {
+        "start": start,
+        "end": end,
+        "bucket": bucket,
+        "window": window,
+        "users": results,
+    }
@@ -18,5 +18,7 @@ router.register(r'admin-stats', views.AdminStatsViewSet)
 
 urlpatterns = [
     path('', include(router.urls)),
+    path('stream/', views.event_stream, name='event-stream'),
+    path('_perf/', views.perf_stats, name='perf-stats'),
     # Add custom URL patterns here if needed
 ]
\ No newline at end of file
@@ -1,23 +1,35 @@
 from rest_framework import viewsets, status, filters
-from rest_framework.decorators import action
+from rest_framework.decorators import action, api_view, permission_classes
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated, IsAdminUser, AllowAny
 from django.contrib.auth import get_user_model
-from django.db.models import Q, Count
-from datetime import date
+from django.http import JsonResponse, StreamingHttpResponse
+from asgiref.sync import sync_to_async
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+from rest_framework.exceptions import AuthenticationFailed
+from django.db import IntegrityError, transaction
+from django.db.models import F, Q, Count, Prefetch
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from datetime import date, datetime, timedelta
 from .models import (
     Therapist,
     Appointment,
     Review,
     Resource,
     Event,
+    EventFull,
     EventRegistration,
     ReadingList,
     Category,
     Notification,
     Message,
     UserProgress,
+    MoodBucket,
     AdminStats,
+    Conversation,
+    TherapistClient,
 )
 from .serializers import (
     UserSerializer,
@@ -26,14 +38,28 @@ from .serializers import (
     ReviewSerializer,
     ResourceSerializer,
     EventSerializer,
+    EventSummarySerializer,
     EventRegistrationSerializer,
     ReadingListSerializer,
     CategorySerializer,
     NotificationSerializer,
     MessageSerializer,
+    ConversationSerializer,
     UserProgressSerializer,
     AdminStatsSerializer,
+    TherapistClientSerializer,
 )
+from .slots import slot_index, DEFAULT_SESSION_MINUTES, MAX_RANGE_DAYS
+from .push import stream_events
+from .stats import live_stats
+from .response_cache import cached_response, response_cache
+from .pagination import KeysetPagination
+from .authentication import ClaimsJWTAuthentication
+from .async_views import AsyncReadMixin
+from .compiled import CompiledListMixin, compile_serializer
+from .trends import mood_trends, trend_params
+from .matching import match_index, match_params
+from .profiling import perf_registry
 
 User = get_user_model()
 
@@ -70,7 +96,7 @@ class UserViewSet(viewsets.ModelViewSet):
         return Response(serializer.data)
 
 
-class TherapistViewSet(viewsets.ModelViewSet):
+class TherapistViewSet(CompiledListMixin, AsyncReadMixin, viewsets.ModelViewSet):
     """
     API endpoint for therapists
     """
@@ -88,7 +114,9 @@ class TherapistViewSet(viewsets.ModelViewSet):
     #     return [permission() for permission in permission_classes]
 
     def get_queryset(self):
-        queryset = Therapist.objects.all()
+        queryset = Therapist.objects.select_related("user")
+        if self.action in ("list", "retrieve"):
+            queryset = queryset.prefetch_related("time_slots")
 
         # Filter by availability
         availability = self.request.query_params.get("availability", None)
@@ -120,6 +148,14 @@ class TherapistViewSet(viewsets.ModelViewSet):
 
         return queryset
 
+    @cached_response("therapists", anonymous_only=True)
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    @cached_response("therapists", anonymous_only=True)
+    async def alist(self, request, *args, **kwargs):
+        return await super().alist(request, *args, **kwargs)
+
     @action(detail=True, methods=["get"])
     def reviews(self, request, pk=None):
         therapist = self.get_object()
@@ -130,13 +166,99 @@ class TherapistViewSet(viewsets.ModelViewSet):
     @action(detail=True, methods=["get"])
     def appointments(self, request, pk=None):
         therapist = self.get_object()
-        appointments = Appointment.objects.filter(therapist=therapist)
+        appointments = Appointment.objects.filter(therapist=therapist).order_by(
+            "start_at", "id"
+        )
         serializer = AppointmentSerializer(appointments, many=True)
         return Response(serializer.data)
 
+    @action(detail=False, methods=["get"])
+    def match(self, request):
+        """
+        Available therapists ranked by fit to ``languages`` and
+        ``specializations`` (comma-separated) and a ``max_price`` budget,
+        best first, each with its score
+        """
+        try:
+            params = match_params(request.query_params)
+        except ValueError as error:
+            return Response({"error": str(error)}, status=status.HTTP_400_BAD_REQUEST)
+
+        ranked = match_index.top(**params)
+        compiled = compile_serializer(TherapistSerializer)
+        therapists = compiled.values(
+            Therapist.objects.filter(pk__in=[therapist_id for therapist_id, _ in ranked])
+        )
+        by_id = {row["id"]: row for row in compiled.serialize(therapists)}
+        return Response(
+            [
+                {"therapist": by_id[therapist_id], "score": score}
+                for therapist_id, score in ranked
+                if therapist_id in by_id
+            ]
+        )
+
+    @action(detail=False, methods=["get"], permission_classes=[IsAuthenticated])
+    def clients(self, request):
+        """
+        The requesting therapist's clients, most recently seen first
+        """
+        if request.user.role != "therapist":
+            return Response(
+                {"error": "Only therapists have clients"},
+                status=status.HTTP_403_FORBIDDEN,
+            )
+        queryset = (
+            TherapistClient.objects.filter(therapist__user=request.user)
+            .select_related("user")
+            .order_by(F("last_session_at").desc(nulls_last=True), "-id")
+        )
+
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            serializer = TherapistClientSerializer(page, many=True)
+            return self.get_paginated_response(serializer.data)
+        serializer = TherapistClientSerializer(queryset, many=True)
+        return Response(serializer.data)
+
+    def _slot_params(self, request):
+        """Parse the start/end/duration query params shared by the slot actions"""
+        params = request.query_params
+        today = timezone.localdate()
+        start = parse_date(params.get("start", "")) or today
+        end = parse_date(params.get("end", "")) or start + timedelta(days=6)
+        duration = self._duration_param(request)
+
+        if end < start:
+            raise ValueError("end must not be before start")
+        if (end - start).days >= MAX_RANGE_DAYS:
+            raise ValueError(f"Date range is limited to {MAX_RANGE_DAYS} days")
+        return start, end, duration
+
+    def _duration_param(self, request):
+        """Parse the session length in minutes shared by the slot actions"""
+        try:
+            duration = int(request.query_params.get("duration", DEFAULT_SESSION_MINUTES))
+        except ValueError:
+            raise ValueError("duration must be a number of minutes")
+        if duration <= 0:
+            raise ValueError("duration must be positive")
+        return duration
+
     @action(detail=True, methods=["get"])
     def availability(self, request, pk=None):
         therapist = self.get_object()
+
+        # Concrete bookable datetimes when a date range is requested
+        if "start" in request.query_params or "end" in request.query_params:
+            try:
+                start, end, duration = self._slot_params(request)
+            except ValueError as error:
+                return Response({"error": str(error)}, status=status.HTTP_400_BAD_REQUEST)
+
+            slots = slot_index.bookable_slots([therapist.id], start, end, duration)
+            return Response({"therapist": therapist.id, "slots": slots[therapist.id]})
+
         schedule = {}
 
         # Get all time slots for the therapist
@@ -150,6 +272,92 @@ class TherapistViewSet(viewsets.ModelViewSet):
 
         return Response(schedule)
 
+    @action(detail=False, methods=["get"])
+    def slots(self, request):
+        """
+        Bookable datetimes for several therapists over a date range
+        """
+        try:
+            start, end, duration = self._slot_params(request)
+        except ValueError as error:
+            return Response({"error": str(error)}, status=status.HTTP_400_BAD_REQUEST)
+
+        ids = request.query_params.get("ids", None)
+        if ids:
+            try:
+                therapist_ids = [int(therapist_id) for therapist_id in ids.split(",")]
+            except ValueError:
+                return Response(
+                    {"error": "ids must be a comma-separated list of therapist ids"},
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
+        else:
+            therapist_ids = list(
+                self.filter_queryset(self.get_queryset()).values_list("id", flat=True)
+            )
+
+        return Response(slot_index.bookable_slots(therapist_ids, start, end, duration))
+
+    @action(detail=False, methods=["get"])
+    def free(self, request):
+        """
+        Therapists with a bookable slot starting at the given datetime
+        """
+        at = parse_datetime(request.query_params.get("at", ""))
+        if at is None:
+            return Response(
+                {"error": "at must be an ISO datetime"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        if timezone.is_naive(at):
+            at = timezone.make_aware(at)
+        if at < timezone.now():
+            # Past weeks are not indexed, so everyone would look free.
+            return Response(
+                {"error": "at must not be in the past"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        try:
+            duration = self._duration_param(request)
+        except ValueError as error:
+            return Response({"error": str(error)}, status=status.HTTP_400_BAD_REQUEST)
+
+        free_ids = slot_index.free_therapists(at, duration)
+        queryset = (
+            self.filter_queryset(self.get_queryset())
+            .filter(id__in=free_ids)
+            .order_by("id")
+        )
+
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            serializer = self.get_serializer(page, many=True)
+            return self.get_paginated_response(serializer.data)
+
+        serializer = self.get_serializer(queryset, many=True)
+        return Response(serializer.data)
+
+
+def parse_day_start(value):
+    """Aware datetime for midnight at the start of a calendar date"""
+    return timezone.make_aware(datetime.combine(value, datetime.min.time()))
+
+
+def parse_range_bound(value, inclusive_date=False):
+    """
+    Parse a ``from``/``to`` query param given as an ISO datetime or date.
+    A bare date as an inclusive upper bound means the end of that day.
+    """
+    day = parse_date(value)
+    if day is not None:
+        if inclusive_date:
+            day += timedelta(days=1)
+        return parse_day_start(day)
+    moment = parse_datetime(value)
+    if moment is None:
+        raise ValueError(f"Invalid date or datetime: {value}")
+    return timezone.make_aware(moment) if timezone.is_naive(moment) else moment
+
 
 class AppointmentViewSet(viewsets.ModelViewSet):
     """
@@ -159,6 +367,10 @@ class AppointmentViewSet(viewsets.ModelViewSet):
     queryset = Appointment.objects.all()
     serializer_class = AppointmentSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = KeysetPagination
+    keyset_ordering = ("start_at", "id")
+    ordering_fields = ["start_at", "created_at", "status"]
+    ordering = ["start_at", "id"]
 
     def get_queryset(self):
         user = self.request.user
@@ -178,27 +390,48 @@ class AppointmentViewSet(viewsets.ModelViewSet):
         if status_param:
             queryset = queryset.filter(status=status_param)
 
-        # Filter by date
-        date_param = self.request.query_params.get("date", None)
-        if date_param:
-            queryset = queryset.filter(date=date_param)
+        try:
+            # Filter by date (a calendar day as a start_at range, or a legacy day name)
+            date_param = self.request.query_params.get("date", None)
+            if date_param:
+                day = parse_date(date_param)
+                if day is not None:
+                    queryset = queryset.filter(
+                        start_at__gte=parse_day_start(day),
+                        start_at__lt=parse_day_start(day + timedelta(days=1)),
+                    )
+                else:
+                    queryset = queryset.filter(date=date_param)
+
+            # Filter by start_at range
+            from_param = self.request.query_params.get("from", None)
+            if from_param:
+                queryset = queryset.filter(start_at__gte=parse_range_bound(from_param))
+            to_param = self.request.query_params.get("to", None)
+            if to_param:
+                queryset = queryset.filter(
+                    start_at__lt=parse_range_bound(to_param, inclusive_date=True)
+                )
+        except ValueError as error:
+            raise ValidationError({"error": str(error)})
+
+        # Filter upcoming appointments (sessions still to be held)
+        upcoming = self.request.query_params.get("upcoming", None)
+        if upcoming == "true":
+            queryset = queryset.filter(start_at__gte=timezone.now()).exclude(
+                status="Cancelled"
+            )
 
         # Filter by therapist
         therapist_id = self.request.query_params.get("therapist_id", None)
         if therapist_id:
             queryset = queryset.filter(therapist__id=therapist_id)
 
-        # Filter by user
+        # Filter by user. A therapist's queryset only holds their own
+        # appointments, so the filter itself keeps them to their clients.
         user_id = self.request.query_params.get("user_id", None)
         if user_id and (
-            user.is_staff
-            or user.role == "admin"
-            or (
-                user.role == "therapist"
-                and Appointment.objects.filter(
-                    therapist__user=user, user__id=user_id
-                ).exists()
-            )
+            user.is_staff or user.role == "admin" or user.role == "therapist"
         ):
             queryset = queryset.filter(user__id=user_id)
 
@@ -249,7 +482,7 @@ class ReviewViewSet(viewsets.ModelViewSet):
         serializer.save(user=self.request.user)
 
 
-class ResourceViewSet(viewsets.ModelViewSet):
+class ResourceViewSet(CompiledListMixin, AsyncReadMixin, viewsets.ModelViewSet):
     """
     API endpoint for resources
     """
@@ -291,14 +524,31 @@ class ResourceViewSet(viewsets.ModelViewSet):
 
         return queryset
 
+    @cached_response("resources")
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    @cached_response("resources")
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
+    @cached_response("resources")
+    async def alist(self, request, *args, **kwargs):
+        return await super().alist(request, *args, **kwargs)
+
+    @cached_response("resources")
+    async def aretrieve(self, request, *args, **kwargs):
+        return await super().aretrieve(request, *args, **kwargs)
+
     @action(detail=False, methods=["get"])
+    @cached_response("resources")
     def featured(self, request):
         featured_resources = Resource.objects.filter(featured=True)
         serializer = self.get_serializer(featured_resources, many=True)
         return Response(serializer.data)
 
 
-class EventViewSet(viewsets.ModelViewSet):
+class EventViewSet(AsyncReadMixin, viewsets.ModelViewSet):
     """
     API endpoint for events
     """
@@ -333,8 +583,45 @@ class EventViewSet(viewsets.ModelViewSet):
         if free == "true":
             queryset = queryset.filter(price=0)
 
+        if self._include_registrations():
+            queryset = queryset.prefetch_related(
+                Prefetch(
+                    "registrations",
+                    queryset=EventRegistration.objects.select_related("user"),
+                )
+            )
+
         return queryset
 
+    def _include_registrations(self):
+        # Registrations are embedded only in a detail view that asks for them
+        include = self.request.query_params.get("include", "")
+        return self.action == "retrieve" and "registrations" in include.split(",")
+
+    def get_serializer_class(self):
+        if self.action == "list" or (
+            self.action == "retrieve" and not self._include_registrations()
+        ):
+            return EventSummarySerializer
+        return EventSerializer
+
+    @action(detail=True, methods=["get"])
+    def registrations(self, request, pk=None):
+        event = self.get_object()
+        queryset = (
+            EventRegistration.objects.filter(event=event)
+            .select_related("user")
+            .order_by("registration_date", "id")
+        )
+
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            serializer = EventRegistrationSerializer(page, many=True)
+            return self.get_paginated_response(serializer.data)
+
+        serializer = EventRegistrationSerializer(queryset, many=True)
+        return Response(serializer.data)
+
     @action(detail=True, methods=["post"])
     def register(self, request, pk=None):
         event = self.get_object()
@@ -347,20 +634,25 @@ class EventViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST,
             )
 
-        # Check if event is full
-        if event.registrations.count() >= event.capacity:
+        # Saving takes a spot (see api.signals), or raises EventFull
+        try:
+            registration = EventRegistration.objects.create(
+                event=event,
+                user=user,
+                payment_status="Pending" if event.price > 0 else "Paid",
+            )
+        except IntegrityError:
+            # A parallel request registered the same user first
+            return Response(
+                {"error": "You are already registered for this event"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        except EventFull:
             return Response(
                 {"error": "This event is already full"},
                 status=status.HTTP_400_BAD_REQUEST,
             )
 
-        # Register user for event
-        registration = EventRegistration.objects.create(
-            event=event,
-            user=user,
-            payment_status="Pending" if event.price > 0 else "Paid",
-        )
-
         serializer = EventRegistrationSerializer(registration)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
@@ -369,25 +661,23 @@ class EventViewSet(viewsets.ModelViewSet):
         event = self.get_object()
         user = request.user
 
-        # Check if user is registered
-        try:
-            registration = EventRegistration.objects.get(event=event, user=user)
-        except EventRegistration.DoesNotExist:
+        # Unregister user; the post_delete signal releases the spot
+        with transaction.atomic():
+            deleted, _ = EventRegistration.objects.filter(event=event, user=user).delete()
+
+        if not deleted:
             return Response(
                 {"error": "You are not registered for this event"},
                 status=status.HTTP_400_BAD_REQUEST,
             )
 
-        # Unregister user
-        registration.delete()
-
         return Response(
             {"message": "Successfully unregistered from event"},
             status=status.HTTP_200_OK,
         )
 
 
-class ReadingListViewSet(viewsets.ModelViewSet):
+class ReadingListViewSet(AsyncReadMixin, viewsets.ModelViewSet):
     """
     API endpoint for reading lists
     """
@@ -405,7 +695,7 @@ class ReadingListViewSet(viewsets.ModelViewSet):
     #     return [permission() for permission in permission_classes]
 
     def get_queryset(self):
-        queryset = ReadingList.objects.all()
+        queryset = ReadingList.objects.prefetch_related("books")
 
         # Filter by category
         category = self.request.query_params.get("category", None)
@@ -414,6 +704,22 @@ class ReadingListViewSet(viewsets.ModelViewSet):
 
         return queryset
 
+    @cached_response("reading-lists")
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    @cached_response("reading-lists")
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
+    @cached_response("reading-lists")
+    async def alist(self, request, *args, **kwargs):
+        return await super().alist(request, *args, **kwargs)
+
+    @cached_response("reading-lists")
+    async def aretrieve(self, request, *args, **kwargs):
+        return await super().aretrieve(request, *args, **kwargs)
+
 
 class CategoryViewSet(viewsets.ModelViewSet):
     """
@@ -423,6 +729,14 @@ class CategoryViewSet(viewsets.ModelViewSet):
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
 
+    @cached_response("categories")
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    @cached_response("categories")
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
     # def get_permissions(self):
     #     if self.action in ['list', 'retrieve']:
     #         permission_classes = [AllowAny]
@@ -431,7 +745,7 @@ class CategoryViewSet(viewsets.ModelViewSet):
     #     return [permission() for permission in permission_classes]
 
 
-class NotificationViewSet(viewsets.ModelViewSet):
+class NotificationViewSet(AsyncReadMixin, viewsets.ModelViewSet):
     """
     API endpoint for notifications
     """
@@ -439,47 +753,64 @@ class NotificationViewSet(viewsets.ModelViewSet):
     queryset = Notification.objects.all()
     serializer_class = NotificationSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = KeysetPagination
+    keyset_ordering = ("-created_at", "-id")
+
+    def get_keyset_partitions(self):
+        # Direct and broadcast notifications each walk their own index
+        return [Q(user=self.request.user), Q(user__isnull=True)]
 
     def get_queryset(self):
         user = self.request.user
 
-        # Get notifications for user or their role or all users
-        queryset = Notification.objects.filter(
-            Q(user=user) | Q(role=user.role) | Q(role="all")
-        )
+        # Get notifications for user or their role or all users, with the
+        # user's own read state for broadcasts
+        queryset = Notification.for_user(user)
 
         # Filter by read status
         read = self.request.query_params.get("read", None)
         if read is not None:
             read_bool = read.lower() == "true"
-            queryset = queryset.filter(read=read_bool)
+            queryset = queryset.filter(is_read=read_bool)
 
         return queryset
 
+    def perform_update(self, serializer):
+        notification = serializer.instance
+        if not notification.is_broadcast:
+            serializer.save()
+            notification.is_read = notification.read
+            return
+
+        # A broadcast's shared read flag stays untouched; record a receipt
+        read = serializer.validated_data.pop("read", None)
+        serializer.save()
+        if read is not None:
+            notification.mark_read(self.request.user, read)
+
     @action(detail=True, methods=["patch"])
     def mark_as_read(self, request, pk=None):
         notification = self.get_object()
-        notification.read = True
-        notification.save()
+        notification.mark_read(request.user)
 
         serializer = self.get_serializer(notification)
         return Response(serializer.data)
 
     @action(detail=False, methods=["post"])
     def mark_all_as_read(self, request):
-        user = request.user
-
-        # Mark all user's notifications as read
-        Notification.objects.filter(
-            Q(user=user) | Q(role=user.role) | Q(role="all"), read=False
-        ).update(read=True)
+        Notification.mark_all_read(request.user)
 
         return Response(
             {"message": "All notifications marked as read"}, status=status.HTTP_200_OK
         )
 
+    @action(detail=False, methods=["get"])
+    def unread_count(self, request):
+        count = self.get_queryset().filter(is_read=False).count()
+        return Response({"unread_count": count})
+
 
-class MessageViewSet(viewsets.ModelViewSet):
+class MessageViewSet(AsyncReadMixin, viewsets.ModelViewSet):
     """
     API endpoint for messages
     """
@@ -487,12 +818,27 @@ class MessageViewSet(viewsets.ModelViewSet):
     queryset = Message.objects.all()
     serializer_class = MessageSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = KeysetPagination
+
+    def get_keyset_ordering(self):
+        if self.action == "conversations":
+            return ("-last_timestamp", "-id")
+        return ("-timestamp", "-id")
+
+    def get_keyset_partitions(self):
+        if self.action == "conversations":
+            return None
+        # Sent and received messages each walk their own index
+        user = self.request.user
+        return [Q(sender=user), Q(receiver=user)]
 
     def get_queryset(self):
         user = self.request.user
 
         # Get messages sent to or from the user
-        queryset = Message.objects.filter(Q(sender=user) | Q(receiver=user))
+        queryset = Message.objects.filter(
+            Q(sender=user) | Q(receiver=user)
+        ).select_related("sender", "receiver")
 
         # Filter by conversation partner
         partner_id = self.request.query_params.get("partner_id", None)
@@ -524,47 +870,45 @@ class MessageViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_403_FORBIDDEN,
             )
 
+        with transaction.atomic():
+            # Only the request that flips the flag decrements the unread count.
+            # A queryset update sends no signals, so the conversation is
+            # updated here rather than in api.signals.
+            updated = Message.objects.filter(pk=message.pk, read=False).update(
+                read=True
+            )
+            if updated:
+                Conversation.record_read(message)
         message.read = True
-        message.save()
 
         serializer = self.get_serializer(message)
         return Response(serializer.data)
 
     @action(detail=False, methods=["get"])
     def conversations(self, request):
-        user = request.user
-
-        # Get all users that the current user has exchanged messages with
-        conversation_partners = User.objects.filter(
-            Q(sent_messages__receiver=user) | Q(received_messages__sender=user)
-        ).distinct()
-
-        # Get the latest message and unread count for each conversation
-        conversations = []
-        for partner in conversation_partners:
-            latest_message = (
-                Message.objects.filter(
-                    Q(sender=user, receiver=partner) | Q(sender=partner, receiver=user)
-                )
-                .order_by("-timestamp")
-                .first()
+        # Served from the maintained conversation index, newest first
+        queryset = (
+            Conversation.for_user(request.user)
+            .select_related(
+                "user_a",
+                "user_b",
+                "last_message__sender",
+                "last_message__receiver",
             )
+            .order_by("-last_timestamp", "-id")
+        )
 
-            unread_count = Message.objects.filter(
-                sender=partner, receiver=user, read=False
-            ).count()
-
-            conversations.append(
-                {
-                    "partner": UserSerializer(partner).data,
-                    "latest_message": MessageSerializer(latest_message).data
-                    if latest_message
-                    else None,
-                    "unread_count": unread_count,
-                }
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            serializer = ConversationSerializer(
+                page, many=True, context=self.get_serializer_context()
             )
+            return self.get_paginated_response(serializer.data)
 
-        return Response(conversations)
+        serializer = ConversationSerializer(
+            queryset, many=True, context=self.get_serializer_context()
+        )
+        return Response(serializer.data)
 
 
 class UserProgressViewSet(viewsets.ModelViewSet):
@@ -575,31 +919,35 @@ class UserProgressViewSet(viewsets.ModelViewSet):
     queryset = UserProgress.objects.all()
     serializer_class = UserProgressSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = KeysetPagination
+    keyset_ordering = ("-created_at", "-id")
 
-    def get_queryset(self):
+    def visible_users(self):
+        """
+        Whose progress the requesting user may see, as a filter on ``user``
+        that applies to both progress entries and their mood buckets
+        """
         user = self.request.user
 
         # Users can only see their own progress
         if user.role == "user":
-            queryset = UserProgress.objects.filter(user=user)
+            visible = Q(user=user)
         # Therapists can see progress of their clients
         elif user.role == "therapist":
-            # Get users who have appointments with this therapist
-            client_ids = (
-                Appointment.objects.filter(therapist__user=user)
-                .values_list("user_id", flat=True)
-                .distinct()
-            )
-
-            queryset = UserProgress.objects.filter(user__id__in=client_ids)
+            # Joined through the maintained therapist-client table
+            visible = Q(user__therapist_links__therapist__user=user)
         # Admins can see all progress records
         else:
-            queryset = UserProgress.objects.all()
+            visible = Q()
 
         # Filter by user
         user_id = self.request.query_params.get("user_id", None)
         if user_id:
-            queryset = queryset.filter(user__id=user_id)
+            visible &= Q(user__id=user_id)
+        return visible
+
+    def get_queryset(self):
+        queryset = UserProgress.objects.filter(self.visible_users())
 
         # Filter by date range
         start_date = self.request.query_params.get("start_date", None)
@@ -611,6 +959,20 @@ class UserProgressViewSet(viewsets.ModelViewSet):
 
         return queryset
 
+    @action(detail=False, methods=["get"])
+    def trends(self, request):
+        """
+        Mood trends per user over a date range (default: the last year):
+        count, mean, min, max and slope, plus week or month buckets with
+        the rolling mean over the last ``window`` buckets.
+        """
+        try:
+            params = trend_params(request.query_params)
+        except ValueError as error:
+            return Response({"error": str(error)}, status=status.HTTP_400_BAD_REQUEST)
+        buckets = MoodBucket.objects.filter(self.visible_users())
+        return Response(mood_trends(self.get_queryset(), buckets, **params))
+
     def perform_create(self, serializer):
         # Users can only create progress for themselves
         if self.request.user.role == "user":
@@ -633,33 +995,9 @@ class AdminStatsViewSet(viewsets.ModelViewSet):
         """
         Get statistics for the admin dashboard
         """
-        # Get the latest stats or create if none exist
-        today = date.today()
-        try:
-            stats = AdminStats.objects.get(date=today)
-        except AdminStats.DoesNotExist:
-            # Calculate current statistics
-            stats = AdminStats(date=today)
-            stats.total_therapists = Therapist.objects.count()
-            stats.active_users = User.objects.filter(role="user").count()
-            stats.appointments_today = Appointment.objects.filter(
-                date=today.strftime("%Y-%m-%d")
-            ).count()
-            stats.total_resources = Resource.objects.count()
-
-            # User growth (simplified - actual calculation would need historical data)
-            stats.user_growth = 0
-
-            # Success rate (simplified - actual calculation would need more data)
-            stats.success_rate = 0
-
-            stats.save()
-
-        # Additional statistics for the dashboard
-        appointments_by_status = Appointment.objects.values("status").annotate(
-            count=Count("status")
-        )
-        upcoming_events = Event.objects.filter(date__gte=today).count()
+        # Live counters maintained by api.stats; the daily AdminStats row is
+        # written by the snapshot_stats command
+        stats, appointments_by_status, upcoming_events = live_stats()
 
         # Combine all statistics
         dashboard_stats = {
@@ -669,3 +1007,61 @@ class AdminStatsViewSet(viewsets.ModelViewSet):
         }
 
         return Response(dashboard_stats)
+
+    @action(detail=False, methods=["get"], permission_classes=[IsAdminUser])
+    def cache(self, request):
+        """
+        Response cache hits and misses per namespace for this worker
+        """
+        return Response(response_cache.stats())
+
+
+@api_view(["GET", "DELETE"])
+@permission_classes([IsAdminUser])
+def perf_stats(request):
+    """
+    Latency and query count percentiles per route, recorded by
+    api.profiling.ProfilingMiddleware in this worker; DELETE starts over
+    """
+    if request.method == "DELETE":
+        perf_registry.reset()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+    return Response(perf_registry.snapshot())
+
+
+def stream_user(request):
+    """
+    Resolve the user of a stream request from a JWT, given either in the
+    Authorization header or as ``?token=`` since EventSource cannot set headers
+    """
+    authenticator = ClaimsJWTAuthentication()
+    token = request.GET.get("token")
+    try:
+        if token:
+            return authenticator.get_user(authenticator.get_validated_token(token))
+        authenticated = authenticator.authenticate(request)
+    except (InvalidToken, TokenError, AuthenticationFailed):
+        return None
+    return authenticated[0] if authenticated else None
+
+
+async def event_stream(request):
+    """
+    Server-sent events carrying the current user's new notifications and
+    messages. Needs an ASGI server, one open connection per client.
+    """
+    user = await sync_to_async(stream_user)(request)
+    if user is None:
+        user = await request.auser()
+    if not user.is_authenticated:
+        return JsonResponse(
+            {"error": "Authentication credentials were not provided."}, status=401
+        )
+
+    response = StreamingHttpResponse(
+        stream_events(user), content_type="text/event-stream"
+    )
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"
+    return response
+
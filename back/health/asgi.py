@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'health.settings')
+# Async list/retrieve views only pay off on an event loop (see api.async_views)
+os.environ.setdefault('API_ASYNC_READS', '1')
 
 application = get_asgi_application()
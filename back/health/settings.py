@@ -3,6 +3,7 @@ Django settings for mental_health_project project.
 """
 
 import os
+from importlib.util import find_spec
 from pathlib import Path
 from datetime import timedelta
 
@@ -35,12 +36,14 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "api.profiling.ProfilingMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "corsheaders.middleware.CorsMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
+    "api.db.ReplicaReadMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
 ]
@@ -65,13 +68,63 @@ TEMPLATES = [
 
 WSGI_APPLICATION = "health.wsgi.application"
 
-# Database
-DATABASES = {
-    "default": {
-        "ENGINE": "django.db.backends.sqlite3",
-        "NAME": BASE_DIR / "db.sqlite3",
+# Database. SQLite by default; DB_ENGINE=postgresql with the DB_* variables
+# below switches to Postgres, and DB_REPLICA_HOSTS (comma separated) adds a
+# read replica alias per host. Connections are kept for CONN_MAX_AGE seconds
+# and checked before reuse. See api.db for the SQLite pragmas and the router.
+DB_ENGINE = os.environ.get("DB_ENGINE", "sqlite3")
+DB_CONN_MAX_AGE = int(os.environ.get("DB_CONN_MAX_AGE", 60))
+if DB_ENGINE == "postgresql":
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.postgresql",
+            "NAME": os.environ.get("DB_NAME", "health"),
+            "USER": os.environ.get("DB_USER", ""),
+            "PASSWORD": os.environ.get("DB_PASSWORD", ""),
+            "HOST": os.environ.get("DB_HOST", ""),
+            "PORT": os.environ.get("DB_PORT", ""),
+        }
     }
-}
+else:
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.sqlite3",
+            "NAME": os.environ.get("DB_NAME", BASE_DIR / "db.sqlite3"),
+            # Seconds the driver waits on a locked database; matches busy_timeout
+            "OPTIONS": {"timeout": 5},
+        }
+    }
+DATABASES["default"].update(
+    {"CONN_MAX_AGE": DB_CONN_MAX_AGE, "CONN_HEALTH_CHECKS": True}
+)
+DATABASE_REPLICAS = []
+for index, host in enumerate(
+    filter(None, os.environ.get("DB_REPLICA_HOSTS", "").split(","))
+):
+    alias = f"replica{index + 1}"
+    DATABASES[alias] = {
+        **DATABASES["default"],
+        "HOST": host.strip(),
+        "TEST": {"MIRROR": "default"},
+    }
+    DATABASE_REPLICAS.append(alias)
+DATABASE_ROUTERS = ["api.db.ReplicaRouter"]
+
+# Applied to every new SQLite connection. WAL lets readers run alongside a
+# writer; set DB_SQLITE_TUNING=0 for SQLite's defaults.
+SQLITE_PRAGMAS = (
+    {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "busy_timeout": 5000,
+        "mmap_size": 256 * 1024 * 1024,
+        "cache_size": -20000,
+        "temp_store": "MEMORY",
+    }
+    if os.environ.get("DB_SQLITE_TUNING", "1") != "0"
+    else {}
+)
+
 # Custom user model
 AUTH_USER_MODEL = "api.CustomUser"
 
@@ -104,16 +157,60 @@ STATIC_ROOT = os.path.join(BASE_DIR, "staticfiles")
 # Default primary key field type
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
+# Caches. "responses" holds cached catalog API responses (api.response_cache):
+# least recently used entries are culled past MAX_ENTRIES and every entry
+# expires after TIMEOUT seconds. Use a shared backend (Redis, Memcached) when
+# running several workers so invalidations reach all of them.
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+    "responses": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "api-responses",
+        "TIMEOUT": 300,
+        "OPTIONS": {"MAX_ENTRIES": 5000, "CULL_FREQUENCY": 10},
+    },
+}
+RESPONSE_CACHE_ENABLED = True
+
+# Serve list/retrieve of the viewsets using api.async_views.AsyncReadMixin
+# from async views. Off by default: under WSGI each async view runs its own
+# event loop. health/asgi.py turns it on unless API_ASYNC_READS is set.
+ASYNC_READ_VIEWS = os.environ.get("API_ASYNC_READS", "0") != "0"
+
+# Request profiling (api.profiling): Server-Timing headers and the per-route
+# histograms behind /api/_perf/, for a sample of requests. Lower the sample
+# rate to cut the overhead on busy workers. DRF serializers are only
+# instrumented while profiling is on with a sample rate above zero.
+PROFILING_ENABLED = os.environ.get("API_PROFILING", "1") != "0"
+PROFILING_SAMPLE_RATE = float(os.environ.get("API_PROFILING_SAMPLE_RATE", "1.0"))
+PROFILING_SERVER_TIMING = os.environ.get("API_SERVER_TIMING", "1") != "0"
+
 # REST Framework settings
+# MessagePack is offered to clients that ask for it when msgpack is installed
+MSGPACK_ENABLED = find_spec("msgpack") is not None
+
 REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": (
-        "rest_framework_simplejwt.authentication.JWTAuthentication",
+        "api.authentication.ClaimsJWTAuthentication",
         "rest_framework.authentication.SessionAuthentication",
     ),
     "DEFAULT_PERMISSION_CLASSES": [
         "rest_framework.permissions.AllowAny",
     ],
-    "DEFAULT_PAGINATION_CLASS": "rest_framework.pagination.PageNumberPagination",
+    "DEFAULT_RENDERER_CLASSES": [
+        "api.renderers.ORJSONRenderer",
+        "rest_framework.renderers.BrowsableAPIRenderer",
+    ]
+    + (["api.renderers.MessagePackRenderer"] if MSGPACK_ENABLED else []),
+    "DEFAULT_PARSER_CLASSES": [
+        "api.renderers.ORJSONParser",
+        "rest_framework.parsers.FormParser",
+        "rest_framework.parsers.MultiPartParser",
+    ]
+    + (["api.renderers.MessagePackParser"] if MSGPACK_ENABLED else []),
+    "DEFAULT_PAGINATION_CLASS": "api.pagination.PageNumberPagination",
     "PAGE_SIZE": 10,
     "DEFAULT_FILTER_BACKENDS": [
         "rest_framework.filters.SearchFilter",
@@ -144,10 +241,26 @@ SIMPLE_JWT = {
     "USER_ID_CLAIM": "user_id",
     "AUTH_TOKEN_CLASSES": ("rest_framework_simplejwt.tokens.AccessToken",),
     "TOKEN_TYPE_CLAIM": "token_type",
+    # Access tokens carry role/is_staff claims (see api.authentication)
+    "TOKEN_OBTAIN_SERIALIZER": "api.authentication.ClaimsTokenObtainPairSerializer",
+    "TOKEN_REFRESH_SERIALIZER": "api.authentication.ClaimsTokenRefreshSerializer",
 }
+# Seconds a user row read for authentication stays cached
+AUTH_USER_CACHE_TTL = 60
+# Seconds a worker trusts its cached copy of a user's claims_changed_at: the
+# longest another worker keeps accepting a token after a role change
+AUTH_CLAIMS_TTL = 60
 
 # CORS settings
 CORS_ALLOW_ALL_ORIGINS = (
     True  # Only for development, use specific origins in production
 )
 CORS_ALLOW_CREDENTIALS = True
+
+# Push stream (/api/stream/). Use "api.push.RelayBroker" with
+# `manage.py push_relay` running to share events between several workers.
+PUSH_BACKEND = "api.push.LocalBroker"
+PUSH_RELAY_ADDRESS = ("127.0.0.1", 8765)
+PUSH_RELAY_BUFFER = 1000
+PUSH_QUEUE_SIZE = 100
+PUSH_KEEPALIVE = 15
@@ -26,7 +26,9 @@ export default function AppointmentsList() {
     try {
       setLoading(true);
       const token = localStorage.getItem('access_token');
+      // Appointments are paged by cursor; the total is only sent on request
       const response = await axios.get('http://localhost:8000/api/appointments/', {
+        params: { count: 'true' },
         headers: {
           'Authorization': `Bearer ${token}`
         }